@@ -131,7 +131,7 @@ def build_parser():
     parser.add_argument('--train_word_alignment', type=str,
                         help='word alignment directory path for the training set')
     parser.add_argument('--train_ctc_alignment', type=str,
-                        help='CTC alignment directory path for the training set')
+                        help='CTC alignment directory (or archive) path for the training set')
     parser.add_argument('--dev_set', type=str,
                         help='tsv file path for the development set')
     parser.add_argument('--dev_set_sub1', type=str, default=False,
@@ -141,7 +141,7 @@ def build_parser():
     parser.add_argument('--dev_word_alignment', type=str,
                         help='word alignment directory path for the development set')
     parser.add_argument('--dev_ctc_alignment', type=str,
-                        help='CTC alignment directory path for the development set')
+                        help='CTC alignment directory (or archive) path for the development set')
     parser.add_argument('--eval_sets', type=str, default=[], nargs='+',
                         help='tsv file paths for the evaluation sets')
     parser.add_argument('--nlsyms', type=str, default=False, nargs='?',
@@ -277,6 +277,12 @@ def build_parser():
                         help='number of steps to warm up learning rate')
     parser.add_argument('--accum_grad_n_steps', type=int, default=1,
                         help='total number of steps to accumulate gradients')
+    parser.add_argument('--enc_n_layers_checkpoint', type=int, default=0,
+                        help='number of lower Transformer/Conformer encoder layers to apply activation checkpointing. \
+                        -1 means all layers.')
+    parser.add_argument('--dec_n_layers_checkpoint', type=int, default=0,
+                        help='number of lower Transformer decoder layers to apply activation checkpointing. \
+                        -1 means all layers.')
     # initialization
     parser.add_argument('--param_init', type=float, default=0.1,
                         help='')
@@ -380,10 +386,20 @@ def build_parser():
                         help='print to standard output during evaluation')
     parser.add_argument('--recog_n_gpus', type=int, default=0,
                         help='number of GPUs (0 indicates CPU)')
+    parser.add_argument('--recog_quantize', type=strtobool, default=False,
+                        help='apply dynamic int8 quantization to linear and LSTM layers (CPU only)')
+    parser.add_argument('--recog_bf16', type=strtobool, default=False,
+                        help='run inference with bfloat16 autocast (CPU only)')
+    parser.add_argument('--recog_export_dir', type=str, default=None,
+                        help='directory to save TorchScript modules for a lean runtime (default: recog_dir/export)')
+    parser.add_argument('--recog_export_onnx', type=strtobool, default=False,
+                        help='export ONNX graphs in addition to TorchScript modules')
     parser.add_argument('--recog_sets', type=str, default=[], nargs='+',
                         help='tsv file paths for the evaluation sets')
     parser.add_argument('--recog_word_alignments', type=str, default=[], nargs='+',
                         help='word alignment directory paths for the evaluation sets')
+    parser.add_argument('--recog_n_shards', type=int, default=1,
+                        help='number of processes to conduct CTC forced alignment of shards in parallel')
     parser.add_argument('--recog_first_n_utt', type=int, default=-1,
                         help='recognize the first N utterances for quick evaluation')
     parser.add_argument('--recog_model', type=str, default=False, nargs='+',
@@ -429,10 +445,17 @@ def build_parser():
                                   First-pass backward LM in case of synchronous bidirectional decoding.')
     parser.add_argument('--recog_ctc_weight', type=float, default=0.0,
                         help='weight of CTC score')
+    parser.add_argument('--recog_ctc_prune_threshold', type=float, default=0.0,
+                        help='prune tokens whose CTC posterior is below this value in CTC prefix beam search')
+    parser.add_argument('--recog_ctc_window_margin', type=int, default=0,
+                        help='number of frames around attention peaks (or CTC spikes) to compute CTC prefix scores \
+                              in joint CTC/attention decoding (0 means all frames)')
+    parser.add_argument('--recog_max_symbols_per_frame', type=int, default=1,
+                        help='maximum number of labels emitted per frame in RNN-T decoding')
     parser.add_argument('--recog_lm', type=str, default=False, nargs='?',
-                        help='path to first path LM for shallow fusion')
+                        help='path to first path LM for shallow fusion (or an ARPA file/compiled n-gram LM)')
     parser.add_argument('--recog_lm_second', type=str, default=False, nargs='?',
-                        help='path to second path LM for rescoring')
+                        help='path to second path LM for rescoring (or an ARPA file/compiled n-gram LM)')
     parser.add_argument('--recog_lm_bwd', type=str, default=False, nargs='?',
                         help='path to second path LM in the reverse direction for rescoring')
     parser.add_argument('--recog_resolving_unk', type=strtobool, default=False,
@@ -450,7 +473,11 @@ def build_parser():
     parser.add_argument('--recog_softmax_smoothing', type=float, default=1.0,
                         help='softmax smoothing (beta) for diverse hypothesis generation')
     parser.add_argument('--recog_wordlm', type=strtobool, default=False,
-                        help='')
+                        help='use the first path LM as a word-level LM with look-ahead over a lexicon prefix tree')
+    parser.add_argument('--recog_lexicon', type=str, default=False, nargs='?',
+                        help='lexicon file (each line contains a word and its units) to constrain hypotheses \
+                              in beam search. Words in the dictionary of the word-level LM are spelled by \
+                              characters if not given.')
     parser.add_argument('--recog_n_average', type=int, default=1,
                         help='number of models for the model averaging of Transformer')
     parser.add_argument('--recog_streaming', type=strtobool, default=False,
@@ -459,6 +486,8 @@ def build_parser():
                         help='block-synchronous streaming beam search decoding')
     parser.add_argument('--recog_block_sync_size', type=int, default=40,
                         help='block size in block-synchronous streaming beam search decoding')
+    parser.add_argument('--recog_cnn_cache', type=strtobool, default=False,
+                        help='cache feature maps in the frontend CNN and encode only new frames in each block')
     parser.add_argument('--recog_ctc_spike_forced_decoding', type=strtobool, default=False,
                         help='force MoChA to generate tokens corresponding to CTC spikes')
     parser.add_argument('--recog_ctc_vad', type=strtobool, default=True,
@@ -192,6 +192,10 @@ def build_parser():
                         help='print to standard output during evaluation')
     parser.add_argument('--recog_n_gpus', type=int, default=0,
                         help='number of GPUs (0 indicates CPU)')
+    parser.add_argument('--recog_quantize', type=strtobool, default=False,
+                        help='apply dynamic int8 quantization to linear and LSTM layers (CPU only)')
+    parser.add_argument('--recog_bf16', type=strtobool, default=False,
+                        help='run inference with bfloat16 autocast (CPU only)')
     parser.add_argument('--recog_sets', type=str, default=[], nargs='+',
                         help='tsv file paths for the evaluation sets')
     parser.add_argument('--recog_model', type=str, default=False, nargs='+',
@@ -4,13 +4,19 @@
 # Copyright 2020 Kyoto University (Hirofumi Inaguma)
 #  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
-"""Conduct forced alignment with the pre-trained CTC model."""
+"""Conduct forced alignment with the pre-trained CTC model.
+
+Alignments of all utterances are written into an indexed binary archive
+(recog_dir/ctc_forced_alignments/<set>.ark), which can be passed to --train_ctc_alignment directly.
+Utterances are split into --recog_n_shards shards aligned by multiple processes in parallel.
+"""
 
-import codecs
 import logging
 import os
-import shutil
+import pandas as pd
 import sys
+import torch
+import torch.multiprocessing as mp
 from tqdm import tqdm
 
 from neural_sp.bin.args_asr import parse_args_eval
@@ -20,6 +26,10 @@ from neural_sp.bin.train_utils import (
     load_checkpoint,
     set_logger
 )
+from neural_sp.datasets.alignment import (
+    CTCAlignmentArchiveWriter,
+    merge_ctc_alignment_archives
+)
 from neural_sp.datasets.asr import build_dataloader
 from neural_sp.models.seq2seq.speech2text import Speech2Text
 from neural_sp.utils import mkdir_join
@@ -27,71 +37,48 @@ from neural_sp.utils import mkdir_join
 logger = logging.getLogger(__name__)
 
 
-def main():
-
-    # Load configuration
-    args, recog_params, dir_name = parse_args_eval(sys.argv[1:])
-    args = compute_subsampling_factor(args)
-
-    # Setting for logging
-    if os.path.isfile(os.path.join(args.recog_dir, 'align.log')):
-        os.remove(os.path.join(args.recog_dir, 'align.log'))
-    set_logger(os.path.join(args.recog_dir, 'align.log'), stdout=args.recog_stdout)
-
-    for i, s in enumerate(args.recog_sets):
-        # Align all utterances
-        args.min_n_frames = 0
-        args.max_n_frames = 1e5
-
-        # Load dataloader
-        dataloader = build_dataloader(args=args,
-                                      tsv_path=s,
-                                      batch_size=recog_params['recog_batch_size'])
-
-        if i == 0:
-            # Load the ASR model
-            model = Speech2Text(args, dir_name)
-            epoch = int(args.recog_model[0].split('-')[-1])
-            if args.recog_n_average > 1:
-                # Model averaging for Transformer
-                model = average_checkpoints(model, args.recog_model[0],
-                                            n_average=args.recog_n_average)
-            else:
-                load_checkpoint(args.recog_model[0], model)
-
-            if not args.recog_unit:
-                args.recog_unit = args.unit
-
-            logger.info('recog unit: %s' % args.recog_unit)
-            logger.info('epoch: %d' % epoch)
-            logger.info('batch size: %d' % args.recog_batch_size)
-
-            # GPU setting
-            if args.recog_n_gpus >= 1:
-                model.cudnn_setting(deterministic=True, benchmark=False)
-                model.cuda()
-
-        save_path = mkdir_join(args.recog_dir, 'ctc_forced_alignments')
-
-        # Clean directory
-        if save_path is not None and os.path.isdir(save_path):
-            shutil.rmtree(save_path)
-            os.mkdir(save_path)
-
-        pbar = tqdm(total=len(dataloader))
+def load_model(args, dir_name):
+    model = Speech2Text(args, dir_name)
+    if args.recog_n_average > 1:
+        # Model averaging for Transformer
+        model = average_checkpoints(model, args.recog_model[0],
+                                    n_average=args.recog_n_average)
+    else:
+        load_checkpoint(args.recog_model[0], model)
+    return model
+
+
+def align(shard_id, args, dir_name, tsv_path, archive_path):
+    """Align utterances in a shard and write them into an archive.
+
+    Args:
+        shard_id (int): index of the shard
+        args (Namespace): evaluation arguments
+        dir_name (str): model directory
+        tsv_path (str): tsv file path of the shard
+        archive_path (str): path to the output archive
+
+    """
+    dataloader = build_dataloader(args=args,
+                                  tsv_path=tsv_path,
+                                  batch_size=args.recog_batch_size)
+
+    model = load_model(args, dir_name)
+    # GPU setting
+    if args.recog_n_gpus >= 1:
+        torch.cuda.set_device(shard_id % args.recog_n_gpus)
+        model.cudnn_setting(deterministic=True, benchmark=False)
+        model.cuda()
+
+    with CTCAlignmentArchiveWriter(archive_path) as writer:
+        pbar = tqdm(total=len(dataloader), position=shard_id)
         while True:
             batch, is_new_epoch = dataloader.next()
-            trigger_points = model.ctc_forced_align(batch['xs'], batch['ys'])  # `[B, L]`
+            trigger_points = model.ctc_forced_align(batch['xs'], batch['ys'])  # `[B, L + 1]`
 
             for b in range(len(batch['xs'])):
-                save_path_spk = mkdir_join(save_path, batch['speakers'][b])
-                save_path_utt = mkdir_join(save_path_spk, batch['utt_ids'][b] + '.txt')
-
-                tokens = dataloader.idx2token[0](batch['ys'][b], return_list=True)
-                with codecs.open(save_path_utt, 'w', encoding="utf-8") as f:
-                    for i, tok in enumerate(tokens):
-                        f.write('%s %d\n' % (tok, trigger_points[b, i]))
-                    f.write('%s %d\n' % ('<eos>', trigger_points[b, len(tokens)]))
+                # including <eos>
+                writer.write(batch['utt_ids'][b], trigger_points[b, :len(batch['ys'][b]) + 1])
 
             pbar.update(len(batch['xs']))
 
@@ -101,5 +88,60 @@ def main():
         pbar.close()
 
 
+def main():
+
+    # Load configuration
+    args, recog_params, dir_name = parse_args_eval(sys.argv[1:])
+    args = compute_subsampling_factor(args)
+
+    # Setting for logging
+    if os.path.isfile(os.path.join(args.recog_dir, 'align.log')):
+        os.remove(os.path.join(args.recog_dir, 'align.log'))
+    set_logger(os.path.join(args.recog_dir, 'align.log'), stdout=args.recog_stdout)
+
+    if not args.recog_unit:
+        args.recog_unit = args.unit
+    logger.info('recog unit: %s' % args.recog_unit)
+    logger.info('epoch: %d' % int(args.recog_model[0].split('-')[-1]))
+    logger.info('batch size: %d' % args.recog_batch_size)
+    logger.info('number of shards: %d' % args.recog_n_shards)
+
+    # Align all utterances
+    args.min_n_frames = 0
+    args.max_n_frames = 1e5
+
+    save_path = mkdir_join(args.recog_dir, 'ctc_forced_alignments')
+
+    for s in args.recog_sets:
+        archive_path = os.path.join(save_path, os.path.basename(s).split('.')[0] + '.ark')
+        if args.recog_n_shards == 1:
+            align(0, args, dir_name, s, archive_path)
+        else:
+            # split utterances into shards in a round-robin manner
+            df = pd.read_csv(s, encoding='utf-8', delimiter='\t')
+            tsv_paths = [archive_path + '.%d.tsv' % k for k in range(args.recog_n_shards)]
+            for k in range(args.recog_n_shards):
+                df[k::args.recog_n_shards].to_csv(tsv_paths[k], sep='\t', index=False)
+
+            # NOTE: spawn processes to initialize CUDA in each of them
+            shard_archive_paths = [archive_path + '.%d' % k for k in range(args.recog_n_shards)]
+            processes = []
+            ctx = mp.get_context('spawn')
+            for k in range(args.recog_n_shards):
+                p = ctx.Process(target=align,
+                                args=(k, args, dir_name, tsv_paths[k], shard_archive_paths[k]))
+                p.start()
+                processes.append(p)
+            for p in processes:
+                p.join()
+            if any(p.exitcode != 0 for p in processes):
+                raise RuntimeError('CTC forced alignment failed in some shards.')
+
+            merge_ctc_alignment_archives(shard_archive_paths, archive_path)
+            for p in tsv_paths + shard_archive_paths:
+                os.remove(p)
+        logger.info('Saved CTC alignments to %s' % archive_path)
+
+
 if __name__ == '__main__':
     main()
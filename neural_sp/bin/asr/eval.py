@@ -14,7 +14,12 @@ import sys
 import time
 
 from neural_sp.bin.args_asr import parse_args_eval
-from neural_sp.bin.eval_utils import average_checkpoints
+from neural_sp.bin.eval_utils import (
+    average_checkpoints,
+    cpu_autocast,
+    precision_name,
+    quantize_dynamic_model
+)
 from neural_sp.bin.train_utils import (
     compute_subsampling_factor,
     load_checkpoint,
@@ -30,6 +35,11 @@ from neural_sp.evaluators.word import eval_word
 from neural_sp.evaluators.wordpiece import eval_wordpiece
 from neural_sp.evaluators.wordpiece_bleu import eval_wordpiece_bleu
 from neural_sp.models.lm.build import build_lm
+from neural_sp.models.lm.ngram import (
+    is_ngram_lm,
+    NgramLM
+)
+from neural_sp.models.seq2seq.decoders.lexicon import LexiconPrefixTree
 from neural_sp.models.seq2seq.speech2text import Speech2Text
 
 logger = logging.getLogger(__name__)
@@ -50,6 +60,8 @@ def main():
     ppl_avg, loss_avg = 0, 0
     acc_avg = 0
     bleu_avg = 0
+    rtf_avg = 0
+    precision = precision_name(args.recog_quantize, args.recog_bf16)
     for i, s in enumerate(args.recog_sets):
         # Load dataloader
         dataloader = build_dataloader(args=args,
@@ -88,7 +100,15 @@ def main():
             # Load the LM for shallow fusion
             if not args.lm_fusion:
                 # first path
-                if args.recog_lm is not None and args.recog_lm_weight > 0:
+                if args.recog_lm and args.recog_lm_weight > 0 and is_ngram_lm(args.recog_lm):
+                    if args.recog_wordlm:
+                        lm = NgramLM.load(args.recog_lm, os.path.join(os.path.dirname(args.recog_lm), 'dict.txt'))
+                        model.lexicon = LexiconPrefixTree.from_dicts(
+                            os.path.join(dir_name, 'dict.txt'), os.path.join(os.path.dirname(args.recog_lm), 'dict.txt'),
+                            args.recog_lexicon if args.recog_lexicon else None, lm=lm)
+                    else:
+                        model.lm_fwd = NgramLM.load(args.recog_lm, os.path.join(dir_name, 'dict.txt'))
+                elif args.recog_lm is not None and args.recog_lm_weight > 0:
                     conf_lm = load_config(os.path.join(os.path.dirname(args.recog_lm), 'conf.yml'))
                     args_lm = argparse.Namespace()
                     for k, v in conf_lm.items():
@@ -98,13 +118,23 @@ def main():
                                   lm_dict_path=os.path.join(os.path.dirname(args.recog_lm), 'dict.txt'),
                                   asr_dict_path=os.path.join(dir_name, 'dict.txt'))
                     load_checkpoint(args.recog_lm, lm)
-                    if args_lm.backward:
+                    if args.recog_wordlm:
+                        # NOTE: word-level LM scores are added with look-ahead over the lexicon
+                        model.lexicon = LexiconPrefixTree.from_dicts(
+                            os.path.join(dir_name, 'dict.txt'), os.path.join(os.path.dirname(args.recog_lm), 'dict.txt'),
+                            args.recog_lexicon if args.recog_lexicon else None, lm=lm)
+                    elif args_lm.backward:
                         model.lm_bwd = lm
                     else:
                         model.lm_fwd = lm
+                elif args.recog_lexicon:
+                    model.lexicon = LexiconPrefixTree.from_dicts(os.path.join(dir_name, 'dict.txt'),
+                                                                 lexicon_path=args.recog_lexicon)
 
                 # second path (forward)
-                if args.recog_lm_second is not None and args.recog_lm_second_weight > 0:
+                if args.recog_lm_second and args.recog_lm_second_weight > 0 and is_ngram_lm(args.recog_lm_second):
+                    model.lm_second = NgramLM.load(args.recog_lm_second, os.path.join(dir_name, 'dict.txt'))
+                elif args.recog_lm_second is not None and args.recog_lm_second_weight > 0:
                     conf_lm_second = load_config(os.path.join(os.path.dirname(args.recog_lm_second), 'conf.yml'))
                     args_lm_second = argparse.Namespace()
                     for k, v in conf_lm_second.items():
@@ -154,6 +184,14 @@ def main():
             logger.info('ASR decoder state carry over: %s' % (args.recog_asr_state_carry_over))
             logger.info('LM state carry over: %s' % (args.recog_lm_state_carry_over))
             logger.info('model average (Transformer): %d' % (args.recog_n_average))
+            logger.info('precision: %s' % precision)
+
+            # Reduced-precision inference on CPU
+            if args.recog_quantize or args.recog_bf16:
+                assert args.recog_n_gpus == 0
+            if args.recog_quantize:
+                for m in ensemble_models:
+                    quantize_dynamic_model(m)
 
             # GPU setting
             if args.recog_n_gpus >= 1:
@@ -162,68 +200,72 @@ def main():
 
         start_time = time.time()
 
-        if args.recog_metric == 'edit_distance':
-            if args.recog_unit in ['word', 'word_char']:
-                wer, cer, _ = eval_word(ensemble_models, dataloader, recog_params,
-                                        epoch=epoch - 1,
-                                        recog_dir=args.recog_dir,
-                                        progressbar=True,
-                                        fine_grained=True,
-                                        oracle=True)
-                wer_avg += wer
-                cer_avg += cer
-            elif args.recog_unit == 'wp':
-                wer, cer = eval_wordpiece(ensemble_models, dataloader, recog_params,
-                                          epoch=epoch - 1,
-                                          recog_dir=args.recog_dir,
-                                          streaming=args.recog_streaming,
-                                          progressbar=True,
-                                          fine_grained=True,
-                                          oracle=True)
-                wer_avg += wer
-                cer_avg += cer
-            elif 'char' in args.recog_unit:
-                wer, cer = eval_char(ensemble_models, dataloader, recog_params,
+        with cpu_autocast(args.recog_bf16):
+            if args.recog_metric == 'edit_distance':
+                if args.recog_unit in ['word', 'word_char']:
+                    wer, cer, _ = eval_word(ensemble_models, dataloader, recog_params,
+                                            epoch=epoch - 1,
+                                            recog_dir=args.recog_dir,
+                                            progressbar=True,
+                                            fine_grained=True,
+                                            oracle=True)
+                    wer_avg += wer
+                    cer_avg += cer
+                elif args.recog_unit == 'wp':
+                    wer, cer = eval_wordpiece(ensemble_models, dataloader, recog_params,
+                                              epoch=epoch - 1,
+                                              recog_dir=args.recog_dir,
+                                              streaming=args.recog_streaming,
+                                              progressbar=True,
+                                              fine_grained=True,
+                                              oracle=True)
+                    wer_avg += wer
+                    cer_avg += cer
+                elif 'char' in args.recog_unit:
+                    wer, cer = eval_char(ensemble_models, dataloader, recog_params,
+                                         epoch=epoch - 1,
+                                         recog_dir=args.recog_dir,
+                                         progressbar=True,
+                                         task_idx=0,
+                                         fine_grained=True,
+                                         oracle=True)
+                    #  task_idx=1 if args.recog_unit and 'char' in args.recog_unit else 0)
+                    wer_avg += wer
+                    cer_avg += cer
+                elif 'phone' in args.recog_unit:
+                    per = eval_phone(ensemble_models, dataloader, recog_params,
                                      epoch=epoch - 1,
                                      recog_dir=args.recog_dir,
                                      progressbar=True,
-                                     task_idx=0,
                                      fine_grained=True,
                                      oracle=True)
-                #  task_idx=1 if args.recog_unit and 'char' in args.recog_unit else 0)
-                wer_avg += wer
-                cer_avg += cer
-            elif 'phone' in args.recog_unit:
-                per = eval_phone(ensemble_models, dataloader, recog_params,
-                                 epoch=epoch - 1,
-                                 recog_dir=args.recog_dir,
-                                 progressbar=True,
-                                 fine_grained=True,
-                                 oracle=True)
-                per_avg += per
+                    per_avg += per
+                else:
+                    raise ValueError(args.recog_unit)
+            elif args.recog_metric in ['ppl', 'loss']:
+                ppl, loss = eval_ppl(ensemble_models, dataloader, progressbar=True)
+                ppl_avg += ppl
+                loss_avg += loss
+            elif args.recog_metric == 'accuracy':
+                acc_avg += eval_accuracy(ensemble_models, dataloader, progressbar=True)
+            elif args.recog_metric == 'bleu':
+                bleu = eval_wordpiece_bleu(ensemble_models, dataloader, recog_params,
+                                           epoch=epoch - 1,
+                                           recog_dir=args.recog_dir,
+                                           streaming=args.recog_streaming,
+                                           progressbar=True,
+                                           fine_grained=True,
+                                           oracle=True)
+                bleu_avg += bleu
             else:
-                raise ValueError(args.recog_unit)
-        elif args.recog_metric in ['ppl', 'loss']:
-            ppl, loss = eval_ppl(ensemble_models, dataloader, progressbar=True)
-            ppl_avg += ppl
-            loss_avg += loss
-        elif args.recog_metric == 'accuracy':
-            acc_avg += eval_accuracy(ensemble_models, dataloader, progressbar=True)
-        elif args.recog_metric == 'bleu':
-            bleu = eval_wordpiece_bleu(ensemble_models, dataloader, recog_params,
-                                       epoch=epoch - 1,
-                                       recog_dir=args.recog_dir,
-                                       streaming=args.recog_streaming,
-                                       progressbar=True,
-                                       fine_grained=True,
-                                       oracle=True)
-            bleu_avg += bleu
-        else:
-            raise NotImplementedError(args.recog_metric)
+                raise NotImplementedError(args.recog_metric)
         elapsed_time = time.time() - start_time
         logger.info('Elapsed time: %.3f [sec]' % elapsed_time)
-        logger.info('RTF: %.3f' % (elapsed_time / (dataloader.n_frames * 0.01)))
+        rtf = elapsed_time / (dataloader.n_frames * 0.01)
+        rtf_avg += rtf
+        logger.info('RTF: %.3f' % rtf)
 
+    logger.info('RTF (avg.): %.3f (%s)' % (rtf_avg / len(args.recog_sets), precision))
     if args.recog_metric == 'edit_distance':
         if 'phone' in args.recog_unit:
             logger.info('PER (avg.): %.2f %%\n' % (per_avg / len(args.recog_sets)))
@@ -0,0 +1,78 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Export the ASR model as self-contained TorchScript modules."""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+
+from neural_sp.bin.args_asr import parse_args_eval
+from neural_sp.bin.eval_utils import average_checkpoints
+from neural_sp.bin.train_utils import (
+    compute_subsampling_factor,
+    load_checkpoint,
+    load_config,
+    set_logger
+)
+from neural_sp.models.export import export_model
+from neural_sp.models.lm.build import build_lm
+from neural_sp.models.seq2seq.speech2text import Speech2Text
+from neural_sp.utils import mkdir_join
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    # Load configuration
+    args, recog_params, dir_name = parse_args_eval(sys.argv[1:])
+    args = compute_subsampling_factor(args)
+    save_dir = args.recog_export_dir
+    if save_dir is None:
+        save_dir = mkdir_join(args.recog_dir, 'export')
+    elif not os.path.isdir(save_dir):
+        os.makedirs(save_dir)
+
+    # Setting for logging
+    if os.path.isfile(os.path.join(save_dir, 'export.log')):
+        os.remove(os.path.join(save_dir, 'export.log'))
+    set_logger(os.path.join(save_dir, 'export.log'), stdout=args.recog_stdout)
+
+    # Load the ASR model
+    model = Speech2Text(args, dir_name)
+    if args.recog_n_average > 1:
+        # Model averaging for Transformer
+        model = average_checkpoints(model, args.recog_model[0],
+                                    n_average=args.recog_n_average)
+    else:
+        load_checkpoint(args.recog_model[0], model)
+
+    # Load the LM for shallow fusion
+    lm = None
+    if args.recog_lm is not None:
+        conf_lm = load_config(os.path.join(os.path.dirname(args.recog_lm), 'conf.yml'))
+        args_lm = argparse.Namespace()
+        for k, v in conf_lm.items():
+            setattr(args_lm, k, v)
+        args_lm.recog_mem_len = args.recog_mem_len
+        lm = build_lm(args_lm)
+        load_checkpoint(args.recog_lm, lm)
+
+    meta = export_model(model, save_dir, lm=lm, onnx=args.recog_export_onnx)
+
+    # Copy files needed to convert indices to tokens
+    shutil.copy(args.dict, os.path.join(save_dir, 'dict.txt'))
+    if args.unit == 'wp' and args.wp_model:
+        shutil.copy(args.wp_model, os.path.join(save_dir, 'wp.model'))
+    logger.info('Exported modules: %s' % ', '.join(sorted(meta['modules'].keys())))
+    logger.info('Saved to %s' % save_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,12 +3,16 @@
 
 """Utility functions for evaluation."""
 
+from distutils.version import LooseVersion
 import logging
 import os
 import torch
+import torch.nn as nn
 
 logger = logging.getLogger(__name__)
 
+torch_110_plus = LooseVersion(torch.__version__) >= LooseVersion("1.10.0")
+
 
 def average_checkpoints(model, best_model_path, n_average, topk_list=[]):
     if n_average == 1:
@@ -57,3 +61,86 @@ def average_checkpoints(model, best_model_path, n_average, topk_list=[]):
     torch.save(checkpoint_avg, checkpoint_avg_path)
 
     return model
+
+
+def quantize_dynamic_model(model):
+    """Apply dynamic int8 quantization to linear and LSTM layers for CPU inference.
+       External LMs registered as sub-modules and the word-level LM attached to
+       the lexicon (not a sub-module) are also quantized.
+
+    Args:
+        model (nn.Module): model on CPU
+    Returns:
+        model (nn.Module): quantized model
+
+    """
+    n_quantized = _quantize_dynamic(model)
+    lm = getattr(getattr(model, 'lexicon', None), 'lm', None)
+    if isinstance(lm, nn.Module):
+        n_quantized += _quantize_dynamic(lm)
+    logger.info('Quantize %d layers with dynamic int8 quantization' % n_quantized)
+    return model
+
+
+def _quantize_dynamic(model):
+    model.eval()
+    torch.quantization.quantize_dynamic(model, {nn.Linear, nn.LSTM, nn.LSTMCell},
+                                        dtype=torch.qint8, inplace=True)
+    n_quantized = 0
+    for m in model.modules():
+        if 'quantized' not in type(m).__module__:
+            continue
+        if isinstance(m, torch.nn.quantized.dynamic.LSTM):
+            # NOTE: quantized LSTM keeps packed weights, which cannot be flattened
+            m.flatten_parameters = lambda: None
+        # NOTE: quantized kernels accept float32 inputs only (e.g., under bfloat16 autocast)
+        m.register_forward_pre_hook(lambda module, inputs: _to_float(inputs))
+        n_quantized += 1
+    return n_quantized
+
+
+def _to_float(x):
+    if isinstance(x, nn.utils.rnn.PackedSequence):
+        return x.float() if x.data.dtype == torch.bfloat16 else x
+    if isinstance(x, (tuple, list)):
+        return type(x)(_to_float(x_i) for x_i in x)
+    if isinstance(x, torch.Tensor) and x.dtype == torch.bfloat16:
+        return x.float()
+    return x
+
+
+class _NullContext(object):
+    """No-op context manager."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def cpu_autocast(enabled):
+    """Context manager for bfloat16 autocast on CPU.
+
+    Args:
+        enabled (bool): run with bfloat16 autocast
+    Returns:
+        context manager
+
+    """
+    if not enabled:
+        return _NullContext()
+    if not torch_110_plus:
+        raise NotImplementedError('bfloat16 autocast on CPU requires PyTorch>=1.10.')
+    return torch.autocast('cpu', dtype=torch.bfloat16)
+
+
+def precision_name(quantize, bf16):
+    """Name of the inference precision for logging."""
+    if quantize and bf16:
+        return 'int8+bf16'
+    elif quantize:
+        return 'int8'
+    elif bf16:
+        return 'bf16'
+    return 'fp32'
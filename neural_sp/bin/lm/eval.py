@@ -12,6 +12,11 @@ import sys
 import time
 
 from neural_sp.bin.args_lm import parse_args_eval
+from neural_sp.bin.eval_utils import (
+    cpu_autocast,
+    precision_name,
+    quantize_dynamic_model
+)
 from neural_sp.bin.train_utils import (
     load_checkpoint,
     set_logger
@@ -61,17 +66,25 @@ def main():
             logger.info('cache theta: %.3f' % (args.recog_cache_theta))
             logger.info('cache lambda: %.3f' % (args.recog_cache_lambda))
             logger.info('model average (Transformer): %d' % (args.recog_n_average))
+            logger.info('precision: %s' % precision_name(args.recog_quantize, args.recog_bf16))
             model.cache_theta = args.recog_cache_theta
             model.cache_lambda = args.recog_cache_lambda
 
+            # Reduced-precision inference on CPU
+            if args.recog_quantize or args.recog_bf16:
+                assert args.recog_n_gpus == 0
+            if args.recog_quantize:
+                quantize_dynamic_model(model)
+
             # GPU setting
             if args.recog_n_gpus > 0:
                 model.cuda()
 
         start_time = time.time()
 
-        ppl, _ = eval_ppl([model], dataset, batch_size=1, bptt=args.bptt,
-                          n_caches=args.recog_n_caches, progressbar=True)
+        with cpu_autocast(args.recog_bf16):
+            ppl, _ = eval_ppl([model], dataset, batch_size=1, bptt=args.bptt,
+                              n_caches=args.recog_n_caches, progressbar=True)
         ppl_avg += ppl
         print('PPL (%s): %.2f' % (dataset.set, ppl))
         logger.info('Elapsed time: %.2f [sec]:' % (time.time() - start_time))
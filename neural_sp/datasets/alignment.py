@@ -4,10 +4,13 @@
 import codecs
 import numpy as np
 import os
+import struct
 
 import sentencepiece as spm
 from collections import deque
 
+ARCHIVE_MAGIC = b'NSPCTCA1'
+
 
 class WordAlignmentConverter(object):
     """Class for converting word alignment into word-piece alignment.
@@ -101,3 +104,116 @@ def load_ctc_alignment(alignment_dir, speaker, utt_id):
     with codecs.open(alignment_path, 'r', encoding='utf-8') as f:
         boundaries = [int(line.strip().split(' ')[1]) for line in f]
     return np.array(boundaries, dtype=np.int32)
+
+
+class CTCAlignmentArchiveWriter(object):
+    """Class for writing CTC alignments of many utterances into a single indexed binary archive.
+
+    The archive consists of a magic number, trigger points of all utterances as
+    a flat int32 array, an index of (utterance ID, offset, length) and the byte offset of the index.
+
+    Args:
+        archive_path (str): path to the archive
+
+    """
+
+    def __init__(self, archive_path):
+        self.f = open(archive_path, 'wb')
+        self.f.write(ARCHIVE_MAGIC)
+        self.index = []
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, utt_id, trigger_points):
+        """Append CTC alignment of an utterance.
+
+        Args:
+            utt_id (str): utterance ID
+            trigger_points (np.ndarray): `[L + 1]` (including <eos>)
+
+        """
+        trigger_points = np.ascontiguousarray(trigger_points, dtype='<i4')
+        self.f.write(trigger_points.tobytes())
+        self.index.append((utt_id, self.offset, len(trigger_points)))
+        self.offset += len(trigger_points)
+
+    def close(self):
+        if self.f.closed:
+            return
+        index_offset = self.f.tell()
+        for utt_id, offset, length in self.index:
+            self.f.write(('%s %d %d\n' % (utt_id, offset, length)).encode('utf-8'))
+        self.f.write(struct.pack('<q', index_offset))
+        self.f.close()
+
+
+class CTCAlignmentArchive(object):
+    """Class for reading CTC alignments from an indexed binary archive.
+
+    Trigger points are memory-mapped, so that only the index is loaded at initialization.
+
+    Args:
+        archive_path (str): path to the archive
+
+    """
+
+    def __init__(self, archive_path):
+        with open(archive_path, 'rb') as f:
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError('%s is not a CTC alignment archive.' % archive_path)
+            f.seek(-8, os.SEEK_END)
+            index_offset = struct.unpack('<q', f.read(8))[0]
+            f.seek(index_offset)
+            lines = f.read(os.path.getsize(archive_path) - 8 - index_offset).decode('utf-8').splitlines()
+
+        self.index = {}
+        for line in lines:
+            utt_id, offset, length = line.split(' ')
+            self.index[utt_id] = (int(offset), int(length))
+
+        n_points = (index_offset - len(ARCHIVE_MAGIC)) // 4
+        self.data = np.memmap(archive_path, dtype='<i4', mode='r',
+                              offset=len(ARCHIVE_MAGIC), shape=(n_points,)) if n_points > 0 else None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, utt_id):
+        return utt_id in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def get(self, utt_id):
+        """Load CTC alignment of an utterance.
+
+        Args:
+            utt_id (str): utterance ID
+        Returns:
+            boundaries (np.ndarray): token boundaries, or None if not found
+
+        """
+        if utt_id not in self.index:
+            return None
+        offset, length = self.index[utt_id]
+        return np.array(self.data[offset:offset + length], dtype=np.int32)
+
+
+def merge_ctc_alignment_archives(archive_paths, archive_path):
+    """Merge CTC alignment archives (e.g., written by multiple processes) into a single archive.
+
+    Args:
+        archive_paths (List): paths to the input archives
+        archive_path (str): path to the output archive
+
+    """
+    with CTCAlignmentArchiveWriter(archive_path) as writer:
+        for p in archive_paths:
+            archive = CTCAlignmentArchive(p)
+            for utt_id in archive.keys():
+                writer.write(utt_id, archive.get(utt_id))
@@ -25,6 +25,7 @@ from neural_sp.datasets.token_converter.word import Word2idx
 from neural_sp.datasets.token_converter.wordpiece import Idx2wp
 from neural_sp.datasets.token_converter.wordpiece import Wp2idx
 
+from neural_sp.datasets.alignment import CTCAlignmentArchive
 from neural_sp.datasets.alignment import load_ctc_alignment
 from neural_sp.datasets.alignment import WordAlignmentConverter
 from neural_sp.datasets.utils import count_vocab_size
@@ -224,7 +225,7 @@ class CustomDataset(Dataset):
             discourse_aware (bool): sort in the discourse order
             first_n_utterances (int): evaluate the first N utterances
             word_alignment_dir (str): path to word alignment directory
-            ctc_alignment_dir (str): path to CTC alignment directory
+            ctc_alignment_dir (str): path to CTC alignment directory or archive
 
         """
         super(Dataset, self).__init__()
@@ -403,8 +404,13 @@ class CustomDataset(Dataset):
             print('Removed %d utterances (for word alignment)' % (n_utts - len(df)))
         elif ctc_alignment_dir is not None:
             n_utts = len(df)
-            df['trigger_points'] = df.apply(lambda x: load_ctc_alignment(
-                ctc_alignment_dir, x['speaker'], x['utt_id']), axis=1)
+            if os.path.isfile(ctc_alignment_dir):
+                # indexed binary archive written by neural_sp/bin/asr/ctc_forced_align.py
+                archive = CTCAlignmentArchive(ctc_alignment_dir)
+                df['trigger_points'] = df.apply(lambda x: archive.get(x['utt_id']), axis=1)
+            else:
+                df['trigger_points'] = df.apply(lambda x: load_ctc_alignment(
+                    ctc_alignment_dir, x['speaker'], x['utt_id']), axis=1)
             # remove utterances which do not have the alignment
             df = df[df.apply(lambda x: x['trigger_points'] is not None, axis=1)]
             print('Removed %d utterances (for CTC alignment)' % (n_utts - len(df)))
@@ -96,7 +96,8 @@ def eval_char(models, dataloader, recog_params, epoch,
                     utt_ids=batch['utt_ids'],
                     speakers=batch['sessions' if dataloader.corpus == 'swbd' else 'speakers'],
                     task=task,
-                    ensemble_models=models[1:] if len(models) > 1 else [])[0]
+                    ensemble_models=models[1:] if len(models) > 1 else [],
+                    store_aws=False)[0]
 
             for b in range(len(batch['xs'])):
                 ref = batch['text'][b]
@@ -84,7 +84,8 @@ def eval_word(models, dataloader, recog_params, epoch,
                     refs_id=batch['ys'],
                     utt_ids=batch['utt_ids'],
                     speakers=batch['sessions' if dataloader.corpus == 'swbd' else 'speakers'],
-                    ensemble_models=models[1:] if len(models) > 1 else [])
+                    ensemble_models=models[1:] if len(models) > 1 else [],
+                    store_aws=recog_params['recog_resolving_unk'])
 
             for b in range(len(batch['xs'])):
                 ref = batch['text'][b]
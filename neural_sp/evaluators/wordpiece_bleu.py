@@ -79,7 +79,8 @@ def eval_wordpiece_bleu(models, dataloader, recog_params, epoch,
                     refs_id=batch['ys'],
                     utt_ids=batch['utt_ids'],
                     speakers=batch['sessions' if dataloader.corpus == 'swbd' else 'speakers'],
-                    ensemble_models=models[1:] if len(models) > 1 else [])[0]
+                    ensemble_models=models[1:] if len(models) > 1 else [],
+                    store_aws=False)[0]
 
             for b in range(len(batch['xs'])):
                 ref = batch['text'][b]
@@ -0,0 +1,544 @@
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Export encoders, single-step decoders, and LMs as self-contained TorchScript/ONNX modules."""
+
+import json
+import logging
+import os
+import torch
+import torch.nn as nn
+import warnings
+
+from neural_sp.models.lm.rnnlm import RNNLM
+from neural_sp.models.lm.transformerlm import TransformerLM
+from neural_sp.models.modules.attention import AttentionMechanism
+from neural_sp.models.modules.multihead_attention import MultiheadAttentionMechanism
+from neural_sp.models.seq2seq.decoders.las import RNNDecoder
+from neural_sp.models.seq2seq.decoders.rnn_transducer import RNNTransducer
+from neural_sp.models.seq2seq.decoders.transformer import TransformerDecoder
+
+logger = logging.getLogger(__name__)
+
+
+def _length_mask(xs, xlens):
+    """Make a padding mask without depending on Python integers.
+
+    Args:
+        xs (FloatTensor): `[B, T, *]`
+        xlens (IntTensor): `[B]`
+    Returns:
+        mask (BoolTensor): `[B, 1, T]`
+
+    """
+    t_range = torch.arange(xs.size(1), device=xs.device)
+    return (t_range.unsqueeze(0) < xlens.to(xs.device).unsqueeze(1)).unsqueeze(1)
+
+
+class EncoderExport(nn.Module):
+    """Encoder forward pass (+ CTC log-probabilities) with tensor-only inputs and outputs.
+
+    Frame stacking and splicing are done by the runtime before calling this module.
+
+    Args:
+        enc (EncoderBase): encoder
+        ssn (SequenceSummaryNetwork): sequence summary network
+        dec (DecoderBase): decoder whose CTC layer is exported (if any)
+
+    """
+
+    def __init__(self, enc, ssn=None, dec=None):
+        super(EncoderExport, self).__init__()
+        self.enc = enc
+        self.ssn = ssn
+        self.ctc = dec if dec is not None and getattr(dec, 'ctc_weight', 0) > 0 else None
+
+    def forward(self, xs, xlens):
+        """Forward pass.
+
+        Args:
+            xs (FloatTensor): `[B, T, input_dim]`
+            xlens (IntTensor): `[B]`
+        Returns:
+            eouts (FloatTensor): `[B, T', enc_n_units]`
+            elens (IntTensor): `[B]`
+            ctc_log_probs (FloatTensor): `[B, T', vocab]` (only when CTC is available)
+
+        """
+        if self.ssn is not None:
+            xs = self.ssn(xs, xlens)
+        eout_dict = self.enc(xs, xlens, 'ys')
+        eouts, elens = eout_dict['ys']['xs'], eout_dict['ys']['xlens']
+        if self.ctc is None:
+            return eouts, elens
+        return eouts, elens, self.ctc.ctc_log_probs(eouts)
+
+
+class LASStepExport(nn.Module):
+    """One decoding step of the attention-based RNN decoder.
+
+    Args:
+        dec (RNNDecoder): LAS decoder
+
+    """
+
+    def __init__(self, dec):
+        super(LASStepExport, self).__init__()
+        assert isinstance(dec, RNNDecoder)
+        if dec.lm is not None:
+            raise NotImplementedError('LM fusion is not supported for export.')
+        if type(dec.score) not in [AttentionMechanism, MultiheadAttentionMechanism] or \
+                dec.attn_type == 'triggered_attention':
+            raise NotImplementedError(dec.attn_type)
+        self.dec = dec
+
+    def forward(self, y, eouts, elens, cv, hxs, cxs, aw):
+        """Forward pass.
+
+        Args:
+            y (LongTensor): `[B, 1]`
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            elens (IntTensor): `[B]`
+            cv (FloatTensor): `[B, 1, enc_n_units]`
+            hxs (FloatTensor): `[n_layers, B, dec_n_units]`
+            cxs (FloatTensor): `[n_layers, B, dec_n_units]` (passed through for GRU)
+            aw (FloatTensor): `[B, H, 1, T]` (zeros at the first step)
+        Returns:
+            log_probs (FloatTensor): `[B, vocab]`
+            cv (FloatTensor): `[B, 1, enc_n_units]`
+            hxs (FloatTensor): `[n_layers, B, dec_n_units]`
+            cxs (FloatTensor): `[n_layers, B, dec_n_units]`
+            aw (FloatTensor): `[B, H, 1, T]`
+
+        """
+        dec = self.dec
+        dstates = {'dstate': (hxs, cxs if dec.rnn_type == 'lstm' else None)}
+        y_emb = dec.dropout_emb(dec.embed(y))
+        # NOTE: do not cache encoder-side attention features inside the traced graph
+        dstates, cv, aw, _, attn_v = dec.decode_step(
+            eouts, dstates, cv, y_emb, _length_mask(eouts, elens), aw, None, cache=False)
+        log_probs = torch.log_softmax(dec.output(attn_v).squeeze(1), dim=-1)
+        hxs, new_cxs = dstates['dstate']
+        if dec.rnn_type == 'lstm':
+            cxs = new_cxs
+        return log_probs, cv, hxs, cxs, aw
+
+
+class TransformerDecoderSrcCacheExport(nn.Module):
+    """Key and value of source-target attention in each Transformer decoder layer.
+
+    Computed once per utterance and fed to `TransformerDecoderStepExport` at every step.
+
+    Args:
+        dec (TransformerDecoder): Transformer decoder
+
+    """
+
+    def __init__(self, dec):
+        super(TransformerDecoderSrcCacheExport, self).__init__()
+        assert isinstance(dec, TransformerDecoder)
+        self.dec = dec
+
+    def forward(self, eouts):
+        """Forward pass.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+        Returns:
+            src_keys (FloatTensor): `[n_layers, B, T, H, d_k]`
+            src_values (FloatTensor): `[n_layers, B, T, H, d_k]`
+
+        """
+        src_keys, src_values = [], []
+        for layer in self.dec.layers:
+            attn = layer.src_attn
+            src_keys.append(attn.w_key(eouts).view(eouts.size(0), -1, attn.n_heads, attn.d_k))
+            src_values.append(attn.w_value(eouts).view(eouts.size(0), -1, attn.n_heads, attn.d_k))
+        return torch.stack(src_keys, dim=0), torch.stack(src_values, dim=0)
+
+
+class TransformerDecoderStepExport(nn.Module):
+    """One decoding step of the Transformer decoder with key/value caches.
+
+    The caches held inside attention modules during beam search
+    (see `TransformerDecoderBlock.forward(..., kv_cache=True)`) are passed as
+    explicit tensors so that the step is stateless.
+    The runtime reorders `keys` and `values` along the batch dimension after pruning hypotheses.
+
+    Args:
+        dec (TransformerDecoder): Transformer decoder
+
+    """
+
+    def __init__(self, dec):
+        super(TransformerDecoderStepExport, self).__init__()
+        assert isinstance(dec, TransformerDecoder)
+        if dec.lm is not None or dec.attn_type != 'scaled_dot' or '1dconv' in dec.pe_type:
+            raise NotImplementedError(dec.attn_type)
+        self.dec = dec
+
+    def forward(self, y, src_keys, src_values, elens, keys, values):
+        """Forward pass.
+
+        Args:
+            y (LongTensor): `[B, 1]`, the last token (<sos> at the first step)
+            src_keys (FloatTensor): `[n_layers, B, T, H, d_k]`
+            src_values (FloatTensor): `[n_layers, B, T, H, d_k]`
+            elens (IntTensor): `[B]`
+            keys (FloatTensor): `[n_layers, B, L-1, H, d_k]`, key of self-attention for previous tokens
+            values (FloatTensor): `[n_layers, B, L-1, H, d_k]`, value of self-attention for previous tokens
+        Returns:
+            log_probs (FloatTensor): `[B, vocab]`
+            keys (FloatTensor): `[n_layers, B, L, H, d_k]`
+            values (FloatTensor): `[n_layers, B, L, H, d_k]`
+
+        """
+        dec = self.dec
+        src_mask = _length_mask(src_keys[0], elens).unsqueeze(3)
+        src_mask = src_mask.repeat([1, 1, 1, src_keys.size(3)])  # `[B, 1, T, H]`
+
+        new_keys, new_values = [], []
+        out = dec.pos_enc(dec.embed(y), offset=keys.size(2))
+        for lth, layer in enumerate(dec.layers):
+            layer.self_attn.key, layer.self_attn.value = keys[lth], values[lth]
+            layer.src_attn.key, layer.src_attn.value = src_keys[lth], src_values[lth]
+            layer.src_attn.mask = src_mask
+            out = layer(out, None, None, None, kv_cache=True)
+            new_keys.append(layer.self_attn.key)
+            new_values.append(layer.self_attn.value)
+            # NOTE: do not leave tensors of the traced graph in the decoder
+            layer.reset()
+        log_probs = torch.log_softmax(dec.output(dec.norm_out(out[:, -1])), dim=-1)
+        return log_probs, torch.stack(new_keys, dim=0), torch.stack(new_values, dim=0)
+
+
+class RNNTPredictionStepExport(nn.Module):
+    """One step of the prediction network of the RNN transducer.
+
+    Args:
+        dec (RNNTransducer): RNN-T decoder
+
+    """
+
+    def __init__(self, dec):
+        super(RNNTPredictionStepExport, self).__init__()
+        assert isinstance(dec, RNNTransducer)
+        self.dec = dec
+
+    def forward(self, y, hxs, cxs):
+        """Forward pass.
+
+        Args:
+            y (LongTensor): `[B, 1]`
+            hxs (FloatTensor): `[n_layers, B, dec_n_units]`
+            cxs (FloatTensor): `[n_layers, B, dec_n_units]` (passed through for GRU)
+        Returns:
+            dout (FloatTensor): `[B, 1, dec_n_units]`
+            hxs (FloatTensor): `[n_layers, B, dec_n_units]`
+            cxs (FloatTensor): `[n_layers, B, dec_n_units]`
+
+        """
+        dec = self.dec
+        dout, dstate = dec.recurrency(dec.dropout_emb(dec.embed(y)), {'hxs': hxs, 'cxs': cxs})
+        if dec.rnn_type == 'lstm_transducer':
+            cxs = dstate['cxs']
+        return dout, dstate['hxs'], cxs
+
+
+class RNNTJointExport(nn.Module):
+    """Joint network of the RNN transducer.
+
+    Args:
+        dec (RNNTransducer): RNN-T decoder
+
+    """
+
+    def __init__(self, dec):
+        super(RNNTJointExport, self).__init__()
+        assert isinstance(dec, RNNTransducer)
+        self.dec = dec
+
+    def forward(self, eouts, douts):
+        """Forward pass.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            douts (FloatTensor): `[B, L, dec_n_units]`
+        Returns:
+            log_probs (FloatTensor): `[B, T, L, vocab]`
+
+        """
+        return torch.log_softmax(self.dec.joint(eouts, douts), dim=-1)
+
+
+class RNNLMStepExport(nn.Module):
+    """One step of RNNLM.
+
+    Args:
+        lm (RNNLM): RNN language model
+
+    """
+
+    def __init__(self, lm):
+        super(RNNLMStepExport, self).__init__()
+        assert isinstance(lm, RNNLM)
+        if lm.adaptive_softmax is not None:
+            raise NotImplementedError('Adaptive softmax is not supported for export.')
+        self.lm = lm
+
+    def forward(self, y, hxs, cxs):
+        """Forward pass.
+
+        Args:
+            y (LongTensor): `[B, 1]`
+            hxs (FloatTensor): `[n_layers, B, n_units]`
+            cxs (FloatTensor): `[n_layers, B, n_units]` (passed through for GRU)
+        Returns:
+            log_probs (FloatTensor): `[B, vocab]`
+            hxs (FloatTensor): `[n_layers, B, n_units]`
+            cxs (FloatTensor): `[n_layers, B, n_units]`
+
+        """
+        _, state, log_probs = self.lm.predict(y, {'hxs': hxs, 'cxs': cxs})
+        if self.lm.rnn_type == 'lstm':
+            cxs = state['cxs']
+        return log_probs[:, -1], state['hxs'], cxs
+
+
+class TransformerLMStepExport(nn.Module):
+    """One step of TransformerLM with layer-wise output caches.
+
+    Args:
+        lm (TransformerLM): Transformer language model
+
+    """
+
+    def __init__(self, lm):
+        super(TransformerLMStepExport, self).__init__()
+        assert isinstance(lm, TransformerLM)
+        if lm.adaptive_softmax is not None:
+            raise NotImplementedError('Adaptive softmax is not supported for export.')
+        self.lm = lm
+
+    def forward(self, ys, cache):
+        """Forward pass.
+
+        Args:
+            ys (LongTensor): `[B, L]`, all tokens so far (starting from <sos>)
+            cache (FloatTensor): `[n_layers, B, L-1, d_model]`
+        Returns:
+            log_probs (FloatTensor): `[B, vocab]`
+            new_cache (FloatTensor): `[n_layers, B, L, d_model]`
+
+        """
+        _, new_cache, log_probs = self.lm.predict(ys, cache=[c for c in cache])
+        return log_probs[:, -1], torch.stack(new_cache, dim=0)
+
+
+def lm_step_module(lm):
+    """Build the one-step module and its example inputs for an LM.
+
+    Args:
+        lm (LMBase): RNNLM or TransformerLM
+    Returns:
+        module (nn.Module):
+        example_inputs (tuple): inputs for tracing
+        names (tuple): input names and output names
+
+    """
+    w = next(lm.parameters())
+    if isinstance(lm, RNNLM):
+        hxs = w.new_zeros(lm.n_layers, 1, lm.n_units)
+        inputs = (w.new_zeros((1, 1), dtype=torch.int64), hxs, torch.zeros_like(hxs))
+        return RNNLMStepExport(lm), inputs, (['y', 'hxs', 'cxs'], ['log_probs', 'hxs_out', 'cxs_out'])
+    elif isinstance(lm, TransformerLM):
+        inputs = (w.new_zeros((1, 2), dtype=torch.int64), w.new_zeros(lm.n_layers, 1, 1, lm.d_model))
+        return TransformerLMStepExport(lm), inputs, (['ys', 'cache'], ['log_probs', 'cache_out'])
+    raise NotImplementedError(type(lm))
+
+
+def trace(module, example_inputs, check_inputs=None):
+    """Trace a module and verify it against eager execution.
+
+    Args:
+        module (nn.Module): module to trace
+        example_inputs (tuple): inputs for tracing
+        check_inputs (list): list of input tuples with shapes different from `example_inputs`
+    Returns:
+        traced (torch.jit.ScriptModule):
+
+    """
+    module.eval()
+    with torch.no_grad(), warnings.catch_warnings():
+        # NOTE: shape-dependent Python branches are verified below instead
+        warnings.simplefilter('ignore', torch.jit.TracerWarning)
+        traced = torch.jit.trace(module, example_inputs, check_trace=False)
+        for inputs in [example_inputs] + (check_inputs or []):
+            outs_ref, outs = module(*inputs), traced(*inputs)
+            if isinstance(outs_ref, torch.Tensor):
+                outs_ref, outs = (outs_ref,), (outs,)
+            for o_ref, o in zip(outs_ref, outs):
+                if o_ref.size() != o.size() or not torch.allclose(o_ref.float(), o.float(), atol=1e-4):
+                    raise ValueError('Traced %s does not match eager execution for input shapes %s.'
+                                     % (type(module).__name__, [tuple(x.size()) for x in inputs]))
+    return traced
+
+
+def export_onnx(module, example_inputs, check_inputs, names, path):
+    """Export a module as an ONNX graph.
+
+    Args:
+        module (nn.Module): module to export
+        example_inputs (tuple): inputs for tracing
+        check_inputs (list): list of input tuples with shapes different from `example_inputs`.
+            Axes whose sizes differ from `example_inputs` are exported as dynamic axes.
+        names (tuple): input names and output names
+        path (str): path to the ONNX file
+
+    """
+    input_names, output_names = names
+    # NOTE: feature dimensions must stay static (e.g., to split gates of LSTM cells)
+    dynamic_axes = {k: {i: '%s_dim%d' % (k, i) for i in range(x.dim())
+                        if any(inputs[j].size(i) != x.size(i) for inputs in check_inputs)}
+                    for j, (k, x) in enumerate(zip(input_names, example_inputs))}
+    module.eval()
+    with torch.no_grad():
+        torch.onnx.export(module, example_inputs, path,
+                          input_names=input_names, output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=13)
+
+
+def _save(module, example_inputs, check_inputs, names, save_dir, name, onnx):
+    traced = trace(module, example_inputs, check_inputs)
+    torch.jit.save(traced, os.path.join(save_dir, name + '.pt'))
+    files = {'torchscript': name + '.pt'}
+    if onnx:
+        export_onnx(module, example_inputs, check_inputs, names, os.path.join(save_dir, name + '.onnx'))
+        files['onnx'] = name + '.onnx'
+    logger.info('Exported %s' % name)
+    return files
+
+
+def export_model(model, save_dir, lm=None, onnx=False):
+    """Export the ASR model (and the external LM) for a lean runtime.
+
+    The runtime only needs the files in `save_dir`: `encoder.pt`, a step function of
+    the decoder (`las_step.pt`, `transformer_src_cache.pt` and `transformer_step.pt`,
+    or `rnnt_prediction.pt` and `rnnt_joint.pt`),
+    `lm_step.pt` if `lm` is given, and `export.json` holding the special symbols and state shapes.
+
+    Args:
+        model (Speech2Text): ASR model
+        save_dir (str): directory to save exported modules
+        lm (LMBase): external LM
+        onnx (bool): export ONNX graphs as well
+    Returns:
+        meta (dict): contents of export.json
+
+    """
+    model.eval()
+    w = next(model.parameters())
+    dir = 'fwd' if hasattr(model, 'dec_fwd') else 'bwd'
+    dec = getattr(model, 'dec_' + dir)
+
+    meta = {'input_dim': model.input_dim,
+            'n_stacks': model.n_stacks, 'n_skips': model.n_skips, 'n_splices': model.n_splices,
+            'vocab': model.vocab, 'blank': model.blank, 'unk': model.unk, 'eos': model.eos,
+            'pad': model.pad, 'dec_type': model.dec_type, 'backward': dir == 'bwd',
+            'enc_n_units': model.enc.output_dim, 'modules': {}}
+
+    # encoder (+ CTC)
+    input_dim = model.input_dim * model.n_stacks * model.n_splices
+    xs = w.new_zeros(2, 64, input_dim).normal_()
+    check_xs = w.new_zeros(3, 37, input_dim).normal_()
+    encoder = EncoderExport(model.enc, model.ssn, dec)
+    meta['ctc'] = encoder.ctc is not None
+    meta['modules']['encoder'] = _save(
+        encoder, (xs, torch.IntTensor([64, 50])), [(check_xs, torch.IntTensor([37, 37, 20]))],
+        (['xs', 'xlens'], ['eouts', 'elens'] + (['ctc_log_probs'] if meta['ctc'] else [])),
+        save_dir, 'encoder', onnx)
+
+    # single-step decoder
+    with torch.no_grad():
+        eouts, elens = encoder(xs, torch.IntTensor([64, 50]))[:2]
+        check_eouts, check_elens = encoder(check_xs, torch.IntTensor([37, 37, 20]))[:2]
+    bs, check_bs = eouts.size(0), check_eouts.size(0)
+    if isinstance(dec, RNNDecoder):
+        n_heads = getattr(dec.score, 'n_heads', 1)
+
+        def _las_inputs(eouts, elens):
+            bs, xmax = eouts.size()[:2]
+            hxs = eouts.new_zeros(dec.n_layers, bs, dec.dec_n_units).normal_()
+            return (eouts.new_zeros((bs, 1), dtype=torch.int64).fill_(dec.eos), eouts, elens,
+                    eouts.new_zeros(bs, 1, dec.enc_n_units).normal_(), hxs, torch.zeros_like(hxs),
+                    torch.softmax(eouts.new_zeros(bs, n_heads, 1, xmax).normal_(), dim=-1))
+
+        meta.update({'rnn_type': dec.rnn_type, 'n_layers': dec.n_layers,
+                     'dec_n_units': dec.dec_n_units, 'attn_n_heads': n_heads})
+        meta['modules']['las_step'] = _save(
+            LASStepExport(dec), _las_inputs(eouts, elens), [_las_inputs(check_eouts, check_elens)],
+            (['y', 'eouts', 'elens', 'cv', 'hxs', 'cxs', 'aw'],
+             ['log_probs', 'cv_out', 'hxs_out', 'cxs_out', 'aw_out']),
+            save_dir, 'las_step', onnx)
+    elif isinstance(dec, TransformerDecoder):
+        attn = dec.layers[0].self_attn
+        n_heads, d_k = attn.n_heads, attn.d_k
+        meta.update({'n_layers': dec.n_layers, 'd_model': dec.d_model, 'n_heads': n_heads, 'd_k': d_k})
+        src_cache = TransformerDecoderSrcCacheExport(dec)
+        meta['modules']['transformer_src_cache'] = _save(
+            src_cache, (eouts,), [(check_eouts,)],
+            (['eouts'], ['src_keys', 'src_values']),
+            save_dir, 'transformer_src_cache', onnx)
+        with torch.no_grad():
+            src_keys, src_values = src_cache(eouts)
+            check_src_keys, check_src_values = src_cache(check_eouts)
+        keys = eouts.new_zeros(dec.n_layers, bs, 2, n_heads, d_k).normal_()
+        check_keys = eouts.new_zeros(dec.n_layers, check_bs, 0, n_heads, d_k)
+        meta['modules']['transformer_step'] = _save(
+            TransformerDecoderStepExport(dec),
+            (eouts.new_zeros((bs, 1), dtype=torch.int64).fill_(dec.eos),
+             src_keys, src_values, elens, keys, torch.randn_like(keys)),
+            [(check_eouts.new_zeros((check_bs, 1), dtype=torch.int64).fill_(dec.eos),
+              check_src_keys, check_src_values, check_elens, check_keys, check_keys)],
+            (['y', 'src_keys', 'src_values', 'elens', 'keys', 'values'],
+             ['log_probs', 'keys_out', 'values_out']),
+            save_dir, 'transformer_step', onnx)
+    elif isinstance(dec, RNNTransducer):
+        meta.update({'rnn_type': dec.rnn_type, 'n_layers': dec.n_layers,
+                     'dec_n_units': dec.dec_n_units})
+        hxs = w.new_zeros(dec.n_layers, bs, dec.dec_n_units)
+        check_hxs = w.new_zeros(dec.n_layers, check_bs, dec.dec_n_units).normal_()
+        meta['modules']['rnnt_prediction'] = _save(
+            RNNTPredictionStepExport(dec),
+            (w.new_zeros((bs, 1), dtype=torch.int64).fill_(dec.eos), hxs, torch.zeros_like(hxs)),
+            [(w.new_zeros((check_bs, 1), dtype=torch.int64).fill_(dec.eos), check_hxs, check_hxs)],
+            (['y', 'hxs', 'cxs'], ['dout', 'hxs_out', 'cxs_out']),
+            save_dir, 'rnnt_prediction', onnx)
+        meta['modules']['rnnt_joint'] = _save(
+            RNNTJointExport(dec),
+            (eouts[:, :1], w.new_zeros(bs, 1, dec.dec_n_units).normal_()),
+            [(check_eouts, w.new_zeros(check_bs, 2, dec.dec_n_units).normal_())],
+            (['eouts', 'douts'], ['log_probs']),
+            save_dir, 'rnnt_joint', onnx)
+    elif dec.ctc_weight == 0:
+        raise NotImplementedError(type(dec))
+
+    # external LM
+    if lm is not None:
+        lm.eval()
+        module, inputs, names = lm_step_module(lm)
+        if isinstance(lm, RNNLM):
+            meta['lm'] = {'lm_type': 'rnn', 'rnn_type': lm.rnn_type,
+                          'n_layers': lm.n_layers, 'n_units': lm.n_units}
+            check_hxs = inputs[1].new_zeros(lm.n_layers, 3, lm.n_units).normal_()
+            check_inputs = [(inputs[0].new_zeros(3, 1).fill_(lm.eos), check_hxs, torch.randn_like(check_hxs))]
+        else:
+            meta['lm'] = {'lm_type': 'transformer', 'n_layers': lm.n_layers, 'd_model': lm.d_model}
+            check_inputs = [(inputs[0].new_zeros(3, 4).fill_(lm.eos),
+                             inputs[1].new_zeros(lm.n_layers, 3, 3, lm.d_model).normal_())]
+        meta['lm']['vocab'] = lm.vocab
+        meta['modules']['lm_step'] = _save(module, inputs, check_inputs, names, save_dir, 'lm_step', onnx)
+
+    with open(os.path.join(save_dir, 'export.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
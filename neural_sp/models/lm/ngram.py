@@ -0,0 +1,341 @@
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Back-off n-gram language model compiled from an ARPA file."""
+
+import codecs
+import logging
+import math
+import numpy as np
+import os
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+LOG10 = math.log(10)
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+ARRAY_NAMES = ['word', 'logp', 'bow', 'suffix', 'depth', 'child_start', 'hash_keys', 'hash_vals']
+
+
+def is_ngram_lm(path):
+    """Whether a path is an ARPA file or an n-gram LM compiled by `NgramLM.save()`."""
+    return path.endswith('.arpa') or os.path.isfile(os.path.join(path, 'word.npy'))
+
+
+def _hash(keys, n_bits):
+    return ((keys.astype(np.uint64) * HASH_MULTIPLIER) >> np.uint64(64 - n_bits)).astype(np.int64)
+
+
+class NgramLM(nn.Module):
+    """Back-off n-gram language model for shallow fusion and rescoring.
+
+    N-gram entries are stored in a trie of flat arrays in breadth-first order,
+    so that children of each node are contiguous and sorted by token index.
+    Each node also has a back-pointer to the node of its suffix (i.e., without the first token),
+    and an open-addressing hash table maps (parent node, token) to a child node
+    for constant-time state transitions. The arrays can be memory-mapped.
+
+    The interface of `predict()` and states follows RNNLM, so that this model can be used
+    in any beam search supporting RNNLM. A state is a dict of
+        hxs (LongTensor): `[1, B, 1]`, trie nodes of the longest known histories
+        cxs (LongTensor): `[1, B, 0]`, dummy
+
+    Args:
+        arrays (dict): trie arrays (see `ARRAY_NAMES`)
+        vocab (int): vocabulary size of the ASR model
+        eos (int): index of <eos>, which is used for both <s> and </s>
+        order (int): n-gram order
+        unk_logp (float): natural log probability of tokens not in the n-gram LM
+
+    """
+
+    def __init__(self, arrays, vocab, eos, order, unk_logp):
+
+        super(NgramLM, self).__init__()
+        logger.info(self.__class__.__name__)
+
+        self.vocab = vocab
+        self.eos = eos
+        self.sos_internal = vocab  # NOTE: <s> is distinguished from </s> only inside the trie
+        self.order = order
+        self.unk_logp = unk_logp
+        for k in ARRAY_NAMES:
+            setattr(self, k, arrays[k])
+        self.n_hash_bits = int(math.log2(self.hash_keys.shape[0]))
+
+    @property
+    def device(self):
+        # NOTE: trie arrays are kept on CPU
+        return torch.device('cpu')
+
+    @property
+    def n_nodes(self):
+        return self.word.shape[0]
+
+    @classmethod
+    def from_arpa(cls, arpa_path, dict_path, unk='<unk>', eos='<eos>'):
+        """Compile an ARPA file into a trie.
+
+        Args:
+            arpa_path (str): path to an ARPA file
+            dict_path (str): path to the dictionary of the ASR model
+            unk (str): <unk> token in the dictionary
+            eos (str): <eos> token in the dictionary
+        Returns:
+            lm (NgramLM):
+
+        """
+        token2idx = {'<blank>': 0}
+        with codecs.open(dict_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                w, idx = line.strip().split(' ')
+                token2idx[w] = int(idx)
+        vocab = max(token2idx.values()) + 1
+        token2idx['<s>'] = vocab
+        token2idx['</s>'] = token2idx[eos]
+        token2idx['<unk>'] = token2idx[unk]
+
+        # Parse n-gram entries
+        entries = []  # `[order]`, each of which is a dict of {token indices: (log10 prob, log10 bow)}
+        n_oov = 0
+        order = 0
+        with codecs.open(arpa_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0 or line.startswith('ngram '):
+                    continue
+                if line.startswith('\\'):
+                    if line.endswith('-grams:'):
+                        order = int(line[1:].split('-')[0])
+                        entries.append({})
+                    continue
+                if order == 0:
+                    continue
+                fields = line.split()
+                words = fields[1:order + 1]
+                if any([w not in token2idx for w in words]):
+                    n_oov += 1
+                    continue
+                bow = float(fields[order + 1]) if len(fields) > order + 1 else 0.
+                entries[order - 1][tuple([token2idx[w] for w in words])] = (float(fields[0]), bow)
+        if n_oov > 0:
+            logger.warning('%d n-grams including tokens out of the ASR vocabulary are skipped.' % n_oov)
+        unk_logp = entries[0].get((token2idx['<unk>'],), (-99., 0.))[0] * LOG10
+
+        # Arrange nodes in breadth-first order
+        word, logp, bow, parent = [-1], [0.], [0.], [-1]
+        level_start = [0]
+        prev_nodes = {(): 0}
+        for n, ngrams in enumerate(entries):
+            level_start.append(len(word))
+            nodes = {}
+            keys = []
+            for ids, (p, b) in ngrams.items():
+                if ids[:-1] not in prev_nodes:
+                    continue  # NOTE: histories missing in lower orders are not reachable
+                keys.append((prev_nodes[ids[:-1]], ids[-1], p, b, ids))
+            for p_node, w, p, b, ids in sorted(keys):
+                nodes[ids] = len(word)
+                word.append(w)
+                logp.append(p * LOG10)
+                bow.append(b * LOG10)
+                parent.append(p_node)
+            prev_nodes = nodes
+        level_start.append(len(word))
+        word = np.array(word, dtype=np.int64)
+        parent = np.array(parent, dtype=np.int64)
+        n_nodes = word.shape[0]
+
+        # Children of each node are contiguous
+        child_start = np.searchsorted(parent[1:], np.arange(n_nodes + 1)) + 1
+
+        arrays = {'word': word,
+                  'logp': np.array(logp, dtype=np.float32),
+                  'bow': np.array(bow, dtype=np.float32),
+                  'child_start': child_start.astype(np.int64)}
+        arrays.update(cls._build_hash_table(parent, word, vocab + 1))
+        arrays['depth'] = np.zeros(n_nodes, dtype=np.int64)
+        arrays['suffix'] = np.zeros(n_nodes, dtype=np.int64)
+        lm = cls(arrays, vocab, token2idx[eos], len(entries), unk_logp)
+
+        # Suffix links are resolved from lower orders
+        for n in range(1, len(entries) + 1):
+            nodes = np.arange(level_start[n], level_start[n + 1])
+            lm.depth[nodes] = n
+            if n > 1:
+                lm.suffix[nodes] = lm._extend(lm.suffix[parent[nodes]], word[nodes], is_state=False)
+        logger.info('%d-gram LM: %d nodes' % (lm.order, n_nodes))
+        return lm
+
+    @staticmethod
+    def _build_hash_table(parent, word, vocab):
+        n_nodes = word.shape[0]
+        n_bits = max(int(math.ceil(math.log2(n_nodes * 2))), 1)
+        hash_keys = np.full(2 ** n_bits, -1, dtype=np.int64)
+        hash_vals = np.full(2 ** n_bits, -1, dtype=np.int64)
+        keys = parent * vocab + word
+        slots = _hash(keys, n_bits)
+        pending = np.arange(1, n_nodes)
+        # linear probing
+        while pending.shape[0] > 0:
+            s = slots[pending]
+            is_empty = hash_keys[s] == -1
+            empty_slots, first = np.unique(s[is_empty], return_index=True)
+            winners = pending[is_empty][first]
+            hash_keys[empty_slots] = keys[winners]
+            hash_vals[empty_slots] = winners
+            is_placed = np.zeros(n_nodes, dtype=bool)
+            is_placed[winners] = True
+            pending = pending[~is_placed[pending]]
+            slots[pending] = (slots[pending] + 1) & (2 ** n_bits - 1)
+        return {'hash_keys': hash_keys, 'hash_vals': hash_vals}
+
+    def save(self, save_dir):
+        """Save trie arrays, which can be loaded with memory mapping."""
+        if not os.path.isdir(save_dir):
+            os.makedirs(save_dir)
+        for k in ARRAY_NAMES:
+            np.save(os.path.join(save_dir, k + '.npy'), getattr(self, k))
+        np.save(os.path.join(save_dir, 'meta.npy'),
+                np.array([self.vocab, self.eos, self.order, self.unk_logp], dtype=np.float64))
+
+    @classmethod
+    def load(cls, path, dict_path=None, mmap=True):
+        """Load an n-gram LM from an ARPA file or a directory saved by `save()`.
+
+        Args:
+            path (str): path to an ARPA file or a directory of trie arrays
+            dict_path (str): path to the dictionary of the ASR model (for ARPA files)
+            mmap (bool): memory-map trie arrays
+        Returns:
+            lm (NgramLM):
+
+        """
+        if path.endswith('.arpa'):
+            return cls.from_arpa(path, dict_path)
+        arrays = {k: np.load(os.path.join(path, k + '.npy'), mmap_mode='r' if mmap else None)
+                  for k in ARRAY_NAMES}
+        vocab, eos, order, unk_logp = np.load(os.path.join(path, 'meta.npy')).tolist()
+        return cls(arrays, int(vocab), int(eos), int(order), unk_logp)
+
+    def _child(self, nodes, ids):
+        """Look up children of nodes in the hash table.
+
+        Args:
+            nodes (np.ndarray): `[B]`
+            ids (np.ndarray): `[B]`
+        Returns:
+            children (np.ndarray): `[B]`, -1 if not found
+
+        """
+        keys = nodes * (self.vocab + 1) + ids
+        slots = _hash(keys, self.n_hash_bits)
+        children = np.full(keys.shape[0], -1, dtype=np.int64)
+        pending = np.arange(keys.shape[0])
+        while pending.shape[0] > 0:
+            k = self.hash_keys[slots[pending]]
+            is_hit = k == keys[pending]
+            children[pending[is_hit]] = self.hash_vals[slots[pending[is_hit]]]
+            pending = pending[~is_hit & (k != -1)]
+            slots[pending] = (slots[pending] + 1) & (self.hash_keys.shape[0] - 1)
+        return children
+
+    def _extend(self, nodes, ids, is_state=True):
+        """Transit to nodes of the longest known histories extended by tokens.
+
+        Args:
+            nodes (np.ndarray): `[B]`
+            ids (np.ndarray): `[B]`
+            is_state (bool): shorten histories of the highest order by one token
+        Returns:
+            new_nodes (np.ndarray): `[B]`
+
+        """
+        new_nodes = np.zeros_like(nodes)
+        pending = np.arange(nodes.shape[0])
+        nodes = nodes.copy()
+        # NOTE: back off at most `order` times
+        while pending.shape[0] > 0:
+            children = self._child(nodes[pending], ids[pending])
+            is_found = children >= 0
+            new_nodes[pending[is_found]] = children[is_found]
+            pending = pending[~is_found & (nodes[pending] > 0)]  # unknown at the root
+            nodes[pending] = self.suffix[nodes[pending]]
+        if is_state:
+            is_full = self.depth[new_nodes] >= self.order
+            new_nodes[is_full] = self.suffix[new_nodes[is_full]]
+        return new_nodes
+
+    def _log_probs(self, nodes):
+        """Compute log probabilities of all tokens given histories.
+
+        Args:
+            nodes (np.ndarray): `[B]`
+        Returns:
+            log_probs (np.ndarray): `[B, vocab]`
+
+        """
+        bs = nodes.shape[0]
+        log_probs = np.full((bs, self.vocab + 1), self.unk_logp, dtype=np.float32)
+
+        # Backtrack suffixes from the longest histories to the root
+        chains = np.full((bs, self.order), -1, dtype=np.int64)
+        rows = np.arange(bs)
+        cur = nodes.copy()
+        for _ in range(self.order):
+            chains[rows, self.depth[cur]] = cur
+            cur = self.suffix[cur]
+
+        # Back off from shorter histories
+        for n in range(self.order):
+            rows = np.nonzero(chains[:, n] >= 0)[0]
+            if rows.shape[0] == 0:
+                continue
+            hist = chains[rows, n]
+            log_probs[rows] += self.bow[hist][:, None]
+            start, end = self.child_start[hist], self.child_start[hist + 1]
+            counts = end - start
+            child_rows = np.repeat(rows, counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            children = np.repeat(start, counts) + offsets
+            log_probs[child_rows, self.word[children]] = self.logp[children]
+        return log_probs[:, :self.vocab]
+
+    def zero_state(self, batch_size):
+        nodes = torch.zeros((1, batch_size, 1), dtype=torch.int64)
+        return {'hxs': nodes, 'cxs': nodes.new_zeros(1, batch_size, 0)}
+
+    def predict(self, ys, state=None, mems=None, cache=None, emb_cache=False):
+        """Precict function for ASR.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            state (dict):
+                hxs (LongTensor): `[1, B, 1]`
+                cxs (LongTensor): `[1, B, 0]`
+            mems: dummy interfance for TransformerXL
+            cache: dummy interfance for TransformerLM/TransformerXL
+            emb_cache: dummy interfance for RNNLM
+        Returns:
+            lmout: dummy interfance for RNNLM
+            new_state (dict):
+                hxs (LongTensor): `[1, B, 1]`
+                cxs (LongTensor): `[1, B, 0]`
+            log_probs (FloatTensor): `[B, L, vocab]`
+
+        """
+        bs, ymax = ys.size()
+        if state is None:
+            state = self.zero_state(bs)
+        nodes = state['hxs'].view(-1).cpu().numpy()
+        ys_np = ys.cpu().numpy()
+        log_probs = []
+        for t in range(ymax):
+            # NOTE: <eos> as an input is the beginning of a sentence
+            ids = np.where(ys_np[:, t] == self.eos, self.sos_internal, ys_np[:, t])
+            nodes = self._extend(nodes, ids)
+            log_probs.append(self._log_probs(nodes))
+        log_probs = torch.from_numpy(np.stack(log_probs, axis=1)).to(ys.device)
+        nodes = torch.from_numpy(nodes).to(ys.device).view(1, bs, 1)
+        return None, {'hxs': nodes, 'cxs': nodes.new_zeros(1, bs, 0)}, log_probs
@@ -3,7 +3,6 @@
 
 """Single-head attention layer."""
 
-import numpy as np
 import torch
 import torch.nn as nn
 
@@ -160,7 +159,7 @@ class AttentionMechanism(nn.Module):
             e = self.v(torch.tanh(self.w(torch.cat([self.key, query], dim=-1)))).transpose(2, 1)
         assert e.size() == (bs, qlen, klen), (e.size(), (bs, qlen, klen))
 
-        NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+        NEG_INF = torch.finfo(e.dtype).min
 
         # Mask the right part from the trigger point
         if self.atype == 'triggered_attention':
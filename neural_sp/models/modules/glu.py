@@ -4,6 +4,7 @@
 """Gated Linear Units (GLU) block."""
 
 from collections import OrderedDict
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
@@ -50,6 +51,7 @@ class ConvGLUBlock(nn.Module):
                           kernel_size=(1, 1)), name='weight', dim=0)
             self.dropout_residual = nn.Dropout(p=dropout)
 
+        self.kernel_size = kernel_size
         self.pad_left = nn.ConstantPad2d((0, 0, kernel_size - 1, 0), 0)
 
         layers = OrderedDict()
@@ -60,7 +62,7 @@ class ConvGLUBlock(nn.Module):
                           kernel_size=(kernel_size, 1)), name='weight', dim=0)
             # TODO(hirofumi0810): padding?
             layers['dropout'] = nn.Dropout(p=dropout)
-            layers['glu'] = nn.GLU()
+            layers['glu'] = nn.GLU(dim=1)
 
         elif bottlececk_dim > 0:
             layers['conv_in'] = nn.utils.weight_norm(
@@ -73,7 +75,7 @@ class ConvGLUBlock(nn.Module):
                           out_channels=bottlececk_dim,
                           kernel_size=(kernel_size, 1)), name='weight', dim=0)
             layers['dropout'] = nn.Dropout(p=dropout)
-            layers['glu'] = nn.GLU()
+            layers['glu'] = nn.GLU(dim=1)
             layers['conv_out'] = nn.utils.weight_norm(
                 nn.Conv2d(in_channels=bottlececk_dim,
                           out_channels=out_ch * 2,
@@ -82,6 +84,12 @@ class ConvGLUBlock(nn.Module):
 
         self.layers = nn.Sequential(layers)
 
+        # for streaming inference
+        self.reset_cache()
+
+    def reset_cache(self):
+        self.cache = None
+
     def forward(self, xs):
         """Forward pass.
 
@@ -98,3 +106,26 @@ class ConvGLUBlock(nn.Module):
         xs = self.layers(xs)  # `[B, out_ch * 2, T ,1]`
         xs = xs + residual
         return xs
+
+    def forward_stateful(self, xs):
+        """Forward pass for new frames in a stream.
+           The last (kernel_size - 1) inputs are cached as the left context
+           of the next call instead of zero padding.
+
+        Args:
+            xs (FloatTensor): `[B, in_ch, T, feat_dim]`
+        Returns:
+            out (FloatTensor): `[B, out_ch, T, feat_dim]`
+
+        """
+        residual = xs
+        if self.conv_residual is not None:
+            residual = self.dropout_residual(self.conv_residual(residual))
+        if self.cache is None:
+            xs = self.pad_left(xs)
+        else:
+            xs = torch.cat([self.cache, xs], dim=2)  # `[B, embed_dim, T+kernel-1, 1]`
+        self.cache = xs[:, :, xs.size(2) - (self.kernel_size - 1):]
+        xs = self.layers(xs)  # `[B, out_ch * 2, T ,1]`
+        xs = xs + residual
+        return xs
@@ -5,7 +5,6 @@
 
 import logging
 import math
-import numpy as np
 import torch
 import torch.nn as nn
 
@@ -116,7 +115,7 @@ class GMMAttention(nn.Module):
 
         # Compute context vector
         if mask is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=myu.dtype).numpy().dtype).min)
+            NEG_INF = torch.finfo(myu.dtype).min
             aw = aw.masked_fill_(mask == 0, NEG_INF)
         aw = self.dropout(aw)
         cv = torch.bmm(aw, value)
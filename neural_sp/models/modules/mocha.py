@@ -8,7 +8,6 @@
 
 import logging
 import math
-import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -96,6 +95,19 @@ class MonotonicEnergy(nn.Module):
         self.key = None
         self.mask = None
 
+    def extend_cache(self, key):
+        """Append key of new encoder outputs to the cache for streaming inference.
+
+        Args:
+            key (FloatTensor): `[1, klen_new, kdim]`
+
+        """
+        if self.conv1d is not None:
+            raise NotImplementedError
+        key = self.w_key(key).view(key.size(0), -1, self.n_heads, self.d_k)
+        self.key = key if self.key is None else torch.cat([self.key, key], dim=1)
+        self.mask = None
+
     def forward(self, key, query, mask, cache=False,
                 boundary_leftmost=0, boundary_rightmost=100000):
         """Compute monotonic energy.
@@ -151,7 +163,7 @@ class MonotonicEnergy(nn.Module):
         if self.r is not None:
             e = e + self.r
         if m is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+            NEG_INF = torch.finfo(e.dtype).min
             e = e.masked_fill_(m == 0, NEG_INF)
         e = e.permute(0, 3, 1, 2)  # `[B, H_ma, qlen, klen]`
 
@@ -213,6 +225,17 @@ class ChunkEnergy(nn.Module):
         self.key = None
         self.mask = None
 
+    def extend_cache(self, key):
+        """Append key of new encoder outputs to the cache for streaming inference.
+
+        Args:
+            key (FloatTensor): `[1, klen_new, kdim]`
+
+        """
+        key = self.w_key(key).view(key.size(0), -1, self.n_heads, self.d_k)
+        self.key = key if self.key is None else torch.cat([self.key, key], dim=1)
+        self.mask = None
+
     def forward(self, key, query, mask, cache=False,
                 boundary_leftmost=0, boundary_rightmost=100000):
         """Compute chunkwise energy.
@@ -262,7 +285,7 @@ class ChunkEnergy(nn.Module):
         # e: `[B, qlen, klen, H_ca]`
 
         if m is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+            NEG_INF = torch.finfo(e.dtype).min
             e = e.masked_fill_(m == 0, NEG_INF)
         e = e.permute(0, 3, 1, 2)  # `[B, H_ca, qlen, klen]`
 
@@ -403,6 +426,51 @@ class MoChA(nn.Module):
         self.key_cur_tail = None
         # NOTE: cache encoder outputs at the previous block
 
+    def extend_cache(self, key, value):
+        """Append key of new encoder outputs to the caches of energy functions for streaming inference.
+        NOTE: value is projected at every step.
+
+        Args:
+            key (FloatTensor): `[1, klen_new, kdim]`
+            value: dummy interface
+
+        """
+        if self.monotonic_energy is not None:
+            self.monotonic_energy.extend_cache(key)
+        if self.chunk_energy is not None:
+            self.chunk_energy.extend_cache(key)
+
+    def get_cache(self):
+        """Get states for streaming inference to switch between streams.
+
+        Returns:
+            cache (dict): boundary offset, tails of keys, and keys cached in energy functions
+
+        """
+        cache = {'bd_L_prev': self.bd_L_prev,
+                 'key_prev_tail': self.key_prev_tail,
+                 'key_cur_tail': self.key_cur_tail}
+        for name in ['monotonic_energy', 'chunk_energy']:
+            energy = getattr(self, name)
+            if energy is not None:
+                cache[name] = (energy.key, energy.mask)
+        return cache
+
+    def set_cache(self, cache):
+        """Restore states returned by get_cache().
+
+        Args:
+            cache (dict): boundary offset, tails of keys, and keys cached in energy functions
+
+        """
+        self.bd_L_prev = cache['bd_L_prev']
+        self.key_prev_tail = cache['key_prev_tail']
+        self.key_cur_tail = cache['key_cur_tail']
+        for name in ['monotonic_energy', 'chunk_energy']:
+            energy = getattr(self, name)
+            if energy is not None:
+                energy.key, energy.mask = cache[name]
+
     def recursive(self, e_ma, aw_prev):
         bs, n_heads_ma, qlen, klen = e_ma.size()
         p_choose = torch.sigmoid(add_gaussian_noise(e_ma, self.noise_std))  # `[B, H_ma, qlen, klen]`
@@ -819,7 +887,7 @@ def hard_chunkwise_attention(alpha, u, mask, chunk_size, H_ca,
                 else:
                     mask[b, h, :, 0, max(0, boundary - chunk_size + 1):boundary + 1] = 1
 
-    NEG_INF = float(np.finfo(torch.tensor(0, dtype=u.dtype).numpy().dtype).min)
+    NEG_INF = torch.finfo(u.dtype).min
     u = u.masked_fill(mask == 0, NEG_INF)
     beta = torch.softmax(u, dim=-1)
     return beta.view(bs, -1, qlen, klen)
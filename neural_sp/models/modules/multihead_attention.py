@@ -5,7 +5,6 @@
 
 import logging
 import math
-import numpy as np
 import torch
 import torch.nn as nn
 
@@ -90,8 +89,37 @@ class MultiheadAttentionMechanism(nn.Module):
         self.value = None
         self.mask = None
 
+    def reorder_cache(self, index):
+        """Reorder cached key and value by hypothesis indices.
+
+        Args:
+            index (LongTensor): `[B']`
+
+        """
+        if self.key is not None:
+            self.key = self.key.index_select(0, index)
+            self.value = self.value.index_select(0, index)
+            if self.mask is not None:
+                self.mask = self.mask.index_select(0, index)
+
+    def extend_cache(self, key, value):
+        """Append key and value of new encoder outputs to the cache for streaming inference.
+
+        Args:
+            key (FloatTensor): `[1, klen_new, kdim]`
+            value (FloatTensor): `[1, klen_new, vdim]`
+
+        """
+        key = self.w_key(key).view(key.size(0), -1, self.n_heads, self.d_k)
+        value = self.w_value(value).view(value.size(0), -1, self.n_heads, self.d_k)
+        if self.key is not None:
+            key = torch.cat([self.key, key], dim=1)
+            value = torch.cat([self.value, value], dim=1)
+        self.key, self.value, self.mask = key, value, None
+
     def forward(self, key, value, query, mask, aw_prev=None, aw_lower=None,
-                cache=False, mode='', trigger_points=None, eps_wait=-1, streaming=False):
+                cache=False, mode='', trigger_points=None, eps_wait=-1, streaming=False,
+                incremental=False):
         """Forward pass.
 
         Args:
@@ -105,28 +133,43 @@ class MultiheadAttentionMechanism(nn.Module):
             trigger_points: dummy interface for MoChA/MMA
             eps_wait: dummy interface for MMA
             streaming: dummy interface for streaming attention
+            incremental (bool): append key and value of new tokens to the cache
+                for incremental self-attention
         Returns:
             cv (FloatTensor): `[B, qlen, vdim]`
             aw (FloatTensor): `[B, H, qlen, klen]`
             attn_state (dict): dummy interface
 
         """
-        bs, klen = key.size()[: 2]
-        qlen = query.size(1)
+        bs, qlen = query.size()[: 2]
         attn_state = {}
 
+        if incremental:
+            # Projection of new tokens only (causality is implicit)
+            assert mask is None
+            key = self.w_key(key).view(bs, -1, self.n_heads, self.d_k)
+            value = self.w_value(value).view(bs, -1, self.n_heads, self.d_k)
+            if self.key is not None:
+                key = torch.cat([self.key, key], dim=1)
+                value = torch.cat([self.value, value], dim=1)
+            self.key, self.value, self.mask = key, value, None
         # Pre-computation of encoder-side features for computing scores
-        if self.key is None or not cache:
-            self.key = self.w_key(key).view(bs, -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
-            self.value = self.w_value(value).view(bs, -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
+        elif self.key is None or not cache:
+            self.key = self.w_key(key).view(key.size(0), -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
+            self.value = self.w_value(value).view(value.size(0), -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
             if mask is not None:
                 self.mask = mask.unsqueeze(3).repeat([1, 1, 1, self.n_heads])
-                mask_size = (bs, qlen, klen, self.n_heads)
+                mask_size = (bs, qlen, key.size(1), self.n_heads)
                 assert self.mask.size() == mask_size, (self.mask.size(), mask_size)
             else:
                 self.mask = None
 
-        key = self.key
+        key, value = self.key, self.value
+        klen = key.size(1)
+        if key.size(0) != bs:
+            # NOTE: encoder-side features of a single utterance are shared among all hypotheses
+            key = key.expand(bs, -1, -1, -1)
+            value = value.expand(bs, -1, -1, -1)
         query = self.w_query(query).view(bs, -1, self.n_heads, self.d_k)  # `[B, qlen, H, d_k]`
 
         if self.atype == 'scaled_dot':
@@ -137,7 +180,7 @@ class MultiheadAttentionMechanism(nn.Module):
 
         # Compute attention weights
         if self.mask is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+            NEG_INF = torch.finfo(e.dtype).min
             e = e.masked_fill_(self.mask == 0, NEG_INF)  # `[B, qlen, klen, H]`
         aw = torch.softmax(e, dim=2)
         aw = self.dropout_attn(aw)
@@ -149,7 +192,7 @@ class MultiheadAttentionMechanism(nn.Module):
             aw_masked = headdrop(aw_masked, self.n_heads, self.dropout_head)  # `[B, H, qlen, klen]`
             aw_masked = aw_masked.permute(0, 2, 3, 1)
 
-        cv = torch.einsum("bijh,bjhd->bihd", (aw_masked, self.value))  # `[B, qlen, H, d_k]`
+        cv = torch.einsum("bijh,bjhd->bihd", (aw_masked, value))  # `[B, qlen, H, d_k]`
         cv = cv.contiguous().view(bs, -1, self.n_heads * self.d_k)  # `[B, qlen, H * d_k]`
         cv = self.w_out(cv)
         aw = aw.permute(0, 3, 1, 2)  # `[B, H, qlen, klen]`
@@ -5,7 +5,6 @@
 
 import logging
 import math
-import numpy as np
 import torch
 import torch.nn as nn
 
@@ -197,7 +196,7 @@ class RelativeMultiheadAttentionMechanism(nn.Module):
 
         # Compute attention weights
         if mask is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+            NEG_INF = torch.finfo(e.dtype).min
             e = e.masked_fill_(mask == 0, NEG_INF)  # `[B, qlen, mlen+qlen, H]`
         aw = torch.softmax(e, dim=2)
         aw = self.dropout_attn(aw)  # `[B, qlen, mlen+qlen, H]`
@@ -12,6 +12,7 @@ from neural_sp.models.modules.mocha import MoChA
 from neural_sp.models.modules.multihead_attention import MultiheadAttentionMechanism as MHA
 from neural_sp.models.modules.positionwise_feed_forward import PositionwiseFeedForward as FFN
 from neural_sp.models.modules.relative_multihead_attention import RelativeMultiheadAttentionMechanism as RelMHA
+from neural_sp.models.torch_utils import checkpoint_forward
 
 random.seed(1)
 
@@ -120,6 +121,9 @@ class TransformerDecoderBlock(nn.Module):
         self.dropout = nn.Dropout(p=dropout)
         self.dropout_layer = dropout_layer
 
+        # activation checkpointing
+        self.checkpoint = False
+
         # LM fusion
         self.lm_fusion = lm_fusion
         if lm_fusion:
@@ -167,13 +171,35 @@ class TransformerDecoderBlock(nn.Module):
         self._yy_aws_lm = None
 
     def reset(self):
+        if not self.memory_transformer:
+            self.self_attn.reset()
         if self.src_attn is not None:
             self.src_attn.reset()
 
+    def reorder_cache(self, index):
+        """Reorder cached key/value of self-attention by hypothesis indices.
+
+        Args:
+            index (LongTensor): `[B']`
+
+        """
+        self.self_attn.reorder_cache(index)
+
+    def extend_cache(self, xs):
+        """Append new encoder outputs to the cache of source-target attention for streaming inference.
+
+        Args:
+            xs (FloatTensor): `[1, T_block, d_model]`
+
+        """
+        if self.src_attn is not None:
+            self.src_attn.extend_cache(xs, xs)
+
     def forward(self, ys, yy_mask, xs=None, xy_mask=None, cache=None,
                 xy_aws_prev=None,
                 mode='hard', eps_wait=-1, lmout=None,
-                pos_embs=None, memory=None, u_bias=None, v_bias=None):
+                pos_embs=None, memory=None, u_bias=None, v_bias=None,
+                kv_cache=False):
         """Transformer decoder forward pass.
 
         Args:
@@ -190,8 +216,11 @@ class TransformerDecoderBlock(nn.Module):
             memory (FloatTensor): `[B, L_prev, d_model]`
             u_bias (FloatTensor): global parameter for TransformerXL
             v_bias (FloatTensor): global parameter for TransformerXL
+            kv_cache (bool): ys contains the last token only. Key/value of the previous
+                tokens are reused from the self-attention cache (see reorder_cache()),
+                and encoder-side features are computed once per utterance.
         Returns:
-            out (FloatTensor): `[B, L, d_model]`
+            out (FloatTensor): `[B, L, d_model]` (`[B, 1, d_model]` if kv_cache)
 
         """
         self.reset_visualization()
@@ -200,6 +229,18 @@ class TransformerDecoderBlock(nn.Module):
         if self.dropout_layer > 0 and self.training and random.random() < self.dropout_layer:
             return ys
 
+        if self.checkpoint and self.training and cache is None:
+            # NOTE: LayerDrop is determined outside the recomputed region
+            return checkpoint_forward(self._forward, ys, yy_mask, xs, xy_mask, None,
+                                      xy_aws_prev, mode, eps_wait, lmout,
+                                      pos_embs, memory, u_bias, v_bias, False)
+        return self._forward(ys, yy_mask, xs, xy_mask, cache,
+                             xy_aws_prev, mode, eps_wait, lmout,
+                             pos_embs, memory, u_bias, v_bias, kv_cache)
+
+    def _forward(self, ys, yy_mask, xs, xy_mask, cache,
+                 xy_aws_prev, mode, eps_wait, lmout,
+                 pos_embs, memory, u_bias, v_bias, kv_cache):
         residual = ys
         if self.memory_transformer:
             if cache is not None:
@@ -223,6 +264,9 @@ class TransformerDecoderBlock(nn.Module):
         # self-attention
         if self.memory_transformer:
             out, self._yy_aws = self.self_attn(cat, ys_q, pos_embs, yy_mask, u_bias, v_bias)  # k/q/m
+        elif kv_cache:
+            assert cache is None and yy_mask is None
+            out, self._yy_aws = self.self_attn(ys, ys, ys_q, mask=None, incremental=True)[:2]  # k/v/q
         else:
             out, self._yy_aws = self.self_attn(ys, ys, ys_q, mask=yy_mask)[:2]  # k/v/q
         out = self.dropout(out) + residual
@@ -233,7 +277,7 @@ class TransformerDecoderBlock(nn.Module):
             out = self.norm2(out)
             out, self._xy_aws, attn_state = self.src_attn(
                 xs, xs, out, mask=xy_mask,  # k/v/q
-                aw_prev=xy_aws_prev, mode=mode, eps_wait=eps_wait)
+                aw_prev=xy_aws_prev, cache=kv_cache, mode=mode, eps_wait=eps_wait)
             out = self.dropout(out) + residual
 
             if attn_state.get('beta', None) is not None:
@@ -11,11 +11,16 @@ import torch
 from neural_sp.models.torch_utils import (
     np2tensor,
     pad_list,
+    segment_max,
     tensor2np,
 )
 
 logger = logging.getLogger(__name__)
 
+HASH_BITS = 31
+HASH_MODULI = (2147483647, 2147483647)  # 2^31 - 1
+HASH_BASES = (1000003, 999983)
+
 
 class BeamSearch(object):
     def __init__(self, beam_width, eos, ctc_weight, device, beam_width_bwd=0):
@@ -33,9 +38,14 @@ class BeamSearch(object):
         new_hyps = []
         is_finish = False
         for hyp in hyps_sorted:
-            if not backward and len(hyp['hyp']) > 1 and hyp['hyp'][-1] == self.eos:
-                end_hyps += [hyp]
-            elif backward and len(hyp['hyp_bwd']) > 1 and hyp['hyp_bwd'][-1] == self.eos:
+            if backward:
+                is_end = len(hyp['hyp_bwd']) > 1 and hyp['hyp_bwd'][-1] == self.eos
+            elif 'node' in hyp:
+                # NOTE: tokens of hypotheses in HypothesisStore are not kept in the dict
+                is_end = hyp['ylen'] > 0 and hyp['y'] == self.eos
+            else:
+                is_end = len(hyp['hyp']) > 1 and hyp['hyp'][-1] == self.eos
+            if is_end:
                 end_hyps += [hyp]
             else:
                 new_hyps += [hyp]
@@ -55,13 +65,35 @@ class BeamSearch(object):
                                                        new_chunk=new_chunk)
         total_scores_ctc = torch.from_numpy(ctc_scores).to(self.device)
         total_scores_topk += total_scores_ctc * self.ctc_weight
-        # Sort again
-        total_scores_topk, joint_ids_topk = torch.topk(
-            total_scores_topk, k=beam_width, dim=1, largest=True, sorted=True)
-        topk_ids = topk_ids[:, joint_ids_topk[0]]
-        new_ctc_states = new_ctc_states[joint_ids_topk[0].cpu().numpy()]
+        # NOTE: do not sort again here so that scores and states are aligned with topk_ids
         return new_ctc_states, total_scores_ctc, total_scores_topk
 
+    def ctc_prefix_score_batch(self, hyps, topk_ids, ctc_prefix_scorer, utt_id=0, frames=None):
+        """Compute CTC prefix scores of top-K candidates of all hypotheses at once.
+
+        Args:
+            hyps (List[dict]): beam candidates of a single utterance
+            topk_ids (LongTensor): `[N, K]`
+            ctc_prefix_scorer (CTCPrefixScoreBatch): CTC prefix scorer in batch-mode
+            utt_id (int): index of the utterance in ctc_prefix_scorer
+            frames (LongTensor): `[N]` reference frames for windowed CTC prefix scoring
+        Returns:
+            ctc_scores (FloatTensor): `[N, K]`
+            ctc_states (FloatTensor): `[T, 2, N, K]`
+
+        """
+        if ctc_prefix_scorer is None:
+            return topk_ids.new_zeros(topk_ids.size(), dtype=torch.float32), None
+
+        ctc_states = torch.stack([beam['ctc_state'] for beam in hyps], dim=2)  # `[T, 2, N]`
+        utt_ids = topk_ids.new_full((len(hyps),), utt_id)
+        if 'node' in hyps[0]:
+            # hypotheses in HypothesisStore
+            ylens = topk_ids.new_tensor([beam['ylen'] for beam in hyps])
+            last = topk_ids.new_tensor([beam['y'] for beam in hyps])
+            return ctc_prefix_scorer(None, topk_ids, ctc_states, utt_ids, frames, ylens=ylens, last=last)
+        return ctc_prefix_scorer([beam['hyp'] for beam in hyps], topk_ids, ctc_states, utt_ids, frames)
+
     def add_lm_score(self, after_topk=True):
         raise NotImplementedError
 
@@ -109,25 +141,51 @@ class BeamSearch(object):
 
     def lm_rescoring(self, hyps, lm, lm_weight, reverse=False, normalize=False,
                      tag=''):
-        if lm is None:
+        """Rescore hypotheses with an external LM in a single padded forward pass.
+
+        Args:
+            hyps (List[dict]): hypotheses (possibly of multiple utterances), each of which includes <sos>
+            lm (RNNLM, TransformerLM or NgramLM): second-pass LM
+            lm_weight (float): weight of the second-pass LM score
+            reverse (bool): rescore reversed token sequences (for a backward LM)
+            normalize (bool): normalize LM scores by length
+            tag (str): suffix of the key to store LM scores
+
+        """
+        if lm is None or len(hyps) == 0:
             return
-        for i in range(len(hyps)):
-            ys = hyps[i]['hyp']  # include <sos>
-            if reverse:
-                ys = ys[::-1]
-
-            ys = [np2tensor(np.fromiter(ys, dtype=np.int64), self.device)]
-            ys_in = pad_list([y[:-1] for y in ys], -1)  # `[1, L-1]`
-            ys_out = pad_list([y[1:] for y in ys], -1)  # `[1, L-1]`
-
-            if ys_in.size(1) > 0:
-                _, _, scores_lm = lm.predict(ys_in, None)
-                score_lm = sum([scores_lm[0, t, ys_out[0, t]] for t in range(ys_out.size(1))])
+        ys_all = [tuple(hyp['hyp'][::-1]) if reverse else tuple(hyp['hyp']) for hyp in hyps]
+
+        # NOTE: LMs are causal, so scores of a hypothesis are also obtained from
+        # the forward pass of any hypothesis having it as a prefix.
+        # In lexicographic order, such a hypothesis immediately follows the prefix.
+        rows, host = [], {}
+        succ = None
+        for ys in sorted(set(ys_all), reverse=True):
+            if succ is not None and succ[:len(ys)] == ys:
+                host[ys] = host[succ]
+            else:
+                host[ys] = len(rows)
+                rows.append(ys)
+            succ = ys
+
+        cum_scores_lm = None
+        if max([len(ys) for ys in rows]) > 1:
+            ys = [np2tensor(np.fromiter(ys, dtype=np.int64), self.device) for ys in rows]
+            # NOTE: padded positions do not affect the preceding positions
+            ys_in = pad_list([y[:-1] for y in ys], 0)  # `[R, L-1]`
+            ys_out = pad_list([y[1:] for y in ys], 0)  # `[R, L-1]`
+            _, _, scores_lm = lm.predict(ys_in, None)
+            cum_scores_lm = torch.cumsum(scores_lm.gather(2, ys_out.unsqueeze(2)).squeeze(2), dim=1)
+            cum_scores_lm = cum_scores_lm.tolist()
+
+        for i, ys in enumerate(ys_all):
+            if len(ys) > 1:
+                score_lm = cum_scores_lm[host[ys]][len(ys) - 2]
                 if normalize:
-                    score_lm /= ys_out.size(1)  # normalize by length
+                    score_lm /= len(ys) - 1  # normalize by length
             else:
                 score_lm = 0
-
             hyps[i]['score'] += score_lm * lm_weight
             hyps[i]['score_lm_' + tag] = score_lm
 
@@ -149,22 +207,190 @@ class BeamSearch(object):
         # NOTE: assumming hyps is already sorted
         hyps_merged = {}
         for beam in hyps:
-            hyp_ids_str = beam['hyp_ids_str']
-            if hyp_ids_str not in hyps_merged.keys():
-                hyps_merged[hyp_ids_str] = beam
+            key = beam['key']  # hashed prefix
+            if key not in hyps_merged.keys():
+                hyps_merged[key] = beam
             else:
                 if merge_prob:
                     for k in ['score', 'score_rnnt']:
-                        hyps_merged[hyp_ids_str][k] = expsumlog(hyps_merged[hyp_ids_str][k], beam[k])
+                        hyps_merged[key][k] = expsumlog(hyps_merged[key][k], beam[k])
                     # NOTE: LM scores should not be merged
 
-                elif beam['score'] > hyps_merged[hyp_ids_str]['score']:
+                elif beam['score'] > hyps_merged[key]['score']:
                     # Otherwise, pick up a path having higher log-probability
-                    hyps_merged[hyp_ids_str] = beam
+                    hyps_merged[key] = beam
 
         hyps = [v for v in hyps_merged.values()]
         return hyps
 
+    def merge_rnnt_path_batch(self, utt_ids, keys, scores, scores_rnnt, priority=None, merge_prob=True):
+        """Merge multiple alignment paths corresponding to the same token IDs for RNN-T in batch-mode.
+        Paths are grouped by hashed prefixes per utterance, and probabilities are summed up within each group.
+
+        Args:
+            utt_ids (LongTensor): `[N]`
+            keys (LongTensor): `[N]`, hashed prefixes
+            scores (FloatTensor): `[N]`
+            scores_rnnt (FloatTensor): `[N]`
+            priority (BoolTensor): `[N]`, paths preferred as the representative of each group
+            merge_prob (bool): sum up probabilities of paths in each group (otherwise take the maximum)
+        Returns:
+            group_ids (LongTensor): `[N]`, index of the group of each path
+            rep_ids (LongTensor): `[G]`, index of the representative path of each group
+            max_scores (FloatTensor): `[G]`, the best score of paths in each group used for ranking
+            merged_scores_rnnt (FloatTensor): `[G]`
+
+        """
+        n_paths = scores.size(0)
+        _, group_ids = torch.unique(torch.stack([utt_ids, keys], dim=1), dim=0, return_inverse=True)
+        n_groups = group_ids.max().item() + 1 if n_paths > 0 else 0
+
+        max_scores = segment_max(scores, group_ids, n_groups)
+        max_scores_rnnt = segment_max(scores_rnnt, group_ids, n_groups)
+        merged_scores_rnnt = max_scores_rnnt
+        if merge_prob:
+            merged_scores_rnnt = torch.zeros_like(max_scores_rnnt).index_add_(
+                0, group_ids, torch.exp(scores_rnnt - max_scores_rnnt[group_ids])).log() + max_scores_rnnt
+
+        # the best path (or the best one among preferred paths) represents each group
+        rank = scores.clone()
+        if priority is not None and n_paths > 0:
+            rank = rank + priority.float() * (scores.max() - scores.min() + 1)
+        best_rank = segment_max(rank, group_ids, n_groups)
+        is_rep = rank == best_rank[group_ids]
+        path_ids = torch.arange(n_paths, device=scores.device)
+        rep_ids = path_ids.new_zeros(n_groups).scatter_(0, group_ids[is_rep], path_ids[is_rep])
+        return group_ids, rep_ids, max_scores, merged_scores_rnnt
+
+
+class HypothesisStore(object):
+    """Store of hypotheses with back-pointers for beam search.
+
+    Tokens, back-pointers and scores of `[N]` rows (e.g., `[B * beam_width]` hypotheses)
+    are written to `[max_len, N]` tensors at each step instead of copying prefixes.
+    Beam search over a list of dicts writes hypotheses with append_hyps().
+    A hypothesis is referred to by a node index `step * N + row`, and token sequences
+    are recovered by backtracking only when they are needed (e.g., at the end of decoding).
+
+    Args:
+        n_rows (int): number of rows written at each step
+        sos (int): index of <sos> written at the first step
+        device (torch.device):
+        max_len (int): initial capacity in steps (extended if necessary)
+
+    """
+
+    def __init__(self, n_rows, sos, device, max_len=100):
+
+        super(HypothesisStore, self).__init__()
+
+        self.n_rows = n_rows
+        self.tokens = torch.full((max(max_len, 1), n_rows), sos, dtype=torch.int64, device=device)
+        self.back_pointers = torch.full_like(self.tokens, -1)
+        self.scores = torch.zeros(self.tokens.size(), device=device)
+        self.n_steps = 1
+        self._cache = None  # CPU copies for backtracking
+
+    @property
+    def roots(self):
+        """Nodes of <sos> at the first step (`[N]`)."""
+        return torch.arange(self.n_rows, device=self.tokens.device)
+
+    def append(self, ids, back_pointers, scores=None, mask=None):
+        """Write tokens of new hypotheses at the next step.
+
+        Args:
+            ids (LongTensor): `[N]`, tokens appended to parent hypotheses
+            back_pointers (LongTensor): `[N]`, nodes of parent hypotheses
+            scores (FloatTensor): `[N]`, scores of new hypotheses
+            mask (BoolTensor): `[N]`, rows to extend. Other rows keep nodes of their parents.
+        Returns:
+            nodes (LongTensor): `[N]`, nodes of new hypotheses
+
+        """
+        if self.n_steps == self.tokens.size(0):
+            # double the capacity
+            self.tokens = torch.cat([self.tokens, torch.full_like(self.tokens, -1)], dim=0)
+            self.back_pointers = torch.cat([self.back_pointers, torch.full_like(self.back_pointers, -1)], dim=0)
+            self.scores = torch.cat([self.scores, torch.zeros_like(self.scores)], dim=0)
+        self.tokens[self.n_steps] = ids
+        self.back_pointers[self.n_steps] = back_pointers
+        if scores is not None:
+            self.scores[self.n_steps] = scores
+        nodes = self.roots + self.n_steps * self.n_rows
+        if mask is not None:
+            nodes = torch.where(mask, nodes, back_pointers)
+        self.n_steps += 1
+        self._cache = None
+        return nodes
+
+    def append_hyps(self, hyps):
+        """Write the last tokens of hypotheses in beam search over a list of dicts.
+        A hypothesis extended at the current step has 'y' (the last token), 'parent'
+        (the node of its parent), and 'node' of None, which is set to a new node.
+        The other hypotheses (e.g., extended by blank in RNN-T) keep their nodes.
+
+        Args:
+            hyps (List[dict]): up to `[N]` hypotheses
+
+        """
+        rows = [j for j, hyp in enumerate(hyps) if hyp['node'] is None]
+        if len(rows) == 0:
+            return
+        assert len(rows) <= self.n_rows
+        pad = [-1] * (self.n_rows - len(rows))
+        ids = self.tokens.new_tensor([hyps[j]['y'] for j in rows] + pad)
+        back_pointers = self.tokens.new_tensor([hyps[j]['parent'] for j in rows] + pad)
+        offset = self.n_steps * self.n_rows
+        self.append(ids, back_pointers)
+        for r, j in enumerate(rows):
+            hyps[j]['node'] = offset + r
+
+    def path(self, node):
+        """Backtrack nodes from <sos>.
+
+        Args:
+            node (int): node of the last token
+        Returns:
+            nodes (List[int]): nodes from <sos> to the last token
+
+        """
+        if self._cache is None:
+            self._cache = self.back_pointers[:self.n_steps].view(-1).tolist()
+        nodes = []
+        while node >= 0:
+            nodes.append(node)
+            node = self._cache[node]
+        return nodes[::-1]
+
+    def backtrack(self, node):
+        """Recover the token sequence of a hypothesis.
+
+        Args:
+            node (int): node of the last token
+        Returns:
+            hyp (List[int]): token IDs including <sos>
+
+        """
+        nodes = self.path(node)
+        return self.tokens.view(-1)[torch.tensor(nodes, device=self.tokens.device)].tolist()
+
+
+def hash_prefix(keys, tokens):
+    """Extend hashed prefixes by tokens.
+    Two polynomial rolling hashes are packed into a single 62-bit integer.
+
+    Args:
+        keys (LongTensor): `[N]`, hashed prefixes
+        tokens (LongTensor): `[N]`
+    Returns:
+        keys (LongTensor): `[N]`
+
+    """
+    h1 = (keys >> HASH_BITS) * HASH_BASES[0] + tokens + 1
+    h2 = (keys & HASH_MODULI[1]) * HASH_BASES[1] + tokens + 1
+    return ((h1 % HASH_MODULI[0]) << HASH_BITS) + h2 % HASH_MODULI[1]
+
 
 def expsumlog(a, b):
     return math.log(math.exp(a) + math.exp(b))
@@ -5,7 +5,7 @@
 
 
 def build_decoder(args, special_symbols, enc_n_units, vocab,
-                  ctc_weight, ctc_fc_list, global_weight, external_lm=None):
+                  ctc_weight, ctc_fc_list, global_weight, external_lm=None, backward=False):
 
     # safeguard
     if not hasattr(args, 'transformer_dec_d_model') and hasattr(args, 'transformer_d_model'):
@@ -42,7 +42,7 @@ def build_decoder(args, special_symbols, enc_n_units, vocab,
             ctc_weight=ctc_weight,
             ctc_lsm_prob=args.ctc_lsm_prob,
             ctc_fc_list=ctc_fc_list,
-            backward=(dir == 'bwd'),
+            backward=backward,
             global_weight=global_weight,
             mtl_per_batch=args.mtl_per_batch,
             param_init=args.transformer_param_init,
@@ -83,7 +83,9 @@ def build_decoder(args, special_symbols, enc_n_units, vocab,
             external_lm=external_lm if args.lm_init else None,
             global_weight=global_weight,
             mtl_per_batch=args.mtl_per_batch,
-            param_init=args.param_init)
+            param_init=args.param_init,
+            joint_chunk_size=args.rnnt_joint_chunk_size,
+            joint_topk=args.rnnt_joint_topk)
 
     else:
         from neural_sp.models.seq2seq.decoders.las import RNNDecoder
@@ -118,7 +120,7 @@ def build_decoder(args, special_symbols, enc_n_units, vocab,
             external_lm=external_lm,
             lm_fusion=args.lm_fusion,
             lm_init=args.lm_init,
-            backward=(dir == 'bwd'),
+            backward=backward,
             global_weight=global_weight,
             mtl_per_batch=args.mtl_per_batch,
             param_init=args.param_init,
@@ -5,17 +5,24 @@
 
 from collections import OrderedDict
 from distutils.version import LooseVersion
-from itertools import groupby
 import logging
+import math
 import numpy as np
 import random
 import torch
 import torch.nn as nn
 
 from neural_sp.models.criterion import kldiv_lsm_ctc
-from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
+from neural_sp.models.lm.ngram import NgramLM
+from neural_sp.models.lm.rnnlm import RNNLM
+from neural_sp.models.seq2seq.decoders.beam_search import (
+    BeamSearch,
+    HypothesisStore,
+    hash_prefix
+)
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import (
+    logaddexp,
     make_pad_mask,
     np2tensor,
     pad_list,
@@ -27,6 +34,7 @@ random.seed(1)
 # LOG_0 = float(np.finfo(np.float32).min)
 LOG_0 = -1e10
 LOG_1 = 0
+NEG_INF = float('-inf')
 
 logger = logging.getLogger(__name__)
 
@@ -141,49 +149,51 @@ class CTC(DecoderBase):
                                      ys_ctc, elens, ylens) / logits.size(1)
         return loss
 
-    def trigger_points(self, eouts, elens):
-        """Extract trigger points for inference.
+    def best_paths(self, eouts, elens):
+        """Extract collapsed best paths of all utterances in batch-mode.
 
         Args:
             eouts (FloatTensor): `[B, T, enc_n_units]`
             elens (IntTensor): `[B]`
         Returns:
-            trigger_points_pred (IntTensor): `[B, L]`
+            hyps (LongTensor): `[B, L]`, padded with -1
+            ylens (LongTensor): `[B]`
+            trigger_points (LongTensor): `[B, L]`, most left frames of tokens, padded with 0
 
         """
         bs, xmax, _ = eouts.size()
-        log_probs = torch.log_softmax(self.output(eouts), dim=-1)
-        best_paths = log_probs.argmax(-1)  # `[B, L]`
-
-        hyps = []
-        for b in range(bs):
-            indices = [best_paths[b, t].item() for t in range(elens[b])]
-
-            # Step 1. Collapse repeated labels
-            collapsed_indices = [x[0] for x in groupby(indices)]
-
-            # Step 2. Remove all blank labels
-            best_hyp = [x for x in filter(lambda x: x != self.blank, collapsed_indices)]
-            hyps.append(best_hyp)
-
-        ymax = max([len(h) for h in hyps])
-
-        # pick up trigger points
-        trigger_points_pred = log_probs.new_zeros((bs, ymax + 1), dtype=torch.int32)  # +1 for <eos>
-        for b in range(bs):
-            n_triggers = 0
-            for t in range(elens[b]):
-                token_idx = best_paths[b, t]
+        best_paths = self.output(eouts).argmax(-1)  # `[B, T]`
+        mask = make_pad_mask(torch.as_tensor(elens, device=eouts.device))  # `[B, T]`
+
+        # Step 1. Collapse repeated labels
+        is_new = torch.ones_like(mask)
+        is_new[:, 1:] = best_paths[:, 1:] != best_paths[:, :-1]
+        # Step 2. Remove all blank labels
+        emit = is_new & (best_paths != self.blank) & mask
+        ylens = emit.sum(1)
+
+        # scatter emitted tokens to their positions, and the others to a dummy position
+        ymax = int(ylens.max()) if bs > 0 else 0
+        pos = torch.where(emit, emit.cumsum(1) - 1, torch.full_like(best_paths, ymax))
+        hyps = best_paths.new_full((bs, ymax + 1), -1).scatter_(1, pos, best_paths)[:, :ymax]
+        frames = torch.arange(xmax, device=eouts.device).unsqueeze(0).expand(bs, -1)
+        trigger_points = best_paths.new_zeros((bs, ymax + 1)).scatter_(1, pos, frames)[:, :ymax]
+        return hyps, ylens, trigger_points
 
-                if token_idx == self.blank:
-                    continue
-                if not (t == 0 or token_idx != best_paths[b, t - 1]):
-                    continue
+    def trigger_points(self, eouts, elens):
+        """Extract trigger points for inference.
 
-                # NOTE: select the most left trigger points
-                trigger_points_pred[b, n_triggers] = t
-                n_triggers += 1
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            elens (IntTensor): `[B]`
+        Returns:
+            trigger_points_pred (IntTensor): `[B, L]`
 
+        """
+        _, _, trigger_points = self.best_paths(eouts, elens)
+        # NOTE: select the most left trigger points
+        trigger_points_pred = torch.cat([trigger_points, trigger_points.new_zeros(eouts.size(0), 1)],
+                                        dim=1).int()  # +1 for <eos>
         return trigger_points_pred
 
     def greedy(self, eouts, elens):
@@ -196,26 +206,20 @@ class CTC(DecoderBase):
             hyps (np.ndarray): Best path hypothesis. `[B, L]`
 
         """
-        log_probs = torch.log_softmax(self.output(eouts), dim=-1)
-        best_paths = log_probs.argmax(-1)  # `[B, L]`
-
-        hyps = []
-        for b in range(eouts.size(0)):
-            indices = [best_paths[b, t].item() for t in range(elens[b])]
-
-            # Step 1. Collapse repeated labels
-            collapsed_indices = [x[0] for x in groupby(indices)]
-
-            # Step 2. Remove all blank labels
-            best_hyp = [x for x in filter(lambda x: x != self.blank, collapsed_indices)]
-            hyps.append([best_hyp])
-
+        hyps, ylens, _ = self.best_paths(eouts, elens)
+        hyps = [[hyp[:ylen]] for hyp, ylen in zip(hyps.tolist(), ylens.tolist())]
         return hyps
 
     def beam_search(self, eouts, elens, params, idx2token,
                     lm=None, lm_second=None, lm_second_bwd=None,
                     nbest=1, refs_id=None, utt_ids=None, speakers=None):
-        """Beam search decoding.
+        """Prefix beam search decoding over all utterances at once.
+
+        Blank/non-blank log probabilities of prefixes are kept as `[B, beam]` tensors.
+        At each frame, the vocabulary is pre-pruned by top-K (and a threshold if
+        recog_ctc_prune_threshold > 0) on the CTC posterior, and LM states of all
+        extended prefixes are updated by a single batched LM query.
+        Prefixes are identified by hashes and recovered by back-pointers at the end.
 
         Args:
             eouts (FloatTensor): `[B, T, enc_n_units]`
@@ -226,8 +230,9 @@ class CTC(DecoderBase):
                 recog_lm_weight (float): weight of first path LM score
                 recog_lm_second_weight (float): weight of second path LM score
                 recog_lm_bwd_weight (float): weight of second path backward LM score
+                recog_ctc_prune_threshold (float): minimum CTC posterior of candidate tokens
             idx2token (): converter from index to token
-            lm (torch.nn.module): firsh path LM
+            lm (torch.nn.module): firsh path LM (RNNLM)
             lm_second (torch.nn.module): second path LM
             lm_second_bwd (torch.nn.module): second path backward LM
             nbest (int):
@@ -238,104 +243,138 @@ class CTC(DecoderBase):
             nbest_hyps_idx (List[List[List]]): Best path hypothesis
 
         """
-        bs = eouts.size(0)
+        bs, xmax = eouts.size()[:2]
 
         beam_width = params['recog_beam_width']
         lp_weight = params['recog_length_penalty']
         lm_weight = params['recog_lm_weight']
         lm_weight_second = params['recog_lm_second_weight']
         lm_weight_second_bwd = params['recog_lm_bwd_weight']
+        prune_threshold = params['recog_ctc_prune_threshold']
 
         helper = BeamSearch(beam_width, self.eos, 1.0, eouts.device)
         lm = helper.verify_lm_eval_mode(lm, lm_weight)
         lm_second = helper.verify_lm_eval_mode(lm_second, lm_weight_second)
         lm_second_bwd = helper.verify_lm_eval_mode(lm_second_bwd, lm_weight_second_bwd)
+        if lm is not None and not isinstance(lm, (RNNLM, NgramLM)):
+            raise NotImplementedError('Only RNNLM and NgramLM are supported for shallow fusion with CTC.')
 
-        nbest_hyps_idx = []
         log_probs = torch.log_softmax(self.output(eouts), dim=-1)
+        # NOTE: frames after elens[b] emit <blank> with probability 1 so that they do not change the ranking
+        mask = make_pad_mask(torch.as_tensor(elens, device=eouts.device).long())
+        log_probs_pad = torch.full_like(log_probs[0, 0], NEG_INF)
+        log_probs_pad[self.blank] = LOG_1
+        log_probs = torch.where(mask.unsqueeze(2), log_probs, log_probs_pad)
+
+        # candidate tokens (except for <blank>) per frame
+        n_cands = min(beam_width, self.vocab - 1)
+        log_probs_nb = log_probs.clone()
+        log_probs_nb[:, :, self.blank] = NEG_INF
+        cand_log_probs, cand_ids = torch.topk(log_probs_nb, k=n_cands, dim=-1)  # `[B, T, C]`
+        if prune_threshold > 0:
+            cand_log_probs = cand_log_probs.masked_fill(cand_log_probs < math.log(prune_threshold), NEG_INF)
+
+        # Initialize the beam with the empty sequence, a probability of
+        # 1 for ending in blank and zero for ending in non-blank (in log space).
+        n_rows = bs * beam_width
+        p_b = eouts.new_full((bs, beam_width), NEG_INF)
+        p_b[:, 0] = LOG_1
+        p_nb = eouts.new_full((bs, beam_width), NEG_INF)
+        score_lm = eouts.new_zeros(bs, beam_width)
+        store = HypothesisStore(n_rows, self.eos, eouts.device, max_len=max(elens) + 1)
+        nodes = store.roots.view(bs, beam_width)
+        keys = eouts.new_zeros((bs, beam_width), dtype=torch.int64)  # hashed prefixes
+        ylens = eouts.new_zeros((bs, beam_width), dtype=torch.int64)
+        last = eouts.new_full((bs, beam_width), -1, dtype=torch.int64)  # -1 for empty prefixes
+
+        # LM log probabilities of the next token for each prefix
+        lmstate, lm_log_probs = None, None
+        if lm is not None:
+            _, lmstate, lm_log_probs = lm.predict(eouts.new_full((n_rows, 1), self.eos, dtype=torch.int64), None)
+            lm_log_probs = lm_log_probs[:, -1].view(bs, beam_width, -1)
+
+        batch_idx = torch.arange(bs, device=eouts.device).unsqueeze(1)
+        for t in range(max(elens)):
+            lp_t = log_probs[:, t]  # `[B, vocab]`
+            lp_cands = cand_log_probs[:, t]  # `[B, C]`
+            ids_cands = cand_ids[:, t]  # `[B, C]`
+            p_tot = logaddexp(p_b, p_nb)
+
+            # case 1. prefix is not extended
+            new_p_b = p_tot + lp_t[:, self.blank:self.blank + 1]
+            new_p_nb = torch.where(ylens > 0, p_nb + lp_t.gather(1, last.clamp(min=0)), p_b.new_full((), NEG_INF))
+
+            # NOTE: prefix k' = prefix k + [c] is already in the beam. Merge the extension into k'.
+            is_parent = hash_prefix(keys.unsqueeze(2), last.unsqueeze(1)) == keys.unsqueeze(1)  # `[B, K, K']`
+            is_parent &= (ylens.unsqueeze(1) == ylens.unsqueeze(2) + 1)
+            is_parent &= (p_tot > NEG_INF).unsqueeze(2) & (p_tot > NEG_INF).unsqueeze(1)
+            p_ext = torch.where(last.unsqueeze(2) == last.unsqueeze(1), p_b.unsqueeze(2), p_tot.unsqueeze(2))
+            p_ext = p_ext + lp_t.gather(1, last.clamp(min=0)).unsqueeze(1)
+            p_ext = p_ext.masked_fill(~is_parent, NEG_INF).logsumexp(1)  # `[B, K']`
+            new_p_nb = logaddexp(new_p_nb, p_ext)
+            scores_stay = logaddexp(new_p_b, new_p_nb) + score_lm * lm_weight + ylens * lp_weight
+
+            # case 2. prefix is extended
+            is_repeat = last.unsqueeze(2) == ids_cands.unsqueeze(1)  # `[B, K, C]`
+            ext_p_nb = torch.where(is_repeat, p_b.unsqueeze(2), p_tot.unsqueeze(2)) + lp_cands.unsqueeze(1)
+            is_dup = (is_parent.unsqueeze(3) & (last[:, None, :, None] == ids_cands[:, None, None, :])).any(2)
+            ext_p_nb = ext_p_nb.masked_fill(is_dup, NEG_INF)
+            ext_score_lm = score_lm.unsqueeze(2)
+            if lm is not None:
+                ext_score_lm = ext_score_lm + lm_log_probs.gather(
+                    2, ids_cands.unsqueeze(1).expand(-1, beam_width, -1))
+            scores_ext = ext_p_nb + ext_score_lm * lm_weight + (ylens + 1).unsqueeze(2) * lp_weight
+
+            # Pruning
+            scores = torch.cat([scores_stay, scores_ext.view(bs, -1)], dim=1)  # `[B, K + K * C]`
+            scores_topk, topk_ids = torch.topk(scores, k=beam_width, dim=1)
+            is_ext = topk_ids >= beam_width
+            ext_ids = (topk_ids - beam_width).clamp(min=0)
+            src = torch.where(is_ext, ext_ids // n_cands, topk_ids)  # `[B, K]`
+            c = ids_cands.gather(1, ext_ids % n_cands)
+
+            # Reorder by back-pointers
+            p_b = torch.where(is_ext, p_b.new_full((), NEG_INF), new_p_b.gather(1, src))
+            p_nb = torch.where(is_ext, ext_p_nb.view(bs, -1).gather(1, ext_ids), new_p_nb.gather(1, src))
+            p_b = p_b.masked_fill(scores_topk == NEG_INF, NEG_INF)
+            p_nb = p_nb.masked_fill(scores_topk == NEG_INF, NEG_INF)
+            score_lm = torch.where(is_ext, ext_score_lm.expand(-1, -1, n_cands).reshape(bs, -1).gather(1, ext_ids),
+                                   score_lm.gather(1, src))
+            keys = keys.gather(1, src)
+            keys = torch.where(is_ext, hash_prefix(keys, c), keys)
+            nodes = store.append(c.view(-1), nodes.gather(1, src).view(-1), mask=is_ext.view(-1)).view(bs, beam_width)
+            ylens = ylens.gather(1, src) + is_ext.long()
+            last = torch.where(is_ext, c, last.gather(1, src))
+
+            # Update LM states of extended prefixes only
+            if lm is not None:
+                rows = (src + batch_idx * beam_width).view(-1)
+                lmstate = {'hxs': lmstate['hxs'][:, rows],
+                           'cxs': lmstate['cxs'][:, rows] if lmstate['cxs'] is not None else None}
+                lm_log_probs = lm_log_probs.view(n_rows, -1)[rows]
+                ext_rows = is_ext.view(-1).nonzero()[:, 0]
+                if ext_rows.numel() > 0:
+                    lmstate_ext = {'hxs': lmstate['hxs'][:, ext_rows],
+                                   'cxs': lmstate['cxs'][:, ext_rows] if lmstate['cxs'] is not None else None}
+                    _, lmstate_ext, lm_log_probs_ext = lm.predict(c.view(-1, 1)[ext_rows], lmstate_ext)
+                    lmstate['hxs'][:, ext_rows] = lmstate_ext['hxs']
+                    if lmstate['cxs'] is not None:
+                        lmstate['cxs'][:, ext_rows] = lmstate_ext['cxs']
+                    lm_log_probs[ext_rows] = lm_log_probs_ext[:, -1]
+                lm_log_probs = lm_log_probs.view(bs, beam_width, -1)
+
+        p_tot = logaddexp(p_b, p_nb)
+        scores = p_tot + score_lm * lm_weight + ylens * lp_weight
+        p_tot, score_lm, scores, ylens, nodes = map(tensor2np, [p_tot, score_lm, scores, ylens, nodes])
+
+        nbest_hyps_idx = []
         for b in range(bs):
-            # Elements in the beam are (prefix, (p_b, p_no_blank))
-            # Initialize the beam with the empty sequence, a probability of
-            # 1 for ending in blank and zero for ending in non-blank (in log space).
-            beam = [{'hyp': [self.eos],  # <eos> is used for LM
-                     'p_b': LOG_1,
-                     'p_nb': LOG_0,
-                     'score_lm': LOG_1,
-                     'lmstate': None}]
-
-            for t in range(elens[b]):
-                new_beam = []
-
-                # Pick up the top-k scores
-                log_probs_topk, topk_ids = torch.topk(
-                    log_probs[b:b + 1, t], k=min(beam_width, self.vocab), dim=-1, largest=True, sorted=True)
-
-                for i_beam in range(len(beam)):
-                    hyp = beam[i_beam]['hyp'][:]
-                    p_b = beam[i_beam]['p_b']
-                    p_nb = beam[i_beam]['p_nb']
-                    score_lm = beam[i_beam]['score_lm']
-
-                    # case 1. hyp is not extended
-                    new_p_b = np.logaddexp(p_b + log_probs[b, t, self.blank].item(),
-                                           p_nb + log_probs[b, t, self.blank].item())
-                    if len(hyp) > 1:
-                        new_p_nb = p_nb + log_probs[b, t, hyp[-1]].item()
-                    else:
-                        new_p_nb = LOG_0
-                    score_ctc = np.logaddexp(new_p_b, new_p_nb)
-                    score_lp = len(hyp[1:]) * lp_weight
-                    new_beam.append({'hyp': hyp,
-                                     'score': score_ctc + score_lm + score_lp,
-                                     'p_b': new_p_b,
-                                     'p_nb': new_p_nb,
-                                     'score_ctc': score_ctc,
-                                     'score_lm': score_lm,
-                                     'score_lp': score_lp,
-                                     'lmstate': beam[i_beam]['lmstate']})
-
-                    # Update LM states for shallow fusion
-                    if lm is not None:
-                        _, lmstate, lm_log_probs = lm.predict(
-                            eouts.new_zeros(1, 1).fill_(hyp[-1]), beam[i_beam]['lmstate'])
-                    else:
-                        lmstate = None
-
-                    # case 2. hyp is extended
-                    new_p_b = LOG_0
-                    for c in tensor2np(topk_ids)[0]:
-                        p_t = log_probs[b, t, c].item()
-
-                        if c == self.blank:
-                            continue
-
-                        c_prev = hyp[-1] if len(hyp) > 1 else None
-                        if c == c_prev:
-                            new_p_nb = p_b + p_t
-                            # TODO(hirofumi): apply character LM here
-                        else:
-                            new_p_nb = np.logaddexp(p_b + p_t, p_nb + p_t)
-                            # TODO(hirofumi): apply character LM here
-                            if c == self.space:
-                                pass
-                                # TODO(hirofumi): apply word LM here
-
-                        score_ctc = np.logaddexp(new_p_b, new_p_nb)
-                        score_lp = (len(hyp[1:]) + 1) * lp_weight
-                        if lm_weight > 0 and lm is not None:
-                            local_score_lm = lm_log_probs[0, 0, c].item() * lm_weight
-                            score_lm += local_score_lm
-                        new_beam.append({'hyp': hyp + [c],
-                                         'score': score_ctc + score_lm + score_lp,
-                                         'p_b': new_p_b,
-                                         'p_nb': new_p_nb,
-                                         'score_ctc': score_ctc,
-                                         'score_lm': score_lm,
-                                         'score_lp': score_lp,
-                                         'lmstate': lmstate})
-
-                # Pruning
-                beam = sorted(new_beam, key=lambda x: x['score'], reverse=True)[:beam_width]
+            beam = [{'hyp': store.backtrack(int(nodes[b, k])),  # <eos> is used for LM
+                     'score': scores[b, k],
+                     'score_ctc': p_tot[b, k],
+                     'score_lm': score_lm[b, k],
+                     'score_lp': ylens[b, k] * lp_weight}
+                    for k in range(beam_width) if p_tot[b, k] > NEG_INF]
 
             # forward second path LM rescoring
             helper.lm_rescoring(beam, lm_second, lm_weight_second, tag='second')
@@ -343,6 +382,8 @@ class CTC(DecoderBase):
             # backward secodn path LM rescoring
             helper.lm_rescoring(beam, lm_second_bwd, lm_weight_second_bwd, tag='second_bwd')
 
+            beam = sorted(beam, key=lambda x: x['score'], reverse=True)
+
             # Exclude <eos>
             nbest_hyps_idx.append([hyp['hyp'][1:] for hyp in beam])
 
@@ -357,7 +398,7 @@ class CTC(DecoderBase):
                     logger.info('Hyp: %s' % idx2token(beam[k]['hyp'][1:]))
                     logger.info('log prob (hyp): %.7f' % beam[k]['score'])
                     logger.info('log prob (hyp, ctc): %.7f' % (beam[k]['score_ctc']))
-                    logger.info('log prob (hyp, lp): %.7f' % (beam[k]['score_lp'] * lp_weight))
+                    logger.info('log prob (hyp, lp): %.7f' % (beam[k]['score_lp']))
                     if lm is not None:
                         logger.info('log prob (hyp, first-path lm): %.7f' %
                                     (beam[k]['score_lm'] * lm_weight))
@@ -375,76 +416,6 @@ def _label_to_path(labels, blank):
     return path
 
 
-def _flip_path(path, path_lens):
-    """Flips label sequence.
-    This function rotates a label sequence and flips it.
-    ``path[b, t]`` stores a label at time ``t`` in ``b``-th batch.
-    The rotated matrix ``r`` is defined as
-    ``r[b, t] = path[b, t + path_lens[b]]``
-    .. ::
-       a b c d .     . a b c d    d c b a .
-       e f . . .  -> . . . e f -> f e . . .
-       g h i j k     g h i j k    k j i h g
-
-    Args:
-        path (FloatTensor): `[B, 2*L+1]`
-        path_lens (LongTensor): `[B]`
-    Returns:
-        FloatTensor: `[B, 2*L+1]`
-
-    """
-    bs = path.size(0)
-    max_path_len = path.size(1)
-    rotate = (torch.arange(max_path_len) + path_lens[:, None]) % max_path_len
-    return torch.flip(path[torch.arange(bs, dtype=torch.int64)[:, None], rotate], dims=[1])
-
-
-def _flip_label_probability(log_probs, xlens):
-    """Flips a label probability matrix.
-    This function rotates a label probability matrix and flips it.
-    ``log_probs[i, b, l]`` stores log probability of label ``l`` at ``i``-th
-    input in ``b``-th batch.
-    The rotated matrix ``r`` is defined as
-    ``r[i, b, l] = log_probs[i + xlens[b], b, l]``
-
-    Args:
-        cum_log_prob (FloatTensor): `[T, B, vocab]`
-        xlens (LongTensor): `[B]`
-    Returns:
-        FloatTensor: `[T, B, vocab]`
-
-    """
-    xmax, bs, vocab = log_probs.size()
-    rotate = (torch.arange(xmax, dtype=torch.int64)[:, None] + xlens) % xmax
-    return torch.flip(log_probs[rotate[:, :, None],
-                                torch.arange(bs, dtype=torch.int64)[None, :, None],
-                                torch.arange(vocab, dtype=torch.int64)[None, None, :]], dims=[0])
-
-
-def _flip_path_probability(cum_log_prob, xlens, path_lens):
-    """Flips a path probability matrix.
-    This function returns a path probability matrix and flips it.
-    ``cum_log_prob[i, b, t]`` stores log probability at ``i``-th input and
-    at time ``t`` in a output sequence in ``b``-th batch.
-    The rotated matrix ``r`` is defined as
-    ``r[i, j, k] = cum_log_prob[i + xlens[j], j, k + path_lens[j]]``
-
-    Args:
-        cum_log_prob (FloatTensor): `[T, B, 2*L+1]`
-        xlens (LongTensor): `[B]`
-        path_lens (LongTensor): `[B]`
-    Returns:
-        FloatTensor: `[T, B, 2*L+1]`
-
-    """
-    xmax, bs, max_path_len = cum_log_prob.size()
-    rotate_input = ((torch.arange(xmax, dtype=torch.int64)[:, None] + xlens) % xmax)
-    rotate_label = ((torch.arange(max_path_len, dtype=torch.int64) + path_lens[:, None]) % max_path_len)
-    return torch.flip(cum_log_prob[rotate_input[:, :, None],
-                                   torch.arange(bs, dtype=torch.int64)[None, :, None],
-                                   rotate_label], dims=[0, 2])
-
-
 class CTCForcedAligner(object):
     def __init__(self, blank=0):
         self.blank = blank
@@ -475,114 +446,87 @@ class CTCForcedAligner(object):
             trigger_points = self.align(log_probs, elens, ys_in_pad, ylens)
         return trigger_points
 
-    def _computes_transition(self, prev_log_prob, path, path_lens, cum_log_prob, y, skip_accum=False):
-        bs, max_path_len = path.size()
-        mat = prev_log_prob.new_zeros(3, bs, max_path_len).fill_(self.log0)
-        mat[0, :, :] = prev_log_prob
-        mat[1, :, 1:] = prev_log_prob[:, :-1]
-        mat[2, :, 2:] = prev_log_prob[:, :-2]
-        # disable transition between the same symbols
-        # (including blank-to-blank)
-        same_transition = (path[:, :-2] == path[:, 2:])
-        mat[2, :, 2:][same_transition] = self.log0
-        log_prob = torch.logsumexp(mat, dim=0)
-        outside = torch.arange(max_path_len, dtype=torch.int64) >= path_lens.unsqueeze(1)
-        log_prob[outside] = self.log0
-        if not skip_accum:
-            cum_log_prob += log_prob
-        batch_index = torch.arange(bs, dtype=torch.int64).unsqueeze(1)
-        log_prob += y[batch_index, path]
-        return log_prob
-
     def align(self, log_probs, elens, ys, ylens, add_eos=True):
-        """Calculte the best CTC alignment with the forward-backward algorithm.
+        """Calculte the best CTC alignment with the Viterbi algorithm.
+
         Args:
             log_probs (FloatTensor): `[T, B, vocab]`
-            elens (FloatTensor): `[B]`
-            ys (FloatTensor): `[B, L]`
-            ylens (FloatTensor): `[B]`
+            elens (IntTensor): `[B]`
+            ys (LongTensor): `[B, L]`
+            ylens (IntTensor): `[B]`
             add_eos (bool): Use the last time index as a boundary corresponding to <eos>
         Returns:
-            trigger_points (IntTensor): `[B, L]`
+            trigger_points (IntTensor): `[B, L + 1]`
 
         """
         xmax, bs, vocab = log_probs.size()
+        device = log_probs.device
+        elens = elens.to(device).long()
+        ylens = ylens.to(device).long()
 
-        path = _label_to_path(ys, self.blank)
-        path_lens = 2 * ylens.long() + 1
+        path = _label_to_path(ys, self.blank)  # `[B, 2*L+1]`
+        path_lens = 2 * ylens + 1
 
         ymax = ys.size(1)
         max_path_len = path.size(1)
         assert ys.size() == (bs, ymax), ys.size()
         assert path.size() == (bs, ymax * 2 + 1)
 
-        alpha = log_probs.new_zeros(bs, max_path_len).fill_(self.log0)
-        alpha[:, 0] = LOG_1
-        beta = alpha.clone()
-        gamma = alpha.clone()
-
-        batch_index = torch.arange(bs, dtype=torch.int64).unsqueeze(1)
-        seq_index = torch.arange(xmax, dtype=torch.int64).unsqueeze(1).unsqueeze(2)
-        log_probs_fwd_bwd = log_probs[seq_index, batch_index, path]
-
-        # forward algorithm
-        for t in range(xmax):
-            alpha = self._computes_transition(alpha, path, path_lens, log_probs_fwd_bwd[t], log_probs[t])
-
-        # backward algorithm
-        r_path = _flip_path(path, path_lens)
-        log_probs_inv = _flip_label_probability(log_probs, elens.long())  # `[T, B, vocab]`
-        log_probs_fwd_bwd = _flip_path_probability(log_probs_fwd_bwd, elens.long(), path_lens)  # `[T, B, 2*L+1]`
-        for t in range(xmax):
-            beta = self._computes_transition(beta, r_path, path_lens, log_probs_fwd_bwd[t], log_probs_inv[t])
-
-        # pick up the best CTC path
-        best_aligns = log_probs.new_zeros((bs, xmax), dtype=torch.int64)
-
-        # forward algorithm
-        log_probs_fwd_bwd = _flip_path_probability(log_probs_fwd_bwd, elens.long(), path_lens)
-        for t in range(xmax):
-            gamma = self._computes_transition(gamma, path, path_lens, log_probs_fwd_bwd[t], log_probs[t],
-                                              skip_accum=True)
-
-            # select paths where gamma is valid
-            log_probs_fwd_bwd[t] = log_probs_fwd_bwd[t].masked_fill_(gamma == self.log0, self.log0)
-
-            # pick up the best alignment
-            offsets = log_probs_fwd_bwd[t].argmax(1)
-            for b in range(bs):
-                if t <= elens[b] - 1:
-                    token_idx = path[b, offsets[b]]
-                    best_aligns[b, t] = token_idx
-
-            # remove the rest of paths
-            gamma = log_probs.new_zeros(bs, max_path_len).fill_(self.log0)
-            for b in range(bs):
-                gamma[b, offsets[b]] = LOG_1
+        batch_index = torch.arange(bs, dtype=torch.int64, device=device)
+        state_index = torch.arange(max_path_len, dtype=torch.int64, device=device)
+        time_index = torch.arange(xmax, dtype=torch.int64, device=device)
+
+        # emission scores of states in the trellis
+        log_probs_path = log_probs.gather(2, path.unsqueeze(0).expand(xmax, -1, -1))  # `[T, B, 2*L+1]`
+        log_probs_path = log_probs_path.masked_fill(state_index.unsqueeze(0) >= path_lens.unsqueeze(1), self.log0)
+
+        # disable transition between the same symbols (including blank-to-blank)
+        skippable = torch.zeros_like(path, dtype=torch.bool)
+        skippable[:, 2:] = path[:, 2:] != path[:, :-2]
+
+        # forward pass
+        delta = log_probs_path.new_zeros(bs, max_path_len).fill_(self.log0)
+        delta[:, :2] = log_probs_path[0, :, :2]
+        back_pointers = torch.zeros((xmax, bs, max_path_len), dtype=torch.uint8, device=device)
+        for t in range(1, xmax):
+            mat = delta.new_zeros(3, bs, max_path_len).fill_(self.log0)
+            mat[0] = delta
+            mat[1, :, 1:] = delta[:, :-1]
+            mat[2, :, 2:] = delta[:, :-2]
+            mat[2] = mat[2].masked_fill(~skippable, self.log0)
+            delta_t, bp_t = mat.max(0)
+            # NOTE: keep the scores of finished utterances
+            is_active = (t < elens).unsqueeze(1)
+            delta = torch.where(is_active, delta_t + log_probs_path[t], delta)
+            back_pointers[t] = bp_t.masked_fill(~is_active, 0)
+
+        # end with the last blank or the last label
+        last = (path_lens - 1).unsqueeze(1)
+        score_blank = delta.gather(1, last).squeeze(1)
+        score_label = delta.gather(1, (last - 1).clamp(min=0)).squeeze(1)
+        states = torch.where((ylens > 0) & (score_label > score_blank), last.squeeze(1) - 1, last.squeeze(1))
+
+        # backtrace all utterances at once
+        best_states = torch.zeros((xmax, bs), dtype=torch.int64, device=device)
+        for t in range(xmax - 1, 0, -1):
+            best_states[t] = states
+            states = states - back_pointers[t, batch_index, states].long()
+        best_states[0] = states
+        best_states = best_states.transpose(0, 1)  # `[B, T]`
 
         # pick up trigger points
-        trigger_aligns = torch.zeros((bs, xmax), dtype=torch.int64)
-        trigger_points = log_probs.new_zeros((bs, ymax + 1), dtype=torch.int32)  # +1 for <eos>
-        for b in range(bs):
-            n_triggers = 0
-            if add_eos:
-                trigger_points[b, ylens[b]] = elens[b] - 1
-                # NOTE: use the last time index as a boundary corresponding to <eos>
-                # Otherwise, index: 0 is used for <eos>
-            for t in range(elens[b]):
-                token_idx = best_aligns[b, t]
-                if token_idx == self.blank:
-                    continue
-                if not (t == 0 or token_idx != best_aligns[b, t - 1]):
-                    continue
-
-                # NOTE: select the most left trigger points
-                trigger_aligns[b, t] = token_idx
-                trigger_points[b, n_triggers] = t
-                n_triggers += 1
-
-        assert ylens.sum() == (trigger_aligns != 0).sum()
-        return trigger_points
+        # NOTE: select the most left trigger points
+        is_trigger = (best_states % 2 == 1) & (time_index.unsqueeze(0) < elens.unsqueeze(1))
+        is_trigger[:, 1:] &= best_states[:, 1:] != best_states[:, :-1]
+        assert ylens.sum() == is_trigger.sum()
+        label_index = torch.where(is_trigger, best_states // 2, best_states.new_full((1,), ymax + 1))
+        trigger_points = torch.zeros((bs, ymax + 2), dtype=torch.int64, device=device)  # +1 for <eos>, dummy
+        trigger_points.scatter_(1, label_index, time_index.unsqueeze(0).expand(bs, -1))
+        if add_eos:
+            # NOTE: use the last time index as a boundary corresponding to <eos>
+            # Otherwise, index: 0 is used for <eos>
+            trigger_points.scatter_(1, ylens.unsqueeze(1), (elens - 1).unsqueeze(1))
+        return trigger_points[:, :-1].int()
 
 
 class CTCPrefixScore(object):
@@ -701,3 +645,162 @@ class CTCPrefixScore(object):
         # return the log prefix probability and CTC states, where the label axis
         # of the CTC states is moved to the first axis to slice it easily
         return log_psi, np.rollaxis(r, 2)
+
+
+class CTCPrefixScoreBatch(object):
+    """Compute CTC label sequence scores of multiple hypotheses in batch-mode.
+
+    This is a torch version of CTCPrefixScore. Prefix scores of all hypotheses
+    (e.g., `[B * beam_width]` hypotheses of `[B]` utterances) are computed for all
+    (or a pre-pruned set of) candidate labels in a single pass over time
+    on the device of CTC posteriors.
+
+    When margin > 0, the time recursion is restricted to a window of +/- margin frames
+    around a reference frame of each hypothesis (an attention peak or the CTC spike of
+    the last label), which reduces the cost per output step from O(T) to O(margin).
+    Frames after the window are assumed to emit <blank> only, so that the scores of
+    <eos> and the CTC states of the next step stay consistent.
+
+    [Reference]:
+        https://github.com/espnet/espnet
+    """
+
+    def __init__(self, log_probs, xlens, blank, eos, backward=False, margin=0):
+        """
+        Args:
+            log_probs (FloatTensor): `[B, T, vocab]`
+            xlens (IntTensor): `[B]`
+            blank (int): index of <blank>
+            eos (int): index of <eos>
+            backward (bool): reverse CTC posteriors in time for the backward decoder
+            margin (int): number of frames on each side of the reference frame
+                to compute prefix scores (0 means all frames)
+
+        """
+        self.blank = blank
+        self.eos = eos
+        self.log0 = LOG_0
+        self.device = log_probs.device
+        self.margin = margin
+
+        bs, xmax, vocab = log_probs.size()
+        self.xmax = xmax
+        self.vocab = vocab
+        xlens = torch.as_tensor(xlens, device=self.device).long()
+        log_probs = log_probs.float()
+        if backward:
+            t = torch.arange(xmax, device=self.device).unsqueeze(0)
+            index = torch.where(t < xlens.unsqueeze(1), xlens.unsqueeze(1) - 1 - t, t)  # `[B, T]`
+            log_probs = log_probs.gather(1, index.unsqueeze(2).expand(-1, -1, vocab))
+
+        # NOTE: padded frames emit <blank> only so that r_T(h) is equal to r_{xlen}(h)
+        pad_mask = ~make_pad_mask(xlens)  # `[B, T]`
+        log_probs = log_probs.masked_fill(pad_mask.unsqueeze(2), self.log0)
+        log_probs[:, :, blank] = log_probs[:, :, blank].masked_fill(pad_mask, LOG_1)
+        self.log_probs = log_probs.transpose(0, 1).contiguous()  # `[T, B, vocab]`
+
+    def initial_state(self):
+        """Obtain initial CTC states of all utterances.
+
+        Returns:
+            ctc_states (FloatTensor): `[T, 2, B]`
+
+        """
+        # r_t^n(<sos>) and r_t^b(<sos>), where 0 and 1 of axis=1 represent
+        # superscripts n and b (non-blank and blank), respectively.
+        r = self.log_probs.new_full((self.xmax, 2, self.log_probs.size(1)), self.log0)
+        r[:, 1] = torch.cumsum(self.log_probs[:, :, self.blank], dim=0)
+        return r
+
+    def __call__(self, hyps, cs, r_prev, utt_ids=None, frames=None, ylens=None, last=None):
+        """Compute CTC prefix scores for next labels of all hypotheses.
+
+        Args:
+            hyps (List[List]): `[N]` prefix label sequences including <sos> (not used if ylens and last are given)
+            cs (LongTensor): `[N, C]` next labels. If None, all labels in the vocabulary are scored.
+            r_prev (FloatTensor): `[T, 2, N]` previous CTC states
+            utt_ids (LongTensor): `[N]` index of the utterance each hypothesis belongs to
+            frames (LongTensor): `[N]` reference frames of the window (e.g., attention peaks).
+                If None, the CTC spike of the last label is used. This is used only when margin > 0.
+            ylens (LongTensor): `[N]` lengths of prefixes excluding <sos>
+            last (LongTensor): `[N]` last labels of prefixes
+        Returns:
+            ctc_scores (FloatTensor): `[N, C]`
+            ctc_states (FloatTensor): `[T, 2, N, C]`
+
+        """
+        if ylens is None or last is None:
+            ylens = torch.tensor([len(hyp) - 1 for hyp in hyps], device=self.device)  # ignore sos
+            last = torch.tensor([hyp[-1] for hyp in hyps], device=self.device)
+        n_hyps = ylens.size(0)
+        if utt_ids is None:
+            assert self.log_probs.size(1) == 1
+            utt_ids = torch.zeros(n_hyps, dtype=torch.int64, device=self.device)
+        if cs is None:
+            cs = torch.arange(self.vocab, device=self.device).unsqueeze(0).repeat(n_hyps, 1)
+        xmax = self.xmax
+
+        ylens_t = ylens.to(self.device)
+        last = last.to(self.device)
+
+        xs = self.log_probs[:, utt_ids.unsqueeze(1), cs]  # `[T, N, C]`
+        xs_blank = self.log_probs[:, utt_ids, self.blank].unsqueeze(2)  # `[T, N, 1]`
+
+        # prepare forward probabilities for the last label
+        r_sum = logaddexp(r_prev[:, 0], r_prev[:, 1])  # `[T, N]`, log(r_t^n(g) + r_t^b(g))
+        same = ((cs == last.unsqueeze(1)) & (ylens_t > 0).unsqueeze(1)).unsqueeze(0)  # `[1, N, C]`
+        log_phi = torch.where(same, r_prev[:, 1].unsqueeze(2), r_sum.unsqueeze(2))  # `[T, N, C]`
+
+        # compute forward probabilities log(r_t^n(h)), log(r_t^b(h)),
+        # and log prefix probabilities log(psi)
+        # NOTE: r_t(h) of a hypothesis longer than the shortest one stays log(0)
+        # until t = len(h) - 1 because r_t(g) of its prefix does so
+        start = min(max(int(ylens_t.min()), 1), xmax)
+        end = xmax
+        first = ylens_t == 0
+        if self.margin > 0:
+            # window of each hypothesis
+            if frames is None:
+                frames = r_prev[:, 0].argmax(0)  # CTC spike of the last label
+            starts = torch.clamp(torch.max(ylens_t.clamp(min=1), frames - self.margin), max=xmax)
+            ends = torch.clamp(torch.max(frames + self.margin + 1, starts), max=xmax)
+            start, end = int(starts.min()), int(ends.max())
+            first = first & (starts == 1)
+            starts, ends = starts.unsqueeze(1), ends.unsqueeze(1)  # `[N, 1]`
+        r = xs.new_full((xmax, 2, n_hyps, xs.size(2)), self.log0)
+        if start == 1:
+            r[0, 0] = torch.where(first.unsqueeze(1), xs[0], r[0, 0])
+        for t in range(start, end):
+            r_nb = logaddexp(r[t - 1, 0], log_phi[t - 1]) + xs[t]
+            r_b = logaddexp(r[t - 1, 0], r[t - 1, 1]) + xs_blank[t]
+            if self.margin > 0:
+                r_nb = r_nb.masked_fill((t < starts) | (t >= ends), self.log0)
+                r_b = r_b.masked_fill(t < starts, self.log0)
+            r[t, 0] = r_nb
+            r[t, 1] = r_b
+        log_phi_x = log_phi[start - 1:end - 1] + xs[start:end]  # `[W, N, C]`
+        if self.margin > 0:
+            t = torch.arange(start, end, device=self.device).view(-1, 1, 1)
+            log_phi_x = log_phi_x.masked_fill((t < starts) | (t >= ends), self.log0)
+        log_psi = torch.logsumexp(torch.cat([r[start - 1:start, 0], log_phi_x], dim=0), dim=0)
+        if end < xmax:
+            # NOTE: only <blank> is emitted after the window
+            r_sum_end = logaddexp(r[end - 1, 0], r[end - 1, 1])  # `[N, C]`
+            r[end:, 1] = r_sum_end.unsqueeze(0) + torch.cumsum(xs_blank[end:], dim=0)
+
+        # get P(...eos|X) that ends with the prefix itself
+        log_psi = torch.where(cs == self.eos, r_sum[-1].unsqueeze(1), log_psi)
+        return log_psi, r
+
+    @staticmethod
+    def index_select_state(ctc_states, index):
+        """Reorder CTC states by back-pointers.
+
+        Args:
+            ctc_states (FloatTensor): `[T, 2, N, C]`
+            index (LongTensor): `[M]` indices over flattened `[N * C]` candidates
+        Returns:
+            ctc_states (FloatTensor): `[T, 2, M]`
+
+        """
+        return ctc_states.view(ctc_states.size(0), 2, -1).index_select(2, index)
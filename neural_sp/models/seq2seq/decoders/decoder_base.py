@@ -42,6 +42,10 @@ class DecoderBase(ModelBase):
     def beam_search(self, eouts, elens, params, idx2token):
         raise NotImplementedError
 
+    def batch_decodable(self, params, lm=None):
+        """Whether beam_search_batch() supports the decoding options."""
+        return False
+
     def _plot_attention(self, save_path=None, n_cols=2):
         """Plot attention for each head in all decoder layers."""
         if not hasattr(self, 'aws_dict'):
@@ -146,6 +150,7 @@ class DecoderBase(ModelBase):
                 recog_lm_weight (float): weight of first path LM score
                 recog_lm_second_weight (float): weight of second path LM score
                 recog_lm_rev_weight (float): weight of second path backward LM score
+                recog_ctc_prune_threshold (float): minimum CTC posterior of candidate tokens
             lm: firsh path LM
             lm_second: second path LM
             lm_second_bwd: second path backward LM
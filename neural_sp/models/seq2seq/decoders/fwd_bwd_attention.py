@@ -4,6 +4,7 @@
 """Forward-backward attention decoding."""
 
 import logging
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -13,20 +14,28 @@ def fwd_bwd_attention(nbest_hyps_fwd, aws_fwd, scores_fwd,
                       eos, gnmt_decoding, lp_weight, idx2token, refs_id, flip=False):
     """Decoding with the forward and backward attention-based decoders.
 
+    Hypotheses of both decoders are merged at the same token attending to the same time,
+    where the forward hypothesis is continued by the rest of the backward hypothesis.
+
     Args:
-        nbest_hyps_fwd (list): A list of length `[B]`, which contains list of n hypotheses
-        aws_fwd (list): A list of length `[B]`, which contains arrays of size `[L, T]`
-        scores_fwd (list):
-        nbest_hyps_bwd (list):
-        aws_bwd (list):
-        scores_bwd (list):
-        eos (int):
-        gnmt_decoding (float):
+        nbest_hyps_fwd (List[List[np.array]]): length `[B]`, each of which contains a list of
+            hypotheses of size `[nbest]`, each of which containts an array of size `[L]`
+        aws_fwd (List[List[np.array]]): length `[B]`, each of which contains a list of
+            attention weights of size `[nbest]`, each of which containts an array of size `[H, L, T]`
+        scores_fwd (List[List[np.array]]): length `[B]`, each of which contains a list of
+            cumulative log probabilities at all steps of size `[nbest]`, each of which containts an array of size `[L]`
+        nbest_hyps_bwd (List[List[np.array]]): hypotheses of the backward decoder (in the forward order)
+        aws_bwd (List[List[np.array]]): attention weights of the backward decoder (in the forward order)
+        scores_bwd (List[List[np.array]]): log probabilities of the backward decoder,
+            accumulated from the end of hypotheses
+        eos (int): index for <eos> (shared with <sos>)
+        gnmt_decoding (bool):
         lp_weight (float):
         idx2token (): converter from index to token
-        refs_id ():
+        refs_id (List): reference list
         flip (bool): flip the encoder indices
     Returns:
+        best_hyps (List[np.array]): length `[B]`, each of which contains an array of size `[L]` (excluding <eos>)
 
     """
     bs = len(nbest_hyps_fwd)
@@ -34,70 +43,76 @@ def fwd_bwd_attention(nbest_hyps_fwd, aws_fwd, scores_fwd,
 
     best_hyps = []
     for b in range(bs):
-        max_time = len(aws_fwd[b][0])
+        max_time = aws_fwd[b][0].shape[-1]
 
         merged = []
+        times_fwd, times_bwd = [], []
         for n in range(nbest):
             # forward
-            if len(nbest_hyps_fwd[b][n]) > 1:
-                if nbest_hyps_fwd[b][n][-1] == eos:
-                    merged.append({'hyp': nbest_hyps_fwd[b][n][:-1],
-                                   'score': scores_fwd[b][n][-2]})
-                    # NOTE: remove eos probability
-                else:
-                    merged.append({'hyp': nbest_hyps_fwd[b][n],
-                                   'score': scores_fwd[b][n][-1]})
+            hyp_fwd = nbest_hyps_fwd[b][n]
+            eos_fwd = len(hyp_fwd) > 0 and hyp_fwd[-1] == eos
+            # NOTE: remove eos probability
+            n_tokens = len(hyp_fwd) - int(eos_fwd)
+            if n_tokens > 0:
+                merged.append({'hyp': hyp_fwd[:n_tokens],
+                               'score': scores_fwd[b][n][n_tokens - 1]})
             else:
                 # <eos> only
-                logger.info(nbest_hyps_fwd[b][n])
+                logger.info(hyp_fwd)
+            times_fwd.append(aws_fwd[b][n].sum(0).argmax(-1))  # `[L]`
 
             # backward
-            if len(nbest_hyps_bwd[b][n]) > 1:
-                if nbest_hyps_bwd[b][n][0] == eos:
-                    merged.append({'hyp': nbest_hyps_bwd[b][n][1:],
-                                   'score': scores_bwd[b][n][1]})
-                    # NOTE: remove eos probability
-                else:
-                    merged.append({'hyp': nbest_hyps_bwd[b][n],
-                                   'score': scores_bwd[b][n][0]})
+            hyp_bwd = nbest_hyps_bwd[b][n]
+            eos_bwd = len(hyp_bwd) > 0 and hyp_bwd[0] == eos
+            if len(hyp_bwd) - int(eos_bwd) > 0:
+                merged.append({'hyp': hyp_bwd[int(eos_bwd):],
+                               'score': scores_bwd[b][n][int(eos_bwd)]})
             else:
                 # <eos> only
-                logger.info(nbest_hyps_bwd[b][n])
+                logger.info(hyp_bwd)
+            t_bwd = aws_bwd[b][n].sum(0).argmax(-1)  # `[L]`
+            if flip:
+                # the encoder is not shared between forward and backward decoders
+                t_bwd = max_time - 1 - t_bwd
+            times_bwd.append(t_bwd)
 
         for n_f in range(nbest):
+            hyp_fwd = nbest_hyps_fwd[b][n_f]
+            len_fwd = len(hyp_fwd) - int(len(hyp_fwd) > 0 and hyp_fwd[-1] == eos)
             for n_b in range(nbest):
-                for i_f in range(len(aws_fwd[b][n_f]) - 1):
-                    for i_b in range(len(aws_bwd[b][n_b]) - 1):
-                        if flip:
-                            # the encoder is not shared between forward and backward decoders
-                            t_prev = max_time - aws_bwd[b][n_b][i_b + 1].argmax(-2)
-                            t_curr = aws_fwd[b][n_f][i_f].argmax(-2)
-                            t_next = max_time - aws_bwd[b][n_b][i_b - 1].argmax(-2)
-                        else:
-                            t_prev = aws_bwd[b][n_b][i_b + 1].argmax(-2)
-                            t_curr = aws_fwd[b][n_f][i_f].argmax(-2)
-                            t_next = aws_bwd[b][n_b][i_b - 1].argmax(-2)
+                hyp_bwd = nbest_hyps_bwd[b][n_b]
+                start_bwd = int(len(hyp_bwd) > 0 and hyp_bwd[0] == eos)
+                for i_f in range(len_fwd):
+                    for i_b in range(start_bwd, len(hyp_bwd)):
+                        t_prev = times_bwd[n_b][i_b - 1] if i_b > start_bwd else 0
+                        t_curr = times_fwd[n_f][i_f]
+                        t_next = times_bwd[n_b][i_b + 1] if i_b < len(hyp_bwd) - 1 else max_time
 
                         # the same token at the same time
-                        if t_curr >= t_prev and t_curr <= t_next and nbest_hyps_fwd[b][n_f][i_f] == nbest_hyps_bwd[b][n_b][i_b]:
-                            new_hyp = nbest_hyps_fwd[b][n_f][:i_f + 1].tolist() + \
-                                nbest_hyps_bwd[b][n_b][i_b + 1:].tolist()
-                            score_curr_fwd = scores_fwd[b][n_f][i_f] - scores_fwd[b][n_f][i_f - 1]
-                            score_curr_bwd = scores_bwd[b][n_b][i_b] - scores_bwd[b][n_b][i_b + 1]
+                        if t_prev <= t_curr <= t_next and hyp_fwd[i_f] == hyp_bwd[i_b]:
+                            new_hyp = np.concatenate([hyp_fwd[:i_f + 1], hyp_bwd[i_b + 1:]])
+                            score_prefix_fwd = scores_fwd[b][n_f][i_f - 1] if i_f > 0 else 0.
+                            score_suffix_bwd = scores_bwd[b][n_b][i_b + 1] if i_b < len(hyp_bwd) - 1 else 0.
+                            score_curr_fwd = scores_fwd[b][n_f][i_f] - score_prefix_fwd
+                            score_curr_bwd = scores_bwd[b][n_b][i_b] - score_suffix_bwd
                             score_curr = max(score_curr_fwd, score_curr_bwd)
-                            new_score = scores_fwd[b][n_f][i_f - 1] + scores_bwd[b][n_b][i_b + 1] + score_curr
+                            new_score = score_prefix_fwd + score_suffix_bwd + score_curr
                             merged.append({'hyp': new_hyp, 'score': new_score})
 
                             logger.info('time matching')
-                            if refs_id is not None:
-                                logger.info('Ref: %s' % idx2token(refs_id[b]))
-                            logger.info('hyp (fwd): %s' % idx2token(nbest_hyps_fwd[b][n_f]))
-                            logger.info('hyp (bwd): %s' % idx2token(nbest_hyps_bwd[b][n_b]))
-                            logger.info('hyp (fwd-bwd): %s' % idx2token(new_hyp))
+                            if idx2token is not None:
+                                if refs_id is not None:
+                                    logger.info('Ref: %s' % idx2token(refs_id[b]))
+                                logger.info('hyp (fwd): %s' % idx2token(hyp_fwd))
+                                logger.info('hyp (bwd): %s' % idx2token(hyp_bwd))
+                                logger.info('hyp (fwd-bwd): %s' % idx2token(new_hyp))
                             logger.info('log prob (fwd): %.3f' % scores_fwd[b][n_f][-1])
                             logger.info('log prob (bwd): %.3f' % scores_bwd[b][n_b][0])
                             logger.info('log prob (fwd-bwd): %.3f' % new_score)
 
+        if len(merged) == 0:
+            best_hyps.append(nbest_hyps_fwd[b][0][:0])
+            continue
         merged = sorted(merged, key=lambda x: x['score'], reverse=True)
         best_hyps.append(merged[0]['hyp'])
 
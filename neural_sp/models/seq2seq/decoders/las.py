@@ -4,6 +4,7 @@
 """RNN decoder for Listen Attend and Spell (LAS) model (including CTC loss calculation)."""
 
 from distutils.util import strtobool
+import functools
 import logging
 import math
 import numpy as np
@@ -18,6 +19,7 @@ from neural_sp.models.criterion import (
     MBR,
 )
 # from neural_sp.models.criterion import minimum_bayes_risk
+from neural_sp.models.lm.ngram import NgramLM
 from neural_sp.models.lm.rnnlm import RNNLM
 from neural_sp.models.lm.transformerlm import TransformerLM
 from neural_sp.models.lm.transformer_xl import TransformerXL
@@ -26,10 +28,14 @@ from neural_sp.models.modules.gmm_attention import GMMAttention
 from neural_sp.models.modules.initialization import init_with_uniform
 from neural_sp.models.modules.mocha import MoChA
 from neural_sp.models.modules.multihead_attention import MultiheadAttentionMechanism
-from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
+from neural_sp.models.seq2seq.decoders.beam_search import (
+    BeamSearch,
+    HypothesisStore
+)
 from neural_sp.models.seq2seq.decoders.ctc import (
     CTC,
-    CTCPrefixScore
+    CTCPrefixScore,
+    CTCPrefixScoreBatch
 )
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import (
@@ -39,6 +45,7 @@ from neural_sp.models.torch_utils import (
     repeat,
     pad_list,
     np2tensor,
+    parallel_apply,
     tensor2np,
     tensor2scalar,
 )
@@ -1016,10 +1023,13 @@ class RNNDecoder(DecoderBase):
         hyps = [{'hyp': hyp,
                  'score': 0.,
                  'score_att': 0.,
+                 'score_att_steps': [],
                  'score_ctc': 0.,
                  'score_lm': 0.,
+                 'score_cp': 0.,
                  'dstates': dstates,
                  'cv': cv,
+                 'aw': None,
                  'aws': [None],
                  'myu': None,
                  'lmstate': lmstate,
@@ -1031,6 +1041,7 @@ class RNNDecoder(DecoderBase):
                  'quantity_rate': 1.,
                  'streamable': True,
                  'streaming_failed_point': 1000,
+                 'aw_last_success': None,
                  'boundary': [],
                  'no_boundary': False}]
         return hyps
@@ -1040,7 +1051,7 @@ class RNNDecoder(DecoderBase):
                     nbest=1, exclude_eos=False,
                     refs_id=None, utt_ids=None, speakers=None,
                     ensmbl_eouts=[], ensmbl_elens=[], ensmbl_decs=[],
-                    cache_states=True):
+                    cache_states=True, store_aws=True, lexicon=None, store_score_steps=False):
         """Beam search decoding.
 
         Args:
@@ -1061,12 +1072,18 @@ class RNNDecoder(DecoderBase):
             ensmbl_elens (List[IntTensor]) encoder outputs for ensemble models
             ensmbl_decs (List[torch.nn.Module): decoders for ensemble models
             cache_states (bool): cache TransformerLM/TransformerXL states for fast decoding
+            store_aws (bool): keep attention weights at all steps in each hypothesis.
+                If False, only those at the last step are kept and None is returned as attention weights.
+            lexicon (LexiconPrefixTree): prefix tree to constrain hypotheses to words in a lexicon.
+                Scores of its word-level LM are added with look-ahead instead of those of `lm`.
+            store_score_steps (bool): return cumulative attention scores at all steps instead of sequence-level scores.
+                Those of the backward decoder are accumulated from the end of the (reversed) hypotheses.
         Returns:
             nbest_hyps_idx (List[List[np.array]]): length `[B]`, each of which contains a list of hypotheses of size `[nbest]`,
                 each of which containts a list of arrays of size `[L]`
             aws (List[List[[np.array]]]): length `[B]`, each of which contains a list of attention weights of size `[nbest]`,
                 each of which containts a list of arrays of size `[H, L, T]`
-            scores (List[List[np.array]]): sequence-level scores
+            scores (List[List[np.array]]): sequence-level scores (or arrays of size `[L]` if store_score_steps is True)
 
         """
         bs, xmax, _ = eouts.size()
@@ -1074,6 +1091,7 @@ class RNNDecoder(DecoderBase):
         beam_width = params['recog_beam_width']
         assert 1 <= nbest <= beam_width
         ctc_weight = params['recog_ctc_weight']
+        ctc_window_margin = params['recog_ctc_window_margin']
         max_len_ratio = params['recog_max_len_ratio']
         min_len_ratio = params['recog_min_len_ratio']
         lp_weight = params['recog_length_penalty']
@@ -1094,10 +1112,21 @@ class RNNDecoder(DecoderBase):
         lm_second = helper.verify_lm_eval_mode(lm_second, lm_weight_second)
         lm_second_bwd = helper.verify_lm_eval_mode(lm_second_bwd, lm_weight_second_bwd)
         trfm_lm = isinstance(lm, TransformerLM) or isinstance(lm, TransformerXL)
+        if lexicon is not None:
+            if lm is not None:
+                raise ValueError('lm and lexicon with a word-level LM cannot be used at the same time.')
+            helper.verify_lm_eval_mode(lexicon.lm, lm_weight)
 
+        # NOTE: a decoder shared by several members cannot run concurrently due to attention caches
+        ensmbl_concurrent = len(set([id(dec) for dec in [self] + ensmbl_decs])) == len(ensmbl_decs) + 1
+
+        # For joint CTC-Attention decoding
+        ctc_prefix_scorer = None
         if ctc_log_probs is not None:
             assert ctc_weight > 0
-            ctc_log_probs = tensor2np(ctc_log_probs)
+            ctc_prefix_scorer = CTCPrefixScoreBatch(ctc_log_probs, elens, self.blank, self.eos,
+                                                    backward=self.bwd, margin=ctc_window_margin)
+            ctc_states_init = ctc_prefix_scorer.initial_state()  # `[T, 2, B]`
 
         nbest_hyps_idx, aws, scores = [], [], []
         eos_flags = []
@@ -1107,24 +1136,15 @@ class RNNDecoder(DecoderBase):
             cv = eouts.new_zeros(1, 1, self.enc_n_units)
             dstates = self.zero_state(1)
             lmstate = None
-            ctc_state = None
+            ctc_state = ctc_states_init[:, :, b] if ctc_prefix_scorer is not None else None
             ys = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(self.eos)  # for Transformer(XL) LM
 
-            # For joint CTC-Attention decoding
-            ctc_prefix_scorer = None
-            if ctc_log_probs is not None:
-                if self.bwd:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b][::-1], self.blank, self.eos)
-                else:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b], self.blank, self.eos)
-                ctc_state = ctc_prefix_scorer.initial_state()
-
             if speakers is not None:
                 if speakers[b] == self.prev_spk:
                     if asr_state_CO:
                         dstates = self.dstates_final
                     if lm_state_CO:
-                        if isinstance(lm, RNNLM):
+                        if isinstance(lm, (RNNLM, NgramLM)):
                             lmstate = self.lmstate_final
                         elif isinstance(lm, TransformerLM):
                             ys_prev = self.lmstate_final
@@ -1145,8 +1165,12 @@ class RNNDecoder(DecoderBase):
             end_hyps = []
             hyps = self.initialize_beam([self.eos], dstates, cv, lmstate, ctc_state,
                                         ys, ensmbl_decs)
+            hyps[0]['lex_state'] = lexicon.initial_state() if lexicon is not None else None
             streamable_global = True
             ymax = math.ceil(elens[b] * max_len_ratio)
+            # NOTE: tokens are written to the store instead of being copied to each hypothesis
+            store = HypothesisStore(beam_width, self.eos, eouts.device, max_len=ymax + 1)
+            hyps[0].update(node=0, y=hyps[0].pop('hyp')[-1], ylen=0)
             for i in range(ymax):
                 # batchfy all hypotheses for batch decoding
                 y = eouts.new_zeros((len(hyps), 1), dtype=torch.int64)
@@ -1154,14 +1178,14 @@ class RNNDecoder(DecoderBase):
                     if self.replace_sos and i == 0:
                         prev_idx = refs_id[0][0]
                     else:
-                        prev_idx = beam['hyp'][-1]
+                        prev_idx = beam['y']
                     y[j, 0] = prev_idx
                 cv = torch.cat([beam['cv'] for beam in hyps], dim=0)
                 eouts_b_i = eouts[b:b + 1, :elens[b]].repeat([cv.size(0), 1, 1])
                 if self.attn_type in ['gmm', 'sagmm']:
                     aw = torch.cat([beam['myu'] for beam in hyps], dim=0) if i > 0 else None
                 else:
-                    aw = torch.cat([beam['aws'][-1] for beam in hyps], dim=0) if i > 0 else None
+                    aw = torch.cat([beam['aw'] for beam in hyps], dim=0) if i > 0 else None
                 hxs = torch.cat([beam['dstates']['dstate'][0] for beam in hyps], dim=1)
                 if self.rnn_type == 'lstm':
                     cxs = torch.cat([beam['dstates']['dstate'][1] for beam in hyps], dim=1)
@@ -1178,7 +1202,7 @@ class RNNDecoder(DecoderBase):
                         y_lm = y
 
                     if i > 0 or (i == 0 and trfm_lm and lm_state_CO and self.lmstate_final is not None):
-                        if isinstance(lm, RNNLM):
+                        if isinstance(lm, (RNNLM, NgramLM)):
                             lmstate = {'hxs': torch.cat([beam['lmstate']['hxs'] for beam in hyps], dim=1),
                                        'cxs': torch.cat([beam['lmstate']['cxs'] for beam in hyps], dim=1)}
                         elif trfm_lm:
@@ -1197,14 +1221,15 @@ class RNNDecoder(DecoderBase):
                                                                cache=lmstate if cache_states else None)
 
                 # for the main model
-                y_emb = self.dropout_emb(self.embed(y))
-                dstates, cv, aw, attn_state, attn_v = self.decode_step(
-                    eouts_b_i, dstates, cv, y_emb, None, aw, lmout)
-                probs = torch.softmax(self.output(attn_v).squeeze(1) * softmax_smoothing, dim=1)
+                def step_main():
+                    y_emb = self.dropout_emb(self.embed(y))
+                    dstates_m, cv_m, aw_m, attn_state_m, attn_v = self.decode_step(
+                        eouts_b_i, dstates, cv, y_emb, None, aw, lmout)
+                    probs_m = torch.softmax(self.output(attn_v).squeeze(1) * softmax_smoothing, dim=1)
+                    return dstates_m, cv_m, aw_m, attn_state_m, probs_m
 
                 # for the ensemble
-                ensmbl_dstate, ensmbl_cv, ensmbl_aws = [], [], []
-                for i_e, dec in enumerate(ensmbl_decs):
+                def step_ensmbl(i_e, dec):
                     cv_e = torch.cat([beam['ensmbl_cv'][i_e] for beam in hyps], dim=0)
                     aw_e = torch.cat([beam['ensmbl_aws'][i_e][-1] for beam in hyps], dim=0) if i > 0 else None
                     hxs_e = torch.cat([beam['ensmbl_dstate'][i_e]['dstate'][0] for beam in hyps], dim=1)
@@ -1212,75 +1237,103 @@ class RNNDecoder(DecoderBase):
                         cxs_e = torch.cat([beam['ensmbl_dstate'][i_e]['dstate'][1] for beam in hyps], dim=1)
                     dstates_e = {'dstate': (hxs_e, cxs_e)}
 
-                    dstates_e, cv_e, aw_e, attn_state_e, attn_v_e = dec.decode_step(
+                    dstates_e, cv_e, aw_e, _, attn_v_e = dec.decode_step(
                         ensmbl_eouts[i_e][b:b + 1, :ensmbl_elens[i_e][b]].repeat([cv_e.size(0), 1, 1]),
                         dstates_e, cv_e, dec.dropout_emb(dec.embed(y)), None, aw_e, lmout)
-
-                    ensmbl_dstate += [{'dstate': (dstates_e['dstate'][0][:, j:j + 1],
-                                                  dstates_e['dstate'][1][:, j:j + 1])}]
-                    ensmbl_cv += [cv_e[j:j + 1]]
-                    ensmbl_aws += [beam['ensmbl_aws'][i_e] + [aw_e[j:j + 1]]]
-                    probs += torch.softmax(dec.output(attn_v_e).squeeze(1), dim=1)
+                    return dstates_e, cv_e, aw_e, None, torch.softmax(dec.output(attn_v_e).squeeze(1), dim=1)
+
+                # NOTE: decoder steps of ensemble members run concurrently
+                steps = [step_main] + [functools.partial(step_ensmbl, i_e, dec) for i_e, dec in enumerate(ensmbl_decs)]
+                outs = parallel_apply(steps) if ensmbl_concurrent else [step() for step in steps]
+                dstates, cv, aw, attn_state, probs = outs[0]
+                ensmbl_dstates, ensmbl_cvs, ensmbl_aws = [], [], []
+                for dstates_e, cv_e, aw_e, _, probs_e in outs[1:]:
+                    ensmbl_dstates += [dstates_e]
+                    ensmbl_cvs += [cv_e]
+                    ensmbl_aws += [aw_e]
+                    probs += probs_e
 
                 # Ensemble
                 scores_att = torch.log(probs / (len(ensmbl_decs) + 1))
 
+                # Attention scores of all hypotheses
+                total_scores_att_all = scores_att.new_tensor([beam['score_att'] for beam in hyps]).unsqueeze(1)
+                total_scores_att_all = total_scores_att_all + scores_att
+                if lexicon is not None:
+                    # NOTE: units not allowed by the lexicon are masked before top-K selection
+                    scores_lex, lex_states_next = lexicon.score([beam['lex_state'] for beam in hyps])
+                    scores_lex = scores_lex.to(scores_att.device)
+                    is_invalid = scores_lex == float('-inf')
+                    total_scores_topk_all, topk_ids_all = torch.topk(
+                        (total_scores_att_all * (1 - ctc_weight)).masked_fill(is_invalid, float('-inf')),
+                        k=beam_width, dim=1, largest=True, sorted=True)
+                    scores_lex = scores_lex.masked_fill(is_invalid, 0)
+                else:
+                    total_scores_topk_all, topk_ids_all = torch.topk(
+                        total_scores_att_all * (1 - ctc_weight), k=beam_width, dim=1, largest=True, sorted=True)
+
+                # CTC scores of all hypotheses
+                # NOTE: CTC prefix scores are computed around attention peaks in the windowed mode
+                ctc_scores, ctc_states = helper.ctc_prefix_score_batch(
+                    hyps, topk_ids_all, ctc_prefix_scorer, b, frames=aw[:, :, 0].sum(1).argmax(-1))
+
                 new_hyps = []
                 for j, beam in enumerate(hyps):
-                    # Attention scores
-                    total_scores_att = beam['score_att'] + scores_att[j:j + 1]
-                    total_scores = total_scores_att * (1 - ctc_weight)
-                    total_scores_topk, topk_ids = torch.topk(
-                        total_scores, k=beam_width, dim=1, largest=True, sorted=True)
+                    total_scores_att = total_scores_att_all[j:j + 1]
+                    total_scores_topk = total_scores_topk_all[j:j + 1]
+                    topk_ids = topk_ids_all[j:j + 1]
 
                     # Add LM score <after> top-K selection
                     if lm is not None:
                         total_scores_lm = beam['score_lm'] + scores_lm[j, -1, topk_ids[0]]
                         total_scores_topk += total_scores_lm * lm_weight
+                    elif lexicon is not None and lexicon.lm is not None:
+                        total_scores_lm = beam['score_lm'] + scores_lex[j, topk_ids[0]]
+                        total_scores_topk += total_scores_lm * lm_weight
                     else:
                         total_scores_lm = eouts.new_zeros(beam_width)
 
                     # Add length penalty
                     if lp_weight > 0:
                         if gnmt_decoding:
-                            lp = math.pow(6 + len(beam['hyp'][1:]), lp_weight) / math.pow(6, lp_weight)
+                            lp = math.pow(6 + beam['ylen'], lp_weight) / math.pow(6, lp_weight)
                             total_scores_topk /= lp
                         else:
-                            total_scores_topk += (len(beam['hyp'][1:]) + 1) * lp_weight
+                            total_scores_topk += (beam['ylen'] + 1) * lp_weight
 
                     # Add coverage penalty
                     if cp_weight > 0:
-                        aw_mat = torch.cat(beam['aws'][1:] + [aw[j:j + 1]], dim=2)  # `[B, H, L, T]`
-                        aw_mat = aw_mat[:, 0, :, :]  # `[B, L, T]`
+                        # NOTE: the penalty is accumulated over steps instead of being recomputed
+                        # from the attention history of all steps
+                        aw_j = aw[j:j + 1, 0]  # `[1, 1, T]`
                         if gnmt_decoding:
-                            aw_mat = torch.log(aw_mat.sum(-1))
-                            cp = torch.where(aw_mat < 0, aw_mat, aw_mat.new_zeros(aw_mat.size())).sum()
+                            aw_j = torch.log(aw_j.sum(-1))
+                            cp_i = torch.where(aw_j < 0, aw_j, aw_j.new_zeros(aw_j.size())).sum()
                             # TODO(hirofumi): mask by elens[b]
-                            total_scores_topk += cp * cp_weight
+                        elif cp_threshold == 0:
+                            cp_i = aw_j.sum() / self.score.n_heads
                         else:
-                            # Recompute coverage penalty at each step
-                            if cp_threshold == 0:
-                                cp = aw_mat.sum() / self.score.n_heads
-                            else:
-                                cp = torch.where(aw_mat > cp_threshold, aw_mat,
-                                                 aw_mat.new_zeros(aw_mat.size())).sum() / self.score.n_heads
-                            total_scores_topk += cp * cp_weight
+                            cp_i = torch.where(aw_j > cp_threshold, aw_j,
+                                               aw_j.new_zeros(aw_j.size())).sum() / self.score.n_heads
+                        cp = beam['score_cp'] + cp_i
+                        total_scores_topk += cp * cp_weight
                     else:
                         cp = 0.
 
                     # Add CTC score
-                    new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
-                        beam['hyp'], topk_ids, beam['ctc_state'],
-                        total_scores_topk, ctc_prefix_scorer)
+                    total_scores_ctc = ctc_scores[j]
+                    total_scores_topk += total_scores_ctc * ctc_weight
 
                     for k in range(beam_width):
                         idx = topk_ids[0, k].item()
-                        length_norm_factor = len(beam['hyp'][1:]) + 1 if length_norm else 1
+                        length_norm_factor = beam['ylen'] + 1 if length_norm else 1
                         total_score = total_scores_topk[0, k].item() / length_norm_factor
+                        if lexicon is not None and is_invalid[j, idx]:
+                            continue
 
                         if idx == self.eos:
                             # Exclude short hypotheses
-                            if len(beam['hyp'][1:]) < elens[b] * min_len_ratio:
+                            if beam['ylen'] < elens[b] * min_len_ratio:
                                 continue
                             # EOS threshold
                             max_score_no_eos = scores_att[j, :idx].max(0)[0].item()
@@ -1289,6 +1342,7 @@ class RNNDecoder(DecoderBase):
                                 continue
 
                         streaming_failed_point = beam['streaming_failed_point']
+                        aw_last_success = beam['aw_last_success']
                         quantity_rate = 1.
                         if self.attn_type == 'mocha':
                             n_heads_total = 1
@@ -1305,10 +1359,11 @@ class RNNDecoder(DecoderBase):
 
                             if beam['streamable'] and not streamable_global:
                                 streaming_failed_point = i
+                                aw_last_success = beam['aw']
 
                         new_lmstate = None
                         if lmstate is not None:
-                            if isinstance(lm, RNNLM) or isinstance(self.lm, RNNLM):
+                            if isinstance(lm, (RNNLM, NgramLM)) or isinstance(self.lm, RNNLM):
                                 new_lmstate = {'hxs': lmstate['hxs'][:, j:j + 1],
                                                'cxs': lmstate['cxs'][:, j:j + 1]}
                             elif trfm_lm:
@@ -1316,32 +1371,46 @@ class RNNDecoder(DecoderBase):
                             else:
                                 raise ValueError
 
-                        ys = torch.cat([beam['ys'], eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)], dim=-1)
+                        ys = None
+                        if trfm_lm:
+                            ys = torch.cat([beam['ys'], eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)], dim=-1)
 
                         new_hyps.append(
-                            {'hyp': beam['hyp'] + [idx],
+                            {'node': None,
+                             'parent': beam['node'],
+                             'y': idx,
+                             'ylen': beam['ylen'] + 1,
                              'ys': ys,
                              'score': total_score,
                              'score_att': total_scores_att[0, idx].item(),
+                             'score_att_steps': beam['score_att_steps'] + [total_scores_att[0, idx].item()]
+                             if store_score_steps else None,
                              'score_cp': cp,
                              'score_ctc': total_scores_ctc[k].item(),
                              'score_lm': total_scores_lm[k].item(),
                              'dstates': {'dstate': (dstates['dstate'][0][:, j:j + 1],
                                                     dstates['dstate'][1][:, j:j + 1])},
                              'cv': cv[j:j + 1],
-                             'aws': beam['aws'] + [aw[j:j + 1]],
+                             'aw': aw[j:j + 1],
+                             'aws': beam['aws'] + [aw[j:j + 1]] if store_aws else beam['aws'],
                              'myu': attn_state['myu'][j:j + 1] if self.attn_type in ['gmm', 'sagmm'] else None,
                              'lmstate': new_lmstate,
-                             'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None,
-                             'ensmbl_dstate': ensmbl_dstate,
-                             'ensmbl_cv': ensmbl_cv,
-                             'ensmbl_aws': ensmbl_aws,
+                             'lex_state': lexicon.next_state(beam['lex_state'], idx, lex_states_next[j])
+                             if lexicon is not None else None,
+                             'ctc_state': ctc_states[:, :, j, k] if ctc_prefix_scorer is not None else None,
+                             'ensmbl_dstate': [{'dstate': (dstates_e['dstate'][0][:, j:j + 1],
+                                                           dstates_e['dstate'][1][:, j:j + 1])}
+                                               for dstates_e in ensmbl_dstates],
+                             'ensmbl_cv': [cv_e[j:j + 1] for cv_e in ensmbl_cvs],
+                             'ensmbl_aws': [[aw_e[j:j + 1]] for aw_e in ensmbl_aws],  # NOTE: keep only the last step
                              'streamable': streamable_global,
                              'streaming_failed_point': streaming_failed_point,
+                             'aw_last_success': aw_last_success,
                              'quantity_rate': quantity_rate})
 
                 # Local pruning
                 new_hyps_sorted = sorted(new_hyps, key=lambda x: x['score'], reverse=True)[:beam_width]
+                store.append_hyps(new_hyps_sorted)
 
                 # Remove complete hypotheses
                 new_hyps, end_hyps, is_finish = helper.remove_complete_hyp(
@@ -1356,6 +1425,10 @@ class RNNDecoder(DecoderBase):
             elif len(end_hyps) < nbest and nbest > 1:
                 end_hyps.extend(hyps[:nbest - len(end_hyps)])
 
+            # Recover token sequences only for the final hypotheses
+            for hyp in end_hyps:
+                hyp['hyp'] = store.backtrack(hyp['node'])
+
             # forward/backward second path LM rescoring
             helper.lm_rescoring(end_hyps, lm_second, lm_weight_second,
                                 normalize=length_norm, tag='second')
@@ -1385,7 +1458,7 @@ class RNNDecoder(DecoderBase):
                     logger.info('log prob (hyp, cp): %.7f' % (end_hyps[k]['score_cp'] * cp_weight))
                     if ctc_prefix_scorer is not None:
                         logger.info('log prob (hyp, ctc): %.7f' % (end_hyps[k]['score_ctc'] * ctc_weight))
-                    if lm is not None:
+                    if lm is not None or lexicon is not None:
                         logger.info('log prob (hyp, first-path lm): %.7f' %
                                     (end_hyps[k]['score_lm'] * lm_weight))
                     if lm_second is not None:
@@ -1402,8 +1475,10 @@ class RNNDecoder(DecoderBase):
 
                 if self.attn_type == 'mocha' and end_hyps[0]['streaming_failed_point'] < 1000:
                     assert not self.streamable
-                    aws_last_success = end_hyps[0]['aws'][1:][end_hyps[0]['streaming_failed_point'] - 1]
-                    rightmost_frame = max(0, aws_last_success[0, :, 0].nonzero()[:, -1].max().item()) + 1
+                    aws_last_success = end_hyps[0]['aw_last_success']
+                    rightmost_frame = 0
+                    if aws_last_success is not None:
+                        rightmost_frame = max(0, aws_last_success[0, :, 0].nonzero()[:, -1].max().item()) + 1
                     frame_ratio = rightmost_frame * 100 / xmax
                     self.last_success_frame_ratio = frame_ratio
                     logger.info('streaming last success frame ratio: %.2f' % frame_ratio)
@@ -1412,11 +1487,17 @@ class RNNDecoder(DecoderBase):
             if self.bwd:
                 # Reverse the order
                 nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:][::-1]) for n in range(nbest)]]
-                aws += [[tensor2np(torch.cat(end_hyps[n]['aws'][1:][::-1], dim=2).squeeze(0)) for n in range(nbest)]]
+                if store_aws:
+                    aws += [[tensor2np(torch.cat(end_hyps[n]['aws'][1:][::-1], dim=2).squeeze(0))
+                             for n in range(nbest)]]
             else:
                 nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:]) for n in range(nbest)]]
-                aws += [[tensor2np(torch.cat(end_hyps[n]['aws'][1:], dim=2).squeeze(0)) for n in range(nbest)]]
-            if length_norm:
+                if store_aws:
+                    aws += [[tensor2np(torch.cat(end_hyps[n]['aws'][1:], dim=2).squeeze(0)) for n in range(nbest)]]
+            if store_score_steps:
+                scores += [[np.array(end_hyps[n]['score_att_steps'][::-1] if self.bwd
+                                     else end_hyps[n]['score_att_steps']) for n in range(nbest)]]
+            elif length_norm:
                 scores += [[end_hyps[n]['score_att'] / len(end_hyps[n]['hyp'][1:]) for n in range(nbest)]]
             else:
                 scores += [[end_hyps[n]['score_att'] for n in range(nbest)]]
@@ -1429,15 +1510,27 @@ class RNNDecoder(DecoderBase):
             if self.bwd:
                 nbest_hyps_idx = [[nbest_hyps_idx[b][n][1:] if eos_flags[b][n]
                                    else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
-                aws = [[aws[b][n][:, 1:] if eos_flags[b][n] else aws[b][n] for n in range(nbest)] for b in range(bs)]
+                if store_aws:
+                    aws = [[aws[b][n][:, 1:] if eos_flags[b][n] else aws[b][n]
+                            for n in range(nbest)] for b in range(bs)]
+                if store_score_steps:
+                    scores = [[scores[b][n][1:] if eos_flags[b][n]
+                               else scores[b][n] for n in range(nbest)] for b in range(bs)]
             else:
                 nbest_hyps_idx = [[nbest_hyps_idx[b][n][:-1] if eos_flags[b][n]
                                    else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
-                aws = [[aws[b][n][:, :-1] if eos_flags[b][n] else aws[b][n] for n in range(nbest)] for b in range(bs)]
+                if store_aws:
+                    aws = [[aws[b][n][:, :-1] if eos_flags[b][n] else aws[b][n]
+                            for n in range(nbest)] for b in range(bs)]
+                if store_score_steps:
+                    scores = [[scores[b][n][:-1] if eos_flags[b][n] else scores[b][n]
+                               for n in range(nbest)] for b in range(bs)]
+        if not store_aws:
+            aws = None
 
         # Store ASR/LM state
         self.dstates_final = end_hyps[0]['dstates']
-        if isinstance(lm, RNNLM):
+        if isinstance(lm, (RNNLM, NgramLM)):
             self.lmstate_final = end_hyps[0]['lmstate']
         elif trfm_lm:
             if isinstance(lm, TransformerXL):
@@ -1453,6 +1546,348 @@ class RNNDecoder(DecoderBase):
 
         return nbest_hyps_idx, aws, scores
 
+    def batch_decodable(self, params, lm=None):
+        """Whether beam_search_batch() supports the decoding options.
+           Otherwise, utterances are decoded one by one with beam_search().
+
+        Args:
+            params (dict): decoding hyperparameters
+            lm (torch.nn.module): firsh path LM
+        Returns:
+            (bool)
+
+        """
+        if params['recog_coverage_penalty'] > 0 or self.lm is not None:
+            return False
+        if self.attn_type in ['mocha', 'gmm', 'sagmm', 'triggered_attention']:
+            return False
+        if params['recog_asr_state_carry_over'] or params['recog_lm_state_carry_over']:
+            return False
+        return lm is None or isinstance(lm, (RNNLM, NgramLM, TransformerLM))
+
+    def beam_search_batch(self, eouts, elens, params, idx2token=None,
+                          lm=None, lm_second=None, lm_second_bwd=None, ctc_log_probs=None,
+                          nbest=1, exclude_eos=False, refs_id=None, utt_ids=None,
+                          store_aws=True):
+        """Beam search decoding over multiple utterances at once.
+
+        All hypotheses of all utterances are kept as `[B * beam_width]` tensors, scored by
+        a single decode_step per output step, and pruned by a flattened top-K per utterance.
+        Tokens and attention weights are not copied along with hypotheses but recovered
+        by back-pointers at the end of decoding.
+        This gives the same N-best lists as beam_search() for the supported options.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            elens (IntTensor): `[B]`
+            params (dict): decoding hyperparameters
+            idx2token (): converter from index to token
+            lm (torch.nn.module): firsh path LM (RNNLM or TransformerLM)
+            lm_second (torch.nn.module): second path LM
+            lm_second_bwd (torch.nn.module): secoding path backward LM
+            ctc_log_probs (FloatTensor): `[B, T, vocab]`
+            nbest (int): number of N-best list
+            exclude_eos (bool): exclude <eos> from hypothesis
+            refs_id (List): reference list
+            utt_ids (List): utterance id list
+            store_aws (bool): keep attention weights at all steps for backtracking
+        Returns:
+            nbest_hyps_idx (List[List[np.array]]): length `[B]`, each of which contains a list of hypotheses of size `[nbest]`,
+                each of which containts a list of arrays of size `[L]`
+            aws (List[List[[np.array]]]): length `[B]`, each of which contains a list of attention weights of size `[nbest]`,
+                each of which containts a list of arrays of size `[H, L, T]` (None if store_aws is False)
+            scores (List[List[np.array]]): sequence-level scores
+
+        """
+        bs = eouts.size(0)
+
+        beam_width = params['recog_beam_width']
+        assert 1 <= nbest <= beam_width
+        ctc_weight = params['recog_ctc_weight']
+        ctc_window_margin = params['recog_ctc_window_margin']
+        max_len_ratio = params['recog_max_len_ratio']
+        min_len_ratio = params['recog_min_len_ratio']
+        lp_weight = params['recog_length_penalty']
+        length_norm = params['recog_length_norm']
+        lm_weight = params['recog_lm_weight']
+        lm_weight_second = params['recog_lm_second_weight']
+        lm_weight_second_bwd = params['recog_lm_bwd_weight']
+        gnmt_decoding = params['recog_gnmt_decoding']
+        eos_threshold = params['recog_eos_threshold']
+        softmax_smoothing = params['recog_softmax_smoothing']
+
+        if params['recog_coverage_penalty'] > 0:
+            raise NotImplementedError('Use beam_search() for coverage penalty.')
+        if self.lm is not None or self.attn_type in ['mocha', 'gmm', 'sagmm', 'triggered_attention']:
+            raise NotImplementedError('Use beam_search() for LM fusion and %s attention.' % self.attn_type)
+        assert not params['recog_asr_state_carry_over'] and not params['recog_lm_state_carry_over']
+
+        helper = BeamSearch(beam_width, self.eos, ctc_weight, eouts.device)
+        lm = helper.verify_lm_eval_mode(lm, lm_weight)
+        lm_second = helper.verify_lm_eval_mode(lm_second, lm_weight_second)
+        lm_second_bwd = helper.verify_lm_eval_mode(lm_second_bwd, lm_weight_second_bwd)
+        if lm is not None and not isinstance(lm, (RNNLM, NgramLM, TransformerLM)):
+            raise NotImplementedError(type(lm))
+
+        # NOTE: hypotheses of the b-th utterance are stored in rows [b * beam_width, (b + 1) * beam_width)
+        n_rows = bs * beam_width
+        NEG_INF = float('-inf')
+        ymaxs = [math.ceil(elens[b] * max_len_ratio) for b in range(bs)]
+        # NOTE: Tensor.repeat_interleave is not used for PyTorch<1.1
+        eouts = eouts.unsqueeze(1).expand(-1, beam_width, -1, -1).reshape(n_rows, eouts.size(1), -1)
+        src_mask = make_pad_mask(elens.to(eouts.device)).unsqueeze(1).expand(-1, beam_width, -1).reshape(n_rows, 1, -1)
+        self.score.reset()
+        dstates = self.zero_state(n_rows)
+        cv = eouts.new_zeros(n_rows, 1, self.enc_n_units)
+        aw = None
+        lmstate = None
+        y = eouts.new_zeros(n_rows, dtype=torch.int64).fill_(self.eos)  # last tokens
+        # NOTE: full prefixes are required only by TransformerLM
+        ys = y.unsqueeze(1) if isinstance(lm, TransformerLM) else None  # `[B * beam, L]`, including <sos>
+        store = HypothesisStore(n_rows, self.eos, eouts.device, max_len=max(ymaxs) + 1)
+        nodes = store.roots
+        aws_steps = []  # attention weights of all rows at each step
+        score_att = eouts.new_zeros(n_rows)
+        score_lm = eouts.new_zeros(n_rows)
+        # only the first hypothesis of each utterance is alive at the first step
+        alive = torch.arange(n_rows, device=eouts.device) % beam_width == 0
+
+        # For joint CTC-Attention decoding
+        ctc_prefix_scorer = None
+        if ctc_log_probs is not None:
+            assert ctc_weight > 0
+            ctc_prefix_scorer = CTCPrefixScoreBatch(ctc_log_probs, elens, self.blank, self.eos,
+                                                    backward=self.bwd, margin=ctc_window_margin)
+            ctc_state = ctc_prefix_scorer.initial_state()  # `[T, 2, B]`
+            ctc_state = ctc_state.unsqueeze(3).expand(-1, -1, -1, beam_width).reshape(
+                ctc_state.size(0), 2, n_rows)  # `[T, 2, B * beam]`
+            utt_ids_rows = torch.arange(n_rows, device=eouts.device) // beam_width
+
+        ymins = (elens.to(eouts.device) * min_len_ratio).unsqueeze(1).expand(-1, beam_width).reshape(n_rows)  # `[B * beam]`
+        end_hyps = [[] for _ in range(bs)]
+        last_hyps = [[] for _ in range(bs)]  # alive hypotheses at the last step
+        finished = [ymaxs[b] == 0 for b in range(bs)]
+        for i in range(max(ymaxs)):
+            # Update LM states for shallow fusion
+            scores_lm = None
+            if lm is not None:
+                y_lm = ys if isinstance(lm, TransformerLM) else y.unsqueeze(1)
+                _, lmstate, scores_lm = lm.predict(y_lm, lmstate, cache=lmstate)
+
+            y_emb = self.dropout_emb(self.embed(y.unsqueeze(1)))
+            dstates, cv, aw, _, attn_v = self.decode_step(eouts, dstates, cv, y_emb, src_mask, aw, None)
+            scores_att = torch.log(torch.softmax(self.output(attn_v).squeeze(1) * softmax_smoothing, dim=1))
+            if store_aws:
+                aws_steps.append(aw)
+
+            # Pick up top-K candidates per hypothesis
+            total_scores_att = score_att.unsqueeze(1) + scores_att  # `[B * beam, vocab]`
+            total_scores_topk, topk_ids = torch.topk(total_scores_att * (1 - ctc_weight),
+                                                     k=beam_width, dim=1, largest=True, sorted=True)
+
+            # Add LM score <after> top-K selection
+            if lm is not None:
+                total_scores_lm = score_lm.unsqueeze(1) + scores_lm[:, -1].gather(1, topk_ids)
+                total_scores_topk += total_scores_lm * lm_weight
+            else:
+                total_scores_lm = torch.zeros_like(total_scores_topk)
+
+            # Add length penalty
+            if lp_weight > 0:
+                if gnmt_decoding:
+                    total_scores_topk /= math.pow(6 + i, lp_weight) / math.pow(6, lp_weight)
+                else:
+                    total_scores_topk += (i + 1) * lp_weight
+
+            # Add CTC score
+            if ctc_prefix_scorer is not None:
+                total_scores_ctc, ctc_states = ctc_prefix_scorer(None, topk_ids, ctc_state, utt_ids_rows,
+                                                                 frames=aw[:, :, 0].sum(1).argmax(-1),
+                                                                 ylens=torch.full_like(y, i), last=y)
+                total_scores_topk += total_scores_ctc * ctc_weight
+            else:
+                total_scores_ctc = torch.zeros_like(total_scores_topk)
+            total_scores = total_scores_topk / ((i + 1) if length_norm else 1)
+
+            # Exclude short hypotheses and <eos> below the threshold
+            is_eos = topk_ids == self.eos
+            scores_att_no_eos = scores_att.clone()
+            scores_att_no_eos[:, self.eos] = NEG_INF
+            eos_ok = scores_att[:, self.eos] > eos_threshold * scores_att_no_eos.max(1)[0]
+            eos_ok = (eos_ok & (ymins <= i)).unsqueeze(1)
+            total_scores = total_scores.masked_fill(~alive.unsqueeze(1) | (is_eos & ~eos_ok), NEG_INF)
+
+            # Local pruning over all candidates of each utterance
+            total_scores, flat_ids = torch.topk(total_scores.view(bs, -1), k=beam_width, dim=1,
+                                                largest=True, sorted=True)  # `[B, beam]`
+            src_rows = flat_ids // beam_width + torch.arange(bs, device=eouts.device).unsqueeze(1) * beam_width
+            flat_ids = flat_ids + torch.arange(bs, device=eouts.device).unsqueeze(1) * beam_width * beam_width
+            new_ids = topk_ids.view(-1)[flat_ids.view(-1)].view(bs, beam_width)
+            new_score_att = total_scores_att.gather(1, topk_ids).view(-1)[flat_ids.view(-1)]
+            new_score_lm = total_scores_lm.view(-1)[flat_ids.view(-1)]
+            new_score_ctc = total_scores_ctc.view(-1)[flat_ids.view(-1)]
+
+            # Remove complete hypotheses
+            scores_list = total_scores.tolist()
+            src_rows_list = src_rows.tolist()
+            new_ids_list = new_ids.tolist()
+            new_score_att_list = new_score_att.tolist()
+            new_score_lm_list = new_score_lm.tolist()
+            new_score_ctc_list = new_score_ctc.tolist()
+            nodes_list = nodes.tolist()
+            gather_rows = list(range(n_rows))  # back-pointers to rows at the previous step
+            cand_pos = list(range(n_rows))  # positions in the pruned candidates
+            new_alive = [False] * n_rows
+            for b in range(bs):
+                if finished[b]:
+                    continue
+                n_alive = 0
+                for k in range(beam_width):
+                    if scores_list[b][k] == NEG_INF:
+                        break
+                    j, idx, pos = src_rows_list[b][k], new_ids_list[b][k], b * beam_width + k
+                    if idx == self.eos:
+                        end_hyps[b].append({'node': nodes_list[j],
+                                            'last': idx,
+                                            'score': scores_list[b][k],
+                                            'score_att': new_score_att_list[pos],
+                                            'score_lm': new_score_lm_list[pos],
+                                            'score_ctc': new_score_ctc_list[pos]})
+                    else:
+                        r = b * beam_width + n_alive
+                        gather_rows[r], cand_pos[r], new_alive[r] = j, pos, True
+                        n_alive += 1
+
+                if len(end_hyps[b]) >= beam_width:
+                    end_hyps[b] = end_hyps[b][:beam_width]
+                    finished[b] = True
+                elif i == ymaxs[b] - 1 or n_alive == 0:
+                    finished[b] = True
+                    for r in range(b * beam_width, b * beam_width + n_alive):
+                        j, pos = gather_rows[r], cand_pos[r]
+                        last_hyps[b].append({'node': nodes_list[j],
+                                             'last': new_ids_list[b][pos % beam_width],
+                                             'score': scores_list[b][pos % beam_width],
+                                             'score_att': new_score_att_list[pos],
+                                             'score_lm': new_score_lm_list[pos],
+                                             'score_ctc': new_score_ctc_list[pos]})
+                if finished[b]:
+                    new_alive[b * beam_width:(b + 1) * beam_width] = [False] * beam_width
+            if all(finished):
+                break
+
+            # Reorder states by back-pointers
+            gather = torch.tensor(gather_rows, device=eouts.device)
+            cand_pos = torch.tensor(cand_pos, device=eouts.device)
+            alive = torch.tensor(new_alive, device=eouts.device)
+            hxs, cxs = dstates['dstate']
+            dstates = {'dstate': (hxs.index_select(1, gather),
+                                  cxs.index_select(1, gather) if cxs is not None else None)}
+            cv = cv.index_select(0, gather)
+            aw = aw.index_select(0, gather)
+            y = new_ids.view(-1).index_select(0, cand_pos)
+            nodes = store.append(y, nodes.index_select(0, gather),
+                                 scores=total_scores.view(-1).index_select(0, cand_pos))
+            if ys is not None:
+                ys = torch.cat([ys.index_select(0, gather), y.unsqueeze(1)], dim=1)
+            score_att = new_score_att.index_select(0, cand_pos)
+            score_lm = new_score_lm.index_select(0, cand_pos)
+            if ctc_prefix_scorer is not None:
+                ctc_state = ctc_prefix_scorer.index_select_state(ctc_states, flat_ids.view(-1)[cand_pos])
+            if isinstance(lm, (RNNLM, NgramLM)):
+                lmstate = {'hxs': lmstate['hxs'].index_select(1, gather),
+                           'cxs': lmstate['cxs'].index_select(1, gather) if lmstate['cxs'] is not None else None}
+            elif isinstance(lm, TransformerLM):
+                lmstate = [lmstate_l.index_select(0, gather) for lmstate_l in lmstate]
+
+        for b in range(bs):
+            # Global pruning
+            if len(end_hyps[b]) == 0:
+                end_hyps[b] = last_hyps[b][:]
+            elif len(end_hyps[b]) < nbest and nbest > 1:
+                end_hyps[b].extend(last_hyps[b][:nbest - len(end_hyps[b])])
+
+            # Backtrack tokens and attention weights
+            for hyp in end_hyps[b]:
+                hyp['hyp'] = store.backtrack(hyp['node']) + [hyp['last']]
+                if store_aws:
+                    path = store.path(hyp['node'])
+                    hyp['aws'] = torch.cat([aws_steps[n // n_rows][n % n_rows] for n in path], dim=1)  # `[H, L, T]`
+
+        # forward/backward second path LM rescoring of all utterances at once
+        end_hyps_all = [hyp for hyps_b in end_hyps for hyp in hyps_b]
+        helper.lm_rescoring(end_hyps_all, lm_second, lm_weight_second,
+                            normalize=length_norm, tag='second')
+        helper.lm_rescoring(end_hyps_all, lm_second_bwd, lm_weight_second_bwd,
+                            normalize=length_norm, tag='second_bwd')
+
+        nbest_hyps_idx, aws, scores = [], [], []
+        eos_flags = []
+        for b in range(bs):
+            # Sort by score
+            hyps_b = sorted(end_hyps[b], key=lambda x: x['score'], reverse=True)
+
+            if idx2token is not None:
+                if utt_ids is not None:
+                    logger.info('Utt-id: %s' % utt_ids[b])
+                assert self.vocab == idx2token.vocab
+                logger.info('=' * 200)
+                for k in range(len(hyps_b)):
+                    if refs_id is not None:
+                        logger.info('Ref: %s' % idx2token(refs_id[b]))
+                    logger.info('Hyp: %s' % idx2token(
+                        hyps_b[k]['hyp'][1:][::-1] if self.bwd else hyps_b[k]['hyp'][1:]))
+                    logger.info('log prob (hyp): %.7f' % hyps_b[k]['score'])
+                    logger.info('log prob (hyp, att): %.7f' % (hyps_b[k]['score_att'] * (1 - ctc_weight)))
+                    if ctc_prefix_scorer is not None:
+                        logger.info('log prob (hyp, ctc): %.7f' % (hyps_b[k]['score_ctc'] * ctc_weight))
+                    if lm is not None:
+                        logger.info('log prob (hyp, first-path lm): %.7f' % (hyps_b[k]['score_lm'] * lm_weight))
+                    if lm_second is not None:
+                        logger.info('log prob (hyp, second-path lm): %.7f' %
+                                    (hyps_b[k]['score_lm_second'] * lm_weight_second))
+                    if lm_second_bwd is not None:
+                        logger.info('log prob (hyp, second-path lm, reverse): %.7f' %
+                                    (hyps_b[k]['score_lm_second_bwd'] * lm_weight_second_bwd))
+                    logger.info('-' * 50)
+
+            # N-best list
+            if self.bwd:
+                # Reverse the order
+                nbest_hyps_idx += [[np.array(hyps_b[n]['hyp'][1:][::-1]) for n in range(nbest)]]
+                if store_aws:
+                    aws += [[tensor2np(hyps_b[n]['aws'][:, :, :elens[b]].flip(1)) for n in range(nbest)]]
+            else:
+                nbest_hyps_idx += [[np.array(hyps_b[n]['hyp'][1:]) for n in range(nbest)]]
+                if store_aws:
+                    aws += [[tensor2np(hyps_b[n]['aws'][:, :, :elens[b]]) for n in range(nbest)]]
+            if length_norm:
+                scores += [[hyps_b[n]['score_att'] / len(hyps_b[n]['hyp'][1:]) for n in range(nbest)]]
+            else:
+                scores += [[hyps_b[n]['score_att'] for n in range(nbest)]]
+
+            # Check <eos>
+            eos_flags.append([(hyps_b[n]['hyp'][-1] == self.eos) for n in range(nbest)])
+
+        # Exclude <eos> (<sos> in case of backward decoder)
+        if exclude_eos:
+            if self.bwd:
+                nbest_hyps_idx = [[nbest_hyps_idx[b][n][1:] if eos_flags[b][n]
+                                   else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
+                if store_aws:
+                    aws = [[aws[b][n][:, 1:] if eos_flags[b][n] else aws[b][n]
+                            for n in range(nbest)] for b in range(bs)]
+            else:
+                nbest_hyps_idx = [[nbest_hyps_idx[b][n][:-1] if eos_flags[b][n]
+                                   else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
+                if store_aws:
+                    aws = [[aws[b][n][:, :-1] if eos_flags[b][n] else aws[b][n]
+                            for n in range(nbest)] for b in range(bs)]
+        if not store_aws:
+            aws = None
+
+        return nbest_hyps_idx, aws, scores
+
     def beam_search_block_sync(self, eouts, params, idx2token, hyps,
                                lm=None, ctc_log_probs=None,
                                state_carry_over=False, emb_cache=True):
@@ -1462,10 +1897,7 @@ class RNNDecoder(DecoderBase):
         beam_width = params['recog_beam_width']
         ctc_weight = params['recog_ctc_weight']
         max_len_ratio = params['recog_max_len_ratio']
-        lp_weight = params['recog_length_penalty']
-        length_norm = params['recog_length_norm']
         lm_weight = params['recog_lm_weight']
-        eos_threshold = params['recog_eos_threshold']
         softmax_smoothing = params['recog_softmax_smoothing']
 
         helper = BeamSearch(beam_width, self.eos, ctc_weight, eouts.device)
@@ -1500,7 +1932,7 @@ class RNNDecoder(DecoderBase):
 
             if state_carry_over:
                 dstates = self.dstates_final
-                if isinstance(lm, RNNLM):
+                if isinstance(lm, (RNNLM, NgramLM)):
                     lmstate = self.lmstate_final
 
             self.n_frames = 0
@@ -1556,70 +1988,12 @@ class RNNDecoder(DecoderBase):
             # NOTE: aw: `[B, H, 1, T_block]`
 
             for j, beam in enumerate(hyps):
-                # no token boundary found in the current block for j-th utterance
-                no_boundary = aw[j].sum().item() == 0
-                if no_boundary:
-                    beam['aws'][-1] = eouts.new_zeros(eouts.size(0), 1, 1, eouts.size(1))
-                    # NOTE: case where the first token in the current block is <eos>
-                    beam['no_boundary'] = True
-                    new_hyps.append(beam.copy())  # this is important to remove repeated hyps
-
-                # Attention scores
-                total_scores_att = beam['score_att'] + scores_att[j:j + 1]
-                total_scores = total_scores_att * (1 - ctc_weight)
-
-                # Add LM score <after> top-K selection
-                total_scores_topk, topk_ids = torch.topk(
-                    total_scores, k=beam_width, dim=1, largest=True, sorted=True)
-                if lm is not None:
-                    total_scores_lm = beam['score_lm'] + scores_lm[j, -1, topk_ids[0]]
-                    total_scores_topk += total_scores_lm * lm_weight
-                else:
-                    total_scores_lm = eouts.new_zeros(beam_width)
-
-                # Add length penalty
-                total_scores_topk += (len(beam['hyp'][1:]) + 1) * lp_weight
-
-                cp = self.n_frames
-                if not no_boundary:
-                    boundary_list_j = np.where(tensor2np(aw[j].sum(1).sum(0)) != 0)[0]
-                    cp += int(boundary_list_j[0])
-                    if len(beam['boundary']) > 0:
-                        assert cp >= beam['boundary'][-1], (cp, beam['boundary'])
-
-                # Add CTC score
-                new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
-                    beam['hyp'], topk_ids, beam['ctc_state'],
-                    total_scores_topk, self.ctc_prefix_scorer, new_chunk=(i == 0))
-
-                for k in range(beam_width):
-                    idx = topk_ids[0, k].item()
-                    if no_boundary and idx != self.eos:
-                        continue
-                    length_norm_factor = len(beam['hyp'][1:]) + 1 if length_norm else 1
-                    total_score = total_scores_topk[0, k].item() / length_norm_factor
-
-                    if idx == self.eos:
-                        # EOS threshold
-                        max_score_no_eos = scores_att[j, :idx].max(0)[0].item()
-                        max_score_no_eos = max(max_score_no_eos, scores_att[j, idx + 1:].max(0)[0].item())
-                        if scores_att[j, idx].item() <= eos_threshold * max_score_no_eos:
-                            continue
-
-                    new_hyps.append(
-                        {'hyp': beam['hyp'] + [idx],
-                         'score': total_score,
-                         'score_att': total_scores_att[0, idx].item(),
-                         'score_ctc': total_scores_ctc[k].item(),
-                         'score_lm': total_scores_lm[k].item(),
-                         'dstates': {'dstate': (dstates['dstate'][0][:, j:j + 1], dstates['dstate'][1][:, j:j + 1])},
-                         'cv': cv[j:j + 1],
-                         'aws': beam['aws'] + [aw[j:j + 1]],
-                         'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                     'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
-                         'ctc_state': new_ctc_states[k] if self.ctc_prefix_scorer is not None else None,
-                         'boundary': beam['boundary'] + [cp] if not no_boundary else beam['boundary'],
-                         'no_boundary': no_boundary})
+                new_hyps += self._expand_hyp_block_sync(
+                    beam, aw[j:j + 1], scores_att[j:j + 1], scores_lm[j, -1] if lm is not None else None,
+                    (dstates['dstate'][0][:, j:j + 1], dstates['dstate'][1][:, j:j + 1]), cv[j:j + 1],
+                    {'hxs': lmstate['hxs'][:, j:j + 1],
+                     'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
+                    self.ctc_prefix_scorer, self.n_frames, i == 0, helper, lm, params)
 
             # Local pruning
             new_hyps_sorted = sorted(new_hyps, key=lambda x: x['score'], reverse=True)[:beam_width]
@@ -1663,3 +2037,261 @@ class RNNDecoder(DecoderBase):
         self.score.reset_block()
 
         return end_hyps, hyps, aws
+
+    def beam_search_block_sync_batch(self, eouts, elens, params, streams,
+                                     lm=None, ctc_log_probs=None, emb_cache=True):
+        """Block-synchronous beam search decoding over multiple streams at once for streaming inference.
+        Each stream carries its own beam, MoChA state, CTC prefix scorer, and LM states
+        over blocks as in beam_search_block_sync().
+        The decoder RNN, LM, and output layer are run over hypotheses of all streams in a batch,
+        while MoChA is run per stream because token boundaries are detected in the block of each stream.
+        Streams can join or leave the batch between blocks.
+
+        Args:
+            eouts (FloatTensor): `[B, T_block, enc_n_units]`, encoder outputs of the current block of each stream
+            elens (IntTensor): `[B]`, number of frames in the current block of each stream
+            params (dict): decoding hyperparameters
+            streams (List[dict]): length `[B]`, states of streams returned in the previous block
+                (None for the first block of a stream)
+            lm (torch.nn.module): firsh path LM (RNNLM)
+            ctc_log_probs (FloatTensor): `[B, T_block, vocab]`
+            emb_cache (bool): precompute token embeddings for fast infernece
+        Returns:
+            streams (List[dict]): length `[B]`, each of which contains
+                end_hyps (List): hypotheses ending with <eos> in the current block
+                hyps (List): active hypotheses
+                n_frames (int): number of frames decoded so far
+                attn_cache (dict): MoChA state
+                ctc_prefix_scorer (CTCPrefixScore): CTC prefix scorer
+
+        """
+        assert self.attn_type == 'mocha'
+        bs = eouts.size(0)
+        assert len(streams) == bs
+
+        beam_width = params['recog_beam_width']
+        ctc_weight = params['recog_ctc_weight']
+        max_len_ratio = params['recog_max_len_ratio']
+        lm_weight = params['recog_lm_weight']
+        softmax_smoothing = params['recog_softmax_smoothing']
+
+        helper = BeamSearch(beam_width, self.eos, ctc_weight, eouts.device)
+        lm = helper.verify_lm_eval_mode(lm, lm_weight)
+        if lm is not None and not isinstance(lm, RNNLM):
+            raise NotImplementedError(type(lm))
+
+        # pre-compute embeddings
+        if emb_cache and self.embed_cache is None:
+            indices = torch.arange(0, self.vocab, 1, dtype=torch.int64).to(eouts.device)
+            self.embed_cache = self.dropout_emb(self.embed(indices))  # `[1, vocab, emb_dim]`
+
+        elens = elens.tolist()
+        new_streams = []
+        for b, stream in enumerate(streams):
+            if ctc_log_probs is not None:
+                assert ctc_weight > 0
+                ctc_log_probs_b = tensor2np(ctc_log_probs[b, :elens[b]])
+            if stream is None:
+                # Initialization per stream
+                self.score.reset()
+                ctc_prefix_scorer, ctc_state = None, None
+                if ctc_log_probs is not None:
+                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs_b, self.blank, self.eos)
+                    ctc_state = ctc_prefix_scorer.initial_state()
+                hyps = self.initialize_beam([self.eos], self.zero_state(1), eouts.new_zeros(1, 1, self.enc_n_units),
+                                            None, ctc_state)
+                stream = {'hyps': hyps, 'n_frames': 0,
+                          'attn_cache': self.score.get_cache(), 'ctc_prefix_scorer': ctc_prefix_scorer}
+            else:
+                stream = dict(stream, hyps=[dict(beam, no_boundary=False) for beam in stream['hyps']])
+                if stream['ctc_prefix_scorer'] is not None:
+                    stream['ctc_prefix_scorer'].register_new_chunk(ctc_log_probs_b)
+            new_streams.append(stream)
+
+        ymaxs = [math.ceil(elens[b] * max_len_ratio) for b in range(bs)]
+        hyps = [stream['hyps'] for stream in new_streams]
+        end_hyps = [[] for _ in range(bs)]
+        is_finished = [False] * bs
+        for i in range(max(ymaxs + [0])):
+            # ignore hypotheses with no boundary from batched hypotheses
+            active, new_hyps = [], [[] for _ in range(bs)]
+            for b in range(bs):
+                # finish if no additional token boundary is found in the current block for all candidates
+                if is_finished[b] or i >= ymaxs[b] or len(hyps[b]) == 0:
+                    is_finished[b] = True
+                    continue
+                new_hyps[b] = [beam.copy() for beam in hyps[b] if beam['no_boundary']]
+                hyps_filtered = [beam.copy() for beam in hyps[b] if not beam['no_boundary']]
+                if len(hyps_filtered) == 0:
+                    is_finished[b] = True
+                    continue
+                hyps[b] = hyps_filtered
+                active.append(b)
+            if len(active) == 0:
+                break
+
+            # batchfy hypotheses of all streams for batch decoding
+            hyps_all = [beam for b in active for beam in hyps[b]]
+            y = eouts.new_zeros((len(hyps_all), 1), dtype=torch.int64)
+            for j, beam in enumerate(hyps_all):
+                y[j, 0] = beam['hyp'][-1]
+            cv = torch.cat([beam['cv'] for beam in hyps_all], dim=0)
+            hxs = torch.cat([beam['dstates']['dstate'][0] for beam in hyps_all], dim=1)
+            cxs = torch.cat([beam['dstates']['dstate'][1] for beam in hyps_all], dim=1)
+
+            # Update LM states for LM fusion
+            lmstates = [beam['lmstate'] for beam in hyps_all if beam['lmstate'] is not None]
+            if 0 < len(lmstates) < len(hyps_all):
+                # NOTE: LM states before the first step are equivalent to the zero state
+                zero_lmstate = {k: None if v is None else torch.zeros_like(v) for k, v in lmstates[0].items()}
+                hyps_all = [beam if beam['lmstate'] is not None else dict(beam, lmstate=zero_lmstate)
+                            for beam in hyps_all]
+            lmout, lmstate, scores_lm = helper.update_rnnlm_state_batch(
+                self.lm if self.lm is not None else lm, hyps_all, y, emb_cache=emb_cache)
+
+            if self.embed_cache is not None:
+                y_emb = self.embed_cache[y]
+            else:
+                y_emb = self.dropout_emb(self.embed(y))
+            dstates = self.recurrency(torch.cat([y_emb, cv], dim=-1), (hxs, cxs))
+
+            # NOTE: MoChA is run per stream with its own state
+            aws, cvs = {}, []
+            offset = 0
+            for b in active:
+                n_hyps = len(hyps[b])
+                aw = torch.cat([beam['aws'][-1] for beam in hyps[b]], dim=0) if i > 0 else None
+                self.score.set_cache(new_streams[b]['attn_cache'])
+                cv_b, aws[b], _ = self.score(eouts[b:b + 1, :elens[b]], eouts[b:b + 1, :elens[b]],
+                                             dstates['dout_score'][offset:offset + n_hyps], None, aw,
+                                             cache=True, mode='hard', streaming=True)
+                new_streams[b]['attn_cache'] = self.score.get_cache()
+                cvs.append(cv_b)
+                offset += n_hyps
+            cv = torch.cat(cvs, dim=0)
+            attn_v = self.generate(cv, dstates['dout_gen'], lmout)
+            scores_att = torch.log_softmax(self.output(attn_v).squeeze(1) * softmax_smoothing, dim=1)
+
+            offset = 0
+            for b in active:
+                for j, beam in enumerate(hyps[b]):
+                    r = offset + j
+                    new_hyps[b] += self._expand_hyp_block_sync(
+                        beam, aws[b][j:j + 1], scores_att[r:r + 1], scores_lm[r, -1] if lm is not None else None,
+                        (dstates['dstate'][0][:, r:r + 1], dstates['dstate'][1][:, r:r + 1]), cv[r:r + 1],
+                        {'hxs': lmstate['hxs'][:, r:r + 1],
+                         'cxs': lmstate['cxs'][:, r:r + 1]} if lmstate is not None else None,
+                        new_streams[b]['ctc_prefix_scorer'], new_streams[b]['n_frames'], i == 0, helper, lm, params)
+                offset += len(hyps[b])
+
+                # Local pruning
+                new_hyps_sorted = sorted(new_hyps[b], key=lambda x: x['score'], reverse=True)[:beam_width]
+
+                # Remove complete hypotheses
+                hyps[b], end_hyps[b], is_finished[b] = helper.remove_complete_hyp(new_hyps_sorted, end_hyps[b])
+
+        for b, stream in enumerate(new_streams):
+            # move to the next block
+            self.score.set_cache(stream['attn_cache'])
+            self.score.reset_block()
+            stream.update({'hyps': hyps[b],
+                           'end_hyps': sorted(end_hyps[b], key=lambda x: x['score'], reverse=True),
+                           'n_frames': stream['n_frames'] + elens[b],
+                           'attn_cache': self.score.get_cache()})
+
+        return new_streams
+
+    def _expand_hyp_block_sync(self, beam, aw, scores_att, scores_lm, dstate, cv, lmstate,
+                               ctc_prefix_scorer, n_frames, new_chunk, helper, lm, params):
+        """Expand a hypothesis with top-K tokens in block-synchronous decoding.
+
+        Args:
+            beam (dict): hypothesis
+            aw (FloatTensor): `[1, H, 1, T_block]`
+            scores_att (FloatTensor): `[1, vocab]`
+            scores_lm (FloatTensor): `[vocab]`
+            dstate (tuple): (hxs, cxs), each of which is of size `[n_layers, 1, dec_n_units]`
+            cv (FloatTensor): `[1, 1, enc_n_units]`
+            lmstate (dict): LM state
+            ctc_prefix_scorer (CTCPrefixScore): CTC prefix scorer
+            n_frames (int): number of frames decoded in the previous blocks
+            new_chunk (bool): the first step in the current block
+            helper (BeamSearch): beam search helper
+            lm (torch.nn.module): firsh path LM
+            params (dict): decoding hyperparameters
+        Returns:
+            new_hyps (List): expanded hypotheses
+
+        """
+        beam_width = params['recog_beam_width']
+        ctc_weight = params['recog_ctc_weight']
+        lp_weight = params['recog_length_penalty']
+        length_norm = params['recog_length_norm']
+        lm_weight = params['recog_lm_weight']
+        eos_threshold = params['recog_eos_threshold']
+
+        new_hyps = []
+        # no token boundary found in the current block
+        no_boundary = aw.sum().item() == 0
+        if no_boundary:
+            beam['aws'][-1] = aw.new_zeros(1, 1, 1, aw.size(3))
+            # NOTE: case where the first token in the current block is <eos>
+            beam['no_boundary'] = True
+            new_hyps.append(beam.copy())  # this is important to remove repeated hyps
+
+        # Attention scores
+        total_scores_att = beam['score_att'] + scores_att
+        total_scores = total_scores_att * (1 - ctc_weight)
+
+        # Add LM score <after> top-K selection
+        total_scores_topk, topk_ids = torch.topk(
+            total_scores, k=beam_width, dim=1, largest=True, sorted=True)
+        if lm is not None:
+            total_scores_lm = beam['score_lm'] + scores_lm[topk_ids[0]]
+            total_scores_topk += total_scores_lm * lm_weight
+        else:
+            total_scores_lm = scores_att.new_zeros(beam_width)
+
+        # Add length penalty
+        total_scores_topk += (len(beam['hyp'][1:]) + 1) * lp_weight
+
+        cp = n_frames
+        if not no_boundary:
+            boundary_list = np.where(tensor2np(aw[0].sum(1).sum(0)) != 0)[0]
+            cp += int(boundary_list[0])
+            if len(beam['boundary']) > 0:
+                assert cp >= beam['boundary'][-1], (cp, beam['boundary'])
+
+        # Add CTC score
+        new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
+            beam['hyp'], topk_ids, beam['ctc_state'],
+            total_scores_topk, ctc_prefix_scorer, new_chunk=new_chunk)
+
+        for k in range(beam_width):
+            idx = topk_ids[0, k].item()
+            if no_boundary and idx != self.eos:
+                continue
+            length_norm_factor = len(beam['hyp'][1:]) + 1 if length_norm else 1
+            total_score = total_scores_topk[0, k].item() / length_norm_factor
+
+            if idx == self.eos:
+                # EOS threshold
+                max_score_no_eos = scores_att[0, :idx].max(0)[0].item()
+                max_score_no_eos = max(max_score_no_eos, scores_att[0, idx + 1:].max(0)[0].item())
+                if scores_att[0, idx].item() <= eos_threshold * max_score_no_eos:
+                    continue
+
+            new_hyps.append(
+                {'hyp': beam['hyp'] + [idx],
+                 'score': total_score,
+                 'score_att': total_scores_att[0, idx].item(),
+                 'score_ctc': total_scores_ctc[k].item(),
+                 'score_lm': total_scores_lm[k].item(),
+                 'dstates': {'dstate': dstate},
+                 'cv': cv,
+                 'aws': beam['aws'] + [aw],
+                 'lmstate': lmstate,
+                 'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None,
+                 'boundary': beam['boundary'] + [cp] if not no_boundary else beam['boundary'],
+                 'no_boundary': no_boundary})
+        return new_hyps
@@ -0,0 +1,239 @@
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Lexicon prefix tree for lexicon-constrained decoding with word-level LM lookahead."""
+
+import codecs
+import logging
+import torch
+
+from neural_sp.models.lm.ngram import NgramLM
+from neural_sp.models.lm.rnnlm import RNNLM
+
+logger = logging.getLogger(__name__)
+
+NEG_INF = float('-inf')
+
+
+def load_dict(dict_path):
+    token2idx = {'<blank>': 0}
+    with codecs.open(dict_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            w, idx = line.strip().split(' ')
+            token2idx[w] = int(idx)
+    return token2idx
+
+
+class LexiconPrefixTree(object):
+    """Prefix tree over a lexicon to constrain subword-level hypotheses to valid words.
+
+    Each node corresponds to a prefix of words in units of the ASR model.
+    Words are separated either by the <space> unit (character-level models) or
+    implicitly by the next word-initial unit (e.g., wordpieces starting with "▁").
+    When a word-level LM is given, look-ahead LM scores are distributed to units:
+    moving from node n to its child m is scored by log(P(m) / P(n)), where P(n) is the sum of
+    LM probabilities of words under n, so that the scores of units in a word sum up to
+    the LM score of the word. The word-level LM is run only at word boundaries.
+
+    Args:
+        lexicon (List[tuple]): pairs of a word index of the word-level LM and unit indices of the ASR model
+        vocab (int): vocabulary size of the ASR model
+        eos (int): index of <eos> in the ASR model
+        space (int): index of <space>. If None, word boundaries are implicit.
+        lm (RNNLM or NgramLM): word-level LM
+        lm_eos (int): index of <eos> in the word-level LM
+
+    """
+
+    def __init__(self, lexicon, vocab, eos, space=None, lm=None, lm_eos=2):
+
+        super(LexiconPrefixTree, self).__init__()
+
+        if lm is not None and not isinstance(lm, (RNNLM, NgramLM)):
+            raise NotImplementedError('Only RNNLM and NgramLM are supported as a word-level LM.')
+        self.vocab = vocab
+        self.eos = eos
+        self.space = space
+        self.lm = lm
+        self.lm_eos = lm_eos
+
+        # Build a prefix tree
+        self.children = [{}]  # unit index -> node
+        self.word = [-1]  # index of the word ending at each node
+        for w, units in lexicon:
+            node = 0
+            for u in units:
+                if u not in self.children[node]:
+                    self.children[node][u] = len(self.word)
+                    self.children.append({})
+                    self.word.append(-1)
+                node = self.children[node][u]
+            if self.word[node] < 0:
+                self.word[node] = w
+            # NOTE: the first word is kept for homographs
+
+        # Words under each node occupy a contiguous range in depth-first order
+        n_nodes = len(self.word)
+        self.start, self.end = [0] * n_nodes, [0] * n_nodes
+        pos2word = []
+        stack = [(0, False)]
+        while len(stack) > 0:
+            node, is_exit = stack.pop()
+            if is_exit:
+                self.end[node] = len(pos2word)
+                continue
+            self.start[node] = len(pos2word)
+            if self.word[node] >= 0:
+                pos2word.append(self.word[node])
+            stack.append((node, True))
+            for u in sorted(self.children[node].keys(), reverse=True):
+                stack.append((self.children[node][u], False))
+        self.pos2word = torch.LongTensor(pos2word)
+        self.units = [torch.LongTensor(list(c.keys())) for c in self.children]
+        self.child_start = [torch.LongTensor([self.start[m] for m in c.values()]) for c in self.children]
+        self.child_end = [torch.LongTensor([self.end[m] for m in c.values()]) for c in self.children]
+        logger.info('lexicon: %d words, %d nodes' % (len(pos2word), n_nodes))
+
+    @classmethod
+    def from_dicts(cls, asr_dict_path, word_dict_path=None, lexicon_path=None, lm=None):
+        """Build a prefix tree from dictionaries.
+
+        Args:
+            asr_dict_path (str): path to the dictionary of the ASR model
+            word_dict_path (str): path to the dictionary of the word-level LM.
+                Words are spelled by characters if `lexicon_path` is not given.
+            lexicon_path (str): path to a lexicon file, each line of which contains a word and its units
+            lm (RNNLM or NgramLM): word-level LM
+        Returns:
+            lexicon (LexiconPrefixTree):
+
+        """
+        token2idx = load_dict(asr_dict_path)
+        word2idx = load_dict(word_dict_path) if word_dict_path is not None else {}
+        lexicon = []
+        if lexicon_path is not None:
+            with codecs.open(lexicon_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    w, units = line.strip().split(' ', 1)
+                    units = units.split(' ')
+                    if all([u in token2idx for u in units]):
+                        lexicon.append((word2idx.get(w, word2idx.get('<unk>', 1)), units))
+        elif word_dict_path is not None:
+            for w, idx in word2idx.items():
+                if w[0] == '<' and w[-1] == '>':
+                    continue  # special tokens
+                if all([c in token2idx for c in w]):
+                    lexicon.append((idx, list(w)))
+        else:
+            raise ValueError('Either word_dict_path or lexicon_path must be given.')
+        lexicon = [(w, [token2idx[u] for u in units]) for w, units in lexicon]
+        return cls(lexicon, max(token2idx.values()) + 1, token2idx['<eos>'],
+                   space=token2idx.get('<space>'), lm=lm, lm_eos=word2idx.get('<eos>', 2))
+
+    def _lm_states(self, ws, states):
+        """Advance the word-level LM by words.
+
+        Args:
+            ws (List[int]): word indices
+            states (List[dict]): states before the words (None for the beginning)
+        Returns:
+            new_states (List[dict]): each of which contains
+                lmstate (dict): word-level LM state
+                log_probs (FloatTensor): `[word_vocab]`, log probabilities of the next word
+                cum_probs (DoubleTensor): `[n_words + 1]`, cumulative probabilities in depth-first order
+
+        """
+        lmstate = None
+        if states[0] is not None:
+            lmstate = {k: torch.cat([s['lmstate'][k] for s in states], dim=1)
+                       if states[0]['lmstate'][k] is not None else None for k in ['hxs', 'cxs']}
+        device = lmstate['hxs'].device if lmstate is not None else self.lm.device
+        ys = torch.tensor(ws, dtype=torch.int64, device=device).unsqueeze(1)
+        _, lmstate, log_probs = self.lm.predict(ys, lmstate)
+        log_probs = log_probs[:, -1].cpu()
+        probs = torch.exp(log_probs.double())[:, self.pos2word]
+        cum_probs = torch.cat([probs.new_zeros(len(ws), 1), torch.cumsum(probs, dim=1)], dim=1)
+        return [{'lmstate': {k: lmstate[k][:, j:j + 1] if lmstate[k] is not None else None for k in ['hxs', 'cxs']},
+                 'log_probs': log_probs[j],
+                 'cum_probs': cum_probs[j]} for j in range(len(ws))]
+
+    def initial_state(self):
+        """State of the beginning of a sentence."""
+        state = {'node': 0}
+        if self.lm is not None:
+            state.update(self._lm_states([self.lm_eos], [None])[0])
+        return state
+
+    def _lookahead(self, state, start, end):
+        if self.lm is None:
+            return torch.zeros(start.size(), dtype=torch.float64) if torch.is_tensor(start) else 0.
+        return torch.log((state['cum_probs'][end] - state['cum_probs'][start]).clamp(min=1e-300))
+
+    def score(self, states):
+        """Compute look-ahead LM scores of all units given the current states.
+
+        Args:
+            states (List[dict]): length `[N]`
+        Returns:
+            scores (FloatTensor): `[N, vocab]`, -inf for units not allowed by the lexicon
+            next_states (List[dict]): length `[N]`, states after words ending at the current nodes
+
+        """
+        n = len(states)
+        scores = torch.full((n, self.vocab), NEG_INF, dtype=torch.float64)
+        next_states = [None] * n
+
+        # Run the word-level LM only at word boundaries
+        ends = [j for j, s in enumerate(states) if self.word[s['node']] >= 0]
+        if len(ends) > 0:
+            if self.lm is not None:
+                for j, s in zip(ends, self._lm_states([self.word[states[j]['node']] for j in ends],
+                                                      [states[j] for j in ends])):
+                    next_states[j] = s
+            else:
+                for j in ends:
+                    next_states[j] = {}
+
+        for j, state in enumerate(states):
+            node = state['node']
+            la = self._lookahead(state, self.start[node], self.end[node]) if node > 0 else 0.
+            if next_states[j] is not None:
+                # word boundary
+                base = 0.
+                if self.lm is not None:
+                    base = state['log_probs'][self.word[node]].item() - la
+                if self.space is not None:
+                    scores[j, self.space] = base
+                else:
+                    scores[j, self.units[0]] = base + self._lookahead(
+                        next_states[j], self.child_start[0], self.child_end[0])
+                scores[j, self.eos] = base
+                if self.lm is not None:
+                    scores[j, self.eos] += next_states[j]['log_probs'][self.lm_eos].item()
+            elif node == 0:
+                scores[j, self.eos] = state['log_probs'][self.lm_eos].item() if self.lm is not None else 0.
+            # NOTE: continuing the current word has priority over word boundaries
+            if len(self.units[node]) > 0:
+                scores[j, self.units[node]] = self._lookahead(
+                    state, self.child_start[node], self.child_end[node]) - la
+        return scores.float(), next_states
+
+    def next_state(self, state, idx, next_state):
+        """Transit to the state after a unit.
+
+        Args:
+            state (dict): current state
+            idx (int): unit index
+            next_state (dict): state after the word ending at the current node
+        Returns:
+            new_state (dict):
+
+        """
+        node = state['node']
+        if idx in self.children[node]:
+            return dict(state, node=self.children[node][idx])
+        if idx == self.eos:
+            return state
+        if idx == self.space:
+            return dict(next_state, node=0)
+        return dict(next_state, node=self.children[0][idx])
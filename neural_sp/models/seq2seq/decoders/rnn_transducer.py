@@ -9,26 +9,79 @@ import numpy as np
 import random
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
+from neural_sp.models.lm.ngram import NgramLM
 from neural_sp.models.lm.rnnlm import RNNLM
 from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
+from neural_sp.models.seq2seq.decoders.beam_search import HypothesisStore
+from neural_sp.models.seq2seq.decoders.beam_search import hash_prefix
 from neural_sp.models.seq2seq.decoders.ctc import CTC
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import (
+    checkpoint_forward,
+    logaddexp,
     np2tensor,
     pad_list,
     repeat,
-    tensor2scalar
+    tensor2scalar,
+    torch_19_plus
 )
 
 random.seed(1)
 
 LOG_0 = float(np.finfo(np.float32).min)
 LOG_1 = 0
+LOG_0_LATTICE = -1e10
+
+# NOTE: states in a set of hypotheses whose second dimension corresponds to hypotheses
+HYP_STATE_KEYS = ['hxs', 'cxs', 'lm_hxs', 'lm_cxs', 'lm_hxs_next', 'lm_cxs_next']
 
 logger = logging.getLogger(__name__)
 
 
+def _transducer_nll(log_probs_blank, log_probs_label, elens, ylens):
+    """Compute negative log-likelihoods of Transducer with the forward algorithm.
+    Forward variables are computed along anti-diagonals (t + u = n) of the lattice at once.
+
+    Args:
+        log_probs_blank (FloatTensor): `[B, T, L+1]`, log probabilities of blank at (t, u)
+        log_probs_label (FloatTensor): `[B, T, L]`, log probabilities of the (u+1)-th label at (t, u)
+        elens (LongTensor): `[B]`
+        ylens (LongTensor): `[B]`
+    Returns:
+        nlls (FloatTensor): `[B]`
+
+    """
+    bs, xmax, umax = log_probs_blank.size()
+    device = log_probs_blank.device
+    u_index = torch.arange(umax, dtype=torch.int64, device=device)
+    lp_label = torch.cat([log_probs_label.new_zeros(bs, xmax, 1).fill_(LOG_0_LATTICE),
+                          log_probs_label], dim=2)  # `[B, T, L+1]`, shifted by one label
+
+    alpha = log_probs_blank.new_zeros(bs, umax).fill_(LOG_0_LATTICE)
+    alpha[:, 0] = LOG_1
+    alphas = [alpha]
+    for n in range(1, xmax + umax - 1):
+        t_index = n - u_index
+        # from (t-1, u) with blank
+        is_valid_blank = (t_index >= 1) & (t_index < xmax)
+        from_blank = alpha + log_probs_blank[:, (t_index - 1).clamp(0, xmax - 1), u_index]
+        # from (t, u-1) with the u-th label
+        is_valid_label = (u_index >= 1) & (t_index >= 0) & (t_index < xmax)
+        alpha_shift = torch.cat([alpha.new_zeros(bs, 1).fill_(LOG_0_LATTICE), alpha[:, :-1]], dim=1)
+        from_label = alpha_shift + lp_label[:, t_index.clamp(0, xmax - 1), u_index]
+        alpha = logaddexp(from_blank.masked_fill(~is_valid_blank, LOG_0_LATTICE),
+                          from_label.masked_fill(~is_valid_label, LOG_0_LATTICE))
+        alphas.append(alpha)
+    alphas = torch.stack(alphas, dim=0)  # `[T+L, B, L+1]`
+
+    batch_index = torch.arange(bs, dtype=torch.int64, device=device)
+    log_likelihoods = alphas[elens - 1 + ylens, batch_index, ylens] + \
+        log_probs_blank[batch_index, elens - 1, ylens]
+    return -log_likelihoods
+
+
 class RNNTransducer(DecoderBase):
     """RNN transducer.
 
@@ -55,6 +108,9 @@ class RNNTransducer(DecoderBase):
         global_weight (float): global loss weight for multi-task learning
         mtl_per_batch (bool): change mini-batch per task for multi-task training
         param_init (float): parameter initialization method
+        joint_chunk_size (int): number of frames per chunk in memory-efficient Transducer loss computation
+        joint_topk (int): number of vocabulary entries per lattice cell to compute gradients
+            of the softmax normalizer in memory-efficient Transducer loss computation
 
     """
 
@@ -63,7 +119,8 @@ class RNNTransducer(DecoderBase):
                  bottleneck_dim, emb_dim, vocab,
                  dropout, dropout_emb,
                  ctc_weight, ctc_lsm_prob, ctc_fc_list,
-                 external_lm, global_weight, mtl_per_batch, param_init):
+                 external_lm, global_weight, mtl_per_batch, param_init,
+                 joint_chunk_size=0, joint_topk=0):
 
         super(RNNTransducer, self).__init__()
 
@@ -81,11 +138,15 @@ class RNNTransducer(DecoderBase):
         self.rnnt_weight = global_weight - ctc_weight
         self.ctc_weight = ctc_weight
         self.mtl_per_batch = mtl_per_batch
+        self.joint_chunk_size = joint_chunk_size
+        self.joint_topk = joint_topk
 
         # for cache
         self.prev_spk = ''
         self.lmstate_final = None
         self.state_cache = OrderedDict()
+        self.hyp_store = None  # for streaming inference
+        self.n_frames = 0  # for streaming inference
 
         if ctc_weight > 0:
             self.ctc = CTC(eos=self.eos,
@@ -149,6 +210,13 @@ class RNNTransducer(DecoderBase):
                                help='number of dimensions of the bottleneck layer before the softmax layer')
             group.add_argument('--emb_dim', type=int, default=512,
                                help='number of dimensions in the embedding layer')
+        # memory-efficient Transducer loss
+        group.add_argument('--rnnt_joint_chunk_size', type=int, default=0,
+                           help='number of frames per chunk to compute the joint network and Transducer loss \
+                                 without materializing the full [B, T, L, vocab] lattice (0 means disabled)')
+        group.add_argument('--rnnt_joint_topk', type=int, default=0,
+                           help='number of vocabulary entries per lattice cell used for gradients \
+                                 of the softmax normalizer in the joint network (0 means all entries)')
         return parser
 
     @staticmethod
@@ -240,6 +308,9 @@ class RNNTransducer(DecoderBase):
         ys_emb = self.dropout_emb(self.embed(ys_in))
         dout, _ = self.recurrency(ys_emb, None)
 
+        if self.joint_chunk_size > 0 or self.joint_topk > 0:
+            return self.forward_transducer_chunkwise(eouts, elens, dout, ys_out, ylens)
+
         # Compute output distribution
         logits = self.joint(eouts, dout)  # `[B, T, L+1, vocab]`
 
@@ -264,6 +335,135 @@ class RNNTransducer(DecoderBase):
 
         return loss
 
+    def forward_transducer_chunkwise(self, eouts, elens, douts, ys_out, ylens):
+        """Compute Transducer loss without materializing the full `[B, T, L+1, vocab]` lattice.
+
+        Utterances are sorted by length, and the joint network is computed per chunk of frames
+        only for utterances and labels that are not padded in the chunk.
+        Only log probabilities of blank and reference labels are kept, and the other activations
+        are recomputed during the backward pass.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            elens (IntTensor): `[B]`
+            douts (FloatTensor): `[B, L+1, dec_n_units]`
+            ys_out (LongTensor): `[B, L]`
+            ylens (IntTensor): `[B]`
+        Returns:
+            loss (FloatTensor): `[1]`
+
+        """
+        bs = eouts.size(0)
+        elens = elens.to(eouts.device).long()
+        ylens = ylens.to(eouts.device).long()
+        ys_out = ys_out.to(eouts.device)
+
+        # sort utterances by the number of frames
+        perm = torch.argsort(elens, descending=True)
+        elens, ylens, ys_out = elens[perm], ylens[perm], ys_out[perm]
+        xmax = elens[0].item()
+        enc_proj = self.w_enc(eouts[perm, :xmax])  # `[B, T, bottleneck_dim]`
+        dec_proj = self.w_dec(douts[perm])  # `[B, L+1, bottleneck_dim]`
+
+        chunk_size = self.joint_chunk_size if self.joint_chunk_size > 0 else xmax
+        lattice = enc_proj.new_zeros(bs, xmax, ys_out.size(1) + 1, 2).fill_(LOG_0_LATTICE)
+        for t in range(0, xmax, chunk_size):
+            n_active = (elens > t).sum().item()  # utterances longer than t
+            umax = ylens[:n_active].max().item() + 1
+            enc_chunk = enc_proj[:n_active, t:min(t + chunk_size, xmax)]
+            dec_chunk = dec_proj[:n_active, :umax]
+            ys_chunk = ys_out[:n_active, :umax - 1]
+            if self.joint_topk > 0:
+                lse, vocab_ids = self._joint_topk_first_pass(enc_chunk, dec_chunk, ys_chunk)
+                inputs = (enc_chunk, dec_chunk, ys_chunk, lse, vocab_ids)
+            else:
+                inputs = (enc_chunk, dec_chunk, ys_chunk)
+            if self.training and torch.is_grad_enabled():
+                lattice_chunk = checkpoint_forward(self._joint_lattice, *inputs)
+            else:
+                lattice_chunk = self._joint_lattice(*inputs)
+            lattice[:n_active, t:t + enc_chunk.size(1), :umax] = lattice_chunk
+
+        nlls = _transducer_nll(lattice[:, :, :, 0], lattice[:, :, :-1, 1], elens, ylens)
+        loss = nlls.sum() / bs
+        # NOTE: normalized by bs as in warp_rnnt
+        return loss
+
+    def _joint_topk_first_pass(self, enc_proj, dec_proj, ys, vocab_block_size=1024):
+        """Compute softmax normalizers over all vocabulary entries and select entries
+        whose gradients are computed in the second pass.
+           Logits are computed per block of vocabulary entries, and normalizers and top-k entries
+           are accumulated over blocks so that the `[B, T, L+1, vocab]` logits are not materialized.
+
+        Args:
+            enc_proj (FloatTensor): `[B, T, bottleneck_dim]`
+            dec_proj (FloatTensor): `[B, L+1, bottleneck_dim]`
+            ys (LongTensor): `[B, L]`
+            vocab_block_size (int): number of vocabulary entries computed at once
+        Returns:
+            lse (FloatTensor): `[B, T, L+1]`
+            vocab_ids (LongTensor): `[K]`, union of top-k entries of all cells, blank, and references
+
+        """
+        k = min(self.joint_topk, self.vocab)
+        weight, bias = self.output.weight, self.output.bias
+        with torch.no_grad():
+            out = torch.tanh(enc_proj.unsqueeze(2) + dec_proj.unsqueeze(1))  # `[B, T, L+1, bottleneck_dim]`
+            lse, topk_scores, topk_ids = None, None, None
+            for v in range(0, self.vocab, vocab_block_size):
+                v_end = min(v + vocab_block_size, self.vocab)
+                logits = F.linear(out, weight[v:v_end], None if bias is None else bias[v:v_end])
+                scores, ids = logits.topk(min(k, v_end - v), dim=-1)
+                ids += v
+                if lse is None:
+                    lse = torch.logsumexp(logits, dim=-1)
+                    topk_scores, topk_ids = scores, ids
+                else:
+                    lse = logaddexp(lse, torch.logsumexp(logits, dim=-1))
+                    # merge top-k entries of the previous blocks and the current block
+                    topk_scores, index = torch.cat([topk_scores, scores], dim=-1).topk(k, dim=-1)
+                    topk_ids = torch.cat([topk_ids, ids], dim=-1).gather(-1, index)
+            vocab_ids = torch.cat([topk_ids.reshape(-1), ys.reshape(-1),
+                                   ys.new_zeros((1,)).fill_(self.blank)])
+            vocab_ids = torch.unique(vocab_ids)
+        return lse, vocab_ids
+
+    def _joint_lattice(self, enc_proj, dec_proj, ys, lse=None, vocab_ids=None):
+        """Compute log probabilities of blank and reference labels in the Transducer lattice.
+
+        Args:
+            enc_proj (FloatTensor): `[B, T, bottleneck_dim]`
+            dec_proj (FloatTensor): `[B, L+1, bottleneck_dim]`
+            ys (LongTensor): `[B, L]`
+            lse (FloatTensor): `[B, T, L+1]`, softmax normalizers over all vocabulary entries
+            vocab_ids (LongTensor): `[K]`, vocabulary entries to compute
+        Returns:
+            lattice (FloatTensor): `[B, T, L+1, 2]` (blank, label)
+
+        """
+        bs, xmax = enc_proj.size()[:2]
+        out = torch.tanh(enc_proj.unsqueeze(2) + dec_proj.unsqueeze(1))  # `[B, T, L+1, bottleneck_dim]`
+        if vocab_ids is None:
+            log_probs = torch.log_softmax(self.output(out), dim=-1)
+            blank_ids = ys.new_zeros((1,)).fill_(self.blank)
+            labels = ys
+        else:
+            bias = self.output.bias
+            logits = F.linear(out, self.output.weight[vocab_ids], None if bias is None else bias[vocab_ids])
+            # NOTE: the normalizer over all entries is used for the value,
+            # and gradients are approximated by the selected entries
+            lse_sub = torch.logsumexp(logits, dim=-1)
+            log_probs = logits - (lse + lse_sub - lse_sub.detach()).unsqueeze(-1)
+            ids_map = ys.new_zeros(self.vocab)
+            ids_map[vocab_ids] = torch.arange(vocab_ids.size(0), device=ys.device)
+            blank_ids = ids_map[self.blank:self.blank + 1]
+            labels = ids_map[ys]
+        lp_blank = log_probs[..., blank_ids].squeeze(-1)  # `[B, T, L+1]`
+        index = labels.unsqueeze(1).unsqueeze(3).expand(bs, xmax, labels.size(1), 1)
+        lp_label = log_probs[:, :, :-1].gather(3, index).squeeze(3)  # `[B, T, L]`
+        lp_label = torch.cat([lp_label, lp_label.new_zeros(bs, xmax, 1).fill_(LOG_0_LATTICE)], dim=2)
+        return torch.stack([lp_blank, lp_label], dim=-1)
+
     def joint(self, eouts, douts):
         """Combine encoder outputs and prediction network outputs.
 
@@ -339,9 +539,12 @@ class RNNTransducer(DecoderBase):
 
     def greedy(self, eouts, elens, max_len_ratio, idx2token,
                exclude_eos=False, refs_id=None, utt_ids=None, speakers=None,
-               trigger_points=None, teacher_force=False):
+               trigger_points=None, teacher_force=False, max_symbols_per_frame=1):
         """Greedy decoding.
 
+        All utterances are decoded in lockstep with per-utterance time pointers.
+        The prediction network is updated only for utterances emitting non-blank labels.
+
         Args:
             eouts (FloatTensor): `[B, T, enc_units]`
             elens (IntTensor): `[B]`
@@ -353,34 +556,67 @@ class RNNTransducer(DecoderBase):
             speakers (List): speaker list
             trigger_points: dummy
             teacher_force: dummy
+            max_symbols_per_frame (int): maximum number of labels emitted per frame
         Returns:
             hyps (List): length `[B]`, each of which contains arrays of size `[L]`
             aw: dummy
 
         """
+        assert max_symbols_per_frame >= 1
         bs = eouts.size(0)
-
-        hyps = []
-        for b in range(bs):
-            hyp_b = []
-            # Initialization
-            y = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(self.eos)
-            y_emb = self.dropout_emb(self.embed(y))
-            dout, dstate = self.recurrency(y_emb, None)
-
-            for t in range(elens[b]):
-                # Pick up 1-best per frame
-                out = self.joint(eouts[b:b + 1, t:t + 1], dout)
-                y = out.squeeze(2).argmax(-1)
-                idx = y[0].item()
-
-                # Update prediction network only when predicting non-blank labels
-                if idx != self.blank:
-                    hyp_b += [idx]
-                    y_emb = self.dropout_emb(self.embed(y))
-                    dout, dstate = self.recurrency(y_emb, dstate)
-
-            hyps += [hyp_b]
+        elens = elens.to(eouts.device).long()
+
+        # Initialization
+        y = eouts.new_zeros((bs, 1), dtype=torch.int64).fill_(self.eos)
+        y_emb = self.dropout_emb(self.embed(y))
+        dout, dstate = self.recurrency(y_emb, None)
+
+        t = eouts.new_zeros(bs, dtype=torch.int64)
+        n_symbols = eouts.new_zeros(bs, dtype=torch.int64)
+        emitted_ids, emitted_ys = [], []
+        while True:
+            active_ids = (t < elens).nonzero(as_tuple=False)[:, 0]
+            if active_ids.size(0) == 0:
+                break
+
+            # Pick up 1-best per frame
+            out = self.joint(eouts[active_ids, t[active_ids]].unsqueeze(1), dout[active_ids])
+            y = out.view(active_ids.size(0), -1).argmax(-1)
+            is_label = y != self.blank
+
+            # Move to the next frame after blank or emitting max_symbols_per_frame labels
+            n_symbols[active_ids] += is_label.long()
+            advance_ids = active_ids[~is_label | (n_symbols[active_ids] >= max_symbols_per_frame)]
+            t[advance_ids] += 1
+            n_symbols[advance_ids] = 0
+
+            # Update prediction network only when predicting non-blank labels
+            label_ids = active_ids[is_label]
+            if label_ids.size(0) == 0:
+                continue
+            y = y[is_label]
+            emitted_ids.append(label_ids)
+            emitted_ys.append(y)
+            y_emb = self.dropout_emb(self.embed(y.unsqueeze(1)))
+            dstate_l = {'hxs': dstate['hxs'][:, label_ids], 'cxs': None}
+            if dstate['cxs'] is not None:
+                dstate_l['cxs'] = dstate['cxs'][:, label_ids]
+            dout_l, dstate_l = self.recurrency(y_emb, dstate_l)
+            dout[label_ids] = dout_l
+            dstate['hxs'][:, label_ids] = dstate_l['hxs']
+            if dstate['cxs'] is not None:
+                dstate['cxs'][:, label_ids] = dstate_l['cxs']
+
+        # NOTE: labels are emitted in chronological order, so sorting by (utterance, emission order)
+        # recovers each sequence (without relying on a stable sort)
+        hyps = [[] for _ in range(bs)]
+        if len(emitted_ids) > 0:
+            emitted_ids = torch.cat(emitted_ids)
+            emitted_ys = torch.cat(emitted_ys)
+            n_emitted = emitted_ids.size(0)
+            order = torch.sort(emitted_ids * n_emitted + torch.arange(n_emitted, device=emitted_ids.device))[1]
+            ylens = torch.bincount(emitted_ids, minlength=bs).tolist()
+            hyps = [hyp.tolist() for hyp in torch.split(emitted_ys[order], ylens)]
 
         if idx2token is not None:
             for b in range(bs):
@@ -393,6 +629,288 @@ class RNNTransducer(DecoderBase):
 
         return hyps, None
 
+    def initialize_beam(self, dout, dstate, lmstate):
+        # NOTE: tokens are written to HypothesisStore, where <sos> is the root node 0
+        hyps = [{'node': 0,
+                 'y': self.eos,
+                 'ylen': 0,
+                 'key': hash_prefix(0, self.eos),
+                 'score': 0.,
+                 'score_rnnt': 0.,
+                 'score_lm': 0.,
+                 'dout': dout,
+                 'dstate': dstate,
+                 'lmstate': lmstate}]
+        return hyps
+
+    def _beam_search_step(self, eout_t, hyps, end_hyps, store, helper, lm, lm_weight,
+                          beam_width, softmax_smoothing, merge_prob):
+        """Expand hypotheses with a single encoder frame.
+
+        Args:
+            eout_t (FloatTensor): `[1, 1, enc_n_units]`
+            hyps (List): active hypotheses
+            end_hyps (List): hypotheses ending with <eos>
+            store (HypothesisStore): store of tokens and back-pointers
+            helper (BeamSearch): beam search helper
+            lm (torch.nn.module): firsh path LM
+            lm_weight (float): weight of the first path LM
+            beam_width (int): size of the beam
+            softmax_smoothing (float): temperature for the joint network
+            merge_prob (bool): sum up probabilities of paths with the same prefix
+        Returns:
+            hyps (List): active hypotheses
+            end_hyps (List): hypotheses ending with <eos>
+            is_finish (bool): enough hypotheses ending with <eos> are found
+
+        """
+        # batchfy all hypotheses for batch decoding
+        douts = torch.cat([beam['dout'] for beam in hyps], dim=0)
+        logits = self.joint(eout_t.repeat([douts.size(0), 1, 1]), douts)
+        logits = logits * softmax_smoothing
+        scores_rnnt = torch.log_softmax(logits.squeeze(2).squeeze(1), dim=-1)  # `[B, vocab]`
+
+        new_hyps = []
+        for j, beam in enumerate(hyps):
+            # Transducer scores
+            total_scores_rnnt = beam['score_rnnt'] + scores_rnnt[j:j + 1]
+            total_scores_topk, topk_ids = torch.topk(
+                total_scores_rnnt, k=beam_width, dim=-1, largest=True, sorted=True)
+
+            for k in range(beam_width):
+                idx = topk_ids[0, k].item()
+                total_score = total_scores_topk[0, k].item()
+                total_score_lm = beam['score_lm']
+
+                if idx == self.blank:
+                    new_hyps.append(beam.copy())
+                    new_hyps[-1]['score'] += scores_rnnt[j, self.blank].item()
+                    new_hyps[-1]['score_rnnt'] += scores_rnnt[j, self.blank].item()
+                    continue
+
+                # Update prediction network only when predicting non-blank labels
+                key = hash_prefix(beam['key'], idx)
+                if key in self.state_cache.keys():
+                    # from cache
+                    dout = self.state_cache[key]['dout']
+                    dstate = self.state_cache[key]['dstate']
+                    lmstate = self.state_cache[key]['lmstate']
+                    total_score_lm = self.state_cache[key]['total_score_lm']
+                else:
+                    y = eout_t.new_zeros((1, 1), dtype=torch.int64).fill_(idx)
+                    y_emb = self.dropout_emb(self.embed(y))
+                    dout, dstate = self.recurrency(y_emb, beam['dstate'])
+
+                    # Update LM states for shallow fusion
+                    y_prev = eout_t.new_zeros((1, 1), dtype=torch.int64).fill_(beam['y'])
+                    _, lmstate, scores_lm = helper.update_rnnlm_state(lm, beam, y_prev)
+                    if lm is not None:
+                        total_score_lm += scores_lm[0, -1, idx].item()
+
+                    self.state_cache[key] = {
+                        'dout': dout,
+                        'dstate': dstate,
+                        'lmstate': {'hxs': lmstate['hxs'],
+                                    'cxs': lmstate['cxs']} if lmstate is not None else None,
+                        'total_score_lm': total_score_lm,
+                    }
+
+                if lm is not None:
+                    total_score += total_score_lm * lm_weight
+
+                new_hyps.append({'node': None,
+                                 'parent': beam['node'],
+                                 'y': idx,
+                                 'ylen': beam['ylen'] + 1,
+                                 'key': key,
+                                 'score': total_score,
+                                 'score_rnnt': total_scores_rnnt[0, idx].item(),
+                                 'score_lm': total_score_lm,
+                                 'dout': dout,
+                                 'dstate': dstate,
+                                 'lmstate': {'hxs': lmstate['hxs'],
+                                             'cxs': lmstate['cxs']} if lmstate is not None else None})
+
+        # Local pruning
+        new_hyps_sorted = sorted(new_hyps, key=lambda x: x['score'], reverse=True)
+        new_hyps_sorted = helper.merge_rnnt_path(new_hyps_sorted, merge_prob)[:beam_width]
+        store.append_hyps(new_hyps_sorted)
+
+        # Remove complete hypotheses
+        return helper.remove_complete_hyp(new_hyps_sorted, end_hyps)
+
+    def beam_search_block_sync(self, eouts, params, idx2token, hyps, lm=None, end_hyps=None, merge_prob=True):
+        """Chunk-synchronous beam search decoding for streaming inference.
+        The beam and prediction network states are carried over to the next block.
+
+        Args:
+            eouts (FloatTensor): `[1, T_block, enc_n_units]`
+            params (dict): hyperparameters for decoding
+            idx2token (): converter from index to token
+            hyps (List): active hypotheses in the previous block (None for the first block)
+            lm (torch.nn.module): firsh path LM
+            end_hyps (List): hypotheses ending with <eos> in the previous blocks
+            merge_prob (bool): sum up probabilities of paths with the same prefix
+        Returns:
+            end_hyps (List): hypotheses ending with <eos>
+            hyps (List): active hypotheses
+            aws: dummy
+
+        """
+        assert eouts.size(0) == 1
+        assert params['recog_ctc_weight'] == 0
+
+        beam_width = params['recog_beam_width']
+        lm_weight = params['recog_lm_weight']
+        softmax_smoothing = params['recog_softmax_smoothing']
+
+        helper = BeamSearch(beam_width, self.eos, 0., eouts.device)
+        lm = helper.verify_lm_eval_mode(lm, lm_weight)
+
+        if hyps is None:
+            # Initialization per segment
+            y = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(self.eos)
+            dout, dstate = self.recurrency(self.dropout_emb(self.embed(y)), None)
+            self.state_cache = OrderedDict()
+            self.hyp_store = HypothesisStore(beam_width, self.eos, eouts.device)
+            self.n_frames = 0
+            end_hyps = []
+            hyps = self.initialize_beam(dout, dstate, None)
+
+        for t in range(eouts.size(1)):
+            # NOTE: decoding is finished once enough hypotheses end with <eos>
+            if len(hyps) == 0:
+                break
+            hyps, end_hyps, is_finish = self._beam_search_step(
+                eouts[:, t:t + 1], hyps, end_hyps, self.hyp_store, helper, lm, lm_weight,
+                beam_width, softmax_smoothing, merge_prob)
+            if is_finish:
+                hyps = []
+        self.n_frames += eouts.size(1)
+
+        # Recover token sequences of the current hypotheses
+        for hyp in end_hyps + hyps:
+            hyp['hyp'] = self.hyp_store.backtrack(hyp['node'])
+
+        return end_hyps, hyps, None
+
+    def beam_search_block_sync_batch(self, eouts, elens, params, streams, lm=None, merge_prob=True):
+        """Block-synchronous beam search decoding over multiple streams at once for streaming inference.
+        Each stream carries its own beam over blocks as in beam_search_block_sync(),
+        and hypotheses of all streams are expanded in a batch as in beam_search_batch().
+        Streams can join or leave the batch between blocks.
+
+        Args:
+            eouts (FloatTensor): `[B, T_block, enc_n_units]`, encoder outputs of the current block of each stream
+            elens (IntTensor): `[B]`, number of frames in the current block of each stream
+            params (dict): hyperparameters for decoding
+            streams (List[dict]): length `[B]`, states of streams returned in the previous block
+                (None for the first block of a stream)
+            lm (torch.nn.module): firsh path LM (RNNLM or NgramLM)
+            merge_prob (bool): sum up probabilities of paths with the same prefix
+        Returns:
+            streams (List[dict]): length `[B]`, each of which contains
+                end_hyps (List): hypotheses ending with <eos>
+                hyps (List): active hypotheses
+                n_frames (int): number of frames decoded so far
+
+        """
+        bs = eouts.size(0)
+        device = eouts.device
+        assert len(streams) == bs
+        assert params['recog_ctc_weight'] == 0
+
+        beam_width = params['recog_beam_width']
+        lm_weight = params['recog_lm_weight']
+        softmax_smoothing = params['recog_softmax_smoothing']
+        max_symbols = params['recog_max_symbols_per_frame']
+        assert max_symbols >= 1
+
+        helper = BeamSearch(beam_width, self.eos, 0., device)
+        lm = helper.verify_lm_eval_mode(lm, lm_weight)
+        if lm is not None and not isinstance(lm, (RNNLM, NgramLM)):
+            raise NotImplementedError(type(lm))
+
+        # NOTE: hypotheses of the b-th stream are stored in rows [b * beam_width, (b + 1) * beam_width)
+        n_rows = bs * beam_width
+        NEG_INF = float('-inf')
+        row_index = torch.arange(n_rows, device=device)
+        utt_index = row_index // beam_width
+        elens_rows = elens.to(device).long()[utt_index]
+
+        # Initialization of new streams
+        if any([stream is None for stream in streams]):
+            y = eouts.new_zeros(beam_width, dtype=torch.int64).fill_(self.eos)
+            dout, dstate = self.recurrency(self.dropout_emb(self.embed(y.unsqueeze(1))), None)
+            state = {'y': y,
+                     'keys': hash_prefix(y.new_zeros(beam_width), y),
+                     'score_rnnt': eouts.new_zeros(beam_width).masked_fill(row_index[:beam_width] > 0, NEG_INF),
+                     'score_lm': eouts.new_zeros(beam_width),
+                     'dout': dout,
+                     'hxs': dstate['hxs'],
+                     'cxs': dstate['cxs'],
+                     'lm_hxs': None,
+                     'lm_cxs': None}
+            streams = [{'state': state, 'prefixes': [[self.eos]] * beam_width,
+                        'end_hyps': [], 'finished': False, 'n_frames': 0}
+                       if stream is None else stream for stream in streams]
+
+        # Batchfy hypotheses of all streams
+        states = [stream['state'] for stream in streams]
+        lm_states = [state for state in states if state['lm_hxs'] is not None]
+        if len(lm_states) > 0:
+            # NOTE: LM states before the first step are equivalent to the zero state
+            states = [state if state['lm_hxs'] is not None else
+                      dict(state, **{k: None if lm_states[0][k] is None else torch.zeros_like(lm_states[0][k])
+                                     for k in ['lm_hxs', 'lm_cxs']}) for state in states]
+        hyps = self._cat_hyps(states)
+        # NOTE: tokens in the current block are stored from <sos> of each row,
+        # and prefixes in the previous blocks are prepended by the root row
+        store = HypothesisStore(n_rows, self.eos, device, max_len=eouts.size(1) + 1)
+        hyps['nodes'] = store.roots
+        prefixes = [prefix for stream in streams for prefix in stream['prefixes']]
+        finished = [stream['finished'] for stream in streams]
+        end_hyps = [list(stream['end_hyps']) for stream in streams]
+        cache = [None]
+
+        for t in range(eouts.size(1)):
+            is_active = (t < elens_rows) & ~torch.tensor(finished, device=device)[utt_index]
+            if not is_active.any():
+                break
+            eouts_t = eouts[utt_index, t].unsqueeze(1)  # `[B * beam, 1, enc_n_units]`
+            cache = cache[-1:]  # keep prefixes created at the previous and current frames
+            cache.append(None)
+            hyps = self._beam_search_step_batch(eouts_t, is_active, hyps, end_hyps, finished, cache, store,
+                                                helper, lm, lm_weight, beam_width, softmax_smoothing, max_symbols,
+                                                merge_prob)
+
+        def backtrack(node):
+            return prefixes[store.path(node)[0]] + store.backtrack(node)[1:]
+
+        new_streams = []
+        for b in range(bs):
+            for hyp in end_hyps[b]:
+                if 'node' in hyp:
+                    hyp['hyp'] = backtrack(hyp.pop('node')) + [self.eos]
+            rows = slice(b * beam_width, (b + 1) * beam_width)
+            state = {k: None if v is None else v[:, rows] if k in HYP_STATE_KEYS else v[rows]
+                     for k, v in hyps.items() if k != 'nodes' and not k.endswith('_next')}
+            is_alive = (state['score_rnnt'] > NEG_INF).tolist()
+            prefixes_b = [backtrack(hyps['nodes'][b * beam_width + j].item()) if is_alive[j] else None
+                          for j in range(beam_width)]
+            alive_hyps = [{'hyp': prefixes_b[j],
+                           'score': state['score_rnnt'][j].item() + state['score_lm'][j].item() * lm_weight,
+                           'score_rnnt': state['score_rnnt'][j].item(),
+                           'score_lm': state['score_lm'][j].item()} for j in range(beam_width) if is_alive[j]]
+            new_streams.append({'state': state,
+                                'prefixes': prefixes_b,
+                                'end_hyps': end_hyps[b],
+                                'hyps': [] if finished[b] else alive_hyps,
+                                'finished': finished[b],
+                                'n_frames': streams[b]['n_frames'] + elens[b].item()})
+
+        return new_streams
+
     def beam_search(self, eouts, elens, params, idx2token=None,
                     lm=None, lm_second=None, lm_second_bwd=None, ctc_log_probs=None,
                     nbest=1, exclude_eos=False,
@@ -453,93 +971,17 @@ class RNNTransducer(DecoderBase):
 
             if speakers is not None:
                 if speakers[b] == self.prev_spk:
-                    if lm_state_CO and isinstance(lm, RNNLM):
+                    if lm_state_CO and isinstance(lm, (RNNLM, NgramLM)):
                         lmstate = self.lmstate_final
                 self.prev_spk = speakers[b]
 
             end_hyps = []
-            hyps = [{'hyp': [self.eos],
-                     'hyp_ids_str': '',
-                     'ys': [self.eos],
-                     'score': 0.,
-                     'score_rnnt': 0.,
-                     'score_lm': 0.,
-                     'dout': dout,
-                     'dstate': dstate,
-                     'lmstate': lmstate}]
+            hyps = self.initialize_beam(dout, dstate, lmstate)
+            store = HypothesisStore(beam_width, self.eos, eouts.device, max_len=int(elens[b]) + 1)
             for t in range(elens[b]):
-                # batchfy all hypotheses for batch decoding
-                douts = torch.cat([beam['dout'] for beam in hyps], dim=0)
-                logits = self.joint(eouts[b:b + 1, t:t + 1].repeat([douts.size(0), 1, 1]), douts)
-                logits = logits * softmax_smoothing
-                scores_rnnt = torch.log_softmax(logits.squeeze(2).squeeze(1), dim=-1)  # `[B, vocab]`
-
-                new_hyps = []
-                for j, beam in enumerate(hyps):
-                    # Transducer scores
-                    total_scores_rnnt = beam['score_rnnt'] + scores_rnnt[j:j + 1]
-                    total_scores_topk, topk_ids = torch.topk(
-                        total_scores_rnnt, k=beam_width, dim=-1, largest=True, sorted=True)
-
-                    for k in range(beam_width):
-                        idx = topk_ids[0, k].item()
-                        total_score = total_scores_topk[0, k].item()
-                        total_score_lm = beam['score_lm']
-
-                        if idx == self.blank:
-                            new_hyps.append(beam.copy())
-                            new_hyps[-1]['score'] += scores_rnnt[j, self.blank].item()
-                            new_hyps[-1]['score_rnnt'] += scores_rnnt[j, self.blank].item()
-                            continue
-
-                        # Update prediction network only when predicting non-blank labels
-                        hyp_ids = beam['hyp'] + [idx]
-                        hyp_ids_str = ' '.join(list(map(str, hyp_ids)))
-                        if hyp_ids_str in self.state_cache.keys():
-                            # from cache
-                            dout = self.state_cache[hyp_ids_str]['dout']
-                            dstate = self.state_cache[hyp_ids_str]['dstate']
-                            lmstate = self.state_cache[hyp_ids_str]['lmstate']
-                            total_score_lm = self.state_cache[hyp_ids_str]['total_score_lm']
-                        else:
-                            y = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)
-                            y_emb = self.dropout_emb(self.embed(y))
-                            dout, dstate = self.recurrency(y_emb, beam['dstate'])
-
-                            # Update LM states for shallow fusion
-                            y_prev = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(beam['hyp'][-1])
-                            _, lmstate, scores_lm = helper.update_rnnlm_state(lm, beam, y_prev)
-                            if lm is not None:
-                                total_score_lm += scores_lm[0, -1, idx].item()
-
-                            self.state_cache[hyp_ids_str] = {
-                                'dout': dout,
-                                'dstate': dstate,
-                                'lmstate': {'hxs': lmstate['hxs'],
-                                            'cxs': lmstate['cxs']} if lmstate is not None else None,
-                                'total_score_lm': total_score_lm,
-                            }
-
-                        if lm is not None:
-                            total_score += total_score_lm * lm_weight
-
-                        new_hyps.append({'hyp': hyp_ids,
-                                         'hyp_ids_str': hyp_ids_str,
-                                         'score': total_score,
-                                         'score_rnnt': total_scores_rnnt[0, idx].item(),
-                                         'score_lm': total_score_lm,
-                                         'dout': dout,
-                                         'dstate': dstate,
-                                         'lmstate': {'hxs': lmstate['hxs'],
-                                                     'cxs': lmstate['cxs']} if lmstate is not None else None})
-
-                # Local pruning
-                new_hyps_sorted = sorted(new_hyps, key=lambda x: x['score'], reverse=True)
-                new_hyps_sorted = helper.merge_rnnt_path(new_hyps_sorted, merge_prob)[:beam_width]
-
-                # Remove complete hypotheses
-                new_hyps, end_hyps, is_finish = helper.remove_complete_hyp(new_hyps_sorted, end_hyps)
-                hyps = new_hyps[:]
+                hyps, end_hyps, is_finish = self._beam_search_step(
+                    eouts[b:b + 1, t:t + 1], hyps, end_hyps, store, helper, lm, lm_weight,
+                    beam_width, softmax_smoothing, merge_prob)
                 if is_finish:
                     break
 
@@ -549,6 +991,10 @@ class RNNTransducer(DecoderBase):
             elif len(end_hyps) < nbest and nbest > 1:
                 end_hyps.extend(hyps[:nbest - len(end_hyps)])
 
+            # Recover token sequences only for the final hypotheses
+            for hyp in end_hyps:
+                hyp['hyp'] = store.backtrack(hyp['node'])
+
             # forward/backward second path LM rescoring
             helper.lm_rescoring(end_hyps, lm_second, lm_weight_second, tag='second')
             helper.lm_rescoring(end_hyps, lm_second_bwd, lm_weight_second_bwd, tag='second_bwd')
@@ -585,3 +1031,413 @@ class RNNTransducer(DecoderBase):
             nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:]) for n in range(nbest)]]
 
         return nbest_hyps_idx, None, None
+
+    def batch_decodable(self, params, lm=None):
+        """Whether beam_search_batch() supports the decoding options.
+           Otherwise, utterances are decoded one by one with beam_search().
+
+        Args:
+            params (dict): decoding hyperparameters
+            lm (torch.nn.module): firsh path LM
+        Returns:
+            (bool)
+
+        """
+        if not torch_19_plus:
+            return False
+        if params['recog_ctc_weight'] > 0 or params['recog_lm_state_carry_over']:
+            return False
+        return lm is None or isinstance(lm, (RNNLM, NgramLM))
+
+    def beam_search_batch(self, eouts, elens, params, idx2token=None,
+                          lm=None, lm_second=None, lm_second_bwd=None, ctc_log_probs=None,
+                          nbest=1, exclude_eos=False, refs_id=None, utt_ids=None):
+        """Time-synchronous beam search decoding over multiple utterances at once.
+
+        All hypotheses of all utterances are kept as `[B * beam_width]` tensors.
+        At each frame, hypotheses are expanded by up to `recog_max_symbols_per_frame` labels,
+        and alignment paths reaching the next frame are merged by hashed prefixes.
+        The prediction network is computed only for new prefixes not found in a prefix cache.
+        When the limit of labels is reached, hypotheses move to the next frame without blank,
+        so that this gives the same N-best lists as beam_search() with `recog_max_symbols_per_frame=1`.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            elens (IntTensor): `[B]`
+            params (dict): hyperparameters for decoding
+            idx2token (): converter from index to token
+            lm (torch.nn.module): firsh path LM (RNNLM)
+            lm_second (torch.nn.module): second path LM
+            lm_second_bwd (torch.nn.module): secoding path backward LM
+            ctc_log_probs (FloatTensor): `[B, T, vocab]`
+            nbest (int): number of N-best list
+            exclude_eos (bool): exclude <eos> from hypothesis
+            refs_id (List): reference list
+            utt_ids (List): utterance id list
+        Returns:
+            nbest_hyps_idx (List): length `[B]`, each of which contains list of N hypotheses
+            aws: dummy
+            scores: dummy
+
+        """
+        bs = eouts.size(0)
+        device = eouts.device
+
+        beam_width = params['recog_beam_width']
+        assert 1 <= nbest <= beam_width
+        ctc_weight = params['recog_ctc_weight']
+        assert ctc_weight == 0
+        assert ctc_log_probs is None
+        lm_weight = params['recog_lm_weight']
+        lm_weight_second = params['recog_lm_second_weight']
+        lm_weight_second_bwd = params['recog_lm_bwd_weight']
+        softmax_smoothing = params['recog_softmax_smoothing']
+        max_symbols = params['recog_max_symbols_per_frame']
+        assert max_symbols >= 1
+        assert not params['recog_lm_state_carry_over']
+        if not torch_19_plus:
+            raise NotImplementedError('Batched beam search of RNN-T requires PyTorch>=1.9 (stable sort).')
+
+        helper = BeamSearch(beam_width, self.eos, ctc_weight, device)
+        lm = helper.verify_lm_eval_mode(lm, lm_weight)
+        lm_second = helper.verify_lm_eval_mode(lm_second, lm_weight_second)
+        lm_second_bwd = helper.verify_lm_eval_mode(lm_second_bwd, lm_weight_second_bwd)
+        if lm is not None and not isinstance(lm, (RNNLM, NgramLM)):
+            raise NotImplementedError(type(lm))
+
+        # NOTE: hypotheses of the b-th utterance are stored in rows [b * beam_width, (b + 1) * beam_width)
+        n_rows = bs * beam_width
+        NEG_INF = float('-inf')
+        row_index = torch.arange(n_rows, device=device)
+        utt_index = row_index // beam_width
+        elens_rows = elens.to(device).long()[utt_index]
+        finished = [False] * bs
+        end_hyps = [[] for _ in range(bs)]
+
+        # initial hypotheses
+        # NOTE: tokens are recovered from the store by back-pointers at the end
+        store = HypothesisStore(n_rows, self.eos, device, max_len=elens_rows.max().item() + 1)
+        y = eouts.new_zeros(n_rows, dtype=torch.int64).fill_(self.eos)  # last tokens
+        dout, dstate = self.recurrency(self.dropout_emb(self.embed(y.unsqueeze(1))), None)
+        hyps = {'y': y,
+                'nodes': store.roots,
+                'keys': hash_prefix(y.new_zeros(n_rows), y),
+                'score_rnnt': eouts.new_zeros(n_rows).masked_fill(row_index % beam_width > 0, NEG_INF),
+                'score_lm': eouts.new_zeros(n_rows),
+                'dout': dout,
+                'hxs': dstate['hxs'],
+                'cxs': dstate['cxs'],
+                'lm_hxs': None,
+                'lm_cxs': None}
+        cache = [{'keys': hyps['keys'][:1], 'dout': dout[:1], 'hxs': dstate['hxs'][:, :1],
+                  'cxs': dstate['cxs'][:, :1] if dstate['cxs'] is not None else None}]
+
+        for t in range(elens_rows.max().item()):
+            is_active = (t < elens_rows) & ~torch.tensor(finished, device=device)[utt_index]
+            if not is_active.any():
+                break
+            eouts_t = eouts[utt_index, t].unsqueeze(1)  # `[B * beam, 1, enc_n_units]`
+            cache = cache[-1:]  # keep prefixes created at the previous and current frames
+            cache.append(None)
+            hyps = self._beam_search_step_batch(eouts_t, is_active, hyps, end_hyps, finished, cache, store,
+                                                helper, lm, lm_weight, beam_width, softmax_smoothing, max_symbols)
+
+        for b in range(bs):
+            # Global pruning
+            rows = [r for r in range(b * beam_width, (b + 1) * beam_width) if hyps['score_rnnt'][r] > NEG_INF]
+            alive_hyps = [{'hyp': store.backtrack(hyps['nodes'][r].item()),
+                           'score': hyps['score_rnnt'][r].item() + hyps['score_lm'][r].item() * lm_weight,
+                           'score_rnnt': hyps['score_rnnt'][r].item(),
+                           'score_lm': hyps['score_lm'][r].item()} for r in rows]
+            if len(end_hyps[b]) == 0:
+                end_hyps[b] = alive_hyps
+            elif len(end_hyps[b]) < nbest and nbest > 1:
+                end_hyps[b].extend(alive_hyps[:nbest - len(end_hyps[b])])
+            for hyp in end_hyps[b]:
+                if 'node' in hyp:
+                    hyp['hyp'] = store.backtrack(hyp.pop('node')) + [self.eos]
+
+        # forward/backward second path LM rescoring of all utterances at once
+        end_hyps_all = [hyp for hyps_b in end_hyps for hyp in hyps_b]
+        helper.lm_rescoring(end_hyps_all, lm_second, lm_weight_second, tag='second')
+        helper.lm_rescoring(end_hyps_all, lm_second_bwd, lm_weight_second_bwd, tag='second_bwd')
+
+        nbest_hyps_idx = []
+        for b in range(bs):
+            # Sort by score
+            hyps_b = sorted(end_hyps[b], key=lambda x: x['score'] / max(len(x['hyp'][1:]), 1), reverse=True)
+
+            if idx2token is not None:
+                if utt_ids is not None:
+                    logger.info('Utt-id: %s' % utt_ids[b])
+                assert self.vocab == idx2token.vocab
+                logger.info('=' * 200)
+                for k in range(len(hyps_b)):
+                    if refs_id is not None:
+                        logger.info('Ref: %s' % idx2token(refs_id[b]))
+                    logger.info('Hyp: %s' % idx2token(hyps_b[k]['hyp'][1:]))
+                    logger.info('log prob (hyp): %.7f' % hyps_b[k]['score'])
+                    logger.info('log prob (hyp, rnnt): %.7f' % hyps_b[k]['score_rnnt'])
+                    if lm is not None:
+                        logger.info('log prob (hyp, first-path lm): %.7f' % (hyps_b[k]['score_lm'] * lm_weight))
+                    if lm_second is not None:
+                        logger.info('log prob (hyp, second-path lm): %.7f' %
+                                    (hyps_b[k]['score_lm_second'] * lm_weight_second))
+                    if lm_second_bwd is not None:
+                        logger.info('log prob (hyp, second-path lm, reverse): %.7f' %
+                                    (hyps_b[k]['score_lm_second_bwd'] * lm_weight_second_bwd))
+                    logger.info('-' * 50)
+
+            # N-best list
+            nbest_hyps_idx += [[np.array(hyps_b[n]['hyp'][1:]) for n in range(nbest)]]
+
+        return nbest_hyps_idx, None, None
+
+    def _beam_search_step_batch(self, eouts_t, is_active, hyps, end_hyps, finished, cache, store, helper,
+                                lm, lm_weight, beam_width, softmax_smoothing, max_symbols, merge_prob=True):
+        """Expand hypotheses of multiple utterances with a single encoder frame.
+        Hypotheses of the b-th utterance are stored in rows [b * beam_width, (b + 1) * beam_width).
+
+        Args:
+            eouts_t (FloatTensor): `[B * beam_width, 1, enc_n_units]`
+            is_active (BoolTensor): `[B * beam_width]`, rows of utterances having the current frame
+            hyps (dict): set of hypotheses
+            end_hyps (List[List]): length `[B]`, hypotheses ending with <eos> (updated in place)
+            finished (List[bool]): length `[B]`, enough hypotheses end with <eos> (updated in place)
+            cache (List[dict]): prediction network states of hashed prefixes
+            store (HypothesisStore): store of tokens and back-pointers
+            helper (BeamSearch): beam search helper
+            lm (torch.nn.module): firsh path LM (RNNLM or NgramLM)
+            lm_weight (float): weight of the first path LM
+            beam_width (int): size of the beam
+            softmax_smoothing (float): temperature for the joint network
+            max_symbols (int): maximum number of labels emitted at a single frame
+            merge_prob (bool): sum up probabilities of paths with the same prefix
+        Returns:
+            hyps (dict): set of hypotheses
+
+        """
+        n_rows = is_active.size(0)
+        bs = n_rows // beam_width
+        device = eouts_t.device
+        NEG_INF = float('-inf')
+        row_index = torch.arange(n_rows, device=device)
+        utt_index = row_index // beam_width
+
+        # Expand hypotheses by blank and labels
+        hyps_v = hyps
+        hyps_all, cands = [], []
+        for v in range(max_symbols):
+            hyps_all.append(hyps_v)
+            logits = self.joint(eouts_t, hyps_v['dout']) * softmax_smoothing
+            scores_rnnt = torch.log_softmax(logits.view(n_rows, -1), dim=-1)  # `[B * beam, vocab]`
+            total_scores_rnnt = hyps_v['score_rnnt'].unsqueeze(1) + scores_rnnt
+            total_scores_rnnt = total_scores_rnnt.masked_fill(~is_active.unsqueeze(1), NEG_INF)
+            total_scores_topk, topk_ids = torch.topk(total_scores_rnnt, k=beam_width, dim=-1,
+                                                     largest=True, sorted=True)
+            is_blank = topk_ids == self.blank
+
+            # Update LM states for shallow fusion
+            total_scores_lm = hyps_v['score_lm'].unsqueeze(1).expand(-1, beam_width)
+            if lm is not None:
+                y_prev = hyps_v['y'].unsqueeze(1)
+                lmstate = None
+                if hyps_v['lm_hxs'] is not None:
+                    lmstate = {'hxs': hyps_v['lm_hxs'], 'cxs': hyps_v['lm_cxs']}
+                _, lmstate_next, scores_lm = lm.predict(y_prev, lmstate)
+                if lmstate is None:
+                    # NOTE: equivalent to the zero state
+                    lmstate = {k: torch.zeros_like(v) if v is not None else None
+                               for k, v in lmstate_next.items()}
+                hyps_v['lm_hxs'], hyps_v['lm_cxs'] = lmstate['hxs'], lmstate['cxs']
+                hyps_v['lm_hxs_next'], hyps_v['lm_cxs_next'] = lmstate_next['hxs'], lmstate_next['cxs']
+                total_scores_lm = torch.where(is_blank, total_scores_lm,
+                                              total_scores_lm + scores_lm[:, -1].gather(1, topk_ids))
+            total_scores = total_scores_topk + total_scores_lm * lm_weight
+
+            # Candidates reaching the next frame: blank, <eos>, and labels over the limit
+            to_next = is_blank | (topk_ids == self.eos) | (v == max_symbols - 1)
+            cands.append({'v': torch.full_like(topk_ids, v),
+                          'rows': row_index.unsqueeze(1).expand(-1, beam_width),
+                          'ids': topk_ids,
+                          'is_blank': is_blank,
+                          'score': total_scores.masked_fill(~to_next, NEG_INF),
+                          'score_rnnt': total_scores_topk,
+                          'score_lm': total_scores_lm})
+            if v == max_symbols - 1:
+                break
+
+            # Hypotheses emitting one more label at the same frame
+            total_scores = total_scores.masked_fill(to_next, NEG_INF)
+            total_scores, flat_ids = torch.topk(total_scores.view(bs, -1), k=beam_width, dim=1,
+                                                largest=True, sorted=True)  # `[B, beam]`
+            flat_ids = (flat_ids + utt_index.view(bs, beam_width) * beam_width * beam_width).view(-1)
+            if (total_scores == NEG_INF).all():
+                break
+            hyps_v = self._extend_hyps(hyps_v, flat_ids // beam_width, topk_ids.view(-1)[flat_ids],
+                                       total_scores_topk.view(-1)[flat_ids].masked_fill(
+                                           total_scores.view(-1) == NEG_INF, NEG_INF),
+                                       total_scores_lm.reshape(-1)[flat_ids], cache, store)
+
+        # Keep hypotheses of finished utterances
+        cands.append({'v': row_index.new_zeros(n_rows, 1),
+                      'rows': row_index.unsqueeze(1),
+                      'ids': row_index.new_zeros(n_rows, 1).fill_(self.blank),
+                      'is_blank': row_index.new_ones(n_rows, 1, dtype=torch.bool),
+                      'score': (hyps['score_rnnt'] + hyps['score_lm'] * lm_weight).unsqueeze(1).masked_fill(
+                          is_active.unsqueeze(1), NEG_INF),
+                      'score_rnnt': hyps['score_rnnt'].unsqueeze(1),
+                      'score_lm': hyps['score_lm'].unsqueeze(1)})
+        cands = {k: torch.cat([c[k].reshape(-1) for c in cands]) for k in cands[0].keys()}
+        valid = cands['score'] > NEG_INF
+        cands = {k: c[valid] for k, c in cands.items()}
+        cands_utt = utt_index[cands['rows']]
+        parent_keys = torch.cat([h['keys'] for h in hyps_all])[cands['v'] * n_rows + cands['rows']]
+        cands['keys'] = torch.where(cands['is_blank'], parent_keys, hash_prefix(parent_keys, cands['ids']))
+
+        # Merge paths having the same prefix
+        group_ids, rep_ids, max_scores, merged_scores_rnnt = helper.merge_rnnt_path_batch(
+            cands_utt, cands['keys'], cands['score'], cands['score_rnnt'], priority=cands['is_blank'],
+            merge_prob=merge_prob)
+
+        # Local pruning per utterance in the order of the best path of each group
+        group_utt = cands_utt[rep_ids]
+        order = torch.argsort(max_scores, descending=True, stable=True)
+        order = order[torch.argsort(group_utt[order], stable=True)]
+        group_utt = group_utt[order]
+        first = torch.searchsorted(group_utt, torch.arange(bs, device=device))
+        rank = torch.arange(order.size(0), device=device) - first[group_utt]
+        keep = rank < beam_width
+        order, group_utt, rank = order[keep], group_utt[keep], rank[keep]
+        reps = rep_ids[order]  # candidate representing each group
+        new_score_rnnt = merged_scores_rnnt[order]
+        new_score_lm = cands['score_lm'][reps]
+        new_ids = cands['ids'][reps]
+        is_eos = ~cands['is_blank'][reps] & (new_ids == self.eos)
+
+        # Remove complete hypotheses
+        if is_eos.any():
+            for i in is_eos.nonzero()[:, 0].tolist():
+                b, h = group_utt[i].item(), hyps_all[cands['v'][reps[i]].item()]
+                j = cands['rows'][reps[i]].item()
+                end_hyps[b].append({'node': h['nodes'][j].item(),
+                                    'score': new_score_rnnt[i].item() + new_score_lm[i].item() * lm_weight,
+                                    'score_rnnt': new_score_rnnt[i].item(),
+                                    'score_lm': new_score_lm[i].item()})
+            for b in range(bs):
+                if len(end_hyps[b]) >= beam_width:
+                    end_hyps[b] = end_hyps[b][:beam_width]
+                    finished[b] = True
+            # re-rank the rest of hypotheses
+            is_alive = (~is_eos).long()
+            n_alive = torch.cumsum(is_alive, dim=0)
+            first = torch.searchsorted(group_utt, group_utt)
+            rank = n_alive - 1 - (n_alive[first] - is_alive[first])
+            is_alive = is_alive.bool()
+            group_utt, rank, reps, new_ids = group_utt[is_alive], rank[is_alive], reps[is_alive], new_ids[is_alive]
+            new_score_rnnt, new_score_lm = new_score_rnnt[is_alive], new_score_lm[is_alive]
+
+        # Gather states of new hypotheses
+        dst_rows = group_utt * beam_width + rank
+        src_rows = row_index.clone()
+        src_rows[dst_rows] = cands['v'][reps] * n_rows + cands['rows'][reps]
+        hyps_cat = self._cat_hyps(hyps_all)
+        is_label = torch.zeros_like(row_index, dtype=torch.bool)
+        is_label[dst_rows] = ~cands['is_blank'][reps]
+        ids = row_index.new_zeros(n_rows).fill_(self.blank)
+        ids[dst_rows] = new_ids
+        score_rnnt = eouts_t.new_zeros(n_rows).fill_(NEG_INF)
+        score_rnnt[dst_rows] = new_score_rnnt
+        score_lm = eouts_t.new_zeros(n_rows)
+        score_lm[dst_rows] = new_score_lm
+        return self._extend_hyps(hyps_cat, src_rows, ids, score_rnnt, score_lm, cache, store, is_label=is_label)
+
+    def _cat_hyps(self, hyps_list):
+        """Concatenate sets of hypotheses along rows.
+
+        Args:
+            hyps_list (List[dict]): sets of hypotheses
+        Returns:
+            hyps (dict): set of hypotheses
+
+        """
+        hyps = {}
+        for k in hyps_list[0].keys():
+            if hyps_list[0][k] is None:
+                hyps[k] = None
+                continue
+            # NOTE: states are `[n_layers, N, n_units]`
+            dim = 1 if k in HYP_STATE_KEYS else 0
+            hyps[k] = torch.cat([h[k] for h in hyps_list], dim=dim)
+        return hyps
+
+    def _extend_hyps(self, hyps, src_rows, ids, score_rnnt, score_lm, cache, store, is_label=None):
+        """Select hypotheses and extend them by labels.
+        Prediction network states of new prefixes are loaded from the cache if possible.
+
+        Args:
+            hyps (dict): set of hypotheses
+            src_rows (LongTensor): `[N]`, rows of hypotheses to select
+            ids (LongTensor): `[N]`, labels to extend hypotheses
+            score_rnnt (FloatTensor): `[N]`, scores of new hypotheses (-inf for empty rows)
+            score_lm (FloatTensor): `[N]`
+            cache (List[dict]): prediction network states of hashed prefixes
+            store (HypothesisStore): store of tokens and back-pointers
+            is_label (BoolTensor): `[N]`, extend hypotheses by labels (otherwise, by blank)
+        Returns:
+            new_hyps (dict): set of hypotheses
+
+        """
+        if is_label is None:
+            is_label = torch.ones_like(ids, dtype=torch.bool)
+        new_hyps = {'score_rnnt': score_rnnt, 'score_lm': score_lm}
+        for k, v in hyps.items():
+            if k in new_hyps or k.endswith('_next'):
+                continue
+            new_hyps[k] = None if v is None else v[:, src_rows] if k in HYP_STATE_KEYS else v[src_rows]
+
+        # Append labels
+        if is_label.any():
+            new_hyps['nodes'] = store.append(ids, new_hyps['nodes'], scores=score_rnnt, mask=is_label)
+            new_hyps['y'] = torch.where(is_label, ids, new_hyps['y'])
+        new_hyps['keys'] = torch.where(is_label, hash_prefix(new_hyps['keys'], ids), new_hyps['keys'])
+        if hyps.get('lm_hxs_next') is not None:
+            for k in ['lm_hxs', 'lm_cxs']:
+                if hyps[k + '_next'] is not None:
+                    new_hyps[k] = torch.where(is_label.view(1, -1, 1), hyps[k + '_next'][:, src_rows], new_hyps[k])
+
+        # Update prediction network only for new prefixes
+        rows = (is_label & (score_rnnt > float('-inf'))).nonzero()[:, 0]
+        if rows.size(0) == 0:
+            return new_hyps
+        keys = new_hyps['keys'][rows]
+        blocks = [c for c in cache if c is not None]
+        hit = torch.zeros_like(keys, dtype=torch.bool)
+        if len(blocks) > 0:
+            cache_keys = torch.cat([c['keys'] for c in blocks])
+            order = torch.argsort(cache_keys)
+            pos = torch.searchsorted(cache_keys[order], keys).clamp(max=order.size(0) - 1)
+            hit = cache_keys[order][pos] == keys
+            hit_ids = order[pos[hit]]
+        if hit.any():
+            cache_dout = torch.cat([c['dout'] for c in blocks])
+            new_hyps['dout'][rows[hit]] = cache_dout[hit_ids]
+            for k in ['hxs', 'cxs']:
+                if new_hyps[k] is not None:
+                    new_hyps[k][:, rows[hit]] = torch.cat([c[k] for c in blocks], dim=1)[:, hit_ids]
+        miss = rows[~hit]
+        if miss.size(0) > 0:
+            y_emb = self.dropout_emb(self.embed(ids[miss].unsqueeze(1)))
+            dstate = {'hxs': new_hyps['hxs'][:, miss],
+                      'cxs': new_hyps['cxs'][:, miss] if new_hyps['cxs'] is not None else None}
+            dout, dstate = self.recurrency(y_emb, dstate)
+            new_hyps['dout'][miss] = dout
+            new_hyps['hxs'][:, miss] = dstate['hxs']
+            if new_hyps['cxs'] is not None:
+                new_hyps['cxs'][:, miss] = dstate['cxs']
+            block = {'keys': new_hyps['keys'][miss], 'dout': dout, 'hxs': dstate['hxs'], 'cxs': dstate['cxs']}
+            if cache[-1] is not None:
+                block = {k: None if v is None else torch.cat([cache[-1][k], v], dim=1 if k in HYP_STATE_KEYS else 0)
+                         for k, v in block.items()}
+            cache[-1] = block
+        return new_hyps
@@ -6,6 +6,7 @@
 import copy
 from distutils.util import strtobool
 from distutils.version import LooseVersion
+import functools
 import logging
 import math
 import numpy as np
@@ -14,21 +15,25 @@ import torch
 import torch.nn as nn
 
 from neural_sp.models.criterion import cross_entropy_lsm
+from neural_sp.models.lm.ngram import NgramLM
 from neural_sp.models.lm.rnnlm import RNNLM
 from neural_sp.models.modules.positional_embedding import PositionalEncoding
 from neural_sp.models.modules.transformer import TransformerDecoderBlock
 from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
+from neural_sp.models.seq2seq.decoders.beam_search import HypothesisStore
 from neural_sp.models.seq2seq.decoders.ctc import (
     CTC,
-    CTCPrefixScore
+    CTCPrefixScoreBatch
 )
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import (
     append_sos_eos,
     compute_accuracy,
     make_pad_mask,
+    parallel_apply,
     tensor2np,
-    tensor2scalar
+    tensor2scalar,
+    torch_111_plus
 )
 
 random.seed(1)
@@ -128,6 +133,12 @@ class TransformerDecoder(DecoderBase):
         self.prev_spk = ''
         self.lmstate_final = None
 
+        # for streaming inference
+        self.n_frames = 0
+        self.n_triggers = 0
+        self.ctc_prev_token = self.blank
+        self.eouts_memory = None
+
         # for attention plot
         self.aws_dict = {}
         self.data_dict = {}
@@ -311,6 +322,23 @@ class TransformerDecoder(DecoderBase):
             # nn.init.normal_(self.output.weight, mean=0., std=self.d_model**-0.5)
             nn.init.constant_(self.output.bias, 0.)
 
+    def set_checkpointing(self, n_layers):
+        """Apply activation checkpointing to lower decoder layers during training.
+
+        Args:
+            n_layers (int): number of layers from the bottom. -1 means all layers.
+
+        """
+        if self.att_weight == 0:
+            return
+        # NOTE: attention weights of MoChA must be kept in the graph for the quantity loss
+        assert self.attn_type != 'mocha' or torch_111_plus
+        if n_layers < 0:
+            n_layers = self.n_layers
+        for lth, layer in enumerate(self.layers):
+            layer.checkpoint = lth < n_layers
+        logger.info('Activation checkpointing in %d decoder layers' % min(n_layers, self.n_layers))
+
     def forward(self, eouts, elens, ys, task='all',
                 teacher_logits=None, recog_params={}, idx2token=None, trigger_points=None):
         """Forward pass.
@@ -602,10 +630,13 @@ class TransformerDecoder(DecoderBase):
         """
         bs, xmax, _ = eouts.size()
         n_models = len(ensmbl_decs) + 1
+        # NOTE: a decoder shared by several members cannot run concurrently due to attention caches
+        ensmbl_concurrent = len(set([id(dec) for dec in [self] + ensmbl_decs])) == n_models
 
         beam_width = params['recog_beam_width']
         assert 1 <= nbest <= beam_width
         ctc_weight = params['recog_ctc_weight']
+        ctc_window_margin = params['recog_ctc_window_margin']
         max_len_ratio = params['recog_max_len_ratio']
         min_len_ratio = params['recog_min_len_ratio']
         lp_weight = params['recog_length_penalty']
@@ -623,9 +654,17 @@ class TransformerDecoder(DecoderBase):
         lm_second = helper.verify_lm_eval_mode(lm_second, lm_weight_second)
         lm_second_bwd = helper.verify_lm_eval_mode(lm_second_bwd, lm_weight_second_bwd)
 
+        # For joint CTC-Attention decoding
+        ctc_prefix_scorer = None
         if ctc_log_probs is not None:
             assert ctc_weight > 0
-            ctc_log_probs = tensor2np(ctc_log_probs)
+            ctc_prefix_scorer = CTCPrefixScoreBatch(ctc_log_probs, elens, self.blank, self.eos,
+                                                    backward=self.bwd, margin=ctc_window_margin)
+            ctc_states_init = ctc_prefix_scorer.initial_state()  # `[T, 2, B]`
+
+        # NOTE: key/value of self-attention are projected once per token and cached in each layer,
+        # and reordered by beam index after pruning. Encoder-side features are computed once per utterance.
+        kv_cache = cache_states and self.attn_type != 'mocha' and '1dconv' not in self.pe_type and n_models == 1
 
         nbest_hyps_idx, aws, scores = [], [], []
         eos_flags = []
@@ -636,22 +675,17 @@ class TransformerDecoder(DecoderBase):
             for layer in self.layers:
                 layer.reset()
 
-            # For joint CTC-Attention decoding
-            ctc_prefix_scorer = None
-            if ctc_log_probs is not None:
-                if self.bwd:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b][::-1], self.blank, self.eos)
-                else:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b], self.blank, self.eos)
-
             if speakers is not None:
                 if speakers[b] == self.prev_spk:
-                    if lm_state_carry_over and isinstance(lm, RNNLM):
+                    if lm_state_carry_over and isinstance(lm, (RNNLM, NgramLM)):
                         lmstate = self.lmstate_final
                 self.prev_spk = speakers[b]
 
             end_hyps = []
-            hyps = [{'hyp': [self.eos],
+            # NOTE: tokens are written to the store instead of being copied to each hypothesis
+            hyps = [{'node': 0,
+                     'y': self.eos,
+                     'ylen': 0,
                      'ys': ys,
                      'cache': None,
                      'score': 0.,
@@ -661,21 +695,24 @@ class TransformerDecoder(DecoderBase):
                      'aws': [None],
                      'lmstate': lmstate,
                      'ensmbl_cache': [[None] * dec.n_layers for dec in ensmbl_decs] if n_models > 1 else None,
-                     'ctc_state': ctc_prefix_scorer.initial_state() if ctc_prefix_scorer is not None else None,
+                     'ctc_state': ctc_states_init[:, :, b] if ctc_prefix_scorer is not None else None,
                      'quantity_rate': 1.,
                      'streamable': True,
                      'streaming_failed_point': 1000}]
             streamable_global = True
             ymax = math.ceil(elens[b] * max_len_ratio)
+            store = HypothesisStore(beam_width, self.eos, eouts.device, max_len=ymax + 1)
             for i in range(ymax):
                 # batchfy all hypotheses for batch decoding
                 cache = [None] * self.n_layers
-                if cache_states and i > 0:
+                if cache_states and not kv_cache and i > 0:
                     for lth in range(self.n_layers):
                         cache[lth] = torch.cat([beam['cache'][lth] for beam in hyps], dim=0)
-                ys = eouts.new_zeros((len(hyps), i + 1), dtype=torch.int64)
-                for j, beam in enumerate(hyps):
-                    ys[j, :] = beam['ys']
+                if kv_cache:
+                    # NOTE: only the last tokens are fed because previous tokens are cached in each layer
+                    ys = eouts.new_tensor([[beam['y']] for beam in hyps], dtype=torch.int64)
+                else:
+                    ys = torch.cat([beam['ys'] for beam in hyps], dim=0)
                 if i > 0:
                     xy_aws_prev = torch.cat([beam['aws'][-1] for beam in hyps], dim=0)  # `[B, n_layers, H_ma, 1, klen]`
                 else:
@@ -686,15 +723,21 @@ class TransformerDecoder(DecoderBase):
                 _, lmstate, scores_lm = helper.update_rnnlm_state_batch(lm, hyps, y_lm)
 
                 # for the main model
-                causal_mask = eouts.new_ones(i + 1, i + 1, dtype=torch.uint8)
-                if torch_12_plus:
-                    causal_mask = causal_mask.byte()
-                causal_mask = torch.tril(causal_mask, out=causal_mask).unsqueeze(0).repeat([ys.size(0), 1, 1])
-
-                out = self.pos_enc(self.embed(ys))  # scaled + dropout
+                causal_mask = None
+                if not kv_cache:
+                    causal_mask = eouts.new_ones(i + 1, i + 1, dtype=torch.uint8)
+                    if torch_12_plus:
+                        causal_mask = causal_mask.byte()
+                    causal_mask = torch.tril(causal_mask, out=causal_mask).unsqueeze(0).repeat([ys.size(0), 1, 1])
+
+                if kv_cache:
+                    out = self.pos_enc(self.embed(ys[:, -1:]), offset=i)  # scaled + dropout
+                    eouts_b = eouts[b:b + 1, :elens[b]]
+                else:
+                    out = self.pos_enc(self.embed(ys))  # scaled + dropout
+                    eouts_b = eouts[b:b + 1, :elens[b]].repeat([ys.size(0), 1, 1])
 
                 n_heads_total = 0
-                eouts_b = eouts[b:b + 1, :elens[b]].repeat([ys.size(0), 1, 1])
                 new_cache = [None] * self.n_layers
                 xy_aws_layers = []
                 xy_aws = None
@@ -704,7 +747,7 @@ class TransformerDecoder(DecoderBase):
                         out, causal_mask, eouts_b, None,
                         cache=cache[lth],
                         xy_aws_prev=xy_aws_prev[:, lth - lth_s] if lth >= lth_s and i > 0 else None,
-                        eps_wait=eps_wait)
+                        eps_wait=eps_wait, kv_cache=kv_cache)
                     xy_aws = layer.xy_aws
 
                     new_cache[lth] = out
@@ -722,45 +765,66 @@ class TransformerDecoder(DecoderBase):
                             ensmbl_cache[i_e][lth] = torch.cat([beam['ensmbl_cache'][i_e][lth] for beam in hyps], dim=0)
 
                 # for the ensemble
-                ensmbl_new_cache = [[None] * dec.n_layers for dec in ensmbl_decs]
-                for i_e, dec in enumerate(ensmbl_decs):
+                def step_ensmbl(i_e, dec):
+                    new_cache_e = [None] * dec.n_layers
                     out_e = dec.pos_enc(dec.embed(ys))  # scaled + dropout
-                    eouts_e = ensmbl_eouts[i_e][b:b + 1, :elens[b]].repeat([ys.size(0), 1, 1])
+                    eouts_e = ensmbl_eouts[i_e][b:b + 1, :ensmbl_elens[i_e][b]].repeat([ys.size(0), 1, 1])
                     for lth in range(dec.n_layers):
                         out_e = dec.layers[lth](out_e, causal_mask, eouts_e, None,
                                                 cache=ensmbl_cache[i_e][lth])
-                        ensmbl_new_cache[i_e][lth] = out_e
+                        new_cache_e[lth] = out_e
                     logits_e = dec.output(dec.norm_out(out_e[:, -1]))
-                    probs += torch.softmax(logits_e * softmax_smoothing, dim=1)
-                    # NOTE: sum in the probability scale (not log-scale)
+                    return new_cache_e, torch.softmax(logits_e * softmax_smoothing, dim=1)
+
+                # NOTE: decoder steps of ensemble members run concurrently
+                ensmbl_new_cache = []
+                if n_models > 1:
+                    steps = [functools.partial(step_ensmbl, i_e, dec) for i_e, dec in enumerate(ensmbl_decs)]
+                    outs = parallel_apply(steps) if ensmbl_concurrent else [step() for step in steps]
+                    for new_cache_e, probs_e in outs:
+                        ensmbl_new_cache += [new_cache_e]
+                        probs += probs_e
+                        # NOTE: sum in the probability scale (not log-scale)
 
                 # Ensemble
                 scores_att = torch.log(probs / n_models)
 
-                new_hyps = []
-                for j, beam in enumerate(hyps):
-                    # Attention scores
-                    total_scores_att = beam['score_att'] + scores_att[j:j + 1]
-                    total_scores = total_scores_att * (1 - ctc_weight)
+                # Attention scores of all hypotheses
+                total_scores_att_all = scores_att.new_tensor([beam['score_att'] for beam in hyps]).unsqueeze(1)
+                total_scores_att_all = total_scores_att_all + scores_att
+                total_scores_all = total_scores_att_all * (1 - ctc_weight)
 
-                    # Add LM score <before> top-K selection
-                    if lm is not None:
-                        total_scores_lm = beam['score_lm'] + scores_lm[j:j + 1, -1]
-                        total_scores += total_scores_lm * lm_weight
-                    else:
-                        total_scores_lm = eouts.new_zeros(1, self.vocab)
+                # Add LM score <before> top-K selection
+                if lm is not None:
+                    total_scores_lm_all = scores_lm.new_tensor([beam['score_lm'] for beam in hyps]).unsqueeze(1)
+                    total_scores_lm_all = total_scores_lm_all + scores_lm[:, -1]
+                    total_scores_all += total_scores_lm_all * lm_weight
+                else:
+                    total_scores_lm_all = eouts.new_zeros(len(hyps), self.vocab)
+
+                total_scores_topk_all, topk_ids_all = torch.topk(
+                    total_scores_all, k=beam_width, dim=1, largest=True, sorted=True)
+
+                # CTC scores of all hypotheses
+                # NOTE: CTC prefix scores are computed around CTC spikes in the windowed mode
+                # because source attention of the Transformer is not always monotonic
+                ctc_scores, ctc_states = helper.ctc_prefix_score_batch(
+                    hyps, topk_ids_all, ctc_prefix_scorer, b)
 
-                    total_scores_topk, topk_ids = torch.topk(
-                        total_scores, k=beam_width, dim=1, largest=True, sorted=True)
+                new_hyps = []
+                for j, beam in enumerate(hyps):
+                    total_scores_att = total_scores_att_all[j:j + 1]
+                    total_scores_lm = total_scores_lm_all[j:j + 1]
+                    total_scores_topk = total_scores_topk_all[j:j + 1]
+                    topk_ids = topk_ids_all[j:j + 1]
 
                     # Add length penalty
                     if lp_weight > 0:
-                        total_scores_topk += (len(beam['hyp'][1:]) + 1) * lp_weight
+                        total_scores_topk += (beam['ylen'] + 1) * lp_weight
 
                     # Add CTC score
-                    new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
-                        beam['hyp'], topk_ids, beam['ctc_state'],
-                        total_scores_topk, ctc_prefix_scorer)
+                    total_scores_ctc = ctc_scores[j]
+                    total_scores_topk += total_scores_ctc * ctc_weight
 
                     new_aws = beam['aws'] + [xy_aws_layers[j:j + 1, :, :, -1:]]
                     aws_j = torch.cat(new_aws[1:], dim=3)  # `[1, H, n_layers, L, T]`
@@ -768,12 +832,12 @@ class TransformerDecoder(DecoderBase):
                     # forward direction
                     for k in range(beam_width):
                         idx = topk_ids[0, k].item()
-                        length_norm_factor = len(beam['hyp'][1:]) + 1 if length_norm else 1
+                        length_norm_factor = beam['ylen'] + 1 if length_norm else 1
                         total_score = total_scores_topk[0, k].item() / length_norm_factor
 
                         if idx == self.eos:
                             # Exclude short hypotheses
-                            if len(beam['hyp'][1:]) < elens[b] * min_len_ratio:
+                            if beam['ylen'] < elens[b] * min_len_ratio:
                                 continue
                             # EOS threshold
                             max_score_no_eos = scores_att[j, :idx].max(0)[0].item()
@@ -803,9 +867,15 @@ class TransformerDecoder(DecoderBase):
                                 streaming_failed_point = i
 
                         new_hyps.append(
-                            {'hyp': beam['hyp'] + [idx],
-                             'ys': torch.cat([beam['ys'], eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)], dim=-1),
-                             'cache': [new_cache_l[j:j + 1] for new_cache_l in new_cache] if cache_states else cache,
+                            {'node': None,
+                             'parent': beam['node'],
+                             'y': idx,
+                             'ylen': beam['ylen'] + 1,
+                             'ys': torch.cat([beam['ys'], eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)], dim=-1)
+                             if not kv_cache else None,
+                             'cache': [new_cache_l[j:j + 1] for new_cache_l in new_cache]
+                             if cache_states and not kv_cache else None,
+                             'cache_idx': j,
                              'score': total_score,
                              'score_att': total_scores_att[0, idx].item(),
                              'score_ctc': total_scores_ctc[k].item(),
@@ -813,7 +883,7 @@ class TransformerDecoder(DecoderBase):
                              'aws': new_aws,
                              'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
                                          'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
-                             'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None,
+                             'ctc_state': ctc_states[:, :, j, k] if ctc_prefix_scorer is not None else None,
                              'ensmbl_cache': [[new_cache_e_l[j:j + 1] for new_cache_e_l in new_cache_e] for new_cache_e in ensmbl_new_cache] if cache_states else None,
                              'streamable': streamable_global,
                              'streaming_failed_point': streaming_failed_point,
@@ -821,6 +891,7 @@ class TransformerDecoder(DecoderBase):
 
                 # Local pruning
                 new_hyps_sorted = sorted(new_hyps, key=lambda x: x['score'], reverse=True)[:beam_width]
+                store.append_hyps(new_hyps_sorted)
 
                 # Remove complete hypotheses
                 new_hyps, end_hyps, is_finish = helper.remove_complete_hyp(
@@ -829,12 +900,21 @@ class TransformerDecoder(DecoderBase):
                 if is_finish:
                     break
 
+                if kv_cache:
+                    index = torch.tensor([beam['cache_idx'] for beam in hyps], device=eouts.device)
+                    for layer in self.layers:
+                        layer.reorder_cache(index)
+
             # Global pruning
             if len(end_hyps) == 0:
                 end_hyps = hyps[:]
             elif len(end_hyps) < nbest and nbest > 1:
                 end_hyps.extend(hyps[:nbest - len(end_hyps)])
 
+            # Recover token sequences only for the final hypotheses
+            for hyp in end_hyps:
+                hyp['hyp'] = store.backtrack(hyp['node'])
+
             # forward second path LM rescoring
             helper.lm_rescoring(end_hyps, lm_second, lm_weight_second,
                                 normalize=length_norm, tag='second')
@@ -918,7 +998,188 @@ class TransformerDecoder(DecoderBase):
                 aws = [[aws[b][n][:, :-1] if eos_flags[b][n] else aws[b][n] for n in range(nbest)] for b in range(bs)]
 
         # Store ASR/LM state
-        if isinstance(lm, RNNLM):
+        if isinstance(lm, (RNNLM, NgramLM)):
             self.lmstate_final = end_hyps[0]['lmstate']
 
         return nbest_hyps_idx, aws, scores
+
+    def beam_search_block_sync(self, eouts, params, idx2token, hyps, lm=None,
+                               ctc_log_probs=None, end_hyps=None, is_last_block=False):
+        """Block-synchronous beam search decoding for streaming inference.
+
+        Encoder outputs in each block are appended to the cache of source-target attention,
+        and key/value of self-attention are carried over to the next block.
+        A label-synchronous step is taken only when enough encoder outputs are available,
+        which is decided by the number of CTC spikes (triggered attention) or token boundaries
+        detected by all monotonic heads (MMA). Otherwise, the beam waits for the next block.
+
+        Args:
+            eouts (FloatTensor): `[1, T_block, d_model]`
+            params (dict): hyperparameters for decoding
+            idx2token (): converter from index to token
+            hyps (List): active hypotheses in the previous block (None for the first block)
+            lm (torch.nn.module): firsh path LM
+            ctc_log_probs (FloatTensor): `[1, T_block, vocab]` (for triggered attention)
+            end_hyps (List): hypotheses ending with <eos> in the previous blocks
+            is_last_block (bool): decode until the maximum length without waiting for the next block
+        Returns:
+            end_hyps (List): hypotheses ending with <eos>
+            hyps (List): active hypotheses
+            aws: dummy
+
+        """
+        assert eouts.size(0) == 1
+        assert not self.bwd
+        mma = self.attn_type == 'mocha'
+        if not mma and ctc_log_probs is None:
+            raise ValueError('CTC posteriors are required for triggered attention.')
+        if '1dconv' in self.pe_type:
+            raise NotImplementedError
+        # NOTE: CTC is used only for triggering in the block-synchronous mode
+
+        beam_width = params['recog_beam_width']
+        max_len_ratio = params['recog_max_len_ratio']
+        min_len_ratio = params['recog_min_len_ratio']
+        lp_weight = params['recog_length_penalty']
+        length_norm = params['recog_length_norm']
+        lm_weight = params['recog_lm_weight']
+        eos_threshold = params['recog_eos_threshold']
+        softmax_smoothing = params['recog_softmax_smoothing']
+        eps_wait = params['recog_mma_delay_threshold']
+
+        helper = BeamSearch(beam_width, self.eos, 0., eouts.device)
+        lm = helper.verify_lm_eval_mode(lm, lm_weight)
+
+        if hyps is None:
+            # Initialization per segment
+            for layer in self.layers:
+                layer.reset()
+            self.n_frames = 0
+            self.n_triggers = 0
+            self.ctc_prev_token = self.blank
+            self.eouts_memory = None
+            end_hyps = []
+            hyps = [{'hyp': [self.eos],
+                     'score': 0.,
+                     'score_att': 0.,
+                     'score_lm': 0.,
+                     'aws': None,
+                     'lmstate': None,
+                     'cache_idx': 0}]
+
+        # Append encoder outputs in the current block to the memory of source-target attention
+        for layer in self.layers:
+            layer.extend_cache(eouts)
+        if self.eouts_memory is None:
+            self.eouts_memory = eouts
+        else:
+            self.eouts_memory = torch.cat([self.eouts_memory, eouts], dim=1)
+        self.n_frames += eouts.size(1)
+
+        # Count CTC spikes (trigger points)
+        if ctc_log_probs is not None and ctc_log_probs.size(1) > 0:
+            ctc_ids = ctc_log_probs[0].argmax(-1)
+            ctc_ids_prev = torch.cat([ctc_ids.new_tensor([self.ctc_prev_token]), ctc_ids[:-1]])
+            self.n_triggers += ((ctc_ids != self.blank) & (ctc_ids != ctc_ids_prev)).sum().item()
+            self.ctc_prev_token = ctc_ids[-1].item()
+
+        ymax = math.ceil(self.n_frames * max_len_ratio)
+        lth_s = self.mma_first_layer - 1
+        while len(hyps) > 0:
+            i = len(hyps[0]['hyp']) - 1
+            if i >= ymax:
+                break
+            if not mma and not is_last_block and i >= self.n_triggers:
+                break
+
+            # NOTE: key/value of self-attention are restored if the beam waits for the next block
+            kv_cache_prev = [(layer.self_attn.key, layer.self_attn.value) for layer in self.layers]
+
+            ys = eouts.new_tensor([beam['hyp'][-1] for beam in hyps], dtype=torch.int64).unsqueeze(1)
+
+            # Update LM states for shallow fusion
+            _, lmstate, scores_lm = helper.update_rnnlm_state_batch(lm, hyps, ys.clone())
+
+            out = self.pos_enc(self.embed(ys), offset=i)  # scaled + dropout
+            xy_aws_layers = []
+            for lth, layer in enumerate(self.layers):
+                xy_aws_prev = None
+                if mma and lth >= lth_s and i > 0:
+                    xy_aws_prev = torch.cat([beam['aws'][:, lth - lth_s] for beam in hyps], dim=0)
+                    # zero padding for encoder outputs appended after the previous step
+                    xy_aws_prev = torch.cat([xy_aws_prev, xy_aws_prev.new_zeros(
+                        xy_aws_prev.size()[:-1] + (self.n_frames - xy_aws_prev.size(-1),))], dim=-1)
+                out = layer(out, None, self.eouts_memory, None,
+                            xy_aws_prev=xy_aws_prev, eps_wait=eps_wait, kv_cache=True)
+                if mma and layer.xy_aws is not None:
+                    xy_aws_layers.append(layer.xy_aws)
+            probs = torch.softmax(self.output(self.norm_out(out[:, -1])) * softmax_smoothing, dim=1)
+            scores_att = torch.log(probs)
+
+            if mma:
+                xy_aws_layers = torch.stack(xy_aws_layers, dim=1)  # `[B, n_layers, H_ma, 1, T]`
+                if not is_last_block and (xy_aws_layers.sum(-1) == 0).any().item():
+                    # some monotonic heads have not detected token boundaries yet
+                    for layer, (key, value) in zip(self.layers, kv_cache_prev):
+                        layer.self_attn.key, layer.self_attn.value = key, value
+                    break
+
+            total_scores_att = scores_att.new_tensor([beam['score_att'] for beam in hyps]).unsqueeze(1) + scores_att
+            total_scores = total_scores_att.clone()
+            if lm is not None:
+                total_scores_lm = scores_lm.new_tensor([beam['score_lm'] for beam in hyps]).unsqueeze(1)
+                total_scores_lm = total_scores_lm + scores_lm[:, -1]
+                total_scores += total_scores_lm * lm_weight
+            else:
+                total_scores_lm = eouts.new_zeros(len(hyps), self.vocab)
+            total_scores_topk, topk_ids = torch.topk(total_scores, k=beam_width, dim=1, largest=True, sorted=True)
+
+            # Add length penalty
+            if lp_weight > 0:
+                total_scores_topk += (i + 1) * lp_weight
+
+            new_hyps = []
+            for j, beam in enumerate(hyps):
+                for k in range(beam_width):
+                    idx = topk_ids[j, k].item()
+                    total_score = total_scores_topk[j, k].item() / ((i + 1) if length_norm else 1)
+
+                    if idx == self.eos:
+                        # Exclude short hypotheses
+                        if i < self.n_frames * min_len_ratio:
+                            continue
+                        # EOS threshold
+                        max_score_no_eos = scores_att[j, :idx].max(0)[0].item()
+                        max_score_no_eos = max(max_score_no_eos, scores_att[j, idx + 1:].max(0)[0].item())
+                        if scores_att[j, idx].item() <= eos_threshold * max_score_no_eos:
+                            continue
+
+                    new_hyps.append({'hyp': beam['hyp'] + [idx],
+                                     'score': total_score,
+                                     'score_att': total_scores_att[j, idx].item(),
+                                     'score_lm': total_scores_lm[j, idx].item(),
+                                     'aws': xy_aws_layers[j:j + 1] if mma else None,
+                                     'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
+                                                 'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
+                                     'cache_idx': j})
+
+            # Local pruning
+            new_hyps_sorted = sorted(new_hyps, key=lambda x: x['score'], reverse=True)[:beam_width]
+
+            # Remove complete hypotheses
+            hyps, end_hyps, is_finish = helper.remove_complete_hyp(new_hyps_sorted, end_hyps, prune=True)
+            if is_finish:
+                hyps = []
+                break
+
+            if len(hyps) > 0:
+                index = torch.tensor([beam['cache_idx'] for beam in hyps], device=eouts.device)
+                for layer in self.layers:
+                    layer.reorder_cache(index)
+
+        if idx2token is not None and len(end_hyps + hyps) > 0:
+            best_hyp = max(end_hyps + hyps, key=lambda x: x['score'])
+            logger.debug('Hyp (T:%d, triggers:%d): %s' % (self.n_frames, self.n_triggers,
+                                                          idx2token(best_hyp['hyp'][1:])))
+
+        return end_hyps, hyps, None
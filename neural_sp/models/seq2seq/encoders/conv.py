@@ -5,10 +5,10 @@
 
 from distutils.util import strtobool
 import logging
-import math
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from neural_sp.models.modules.initialization import init_with_lecun_normal
 from neural_sp.models.seq2seq.encoders.encoder_base import EncoderBase
@@ -103,6 +103,12 @@ class ConvEncoder(EncoderBase):
 
         self.reset_parameters(param_init)
 
+        # for streaming inference
+        # NOTE: In the stateful mode, feature maps in each CNN block are cached
+        # and only new frames are processed in each call.
+        self.stateful = False
+        self.reset_cache()
+
     @staticmethod
     def add_args(parser, args):
         """Add arguments."""
@@ -169,17 +175,28 @@ class ConvEncoder(EncoderBase):
         for n, p in self.named_parameters():
             init_with_lecun_normal(n, p, param_init)
 
+    def reset_cache(self):
+        for block in self.layers:
+            block.reset_cache()
+        logger.debug('Reset cache.')
+
     def forward(self, xs, xlens, lookback=False, lookahead=False):
         """Forward pass.
 
         Args:
             xs (FloatTensor): `[B, T, F]`
             xlens (IntTenfor): `[B]` (on CPU)
+            lookback (bool): truncate leftmost frames for lookback in CNN context
+            lookahead (bool): truncate rightmost frames for lookahead in CNN context.
+                In the stateful mode, False means that no more frames follow in the stream.
         Returns:
             xs (FloatTensor): `[B, T', F']`
             xlens (IntTenfor): `[B]` (on CPU)
 
         """
+        if self.stateful:
+            return self.forward_stateful(xs, xlens, flush=not lookahead)
+
         B, T, F = xs.size()
         C_i = self.in_channel
         if not self.is_1dconv:
@@ -197,6 +214,49 @@ class ConvEncoder(EncoderBase):
 
         return xs, xlens
 
+    def forward_stateful(self, xs, xlens, flush=False):
+        """Forward pass for new frames in a stream.
+           Lookback frames are not required because feature maps needed for
+           the left context are cached in each CNN block. Outputs are delayed
+           until the right context of the CNN is available.
+
+        Args:
+            xs (FloatTensor): `[B, T, F]`
+            xlens (IntTenfor): `[B]` (on CPU)
+            flush (bool): pad the right context with zeros at the end of the stream
+        Returns:
+            xs (FloatTensor): `[B, T', F']`
+            xlens (IntTenfor): `[B]` (on CPU)
+
+        """
+        xs = xs[:, :xlens.max()]
+        B, T, F = xs.size()
+        C_i = self.in_channel
+        if self.is_1dconv:
+            xs = xs.transpose(2, 1)  # `[B, F, T]`
+        else:
+            xs = xs.view(B, T, C_i, F // C_i).contiguous().transpose(2, 1)  # `[B, C_i, T, F // C_i]`
+
+        for block in self.layers:
+            xs = block.forward_stateful(xs, flush)
+
+        if xs is None:
+            # outputs are not ready yet
+            odim = self.bridge.in_features if self.bridge is not None else self._odim
+            xs = self.layers[0].conv1.weight.new_zeros(B, 0, odim)
+        elif self.is_1dconv:
+            xs = xs.transpose(2, 1)  # `[B, T', C_o]`
+        else:
+            B, C_o, T, F = xs.size()
+            xs = xs.transpose(2, 1).contiguous().view(B, T, -1)  # `[B, T', C_o * F']`
+        xlens = torch.IntTensor([xs.size(1)] * B)
+
+        # Bridge layer
+        if self.bridge is not None:
+            xs = self.bridge(xs)
+
+        return xs, xlens
+
 
 class Conv1dBlock(EncoderBase):
     """1d-CNN block."""
@@ -247,6 +307,12 @@ class Conv1dBlock(EncoderBase):
                 self._odim = (self._odim // 2) * 2
                 # TODO(hirofumi0810): more efficient way?
 
+        # for streaming inference
+        self.reset_cache()
+
+    def reset_cache(self):
+        self.cache = {'conv1': None, 'conv2': None, 'pool': None, 'residual': None}
+
     def forward(self, xs, xlens, lookback=False, lookahead=False):
         """Forward pass.
 
@@ -286,6 +352,47 @@ class Conv1dBlock(EncoderBase):
 
         return xs, xlens
 
+    def forward_stateful(self, xs, flush=False):
+        """Forward pass for new frames in a stream.
+
+        Args:
+            xs (FloatTensor): `[B, F, T]`, None if there are no new frames
+            flush (bool): pad the right context with zeros at the end of the stream
+        Returns:
+            xs (FloatTensor): `[B, F', T']`, None if no outputs are ready
+
+        """
+        if self.residual:
+            self.cache['residual'] = cat_time(self.cache['residual'], xs)
+
+        xs, self.cache['conv1'] = cached_conv(self.conv1, xs, self.cache['conv1'], flush)
+        if xs is not None:
+            xs = xs.transpose(2, 1)
+            xs = self.batch_norm1(xs)
+            xs = self.layer_norm1(xs)
+            xs = torch.relu(xs)
+            xs = self.dropout(xs)
+            xs = xs.transpose(2, 1)
+
+        xs, self.cache['conv2'] = cached_conv(self.conv2, xs, self.cache['conv2'], flush)
+        if xs is not None:
+            xs = xs.transpose(2, 1)
+            xs = self.batch_norm2(xs)
+            xs = self.layer_norm2(xs)
+            xs = xs.transpose(2, 1)
+            if self.residual:
+                residual = self.cache['residual'][:, :, :xs.size(2)]
+                self.cache['residual'] = self.cache['residual'][:, :, xs.size(2):]
+                if xs.size() == residual.size():
+                    xs += residual
+            xs = torch.relu(xs)
+            xs = self.dropout(xs)
+
+        if self.pool is not None:
+            xs, self.cache['pool'] = cached_pool(self.pool, xs, self.cache['pool'], flush)
+
+        return xs
+
 
 class Conv2dBlock(EncoderBase):
     """2d-CNN block."""
@@ -341,6 +448,12 @@ class Conv2dBlock(EncoderBase):
             # calculate subsampling factor
             self._factor *= pooling[0]
 
+        # for streaming inference
+        self.reset_cache()
+
+    def reset_cache(self):
+        self.cache = {'conv1': None, 'conv2': None, 'pool': None, 'residual': None}
+
     def forward(self, xs, xlens, lookback=False, lookahead=False):
         """Forward pass.
 
@@ -396,6 +509,43 @@ class Conv2dBlock(EncoderBase):
 
         return xs, xlens
 
+    def forward_stateful(self, xs, flush=False):
+        """Forward pass for new frames in a stream.
+
+        Args:
+            xs (FloatTensor): `[B, C_i, T, F]`, None if there are no new frames
+            flush (bool): pad the right context with zeros at the end of the stream
+        Returns:
+            xs (FloatTensor): `[B, C_o, T', F']`, None if no outputs are ready
+
+        """
+        if self.residual:
+            self.cache['residual'] = cat_time(self.cache['residual'], xs)
+
+        xs, self.cache['conv1'] = cached_conv(self.conv1, xs, self.cache['conv1'], flush)
+        if xs is not None:
+            xs = self.batch_norm1(xs)
+            xs = self.layer_norm1(xs)
+            xs = torch.relu(xs)
+            xs = self.dropout(xs)
+
+        xs, self.cache['conv2'] = cached_conv(self.conv2, xs, self.cache['conv2'], flush)
+        if xs is not None:
+            xs = self.batch_norm2(xs)
+            xs = self.layer_norm2(xs)
+            if self.residual:
+                residual = self.cache['residual'][:, :, :xs.size(2)]
+                self.cache['residual'] = self.cache['residual'][:, :, xs.size(2):]
+                if xs.size() == residual.size():
+                    xs += residual  # NOTE: this is the same place as in ResNet
+            xs = torch.relu(xs)
+            xs = self.dropout(xs)
+
+        if self.pool is not None:
+            xs, self.cache['pool'] = cached_pool(self.pool, xs, self.cache['pool'], flush)
+
+        return xs
+
 
 class LayerNorm2D(nn.Module):
     """Layer normalization for CNN outputs."""
@@ -435,19 +585,16 @@ def update_lens_1d(seq_lens, layer):
         return seq_lens
     assert isinstance(seq_lens, torch.IntTensor)
     assert type(layer) in [nn.Conv1d, nn.MaxPool1d]
-    # seq_lens = [_update_1d(seq_len.item(), layer) for seq_len in seq_lens]
-    seq_lens = [_update_1d(seq_len, layer) for seq_len in seq_lens]
-    seq_lens = torch.IntTensor(seq_lens)
+    # NOTE: keep tensor operations so that lengths are not baked into traced graphs
+    seq_lens = _update_1d(seq_lens, layer).int()
     return seq_lens
 
 
 def _update_1d(seq_len, layer):
     if type(layer) == nn.MaxPool1d and layer.ceil_mode:
-        return math.ceil(
-            (seq_len + 1 + 2 * layer.padding - (layer.kernel_size - 1) - 1) // layer.stride + 1)
+        return (seq_len + 1 + 2 * layer.padding - (layer.kernel_size - 1) - 1) // layer.stride + 1
     else:
-        return math.floor(
-            (seq_len + 2 * layer.padding[0] - (layer.kernel_size[0] - 1) - 1) // layer.stride[0] + 1)
+        return (seq_len + 2 * layer.padding[0] - (layer.kernel_size[0] - 1) - 1) // layer.stride[0] + 1
 
 
 def update_lens_2d(seq_lens, layer, dim=0):
@@ -465,19 +612,108 @@ def update_lens_2d(seq_lens, layer, dim=0):
         return seq_lens
     assert isinstance(seq_lens, torch.IntTensor)
     assert type(layer) in [nn.Conv2d, nn.MaxPool2d]
-    # seq_lens = [_update_2d(seq_len.item(), layer, dim) for seq_len in seq_lens]
-    seq_lens = [_update_2d(seq_len, layer, dim) for seq_len in seq_lens]
-    seq_lens = torch.IntTensor(seq_lens)
+    # NOTE: keep tensor operations so that lengths are not baked into traced graphs
+    seq_lens = _update_2d(seq_lens, layer, dim).int()
     return seq_lens
 
 
 def _update_2d(seq_len, layer, dim):
     if type(layer) == nn.MaxPool2d and layer.ceil_mode:
-        return math.ceil(
-            (seq_len + 1 + 2 * layer.padding[dim] - (layer.kernel_size[dim] - 1) - 1) // layer.stride[dim] + 1)
+        return (seq_len + 1 + 2 * layer.padding[dim] - (layer.kernel_size[dim] - 1) - 1) // layer.stride[dim] + 1
+    else:
+        return (seq_len + 2 * layer.padding[dim] - (layer.kernel_size[dim] - 1) - 1) // layer.stride[dim] + 1
+
+
+def cat_time(cache, xs):
+    """Concatenate cached frames and new frames along the time axis.
+
+    Args:
+        cache (FloatTensor): `[B, C, T_cache, (F)]` or None
+        xs (FloatTensor): `[B, C, T, (F)]` or None
+    Returns:
+        xs (FloatTensor): `[B, C, T_cache + T, (F)]` or None
+
+    """
+    if cache is None:
+        return xs
+    if xs is None:
+        return cache
+    return torch.cat([cache, xs], dim=2)
+
+
+def cached_conv(layer, xs, cache, flush=False):
+    """Convolve only new frames along the time axis.
+       The rightmost frames are cached until the right context of the kernel
+       is available, so the concatenated outputs over all calls are the same
+       as those of the full-length input.
+
+    Args:
+        layer (nn.Conv1d or nn.Conv2d): convolution layer
+        xs (FloatTensor): `[B, C_i, T, (F)]`, None if there are no new frames
+        cache (FloatTensor): `[B, C_i, T_cache, (F)]` frames cached in the previous call
+        flush (bool): pad the right context with zeros at the end of the stream
+    Returns:
+        xs (FloatTensor): `[B, C_o, T', (F')]`, None if no outputs are ready
+        cache (FloatTensor): `[B, C_i, T_cache', (F)]`
+
+    """
+    pad = layer.padding[0]
+    stride = layer.stride[0]
+    if cache is None and xs is not None:
+        # zero padding for the leftmost context at the beginning of the stream
+        size = list(xs.size())
+        size[2] = pad
+        cache = xs.new_zeros(size)
+    xs = cat_time(cache, xs)
+    if xs is None:
+        return None, None
+    if flush and pad > 0:
+        size = list(xs.size())
+        size[2] = pad
+        xs = torch.cat([xs, xs.new_zeros(size)], dim=2)
+
+    receptive_field = layer.dilation[0] * (layer.kernel_size[0] - 1) + 1
+    if xs.size(2) < receptive_field:
+        return None, xs
+    n_frames = (xs.size(2) - receptive_field) // stride + 1
+    cache = xs[:, :, n_frames * stride:]
+
+    # no padding along the time axis
+    if isinstance(layer, nn.Conv2d):
+        xs = F.conv2d(xs, layer.weight, layer.bias, layer.stride,
+                      (0, layer.padding[1]), layer.dilation, layer.groups)
     else:
-        return math.floor(
-            (seq_len + 2 * layer.padding[dim] - (layer.kernel_size[dim] - 1) - 1) // layer.stride[dim] + 1)
+        xs = F.conv1d(xs, layer.weight, layer.bias, layer.stride,
+                      0, layer.dilation, layer.groups)
+    return xs, cache
+
+
+def cached_pool(layer, xs, cache, flush=False):
+    """Max-pool only new frames along the time axis.
+       Frames that do not fill a pooling window are cached for the next call.
+
+    Args:
+        layer (nn.MaxPool1d or nn.MaxPool2d): kernel size must be the same as stride
+        xs (FloatTensor): `[B, C, T, (F)]`, None if there are no new frames
+        cache (FloatTensor): `[B, C, T_cache, (F)]` frames cached in the previous call
+        flush (bool): pool the remaining frames at the end of the stream
+    Returns:
+        xs (FloatTensor): `[B, C, T', (F')]`, None if no outputs are ready
+        cache (FloatTensor): `[B, C, T_cache', (F)]`
+
+    """
+    pooling = layer.kernel_size if isinstance(layer, nn.MaxPool1d) else layer.kernel_size[0]
+    xs = cat_time(cache, xs)
+    if xs is None:
+        return None, None
+
+    n_frames = xs.size(2)
+    if not (flush and layer.ceil_mode):
+        n_frames = (n_frames // pooling) * pooling
+    cache = xs[:, :, n_frames:]
+    if n_frames == 0:
+        return None, cache
+    return layer(xs[:, :, :n_frames]), cache
 
 
 def parse_cnn_config(channels, kernel_sizes, strides, poolings):
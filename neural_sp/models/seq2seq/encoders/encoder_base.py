@@ -3,6 +3,7 @@
 
 """Base class for encoders."""
 
+import copy
 import logging
 import os
 import shutil
@@ -54,6 +55,29 @@ class EncoderBase(ModelBase):
     def reset_cache(self):
         raise NotImplementedError
 
+    def get_cache(self):
+        """Get caches for streaming inference to switch between streams.
+
+        Returns:
+            cache (dict): caches of all sub-modules keyed by (module name, attribute)
+
+        """
+        return {(name, attr): copy.copy(getattr(module, attr))
+                for name, module in self.named_modules()
+                for attr in ['cache', 'hx_fwd'] if hasattr(module, attr)}
+
+    def set_cache(self, cache):
+        """Restore caches returned by get_cache().
+
+        Args:
+            cache (dict): caches of all sub-modules keyed by (module name, attribute)
+
+        """
+        modules = dict(self.named_modules())
+        for (name, attr), v in cache.items():
+            # NOTE: copy containers because caches are updated in-place
+            setattr(modules[name], attr, copy.copy(v))
+
     def turn_on_ceil_mode(self, encoder):
         if isinstance(encoder, torch.nn.Module):
             for name, module in encoder.named_children():
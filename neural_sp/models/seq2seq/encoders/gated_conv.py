@@ -8,6 +8,7 @@
 
 from collections import OrderedDict
 import logging
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
@@ -51,7 +52,6 @@ class GatedConvEncoder(EncoderBase):
         layers = OrderedDict()
         for lth in range(len(channels)):
             layers['conv%d' % lth] = ConvGLUBlock(kernel_sizes[lth][0], input_dim, channels[lth],
-                                                  weight_norm=True,
                                                   dropout=0.2)
             input_dim = channels[lth]
 
@@ -69,8 +69,17 @@ class GatedConvEncoder(EncoderBase):
 
         self._factor = 1
 
+        # for streaming
+        self.enc_type = 'gated_conv'
+        self.conv = None
+        self.chunk_size_current = 0
+        self.chunk_size_right = 0
+
         self.reset_parameters(param_init)
 
+        # for streaming inference
+        self.reset_cache()
+
     @staticmethod
     def define_name(dir_name, args):
         return dir_name
@@ -89,13 +98,19 @@ class GatedConvEncoder(EncoderBase):
             else:
                 raise ValueError(n)
 
+    def reset_cache(self):
+        for layer in self.layers:
+            layer.reset_cache()
+        logger.debug('Reset cache.')
+
     def forward(self, xs, xlens, task, streaming=False, lookback=False, lookahead=False):
         """Forward pass.
 
         Args:
             xs (FloatTensor): `[B, T, F]`
             xlens (IntTensor): `[B]`
-            streaming (bool): streaming encoding
+            streaming (bool): streaming encoding.
+                Only new frames are fed and the convolution context is cached in each layer.
             lookback (bool): truncate leftmost frames for lookback in CNN context
             lookahead (bool): truncate rightmost frames for lookahead in CNN context
         Returns:
@@ -108,10 +123,18 @@ class GatedConvEncoder(EncoderBase):
                  'ys_sub1': {'xs': None, 'xlens': None},
                  'ys_sub2': {'xs': None, 'xlens': None}}
 
+        if streaming:
+            xs = xs[:, :xlens.max()]
+            xlens = torch.IntTensor([xs.size(1)] * xs.size(0))
         bs, xmax, input_dim = xs.size()
         xs = xs.transpose(2, 1).unsqueeze(3)  # `[B, in_ch (input_dim), T, 1]`
 
-        xs = self.layers(xs)  # `[B, out_ch, T, 1]`
+        if streaming:
+            # causal convolution does not need lookahead frames
+            for layer in self.layers:
+                xs = layer.forward_stateful(xs)
+        else:
+            xs = self.layers(xs)  # `[B, out_ch, T, 1]`
         bs, out_ch, xmax, freq = xs.size()
         xs = xs.transpose(2, 1).contiguous().view(bs, xmax, -1)  # `[B, T, out_ch * feat_dim]`
 
@@ -277,6 +277,8 @@ class RNNEncoder(EncoderBase):
             init_with_uniform(n, p, param_init)
 
     def reset_cache(self):
+        if self.conv is not None:
+            self.conv.reset_cache()
         self.hx_fwd = [None] * self.n_layers
         logger.debug('Reset cache.')
 
@@ -325,6 +327,11 @@ class RNNEncoder(EncoderBase):
                 eouts['ys']['xs'] = xs
                 eouts['ys']['xlens'] = xlens
                 return eouts
+            if streaming and xs.size(1) == 0:
+                # CNN outputs are not ready yet when they are cached in the streaming mode
+                eouts['ys']['xs'] = xs.new_zeros(bs, 0, self._odim)
+                eouts['ys']['xlens'] = xlens
+                return eouts
             if self.lc_bidir:
                 N_c = N_c // self.conv.subsampling_factor
                 N_r = N_r // self.conv.subsampling_factor
@@ -540,7 +547,7 @@ class Padding(nn.Module):
 
     def forward(self, xs, xlens, rnn, prev_state=None, streaming=False):
         if not streaming and xlens is not None:
-            xs = pack_padded_sequence(xs, xlens.tolist(), batch_first=True)
+            xs = pack_padded_sequence(xs, xlens.cpu(), batch_first=True)
             xs, state = rnn(xs, hx=prev_state)
             xs = pad_packed_sequence(xs, batch_first=True)[0]
         else:
@@ -3,7 +3,6 @@
 
 """Subsampling layers."""
 
-import math
 import torch
 import torch.nn as nn
 
@@ -38,17 +37,17 @@ class ConcatSubsampler(nn.Module):
         if batch_first:
             xs = xs.transpose(1, 0).contiguous()
 
-        xs = [torch.cat([xs[t - r:t - r + 1] for r in range(self.factor - 1, -1, -1)], dim=-1)
-              for t in range(xs.size(0)) if (t + 1) % self.factor == 0]
-        xs = torch.cat(xs, dim=0)
         # NOTE: Exclude the last frames if the length is not divisible
+        xmax, bs, idim = xs.size()
+        xs = xs[:xmax // self.factor * self.factor]
+        xs = xs.view(-1, self.factor, bs, idim).transpose(2, 1).contiguous()
+        xs = xs.view(-1, bs, idim * self.factor)
         xs = torch.relu(self.proj(xs))
 
         if batch_first:
             xs = xs.transpose(1, 0)
 
-        xlens = [max(1, i.item() // self.factor) for i in xlens]
-        xlens = torch.IntTensor(xlens)
+        xlens = torch.clamp(xlens // self.factor, min=1)
         return xs, xlens
 
 
@@ -124,8 +123,7 @@ class DropSubsampler(nn.Module):
         else:
             xs = xs[::self.factor]
 
-        xlens = [max(1, math.ceil(i.item() / self.factor)) for i in xlens]
-        xlens = torch.IntTensor(xlens)
+        xlens = torch.clamp((xlens + self.factor - 1) // self.factor, min=1)
         return xs, xlens
 
 
@@ -156,22 +154,18 @@ class AddSubsampler(nn.Module):
         if batch_first:
             bs, xmax, idim = xs.size()
             xs_even = xs[:, ::self.factor]
-            if xmax % 2 == 0:
-                xs_odd = xs[:, 1::self.factor]
-            else:
-                xs_odd = torch.cat([xs, xs.new_zeros(bs, 1, idim)], dim=1)[:, 1::self.factor]
+            # NOTE: zero-pad the last odd frame without branching on the length
+            xs_odd = torch.cat([xs, xs.new_zeros(bs, 1, idim)], dim=1)[:, 1::self.factor]
+            xs_odd = xs_odd[:, :xs_even.size(1)]
         else:
             xmax, bs, idim = xs.size()
             xs_even = xs[::self.factor]
-            if xmax % 2 == 0:
-                xs_odd = xs[1::self.factor]
-            else:
-                xs_odd = torch.cat([xs, xs.new_zeros(1, bs, idim)], dim=0)[1::self.factor]
+            xs_odd = torch.cat([xs, xs.new_zeros(1, bs, idim)], dim=0)[1::self.factor]
+            xs_odd = xs_odd[:xs_even.size(0)]
 
         xs = xs_odd + xs_even
 
-        xlens = [max(1, math.ceil(i.item() / self.factor)) for i in xlens]
-        xlens = torch.IntTensor(xlens)
+        xlens = torch.clamp((xlens + self.factor - 1) // self.factor, min=1)
         return xs, xlens
 
 
@@ -11,6 +11,8 @@ import math
 import torch
 import torch.nn as nn
 
+from neural_sp.models.seq2seq.encoders.conv import cached_conv
+from neural_sp.models.seq2seq.encoders.conv import cat_time
 from neural_sp.models.seq2seq.encoders.conv import ConvEncoder
 from neural_sp.models.seq2seq.encoders.conv import LayerNorm2D
 from neural_sp.models.seq2seq.encoders.conv import parse_cnn_config
@@ -81,8 +83,17 @@ class TDSEncoder(EncoderBase):
 
         self._factor = 8
 
+        # for streaming
+        self.enc_type = 'tds'
+        self.conv = None
+        self.chunk_size_current = 0
+        self.chunk_size_right = 0
+
         self.reset_parameters()
 
+        # for streaming inference
+        self.reset_cache()
+
     @staticmethod
     def add_args(parser, args):
         # group = parser.add_argument_group("TDS encoder")
@@ -115,15 +126,22 @@ class TDSEncoder(EncoderBase):
             else:
                 raise ValueError(n)
 
+    def reset_cache(self):
+        for layer in self.layers:
+            layer.reset_cache()
+        logger.debug('Reset cache.')
+
     def forward(self, xs, xlens, task, streaming=False, lookback=False, lookahead=False):
         """Forward pass.
 
         Args:
             xs (FloatTensor): `[B, T, F]`
             xlens (IntTensor): `[B]`
-            streaming (bool): streaming encoding
+            streaming (bool): streaming encoding.
+                Only new frames are fed and the convolution context is cached in each layer.
             lookback (bool): truncate leftmost frames for lookback in CNN context
-            lookahead (bool): truncate rightmost frames for lookahead in CNN context
+            lookahead (bool): truncate rightmost frames for lookahead in CNN context.
+                In the streaming mode, False means that no more frames follow in the stream.
         Returns:
             eouts (dict):
                 xs (FloatTensor): `[B, T', C_o * F]`
@@ -134,14 +152,28 @@ class TDSEncoder(EncoderBase):
                  'ys_sub1': {'xs': None, 'xlens': None},
                  'ys_sub2': {'xs': None, 'xlens': None}}
 
+        if streaming:
+            xs = xs[:, :xlens.max()]
         B, T, F = xs.size()
         xs = xs.contiguous().view(B, T, self.C_in, F // self.C_in).transpose(2, 1)
         # `[B, C_i, T, F // C_i]`
 
-        for layer in self.layers:
-            xs, xlens = layer(xs, xlens)
-        B, C_o, T, F = xs.size()
-        xs = xs.transpose(2, 1).contiguous().view(B, T, -1)  # `[B, T, C_o * F]`
+        if streaming:
+            for layer in self.layers:
+                xs = layer.forward_stateful(xs, flush=not lookahead)
+            if xs is None:
+                # outputs are delayed until the right context is available
+                odim = self.bridge.in_features if self.bridge is not None else self._odim
+                xs = self.layers[0].conv1d.weight.new_zeros(B, 0, odim)
+            else:
+                B, C_o, T, F = xs.size()
+                xs = xs.transpose(2, 1).contiguous().view(B, T, -1)  # `[B, T, C_o * F]`
+            xlens = torch.IntTensor([xs.size(1)] * B)
+        else:
+            for layer in self.layers:
+                xs, xlens = layer(xs, xlens)
+            B, C_o, T, F = xs.size()
+            xs = xs.transpose(2, 1).contiguous().view(B, T, -1)  # `[B, T, C_o * F]`
 
         # Bridge layer
         if self.bridge is not None:
@@ -194,6 +226,12 @@ class TDSBlock(nn.Module):
         # self.feed_forward = nn.Linear(in_freq * channel, in_freq * channel)
         self.norm2 = LayerNorm2D(channel, in_freq, eps=layer_norm_eps)
 
+        # for streaming inference
+        self.reset_cache()
+
+    def reset_cache(self):
+        self.cache = {'conv1d': None, 'residual': None}
+
     def forward(self, xs, xlens):
         """Forward pass.
 
@@ -234,6 +272,44 @@ class TDSBlock(nn.Module):
         xs = self.norm2(xs)  # not depends on time-axis based on https://arxiv.org/abs/2001.09727
         return xs, xlens
 
+    def forward_stateful(self, xs, flush=False):
+        """Forward pass for new frames in a stream.
+
+        Args:
+            xs (FloatTensor): `[B, C, T, F]`, None if there are no new frames
+            flush (bool): pad the right context with zeros at the end of the stream
+        Returns:
+            xs (FloatTensor): `[B, C, T', F]`, None if no outputs are ready
+
+        """
+        self.cache['residual'] = cat_time(self.cache['residual'], xs)
+
+        # 1d conv
+        if xs is not None:
+            B, C, T, F = xs.size()
+            xs = xs.transpose(3, 2).contiguous().view(B, C * F, T)
+        xs, self.cache['conv1d'] = cached_conv(self.conv1d, xs, self.cache['conv1d'], flush)
+        if xs is None:
+            return None
+        B, C, _, F = self.cache['residual'].size()
+        xs = self.dropout(torch.relu(xs))
+        xs = xs.view(B, -1, F, xs.size(2)).transpose(3, 2)
+        residual = self.cache['residual'][:, :, :xs.size(2)]
+        self.cache['residual'] = self.cache['residual'][:, :, xs.size(2):]
+        xs = xs + residual  # `[B, C, T', F]`
+        xs = self.norm1(xs)
+
+        # fully connected block
+        B, C, T, F = xs.size()
+        residual = xs
+        xs = xs.transpose(3, 2).contiguous().view(B, C * F, T)
+        xs = self.dropout(torch.relu(self.pointwise_conv1(xs)))
+        xs = self.dropout(self.pointwise_conv2(xs))
+        xs = xs.view(B, -1, F, T).transpose(3, 2)  # `[B, C, T', F]`
+        xs = xs + residual
+        xs = self.norm2(xs)
+        return xs
+
 
 class SubsampleBlock(nn.Module):
     def __init__(self, in_channel, out_channel, kernel_size, stride, in_freq,
@@ -253,6 +329,12 @@ class SubsampleBlock(nn.Module):
         self.dropout = nn.Dropout(p=dropout)
         self.norm = LayerNorm2D(out_channel, in_freq, eps=layer_norm_eps)
 
+        # for streaming inference
+        self.reset_cache()
+
+    def reset_cache(self):
+        self.cache = {'conv1d': None}
+
     def forward(self, xs, xlens):
         """Forward pass.
 
@@ -272,3 +354,24 @@ class SubsampleBlock(nn.Module):
 
         xlens = update_lens_1d(xlens, self.conv1d)
         return xs, xlens
+
+    def forward_stateful(self, xs, flush=False):
+        """Forward pass for new frames in a stream.
+
+        Args:
+            xs (FloatTensor): `[B, C_i, T, F]`, None if there are no new frames
+            flush (bool): pad the right context with zeros at the end of the stream
+        Returns:
+            xs (FloatTensor): `[B, C_o, T', F]`, None if no outputs are ready
+
+        """
+        if xs is not None:
+            B, C, T, F = xs.size()
+            xs = xs.transpose(3, 2).contiguous().view(B, C * F, T)
+        xs, self.cache['conv1d'] = cached_conv(self.conv1d, xs, self.cache['conv1d'], flush)
+        if xs is None:
+            return None
+        xs = self.dropout(torch.relu(xs))
+        xs = xs.view(xs.size(0), self.C_out, self.in_freq, -1).transpose(3, 2)
+        xs = self.norm(xs)
+        return xs
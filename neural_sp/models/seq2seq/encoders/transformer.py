@@ -392,10 +392,28 @@ class TransformerEncoder(EncoderBase):
                 nn.init.xavier_uniform_(self.v_bias)
 
     def reset_cache(self):
-        self.frontend_cache = None  # TODO
+        if self.conv is not None:
+            self.conv.reset_cache()
         self.cache = [None] * self.n_layers
         logger.debug('Reset cache.')
 
+    def set_checkpointing(self, n_layers):
+        """Apply activation checkpointing to lower encoder layers during training.
+
+        Args:
+            n_layers (int): number of layers from the bottom.
+                -1 means all layers including task specific layers.
+
+        """
+        if n_layers < 0:
+            n_layers = self.n_layers
+        for lth, layer in enumerate(self.layers):
+            layer.checkpoint = lth < n_layers
+        for sub in ['sub1', 'sub2']:
+            if hasattr(self, 'layer_' + sub):
+                getattr(self, 'layer_' + sub).checkpoint = getattr(self, 'n_layers_' + sub) <= n_layers
+        logger.info('Activation checkpointing in %d encoder layers' % min(n_layers, self.n_layers))
+
     def forward(self, xs, xlens, task, streaming=False,
                 lookback=False, lookahead=False):
         """Forward pass.
@@ -464,6 +482,11 @@ class TransformerEncoder(EncoderBase):
             eouts['ys']['xs'] = xs
             eouts['ys']['xlens'] = xlens
             return eouts
+        if streaming and xs.size(1) == 0:
+            # CNN outputs are not ready yet when they are cached in the streaming mode
+            eouts['ys']['xs'] = xs.new_zeros(bs, 0, self._odim)
+            eouts['ys']['xlens'] = xlens
+            return eouts
 
         if not streaming:
             self.reset_cache()
@@ -11,6 +11,7 @@ import torch.nn as nn
 from neural_sp.models.modules.multihead_attention import MultiheadAttentionMechanism as MHA
 from neural_sp.models.modules.positionwise_feed_forward import PositionwiseFeedForward as FFN
 from neural_sp.models.modules.relative_multihead_attention import RelativeMultiheadAttentionMechanism as RelMHA
+from neural_sp.models.torch_utils import checkpoint_forward
 
 random.seed(1)
 
@@ -66,6 +67,9 @@ class TransformerEncoderBlock(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.dropout_layer = dropout_layer
 
+        # activation checkpointing
+        self.checkpoint = False
+
         self.reset_visualization()
 
     @property
@@ -97,7 +101,6 @@ class TransformerEncoderBlock(nn.Module):
         """
         self.reset_visualization()
         new_cache = {}
-        qlen = xs.size(1)
 
         # LayerDrop
         if self.dropout_layer > 0:
@@ -106,6 +109,17 @@ class TransformerEncoderBlock(nn.Module):
             else:
                 xs = xs / (1 - self.dropout_layer)
 
+        if self.checkpoint and self.training and cache is None:
+            # NOTE: LayerDrop is determined outside the recomputed region
+            xs = checkpoint_forward(lambda *args: self._forward(*args)[0],
+                                    xs, xx_mask, None, pos_embs, u_bias, v_bias)
+            return xs, new_cache
+        return self._forward(xs, xx_mask, cache, pos_embs, u_bias, v_bias)
+
+    def _forward(self, xs, xx_mask, cache, pos_embs, u_bias, v_bias):
+        new_cache = {}
+        qlen = xs.size(1)
+
         ##################################################
         # self-attention
         ##################################################
@@ -29,7 +29,8 @@ class Streaming(object):
         self.idx2token = idx2token
 
         if self.enc_type in ['lstm', 'conv_lstm', 'conv_uni_transformer',
-                             'conv_uni_conformer', 'conv_uni_conformer_v2']:
+                             'conv_uni_conformer', 'conv_uni_conformer_v2',
+                             'tds', 'gated_conv']:
             self.streaming_type = 'unidir'
         elif 'lstm' in self.enc_type or 'gru' in self.enc_type:
             self.streaming_type = 'lc_bidir'
@@ -64,6 +65,8 @@ class Streaming(object):
         self._n_blanks = 0  # number of blank frames
         self._n_accum_frames = 0
         self._bd_offset = -1  # boudnary offset in each block (AFTER subsampling)
+        self._eout_offset = 0  # input offset of the first encoder output in each block (BEFORE subsampling)
+        self._n_eouts = 0  # number of encoder outputs in each block (AFTER subsampling)
 
         # for CNN frontend
         self.conv_context = encoder.conv.context_size if encoder.conv is not None else 0
@@ -71,6 +74,14 @@ class Streaming(object):
             self.conv_context = 0
             # NOTE: CNN lookahead surpassing a block is not allowed in LC-Transformer/Conformer.
             # Unidirectional Transformer/Conformer can use lookahead in frontend CNN.
+        self.cnn_cache = params['recog_cnn_cache'] and self.streaming_type == 'unidir' and self.conv_context > 0
+        if self.enc_type in ['tds', 'gated_conv']:
+            self.cnn_cache = True
+            # NOTE: convolution context is always cached inside fully-convolutional encoders
+        if self.cnn_cache:
+            self.conv_context = 0
+            # NOTE: feature maps for the CNN context are cached inside the encoder,
+            # so that lookback/lookahead frames are not sliced in each block.
 
         # for test
         self._eout_blocks = []
@@ -111,6 +122,23 @@ class Streaming(object):
     def next_block(self):
         self._offset += self.N_c
 
+    def update_eout_offset(self, n_eouts, is_reset):
+        """Locate encoder outputs of the current block in the input stream.
+
+        When feature maps of the frontend CNN are cached, encoder outputs are delayed
+        by the right context of the CNN, so that they do not start from the current input offset.
+
+        Args:
+            n_eouts (int): number of encoder outputs in the current block (AFTER subsampling)
+            is_reset (bool): encoder states are reset before encoding the current block
+
+        """
+        if is_reset:
+            self._eout_offset = self._offset
+        else:
+            self._eout_offset += self._n_eouts * self._factor
+        self._n_eouts = n_eouts
+
     def extract_feature(self):
         """Slice acoustic features.
 
@@ -118,7 +146,8 @@ class Streaming(object):
             x_block (np.array): `[T_block, input_dim]`
             is_last_block (bool): flag for the last input block
             cnn_lookback (bool): use lookback frames in CNN
-            cnn_lookahead (bool): use lookahead frames in CNN
+            cnn_lookahead (bool): use lookahead frames in CNN.
+                When CNN outputs are cached, this is False only in the last block.
             xlen_block (int): input length of the cernter region in a block (for the last block)
 
         """
@@ -154,7 +183,7 @@ class Streaming(object):
             padded_xmax = N_c + N_r + N_conv
 
         # zero padding for the last blocks
-        if len(x_block) != padded_xmax:
+        if len(x_block) != padded_xmax and not self.cnn_cache:
             zero_pad = np.zeros((padded_xmax - len(x_block), self.input_dim)).astype(np.float32)
             x_block = np.concatenate([x_block, zero_pad], axis=0)
 
@@ -200,6 +229,10 @@ class Streaming(object):
                 print('All blank segments')
             if self._n_blanks * self._factor >= self.BLANK_THRESHOLD:
                 is_reset = True
+                if self.cnn_cache:
+                    # NOTE: back off to the frame next to the block so that
+                    # input frames delayed inside the CNN are encoded again after reset
+                    self._bd_offset = xmax_block - 1
             return is_reset
 
         n_blanks_tmp = self._n_blanks
@@ -230,6 +263,17 @@ class Streaming(object):
         return is_reset
 
     def backoff(self, x_block, decoder, stdout=False):
+        if self.cnn_cache:
+            # NOTE: encoder outputs lag behind the input block by the right context of the CNN
+            offset_bd = self._eout_offset + (self._bd_offset + 1) * self._factor
+            if 0 <= self._bd_offset and offset_bd < self._offset:
+                decoder.n_frames = 0
+                offset_prev = self._offset
+                self._offset = offset_bd
+                if stdout:
+                    print('Back %d frames (%d -> %d)' % (offset_prev - self._offset, offset_prev, self._offset))
+            return
+
         if 0 <= self._bd_offset * self._factor < self.N_c - 1:
             # boundary located in the middle of the current block
             decoder.n_frames = 0
@@ -4,15 +4,18 @@
 """Speech to text sequence-to-sequence model."""
 
 import copy
+import functools
 import logging
 import math
 import numpy as np
 import random
+import time
 import torch
 import torch.nn as nn
 
 from neural_sp.bin.train_utils import load_checkpoint
 from neural_sp.models.base import ModelBase
+from neural_sp.models.lm.ngram import NgramLM
 from neural_sp.models.lm.rnnlm import RNNLM
 from neural_sp.models.seq2seq.decoders.build import build_decoder
 from neural_sp.models.seq2seq.decoders.fwd_bwd_attention import fwd_bwd_attention
@@ -28,6 +31,7 @@ from neural_sp.models.seq2seq.frontends.splicing import splice
 from neural_sp.models.seq2seq.frontends.streaming import Streaming
 from neural_sp.models.torch_utils import (
     np2tensor,
+    parallel_apply,
     tensor2np,
     pad_list
 )
@@ -94,6 +98,9 @@ class Speech2Text(ModelBase):
         # for discourse-aware model
         self.utt_id_prev = None
 
+        # for streaming inference
+        self.chunk_latencies = []
+
         # Feature extraction
         self.input_noise_std = args.input_noise_std
         self.n_stacks = args.n_stacks
@@ -130,6 +137,9 @@ class Speech2Text(ModelBase):
             for n, p in self.enc.named_parameters():
                 p.requires_grad = False
                 logger.info('freeze %s' % n)
+        if getattr(args, 'enc_n_layers_checkpoint', 0) != 0:
+            assert 'transformer' in args.enc_type or 'conformer' in args.enc_type
+            self.enc.set_checkpointing(args.enc_n_layers_checkpoint)
 
         special_symbols = {
             'blank': self.blank,
@@ -162,7 +172,10 @@ class Speech2Text(ModelBase):
                                 self.ctc_weight,
                                 args.ctc_fc_list,
                                 self.main_weight - self.bwd_weight if dir == 'fwd' else self.bwd_weight,
-                                external_lm)
+                                external_lm, backward=(dir == 'bwd'))
+            if getattr(args, 'dec_n_layers_checkpoint', 0) != 0:
+                assert 'transformer' in args.dec_type
+                dec.set_checkpointing(args.dec_n_layers_checkpoint)
             setattr(self, 'dec_' + dir, dec)
 
         # sub task
@@ -175,6 +188,8 @@ class Speech2Text(ModelBase):
                                         getattr(args, 'ctc_fc_list_' + sub),
                                         getattr(self, sub + '_weight'),
                                         external_lm)
+                if getattr(args, 'dec_n_layers_checkpoint', 0) != 0:
+                    dec_sub.set_checkpointing(args.dec_n_layers_checkpoint)
                 setattr(self, 'dec_fwd_' + sub, dec_sub)
 
         if args.input_type == 'text':
@@ -483,138 +498,345 @@ class Speech2Text(ModelBase):
         """Simulate streaming decoding. Both encoding and decoding are performed in the online mode."""
         assert task == 'ys'
         assert self.input_type == 'speech'
-        assert self.ctc_weight > 0
+        blockwise_dec = isinstance(self.dec_fwd, (RNNT, TransformerDecoder))
+        assert self.ctc_weight > 0 or (blockwise_dec and not params['recog_ctc_vad'])
         assert self.fwd_weight > 0
-        assert len(xs) == 1  # batch size
+        if len(xs) > 1:
+            return self.decode_streaming_batch(xs, params, idx2token, exclude_eos, task)
         # assert params['recog_length_norm']
         global_params = copy.deepcopy(params)
         global_params['recog_max_len_ratio'] = 1.0
-        block_sync = params['recog_block_sync']
+        block_sync = params['recog_block_sync'] or blockwise_dec
+        # NOTE: RNN-T and Transformer decoders are always decoded block by block
         block_size = params['recog_block_sync_size']  # before subsampling
 
         streaming = Streaming(xs[0], params, self.enc)
-        factor = self.enc.subsampling_factor
-        block_size //= factor
+        if streaming.cnn_cache and self.enc.conv is not None:
+            self.enc.conv.stateful = True
+        try:
+            factor = self.enc.subsampling_factor
+            block_size //= factor
 
-        hyps = None
-        best_hyp_id_stream = []
-        is_reset = True  # for the first block
+            hyps = None
+            end_hyps = []
+            best_hyp_id_prefix = []
+            best_hyp_id_stream = []
+            is_reset = True  # for the first block
+            self.chunk_latencies = []  # processing time per block [sec]
 
-        stdout = False
+            stdout = False
 
-        self.eval()
-        lm = getattr(self, 'lm_fwd', None)
-        lm_second = getattr(self, 'lm_second', None)
-        # with torch.no_grad():
-        while True:
-            # Encode input features block by block
-            x_block, is_last_block, cnn_lookback, cnn_lookahead, xlen_block = streaming.extract_feature()
-            if is_reset:
-                self.enc.reset_cache()
-            eout_block_dict = self.encode([x_block], 'all',
-                                          streaming=True,
-                                          cnn_lookback=cnn_lookback,
-                                          cnn_lookahead=cnn_lookahead,
-                                          xlen_block=xlen_block)
-            eout_block = eout_block_dict[task]['xs']
-            is_reset = False  # detect the first boundary in the same block
-
-            # CTC-based VAD
-            if streaming.is_ctc_vad:
-                if self.ctc_weight_sub1 > 0:
-                    ctc_probs_block = self.dec_fwd_sub1.ctc_probs(eout_block_dict['ys_sub1']['xs'])
-                    # TODO: consider subsampling
-                else:
-                    ctc_probs_block = self.dec_fwd.ctc_probs(eout_block)
-                is_reset = streaming.ctc_vad(ctc_probs_block, stdout=stdout)
-
-            # Truncate the most right frames
-            if is_reset and not is_last_block and streaming.bd_offset >= 0:
-                eout_block = eout_block[:, :streaming.bd_offset]
-            streaming.cache_eout(eout_block)
+            self.eval()
+            lm = getattr(self, 'lm_fwd', None)
+            lm_second = getattr(self, 'lm_second', None)
+            # with torch.no_grad():
+            while True:
+                start_time = time.time()
+                # Encode input features block by block
+                x_block, is_last_block, cnn_lookback, cnn_lookahead, xlen_block = streaming.extract_feature()
+                if is_reset:
+                    self.enc.reset_cache()
+                eout_block_dict = self.encode([x_block], 'all',
+                                              streaming=True,
+                                              cnn_lookback=cnn_lookback,
+                                              cnn_lookahead=cnn_lookahead,
+                                              xlen_block=xlen_block)
+                eout_block = eout_block_dict[task]['xs']
+                if isinstance(self.dec_fwd, (RNNT, TransformerDecoder)):
+                    # NOTE: exclude encoder outputs of zero-padded frames in the last block
+                    eout_block = eout_block[:, :eout_block_dict[task]['xlens'][0]]
+                streaming.update_eout_offset(eout_block.size(1), is_reset)
+                is_reset = False  # detect the first boundary in the same block
+                if eout_block.size(1) == 0 and not is_last_block:
+                    # encoder outputs are delayed until the CNN context is available
+                    streaming.next_block()
+                    continue
 
-            # Block-synchronous attention decoding
-            if isinstance(self.dec_fwd, RNNT):
-                raise NotImplementedError
-            elif isinstance(self.dec_fwd, RNNDecoder) and block_sync:
-                for i_block in range(math.ceil(eout_block.size(1) / block_size)):
-                    eout_block_i = eout_block[:, i_block * block_size:(i_block + 1) * block_size]
-                    end_hyps, hyps, _ = self.dec_fwd.beam_search_block_sync(
-                        eout_block_i, params, idx2token, hyps, lm,
-                        state_carry_over=False)
-                merged_hyps = sorted(end_hyps + hyps, key=lambda x: x['score'], reverse=True)
-                if len(merged_hyps) > 0:
-                    best_hyp_id_prefix = np.array(merged_hyps[0]['hyp'][1:])
-                    if len(best_hyp_id_prefix) > 0 and best_hyp_id_prefix[-1] == self.eos:
-                        # reset beam if <eos> is generated from the best hypothesis
-                        best_hyp_id_prefix = best_hyp_id_prefix[:-1]  # exclude <eos>
-                        # Segmentation strategy 2:
-                        # If <eos> is emitted from the decoder (not CTC),
-                        # the current block is segmented.
-                        if not is_reset:
-                            streaming._bd_offset = eout_block.size(1) - 1
-                            # TODO: fix later
-                            is_reset = True
-                    if len(best_hyp_id_prefix) > 0:
-                        print('\rStreaming (T:%d [10ms], offset:%d [10ms], blank:%d [10ms]): %s' %
-                              (streaming.offset + eout_block.size(1) * factor,
-                               self.dec_fwd.n_frames * factor,
-                               streaming.n_blanks * factor,
-                               idx2token(best_hyp_id_prefix)))
-            elif isinstance(self.dec_fwd, TransformerDecoder):
-                best_hyp_id_prefix = []
-                raise NotImplementedError
-
-            if is_reset:
-                # Global decoding over the segmented region
-                if not block_sync:
-                    eout = streaming.pop_eouts()
-                    elens = torch.IntTensor([eout.size(1)])
-                    ctc_log_probs = None
-                    if params['recog_ctc_weight'] > 0:
-                        ctc_log_probs = torch.log(self.dec_fwd.ctc_probs(eout))
-                    nbest_hyps_id_offline = self.dec_fwd.beam_search(
-                        eout, elens, global_params, idx2token, lm, lm_second,
-                        ctc_log_probs=ctc_log_probs,
-                        exclude_eos=exclude_eos)[0]
-
-                # pick up the best hyp from ended and active hypotheses
-                if block_sync:
-                    if len(best_hyp_id_prefix) > 0:
-                        best_hyp_id_stream.extend(best_hyp_id_prefix)
-                else:
-                    if len(nbest_hyps_id_offline[0][0]) > 0:
-                        best_hyp_id_stream.extend(nbest_hyps_id_offline[0][0])
-
-                # reset
-                streaming.reset(stdout=stdout)
-                hyps = None
-
-            streaming.next_block()
-            if is_last_block:
-                break
-            # next block will start from the frame next to the boundary
-            streaming.backoff(x_block, self.dec_fwd, stdout=stdout)
-
-        # Global decoding for tail blocks
-        if not block_sync and streaming.n_cache_block > 0:
-            eout = streaming.pop_eouts()
-            elens = torch.IntTensor([eout.size(1)])
-            nbest_hyps_id_offline = self.dec_fwd.beam_search(
-                eout, elens, global_params, idx2token, lm, lm_second,
-                exclude_eos=exclude_eos)[0]
-            if len(nbest_hyps_id_offline[0][0]) > 0:
-                best_hyp_id_stream.extend(nbest_hyps_id_offline[0][0])
-
-        # pick up the best hyp
-        if not is_reset and block_sync and len(best_hyp_id_prefix) > 0:
-            best_hyp_id_stream.extend(best_hyp_id_prefix)
+                # CTC-based VAD
+                if streaming.is_ctc_vad:
+                    if self.ctc_weight_sub1 > 0:
+                        ctc_probs_block = self.dec_fwd_sub1.ctc_probs(eout_block_dict['ys_sub1']['xs'])
+                        # TODO: consider subsampling
+                    else:
+                        ctc_probs_block = self.dec_fwd.ctc_probs(eout_block)
+                    is_reset = streaming.ctc_vad(ctc_probs_block, stdout=stdout)
+
+                # Truncate the most right frames
+                if is_reset and not is_last_block and streaming.bd_offset >= 0:
+                    eout_block = eout_block[:, :streaming.bd_offset]
+                streaming.cache_eout(eout_block)
+
+                # Block-synchronous RNN-T/Transformer decoding
+                if isinstance(self.dec_fwd, (RNNT, TransformerDecoder)):
+                    if isinstance(self.dec_fwd, RNNT):
+                        end_hyps, hyps, _ = self.dec_fwd.beam_search_block_sync(
+                            eout_block, params, idx2token, hyps, lm, end_hyps)
+                    else:
+                        # NOTE: CTC spikes trigger label-synchronous steps except for MMA
+                        ctc_log_probs_block = None
+                        if self.dec_fwd.attn_type != 'mocha':
+                            ctc_log_probs_block = self.dec_fwd.ctc_log_probs(eout_block)
+                        end_hyps, hyps, _ = self.dec_fwd.beam_search_block_sync(
+                            eout_block, params, idx2token, hyps, lm, ctc_log_probs_block, end_hyps,
+                            is_last_block=is_last_block or is_reset)
+                    merged_hyps = end_hyps if len(end_hyps) > 0 else hyps
+                    if len(merged_hyps) > 0:
+                        if isinstance(self.dec_fwd, RNNT):
+                            best_hyp = max(merged_hyps, key=lambda x: x['score'] / max(len(x['hyp'][1:]), 1))
+                        else:
+                            best_hyp = max(merged_hyps, key=lambda x: x['score'])
+                        best_hyp_id_prefix = np.array(best_hyp['hyp'][1:])
+                        if len(best_hyp_id_prefix) > 0 and best_hyp_id_prefix[-1] == self.eos:
+                            best_hyp_id_prefix = best_hyp_id_prefix[:-1]  # exclude <eos>
+                            # the current block is segmented as in block-synchronous attention decoding
+                            if not is_reset:
+                                streaming._bd_offset = eout_block.size(1) - 1
+                                is_reset = True
+                    self.chunk_latencies.append(time.time() - start_time)
+                    logger.debug('Streaming (T:%d [10ms], latency:%.1f [ms]): %s' %
+                                 (streaming.offset + eout_block.size(1) * factor,
+                                  self.chunk_latencies[-1] * 1000,
+                                  idx2token(best_hyp_id_prefix) if idx2token is not None else best_hyp_id_prefix))
+                # Block-synchronous attention decoding
+                elif isinstance(self.dec_fwd, RNNDecoder) and block_sync:
+                    for i_block in range(math.ceil(eout_block.size(1) / block_size)):
+                        eout_block_i = eout_block[:, i_block * block_size:(i_block + 1) * block_size]
+                        end_hyps, hyps, _ = self.dec_fwd.beam_search_block_sync(
+                            eout_block_i, params, idx2token, hyps, lm,
+                            state_carry_over=False)
+                    merged_hyps = sorted(end_hyps + hyps, key=lambda x: x['score'], reverse=True)
+                    if len(merged_hyps) > 0:
+                        best_hyp_id_prefix = np.array(merged_hyps[0]['hyp'][1:])
+                        if len(best_hyp_id_prefix) > 0 and best_hyp_id_prefix[-1] == self.eos:
+                            # reset beam if <eos> is generated from the best hypothesis
+                            best_hyp_id_prefix = best_hyp_id_prefix[:-1]  # exclude <eos>
+                            # Segmentation strategy 2:
+                            # If <eos> is emitted from the decoder (not CTC),
+                            # the current block is segmented.
+                            if not is_reset:
+                                streaming._bd_offset = eout_block.size(1) - 1
+                                # TODO: fix later
+                                is_reset = True
+                        if len(best_hyp_id_prefix) > 0:
+                            print('\rStreaming (T:%d [10ms], offset:%d [10ms], blank:%d [10ms]): %s' %
+                                  (streaming.offset + eout_block.size(1) * factor,
+                                   self.dec_fwd.n_frames * factor,
+                                   streaming.n_blanks * factor,
+                                   idx2token(best_hyp_id_prefix)))
+
+                if is_reset:
+                    # Global decoding over the segmented region
+                    if not block_sync:
+                        eout = streaming.pop_eouts()
+                        elens = torch.IntTensor([eout.size(1)])
+                        ctc_log_probs = None
+                        if params['recog_ctc_weight'] > 0:
+                            ctc_log_probs = torch.log(self.dec_fwd.ctc_probs(eout))
+                        nbest_hyps_id_offline = self.dec_fwd.beam_search(
+                            eout, elens, global_params, idx2token, lm, lm_second,
+                            ctc_log_probs=ctc_log_probs,
+                            exclude_eos=exclude_eos)[0]
+
+                    # pick up the best hyp from ended and active hypotheses
+                    if block_sync:
+                        if len(best_hyp_id_prefix) > 0:
+                            best_hyp_id_stream.extend(best_hyp_id_prefix)
+                    else:
+                        if len(nbest_hyps_id_offline[0][0]) > 0:
+                            best_hyp_id_stream.extend(nbest_hyps_id_offline[0][0])
+
+                    # reset
+                    streaming.reset(stdout=stdout)
+                    hyps = None
+                    end_hyps = []
+
+                streaming.next_block()
+                if is_last_block:
+                    break
+                # next block will start from the frame next to the boundary
+                streaming.backoff(x_block, self.dec_fwd, stdout=stdout)
+
+            # Global decoding for tail blocks
+            if not block_sync and streaming.n_cache_block > 0:
+                eout = streaming.pop_eouts()
+                elens = torch.IntTensor([eout.size(1)])
+                nbest_hyps_id_offline = self.dec_fwd.beam_search(
+                    eout, elens, global_params, idx2token, lm, lm_second,
+                    exclude_eos=exclude_eos)[0]
+                if len(nbest_hyps_id_offline[0][0]) > 0:
+                    best_hyp_id_stream.extend(nbest_hyps_id_offline[0][0])
+
+            # pick up the best hyp
+            if not is_reset and block_sync and len(best_hyp_id_prefix) > 0:
+                best_hyp_id_stream.extend(best_hyp_id_prefix)
+        finally:
+            if streaming.cnn_cache and self.enc.conv is not None:
+                self.enc.conv.stateful = False
+            self.enc.reset_cache()
 
         if len(best_hyp_id_stream) > 0:
             return [[np.stack(best_hyp_id_stream, axis=0)]], [None]
         else:
             return [[[]]], [None]
 
+    def decode_streaming_batch(self, xs, params, idx2token, exclude_eos=False, task='ys'):
+        """Simulate streaming decoding of multiple streams at once.
+        Each stream keeps its own frontend state, encoder cache, and beam, and
+        the current blocks of all streams are decoded in a batch. Streams leave the batch
+        once their last block is decoded.
+
+        Args:
+            xs (List): length `[B]`, which contains arrays of size `[T, input_dim]`
+            params (dict): hyper-parameters for decoding
+            idx2token (): converter from index to token
+            exclude_eos (bool): dummy (<eos> is always excluded)
+            task (str): ys only
+        Returns:
+            best_hyps_id (List[List[np.ndarray]]): length `[B]`, which contains a list of length `[1]`
+            aws: dummy
+
+        """
+        assert task == 'ys'
+        assert self.input_type == 'speech'
+        assert self.ctc_weight > 0 or not params['recog_ctc_vad']
+        assert self.fwd_weight > 0
+        if not (isinstance(self.dec_fwd, RNNT) or (isinstance(self.dec_fwd, RNNDecoder) and params['recog_block_sync'])):
+            raise NotImplementedError('Only RNN-T and block-synchronous attention decoders support batched streaming decoding.')
+        bs = len(xs)
+
+        streamings = [Streaming(x, params, self.enc) for x in xs]
+        if streamings[0].cnn_cache and self.enc.conv is not None:
+            self.enc.conv.stateful = True
+        try:
+            factor = self.enc.subsampling_factor
+            block_size = params['recog_block_sync_size'] // factor
+
+            # states of each stream
+            enc_caches = [None] * bs
+            dec_streams = [None] * bs
+            best_hyp_id_prefix = [[] for _ in range(bs)]
+            best_hyp_id_stream = [[] for _ in range(bs)]
+            is_reset = [True] * bs  # for the first block
+            is_finished = [False] * bs
+            self.chunk_latencies = []  # processing time per block of all streams [sec]
+
+            self.eval()
+            lm = getattr(self, 'lm_fwd', None)
+            while not all(is_finished):
+                start_time = time.time()
+                # Encode input features block by block in each stream
+                blocks = []
+                for b in [b for b in range(bs) if not is_finished[b]]:
+                    streaming = streamings[b]
+                    x_block, is_last_block, cnn_lookback, cnn_lookahead, xlen_block = streaming.extract_feature()
+                    # NOTE: switch the encoder cache to the current stream
+                    if is_reset[b]:
+                        self.enc.reset_cache()
+                    else:
+                        self.enc.set_cache(enc_caches[b])
+                    eout_block_dict = self.encode([x_block], 'all',
+                                                  streaming=True,
+                                                  cnn_lookback=cnn_lookback,
+                                                  cnn_lookahead=cnn_lookahead,
+                                                  xlen_block=xlen_block)
+                    enc_caches[b] = self.enc.get_cache()
+                    eout_block = eout_block_dict[task]['xs']
+                    if isinstance(self.dec_fwd, RNNT):
+                        # NOTE: exclude encoder outputs of zero-padded frames in the last block
+                        eout_block = eout_block[:, :eout_block_dict[task]['xlens'][0]]
+                    streaming.update_eout_offset(eout_block.size(1), is_reset[b])
+                    is_reset[b] = False
+                    if eout_block.size(1) == 0 and not is_last_block:
+                        # encoder outputs are delayed until the CNN context is available
+                        streaming.next_block()
+                        continue
+
+                    # CTC-based VAD
+                    if streaming.is_ctc_vad:
+                        if self.ctc_weight_sub1 > 0:
+                            ctc_probs_block = self.dec_fwd_sub1.ctc_probs(eout_block_dict['ys_sub1']['xs'])
+                        else:
+                            ctc_probs_block = self.dec_fwd.ctc_probs(eout_block)
+                        is_reset[b] = streaming.ctc_vad(ctc_probs_block)
+
+                    # Truncate the most right frames
+                    if is_reset[b] and not is_last_block and streaming.bd_offset >= 0:
+                        eout_block = eout_block[:, :streaming.bd_offset]
+                    blocks.append((b, x_block, eout_block[0], is_last_block))
+
+                if len(blocks) == 0:
+                    continue
+
+                if isinstance(self.dec_fwd, RNNT):
+                    # Block-synchronous RNN-T decoding over all streams
+                    eouts = pad_list([eout_block for _, _, eout_block, _ in blocks], 0.)
+                    elens = torch.IntTensor([eout_block.size(0) for _, _, eout_block, _ in blocks])
+                    new_streams = self.dec_fwd.beam_search_block_sync_batch(
+                        eouts, elens, params, [dec_streams[b] for b, _, _, _ in blocks], lm)
+                    for (b, _, _, _), stream in zip(blocks, new_streams):
+                        dec_streams[b] = stream
+                else:
+                    # Block-synchronous attention decoding over all streams
+                    # NOTE: encoder outputs of each stream are split into sub-blocks as in decode_streaming()
+                    n_sub_blocks = max([math.ceil(eout_block.size(0) / block_size) for _, _, eout_block, _ in blocks])
+                    for i_block in range(n_sub_blocks):
+                        t = i_block * block_size
+                        sub_blocks = [(b, eout_block[t:t + block_size])
+                                      for b, _, eout_block, _ in blocks if t < eout_block.size(0)]
+                        eouts = pad_list([eout_block_i for _, eout_block_i in sub_blocks], 0.)
+                        elens = torch.IntTensor([eout_block_i.size(0) for _, eout_block_i in sub_blocks])
+                        new_streams = self.dec_fwd.beam_search_block_sync_batch(
+                            eouts, elens, params, [dec_streams[b] for b, _ in sub_blocks], lm)
+                        for (b, _), stream in zip(sub_blocks, new_streams):
+                            dec_streams[b] = stream
+                self.chunk_latencies.append(time.time() - start_time)
+
+                for b, x_block, eout_block, is_last_block in blocks:
+                    stream = dec_streams[b]
+                    streaming = streamings[b]
+                    if isinstance(self.dec_fwd, RNNT):
+                        merged_hyps = stream['end_hyps'] if len(stream['end_hyps']) > 0 else stream['hyps']
+                        best_hyp = max(merged_hyps, key=lambda x: x['score'] / max(len(x['hyp'][1:]), 1),
+                                       default=None)
+                    else:
+                        merged_hyps = sorted(stream['end_hyps'] + stream['hyps'], key=lambda x: x['score'], reverse=True)
+                        best_hyp = merged_hyps[0] if len(merged_hyps) > 0 else None
+                    if best_hyp is not None:
+                        best_hyp_id_prefix[b] = np.array(best_hyp['hyp'][1:])
+                        if len(best_hyp_id_prefix[b]) > 0 and best_hyp_id_prefix[b][-1] == self.eos:
+                            best_hyp_id_prefix[b] = best_hyp_id_prefix[b][:-1]  # exclude <eos>
+                            # the current block is segmented as in decode_streaming()
+                            if not is_reset[b]:
+                                streaming._bd_offset = eout_block.size(0) - 1
+                                is_reset[b] = True
+                    logger.debug('Streaming %d (T:%d [10ms]): %s' %
+                                 (b, streaming.offset + eout_block.size(0) * factor,
+                                  idx2token(best_hyp_id_prefix[b]) if idx2token is not None else best_hyp_id_prefix[b]))
+
+                    if is_reset[b]:
+                        if len(best_hyp_id_prefix[b]) > 0:
+                            best_hyp_id_stream[b].extend(best_hyp_id_prefix[b])
+                        # reset
+                        streaming.reset()
+                        dec_streams[b] = None
+
+                    streaming.next_block()
+                    if is_last_block:
+                        is_finished[b] = True
+                        # pick up the best hyp
+                        if not is_reset[b] and len(best_hyp_id_prefix[b]) > 0:
+                            best_hyp_id_stream[b].extend(best_hyp_id_prefix[b])
+                        continue
+                    # next block will start from the frame next to the boundary
+                    streaming.backoff(x_block, self.dec_fwd)
+        finally:
+            if streamings[0].cnn_cache and self.enc.conv is not None:
+                self.enc.conv.stateful = False
+            self.enc.reset_cache()
+
+        best_hyps_id = [[np.stack(hyp, axis=0)] if len(hyp) > 0 else [[]] for hyp in best_hyp_id_stream]
+        return best_hyps_id, [None] * bs
+
     def streamable(self):
         return getattr(self.dec_fwd, 'streamable', False)
 
@@ -626,7 +848,8 @@ class Speech2Text(ModelBase):
 
     def decode(self, xs, params, idx2token, exclude_eos=False,
                refs_id=None, refs=None, utt_ids=None, speakers=None,
-               task='ys', ensemble_models=[], trigger_points=None, teacher_force=False):
+               task='ys', ensemble_models=[], trigger_points=None, teacher_force=False,
+               store_aws=True):
         """Decode in the inference stage.
 
         Args:
@@ -651,6 +874,7 @@ class Speech2Text(ModelBase):
             ensemble_models (List): Speech2Text classes
             trigger_points (np.ndarray): `[B, L]`
             teacher_force (bool): conduct teacher-forcing
+            store_aws (bool): keep attention weights of all steps in beam search (for plotting and resolving UNK)
         Returns:
             nbest_hyps_id (List[List[np.ndarray]]): length `[B]`, which contains a list of length `[n_best]` which contains arrays of size `[L]`
             aws (List[np.ndarray]): length `[B]`, which contains arrays of size `[L, T, n_heads]`
@@ -691,33 +915,72 @@ class Speech2Text(ModelBase):
 
             # Attention/RNN-T
             elif params['recog_beam_width'] == 1 and not params['recog_fwd_bwd_attention']:
+                kwargs = {}
+                if 'transducer' in self.dec_type:
+                    kwargs['max_symbols_per_frame'] = params['recog_max_symbols_per_frame']
                 best_hyps_id, aws = getattr(self, 'dec_' + dir).greedy(
                     eout, elens, params['recog_max_len_ratio'], idx2token,
-                    exclude_eos, refs_id, utt_ids, speakers)
+                    exclude_eos, refs_id, utt_ids, speakers, **kwargs)
                 nbest_hyps_id = [[hyp] for hyp in best_hyps_id]
             else:
-                assert params['recog_batch_size'] == 1
+                # NOTE: multiple utterances are decoded at once only by the LAS and RNN-T decoders
+                # NOTE: fall back to per-utterance beam search for the other decoders and
+                # options unsupported by batched beam search (e.g., lexicon-constrained decoding)
+                lexicon = getattr(self, 'lexicon', None)
+                batch_decoding = False
+                if params['recog_batch_size'] > 1 and lexicon is None and len(ensemble_models) == 0:
+                    batch_decoding = not params['recog_fwd_bwd_attention'] and getattr(self, 'dec_' + dir).batch_decodable(
+                        params, getattr(self, 'lm_' + dir, None))
 
                 ctc_log_probs = None
                 if params['recog_ctc_weight'] > 0:
                     ctc_log_probs = self.dec_fwd.ctc_log_probs(eout)
 
+                # batch decoding
+                if batch_decoding:
+                    lm = getattr(self, 'lm_' + dir, None)
+                    lm_second = getattr(self, 'lm_second', None)
+                    lm_bwd = getattr(self, 'lm_bwd', None)
+
+                    kwargs = {}
+                    if isinstance(getattr(self, 'dec_' + dir), RNNDecoder):
+                        kwargs['store_aws'] = store_aws
+                    nbest_hyps_id, aws, scores = getattr(self, 'dec_' + dir).beam_search_batch(
+                        eout, elens, params, idx2token,
+                        lm, lm_second, lm_bwd, ctc_log_probs,
+                        params['recog_beam_width'], exclude_eos, refs_id, utt_ids, **kwargs)
+
                 # forward-backward decoding
-                if params['recog_fwd_bwd_attention']:
+                elif params['recog_fwd_bwd_attention']:
+                    if not isinstance(self.dec_fwd, RNNDecoder):
+                        raise NotImplementedError('Forward-backward attention is supported only by RNNDecoder.')
                     lm = getattr(self, 'lm_fwd', None)
                     lm_bwd = getattr(self, 'lm_bwd', None)
 
+                    # NOTE: hypotheses are merged with attention weights and scores at all steps
                     # forward decoder
-                    nbest_hyps_id_fwd, aws_fwd, scores_fwd = self.dec_fwd.beam_search(
+                    search_fwd = functools.partial(
+                        self.dec_fwd.beam_search,
                         eout, elens, params, idx2token,
                         lm, None, lm_bwd, ctc_log_probs,
-                        params['recog_beam_width'], False, refs_id, utt_ids, speakers)
+                        params['recog_beam_width'], False, refs_id, utt_ids, speakers,
+                        store_aws=True, store_score_steps=True)
 
                     # backward decoder
-                    nbest_hyps_id_bwd, aws_bwd, scores_bwd, _ = self.dec_bwd.beam_search(
+                    search_bwd = functools.partial(
+                        self.dec_bwd.beam_search,
                         eout, elens, params, idx2token,
                         lm_bwd, None, lm, ctc_log_probs,
-                        params['recog_beam_width'], False, refs_id, utt_ids, speakers)
+                        params['recog_beam_width'], False, refs_id, utt_ids, speakers,
+                        store_aws=True, store_score_steps=True)
+
+                    # NOTE: the two searches are independent until merging and run concurrently.
+                    # LMs shared by both searches must not cache states in modules.
+                    if all([lm_i is None or isinstance(lm_i, (RNNLM, NgramLM)) for lm_i in [lm, lm_bwd]]):
+                        outs = parallel_apply([search_fwd, search_bwd])
+                    else:
+                        outs = [search_fwd(), search_bwd()]
+                    (nbest_hyps_id_fwd, aws_fwd, scores_fwd), (nbest_hyps_id_bwd, aws_bwd, scores_bwd) = outs
 
                     # forward-backward attention
                     best_hyps_id = fwd_bwd_attention(
@@ -729,23 +992,30 @@ class Speech2Text(ModelBase):
                     aws = None
                 else:
                     # ensemble
-                    ensmbl_eouts, ensmbl_elens, ensmbl_decs = [], [], []
+                    # NOTE: encoders of ensemble members run concurrently
+                    ensmbl_eout_dicts = []
                     if len(ensemble_models) > 0:
-                        for i_e, model in enumerate(ensemble_models):
-                            enc_outs_e = model.encode(xs, task)
-                            ensmbl_eouts += [enc_outs_e[task]['xs']]
-                            ensmbl_elens += [enc_outs_e[task]['xlens']]
-                            ensmbl_decs += [getattr(model, 'dec_' + dir)]
-                            # NOTE: only support for the main task now
+                        ensmbl_eout_dicts = parallel_apply(
+                            [functools.partial(model.encode, xs, task) for model in ensemble_models])
+                    ensmbl_eouts, ensmbl_elens, ensmbl_decs = [], [], []
+                    for model, enc_outs_e in zip(ensemble_models, ensmbl_eout_dicts):
+                        ensmbl_eouts += [enc_outs_e[task]['xs']]
+                        ensmbl_elens += [enc_outs_e[task]['xlens']]
+                        ensmbl_decs += [getattr(model, 'dec_' + dir)]
+                        # NOTE: only support for the main task now
 
                     lm = getattr(self, 'lm_' + dir, None)
                     lm_second = getattr(self, 'lm_second', None)
                     lm_bwd = getattr(self, 'lm_bwd' if dir == 'fwd' else 'lm_bwd', None)
 
+                    kwargs = {}
+                    if isinstance(getattr(self, 'dec_' + dir), RNNDecoder):
+                        kwargs['store_aws'] = store_aws
+                        kwargs['lexicon'] = lexicon
                     nbest_hyps_id, aws, scores = getattr(self, 'dec_' + dir).beam_search(
                         eout, elens, params, idx2token,
                         lm, lm_second, lm_bwd, ctc_log_probs,
                         params['recog_beam_width'], exclude_eos, refs_id, utt_ids, speakers,
-                        ensmbl_eouts, ensmbl_elens, ensmbl_decs)
+                        ensmbl_eouts, ensmbl_elens, ensmbl_decs, **kwargs)
 
             return nbest_hyps_id, aws
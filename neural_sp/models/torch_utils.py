@@ -3,15 +3,154 @@
 
 """Utility functions."""
 
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 import copy
+from distutils.version import LooseVersion
 import numpy as np
 import torch
+from torch.utils.checkpoint import checkpoint
+
+torch_19_plus = LooseVersion(torch.__version__) >= LooseVersion("1.9")
+torch_110_plus = LooseVersion(torch.__version__) >= LooseVersion("1.10")
+torch_111_plus = LooseVersion(torch.__version__) >= LooseVersion("1.11")
+torch_112_plus = LooseVersion(torch.__version__) >= LooseVersion("1.12")
+
+_executors = {}
 
 
 def repeat(module, n_layers):
     return torch.nn.ModuleList([copy.deepcopy(module) for _ in range(n_layers)])
 
 
+def checkpoint_forward(function, *args, module=None):
+    """Run a forward pass with activation checkpointing.
+       Intermediate activations in `function` are not stored
+       but recomputed during the backward pass.
+
+    Args:
+        function (callable): forward function returning a single tensor
+        args: inputs to `function`
+        module (nn.Module): module run in `function`. Running statistics of
+            batch normalization layers in it are restored after recomputation.
+    Returns:
+        output (torch.Tensor): output of `function`
+
+    """
+    bns = []
+    if module is not None:
+        bns = [m for m in module.modules()
+               if isinstance(m, torch.nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+    if len(bns) > 0:
+        function = _keep_running_stats(function, bns)
+    if torch_111_plus:
+        return checkpoint(function, *args, use_reentrant=False)
+    # NOTE: gradients are not propagated to parameters if no input requires gradients
+    return checkpoint(function, *args)
+
+
+def _keep_running_stats(function, bns):
+    """Wrap `function` so that recomputation does not update running statistics of `bns` twice."""
+    n_calls = [0]
+
+    def wrapper(*args):
+        n_calls[0] += 1
+        if n_calls[0] == 1:
+            return function(*args)
+        # NOTE: the first call has already updated running statistics
+        buffers = [[b.clone() for b in [bn.running_mean, bn.running_var, bn.num_batches_tracked]]
+                   for bn in bns]
+        try:
+            return function(*args)
+        finally:
+            for bn, (mean, var, n_batches) in zip(bns, buffers):
+                bn.running_mean.copy_(mean)
+                bn.running_var.copy_(var)
+                bn.num_batches_tracked.copy_(n_batches)
+
+    return wrapper
+
+
+def parallel_apply(functions):
+    """Run functions concurrently in threads.
+       PyTorch releases the GIL inside operators, so independent models
+       (e.g., ensemble members) overlap. Intra-op threads are split among the functions
+       so that the total number of threads does not exceed that of the caller.
+
+    Args:
+        functions (List[callable]): functions without arguments
+    Returns:
+        outputs (List): outputs of `functions`
+
+    """
+    if len(functions) == 1:
+        return [functions[0]()]
+
+    n_threads = torch.get_num_threads()
+    n_threads_per_func = max(1, n_threads // len(functions))
+    # NOTE: grad mode and autocast state are thread-local
+    grad_enabled = torch.is_grad_enabled()
+    autocast_dtype = None
+    if torch_110_plus and torch.is_autocast_cpu_enabled():
+        autocast_dtype = torch.get_autocast_cpu_dtype()
+
+    def run(function):
+        with torch.set_grad_enabled(grad_enabled):
+            if autocast_dtype is None:
+                return function()
+            with torch.autocast('cpu', dtype=autocast_dtype):
+                return function()
+
+    n_workers = len(functions) - 1
+    if n_workers not in _executors:
+        _executors[n_workers] = ThreadPoolExecutor(max_workers=n_workers)
+    # NOTE: the number of intra-op threads is process-global, so it is set only once here
+    # and restored after all workers have finished
+    torch.set_num_threads(n_threads_per_func)
+    futures = []
+    try:
+        futures = [_executors[n_workers].submit(run, function) for function in functions[1:]]
+        # NOTE: the first function runs in the caller thread
+        outputs = [functions[0]()]
+    finally:
+        wait(futures)
+        torch.set_num_threads(n_threads)
+    return outputs + [future.result() for future in futures]
+
+
+def logaddexp(x1, x2):
+    """Compute log(exp(x1) + exp(x2)) element-wise (torch.logaddexp requires PyTorch>=1.6).
+
+    Args:
+        x1 (FloatTensor):
+        x2 (FloatTensor):
+    Returns:
+        FloatTensor
+
+    """
+    return torch.logsumexp(torch.stack(torch.broadcast_tensors(x1, x2)), dim=0)
+
+
+def segment_max(values, segment_ids, n_segments):
+    """Compute the maximum value in each segment.
+
+    Args:
+        values (FloatTensor): `[N]`
+        segment_ids (LongTensor): `[N]`, index of the segment of each value
+        n_segments (int): number of segments (each of which must have at least one value)
+    Returns:
+        FloatTensor: `[n_segments]`
+
+    """
+    if torch_112_plus:
+        return values.new_zeros(n_segments).fill_(float('-inf')).scatter_reduce(
+            0, segment_ids, values, reduce='amax')
+    # NOTE: Tensor.scatter_reduce requires PyTorch>=1.12
+    if n_segments == 0:
+        return values.new_zeros(0)
+    return torch.stack([values[segment_ids == i].max() for i in range(n_segments)])
+
+
 def tensor2np(x):
     """Convert torch.Tensor to np.ndarray.
 
@@ -23,6 +162,8 @@ def tensor2np(x):
     """
     if x is None:
         return x
+    if x.dtype == getattr(torch, 'bfloat16', None):
+        x = x.float()  # numpy does not support bfloat16 (nor does PyTorch<1.3 have it)
     return x.cpu().detach().numpy()
 
 
@@ -86,11 +227,9 @@ def make_pad_mask(seq_lens):
         mask (IntTensor): `[B, T]`
 
     """
-    bs = seq_lens.size(0)
     max_time = seq_lens.max()
     seq_range = torch.arange(0, max_time, dtype=torch.int32, device=seq_lens.device)
-    seq_range = seq_range.unsqueeze(0).expand(bs, max_time)
-    mask = seq_range < seq_lens.unsqueeze(-1)
+    mask = seq_range.unsqueeze(0) < seq_lens.unsqueeze(-1)
     return mask
 
 
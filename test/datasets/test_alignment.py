@@ -0,0 +1,40 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for CTC alignment archive."""
+
+import importlib
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("n_shards", [1, 3])
+def test_ctc_alignment_archive(tmp_path, n_shards):
+    module = importlib.import_module('neural_sp.datasets.alignment')
+
+    alignments = {'utt%d' % i: np.sort(np.random.randint(0, 1000, size=np.random.randint(1, 20))).astype(np.int32)
+                  for i in range(10)}
+    utt_ids = sorted(alignments.keys())
+
+    # write shards
+    shard_paths = [str(tmp_path / ('ctc_alignments.ark.%d' % k)) for k in range(n_shards)]
+    for k in range(n_shards):
+        with module.CTCAlignmentArchiveWriter(shard_paths[k]) as writer:
+            for utt_id in utt_ids[k::n_shards]:
+                writer.write(utt_id, alignments[utt_id])
+    archive_path = str(tmp_path / 'ctc_alignments.ark')
+    module.merge_ctc_alignment_archives(shard_paths, archive_path)
+
+    archive = module.CTCAlignmentArchive(archive_path)
+    assert len(archive) == len(alignments)
+    for utt_id in utt_ids:
+        assert utt_id in archive
+        boundaries = archive.get(utt_id)
+        assert boundaries.dtype == np.int32
+        assert np.array_equal(boundaries, alignments[utt_id])
+    assert archive.get('unknown') is None
+
+    # not an archive
+    (tmp_path / 'ctc_alignments.txt').write_bytes(b'a 0\n<eos> 1\n')
+    with pytest.raises(ValueError):
+        module.CTCAlignmentArchive(str(tmp_path / 'ctc_alignments.txt'))
@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for beam search utilities."""
+
+import importlib
+import itertools
+import pytest
+import torch
+
+
+VOCAB = 10
+SOS = 2
+
+
+def make_store(n_rows, max_len):
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.beam_search')
+    return module.HypothesisStore(n_rows, SOS, torch.device('cpu'), max_len=max_len)
+
+
+@pytest.mark.parametrize(
+    "max_len,use_mask",
+    list(itertools.product([1, 3, 100], [False, True]))
+)
+def test_hypothesis_store(max_len, use_mask):
+    """Token sequences recovered by backtracking are equal to those of copied prefixes."""
+    n_rows, n_steps = 4, 12
+    store = make_store(n_rows, max_len)
+    assert store.tokens.size() == (max(max_len, 1), n_rows)
+
+    nodes = store.roots
+    assert nodes.tolist() == list(range(n_rows))
+    prefixes = [[SOS] for _ in range(n_rows)]
+    for step in range(n_steps):
+        parents = torch.randint(0, n_rows, (n_rows,))
+        ids = torch.randint(0, VOCAB, (n_rows,))
+        scores = torch.randn(n_rows)
+        mask = torch.rand(n_rows) > 0.3 if use_mask else None
+        nodes = store.append(ids, nodes[parents], scores, mask)
+        prefixes = [prefixes[p] + [ids[j].item()] if mask is None or mask[j] else prefixes[p]
+                    for j, p in enumerate(parents.tolist())]
+        assert store.n_steps == step + 2
+        # capacity is extended if necessary
+        assert store.tokens.size(0) >= store.n_steps
+        assert store.back_pointers.size() == store.scores.size() == store.tokens.size()
+        for j in range(n_rows):
+            if mask is None or mask[j]:
+                assert nodes[j].item() == (step + 1) * n_rows + j
+                assert store.scores[step + 1, j].item() == scores[j].item()
+
+    for j in range(n_rows):
+        assert store.backtrack(nodes[j].item()) == prefixes[j]
+        path = store.path(nodes[j].item())
+        assert len(path) == len(prefixes[j])
+        assert path[0] in range(n_rows)  # root
+
+
+def test_hypothesis_store_append_hyps():
+    """Only hypotheses extended at the current step are written."""
+    store = make_store(3, 1)
+    hyps = [{'node': 0, 'y': SOS, 'ylen': 0}]
+    # step 1: expand the root
+    hyps = [{'node': None, 'parent': hyps[0]['node'], 'y': y, 'ylen': 1} for y in [5, 7]]
+    store.append_hyps(hyps)
+    assert [hyp['node'] for hyp in hyps] == [3, 4]
+    # step 2: keep the first hypothesis (e.g., by blank) and extend the second one
+    hyps = [dict(hyps[0]), {'node': None, 'parent': hyps[1]['node'], 'y': 1, 'ylen': 2}]
+    store.append_hyps(hyps)
+    assert [hyp['node'] for hyp in hyps] == [3, 6]
+    # step 3: nothing to write
+    store.append_hyps([dict(hyps[0])])
+    assert store.n_steps == 3
+    assert store.backtrack(hyps[0]['node']) == [SOS, 5]
+    assert store.backtrack(hyps[1]['node']) == [SOS, 7, 1]
+
+
+def test_hash_prefix():
+    """Prefixes are hashed incrementally, and Python integers give the same keys as tensors."""
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.beam_search')
+    hash_prefix = module.hash_prefix
+
+    seqs = [[SOS] + list(seq) for n in range(4) for seq in itertools.product(range(VOCAB), repeat=n)]
+    keys = []
+    for seq in seqs:
+        key = 0
+        for y in seq:
+            key = hash_prefix(key, y)
+        assert 0 <= key < 2 ** 62
+        keys.append(key)
+    # no collision among all sequences of up to 3 tokens
+    assert len(set(keys)) == len(seqs)
+
+    keys_tensor = torch.zeros(len(seqs), dtype=torch.int64)
+    for t in range(4):
+        tokens = torch.tensor([seq[t] if t < len(seq) else 0 for seq in seqs])
+        is_ext = torch.tensor([t < len(seq) for seq in seqs])
+        keys_tensor = torch.where(is_ext, hash_prefix(keys_tensor, tokens), keys_tensor)
+    assert keys_tensor.tolist() == keys
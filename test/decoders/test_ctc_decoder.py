@@ -0,0 +1,286 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for CTC decoder."""
+
+import argparse
+import importlib
+import itertools
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+from neural_sp.models.torch_utils import tensor2np
+
+
+ENC_N_UNITS = 16
+VOCAB = 10
+
+
+def make_args(**kwargs):
+    args = dict(
+        eos=2,
+        blank=0,
+        enc_n_units=ENC_N_UNITS,
+        vocab=VOCAB,
+        dropout=0.1,
+        lsm_prob=0.0,
+        fc_list='16_16',
+        param_init=0.1,
+        backward=False,
+    )
+    args.update(kwargs)
+    return args
+
+
+def make_decode_params(**kwargs):
+    args = dict(
+        recog_beam_width=4,
+        recog_length_penalty=0.0,
+        recog_lm_weight=0.0,
+        recog_lm_second_weight=0.0,
+        recog_lm_bwd_weight=0.0,
+        recog_ctc_prune_threshold=0.0,
+    )
+    args.update(kwargs)
+    return args
+
+
+def make_args_rnnlm(**kwargs):
+    args = dict(
+        lm_type='lstm',
+        n_units=16,
+        n_projs=0,
+        n_layers=2,
+        residual=False,
+        use_glu=False,
+        n_units_null_context=0,
+        bottleneck_dim=16,
+        emb_dim=16,
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        lsm_prob=0.0,
+        param_init=0.1,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def make_eouts(elens):
+    eouts = [np.random.randn(elen, ENC_N_UNITS).astype(np.float32) * 4 for elen in elens]
+    return pad_list([np2tensor(x).float() for x in eouts], 0.), torch.IntTensor(elens)
+
+
+@pytest.mark.parametrize("elens", [[40, 31, 17], [1, 5, 2], [10]])
+def test_greedy(elens):
+    """Vectorized best paths are equal to those collapsed frame by frame."""
+    args = make_args(fc_list='')
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    ctc = module.CTC(**args)
+    ctc.eval()
+
+    eouts, elens = make_eouts(elens)
+    with torch.no_grad():
+        hyps = ctc.greedy(eouts, elens)
+        trigger_points = ctc.trigger_points(eouts, elens)
+        best_paths = ctc.output(eouts).argmax(-1)
+
+    assert len(hyps) == eouts.size(0)
+    for b in range(eouts.size(0)):
+        path = best_paths[b, :elens[b]].tolist()
+        hyp_ref, trigger_points_ref = [], []
+        for t, idx in enumerate(path):
+            if idx != args['blank'] and (t == 0 or idx != path[t - 1]):
+                hyp_ref.append(idx)
+                trigger_points_ref.append(t)
+        assert hyps[b] == [hyp_ref]
+        assert trigger_points[b, :len(hyp_ref)].tolist() == trigger_points_ref
+        assert (trigger_points[b, len(hyp_ref):] == 0).all()
+    assert trigger_points.size(1) == max([len(hyp[0]) for hyp in hyps]) + 1
+
+
+def test_beam_search_exact():
+    """Prefix beam search without pruning gives the exact N-best list."""
+    args = make_args(vocab=4, fc_list='')
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    ctc = module.CTC(**args)
+    ctc.eval()
+
+    T = 5
+    eouts, elens = make_eouts([T])
+    params = make_decode_params(recog_beam_width=200)
+    with torch.no_grad():
+        nbest_hyps = ctc.beam_search(eouts, elens, params, idx2token=None)[0]
+        log_probs = torch.log_softmax(ctc.output(eouts), dim=-1)[0].double()
+
+    # sum over all paths
+    probs = {}
+    for path in itertools.product(range(args['vocab']), repeat=T):
+        hyp = tuple(x[0] for x in itertools.groupby(path) if x[0] != args['blank'])
+        prob = log_probs[torch.arange(T), torch.LongTensor(path)].sum().exp().item()
+        probs[hyp] = probs.get(hyp, 0.) + prob
+    nbest_hyps_ref = sorted(probs.keys(), key=lambda x: probs[x], reverse=True)
+
+    assert len(nbest_hyps) == len(nbest_hyps_ref)
+    assert [tuple(hyp) for hyp in nbest_hyps[:10]] == nbest_hyps_ref[:10]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        ({'recog_beam_width': 4}),
+        ({'recog_beam_width': 8}),
+        ({'recog_beam_width': 4, 'recog_length_penalty': 0.5}),
+        ({'recog_beam_width': 4, 'recog_ctc_prune_threshold': 0.05}),
+        ({'recog_beam_width': 4, 'recog_lm_weight': 0.5}),
+        ({'recog_beam_width': 4, 'recog_lm_weight': 0.5, 'recog_lm_second_weight': 0.3}),
+    ]
+)
+def test_beam_search_batch(params):
+    """Decoding multiple utterances at once gives the same results as one by one."""
+    args = make_args()
+    params = make_decode_params(**params)
+
+    lm, lm_second = None, None
+    module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+    if params['recog_lm_weight'] > 0:
+        lm = module_rnnlm.RNNLM(make_args_rnnlm())
+    if params['recog_lm_second_weight'] > 0:
+        lm_second = module_rnnlm.RNNLM(make_args_rnnlm())
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    ctc = module.CTC(**args)
+    ctc.eval()
+
+    eouts, elens = make_eouts([40, 31, 17])
+    with torch.no_grad():
+        nbest_hyps = ctc.beam_search(eouts, elens, params, idx2token=None,
+                                     lm=lm, lm_second=lm_second)
+        assert len(nbest_hyps) == eouts.size(0)
+        for b in range(eouts.size(0)):
+            nbest_hyps_b = ctc.beam_search(eouts[b:b + 1, :elens[b]], elens[b:b + 1], params, idx2token=None,
+                                           lm=lm, lm_second=lm_second)[0]
+            assert 0 < len(nbest_hyps[b]) <= params['recog_beam_width']
+            assert nbest_hyps[b] == nbest_hyps_b
+            # no duplicated prefix in the beam
+            assert len(set(map(tuple, nbest_hyps[b]))) == len(nbest_hyps[b])
+
+
+@pytest.mark.parametrize("backward", [False, True])
+def test_ctc_prefix_score_batch(backward):
+    """Batched CTC prefix scores are equal to those of CTCPrefixScore."""
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    blank, eos = 0, 2
+
+    xlens = [20, 13]
+    log_probs = torch.log_softmax(torch.randn(len(xlens), max(xlens), VOCAB) * 3, dim=-1)
+    scorer = module.CTCPrefixScoreBatch(log_probs, torch.IntTensor(xlens), blank, eos, backward=backward)
+    r_init = scorer.initial_state()
+    assert r_init.size() == (max(xlens), 2, len(xlens))
+
+    # prefixes of different lengths of all utterances are scored at once
+    hyps = [[eos], [eos, 3], [eos, 3, 3], [eos, 3, 3, 5]]
+    cs = np.arange(1, VOCAB)
+    states, utt_ids, scores_ref = [], [], []
+    for b, xlen in enumerate(xlens):
+        log_probs_b = tensor2np(log_probs[b, :xlen])
+        scorer_ref = module.CTCPrefixScore(log_probs_b[::-1] if backward else log_probs_b, blank, eos)
+        r_ref, r = scorer_ref.initial_state(), r_init[:, :, b]
+        for n, hyp in enumerate(hyps):
+            states.append(r)
+            utt_ids.append(b)
+            scores_ref_n, states_ref_n = scorer_ref(hyp, cs, r_ref)
+            scores_ref.append(scores_ref_n)
+            if n < len(hyps) - 1:
+                # extend the prefix by the next label
+                k = int(np.where(cs == hyps[n + 1][-1])[0][0])
+                r_ref = states_ref_n[k]
+                r = scorer([hyp], torch.from_numpy(cs).unsqueeze(0), r.unsqueeze(2),
+                           torch.LongTensor([b]))[1][:, :, 0, k]
+
+    ctc_scores, ctc_states = scorer(hyps * len(xlens), torch.from_numpy(cs).repeat(len(states), 1),
+                                    torch.stack(states, dim=2), torch.LongTensor(utt_ids))
+    assert ctc_scores.size() == (len(states), len(cs))
+    assert ctc_states.size() == (max(xlens), 2, len(states), len(cs))
+    assert np.allclose(tensor2np(ctc_scores), np.stack(scores_ref), atol=1e-4)
+
+    # reorder states by back-pointers
+    index = torch.LongTensor([len(cs) * 3 + 1, 0])
+    ctc_states_sel = module.CTCPrefixScoreBatch.index_select_state(ctc_states, index)
+    assert torch.equal(ctc_states_sel[:, :, 0], ctc_states[:, :, 3, 1])
+    assert torch.equal(ctc_states_sel[:, :, 1], ctc_states[:, :, 0, 0])
+
+
+@pytest.mark.parametrize("margin", [3, 100])
+def test_ctc_prefix_score_batch_window(margin):
+    """Windowed CTC prefix scores are lower bounds of those over all frames."""
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    blank, eos = 0, 2
+
+    xlens = torch.IntTensor([30, 22])
+    log_probs = torch.log_softmax(torch.randn(len(xlens), max(xlens), VOCAB) * 3, dim=-1)
+    scorer = module.CTCPrefixScoreBatch(log_probs, xlens, blank, eos)
+    scorer_window = module.CTCPrefixScoreBatch(log_probs, xlens, blank, eos, margin=margin)
+
+    hyps = [[eos], [eos]]
+    cs = torch.arange(1, VOCAB).unsqueeze(0).repeat(2, 1)
+    utt_ids = torch.LongTensor([0, 1])
+    r = r_window = scorer.initial_state()
+    frames = torch.LongTensor([5, 8])
+    for i in range(3):
+        ctc_scores, ctc_states = scorer(hyps, cs, r, utt_ids)
+        ctc_scores_window, ctc_states_window = scorer_window(hyps, cs, r_window, utt_ids, frames)
+        assert torch.isfinite(ctc_scores_window).all()
+        if margin >= max(xlens):
+            assert torch.allclose(ctc_scores_window, ctc_scores, atol=1e-4)
+        else:
+            assert (ctc_scores_window <= ctc_scores + 1e-4).all()
+
+        # extend each prefix by the best non-<eos> label
+        k = ctc_scores.masked_fill(cs == eos, float('-inf')).argmax(1)
+        hyps = [hyp + [cs[n, k[n]].item()] for n, hyp in enumerate(hyps)]
+        index = torch.arange(2) * cs.size(1) + k
+        r = module.CTCPrefixScoreBatch.index_select_state(ctc_states, index)
+        r_window = module.CTCPrefixScoreBatch.index_select_state(ctc_states_window, index)
+        frames += 5
+
+
+@pytest.mark.parametrize("ys", [[[3, 4, 4]], [[5], [3, 3], [7, 1]], [[1, 2, 3, 4, 5, 6, 7, 8, 9, 1], [4, 5]]])
+def test_forced_align(ys):
+    """Batched Viterbi alignment gives the best path of each utterance."""
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    aligner = module.CTCForcedAligner(blank=0)
+
+    elens = [len(y) * 2 + 4 for y in ys]
+    if len(ys) > 1:
+        elens[-1] += 3
+    logits = torch.randn(len(ys), max(elens), VOCAB) * 3
+    with torch.no_grad():
+        trigger_points = aligner(logits.clone(), torch.IntTensor(elens), ys,
+                                 torch.IntTensor([len(y) for y in ys]))
+    assert trigger_points.size() == (len(ys), max([len(y) for y in ys]) + 1)
+
+    log_probs = torch.log_softmax(logits, dim=-1)
+    for b, y in enumerate(ys):
+        # best path by dynamic programming over frames for each utterance
+        T, L = elens[b], len(y)
+        path = [0] + list(itertools.chain.from_iterable([[token, 0] for token in y]))
+        best = {0: (log_probs[b, 0, 0].item(), [0]), 1: (log_probs[b, 0, y[0]].item(), [1])}
+        for t in range(1, T):
+            best_t = {}
+            for s in range(len(path)):
+                prevs = [s - 1, s] + ([s - 2] if s >= 2 and path[s] != path[s - 2] else [])
+                cands = [best[p] for p in prevs if p in best]
+                if len(cands) == 0:
+                    continue
+                score, states = max(cands, key=lambda x: x[0])
+                best_t[s] = (score + log_probs[b, t, path[s]].item(), states + [s])
+            best = best_t
+        states = max([best[s] for s in [len(path) - 1, len(path) - 2]], key=lambda x: x[0])[1]
+        trigger_points_ref = [states.index(2 * i + 1) for i in range(L)] + [T - 1]
+        assert trigger_points[b, :L + 1].tolist() == trigger_points_ref
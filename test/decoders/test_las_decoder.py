@@ -4,6 +4,8 @@
 """Test for attention-based RNN decoder."""
 
 import argparse
+import copy
+import functools
 import importlib
 import math
 import numpy as np
@@ -11,7 +13,9 @@ import pytest
 import torch
 
 from neural_sp.datasets.token_converter.character import Idx2char
+from neural_sp.models.torch_utils import make_pad_mask
 from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import parallel_apply
 from neural_sp.models.torch_utils import pad_list
 
 
@@ -189,6 +193,8 @@ def make_decode_params(**kwargs):
         recog_batch_size=1,
         recog_beam_width=1,
         recog_ctc_weight=0.0,
+        recog_ctc_prune_threshold=0.0,
+        recog_ctc_window_margin=0,
         recog_lm_weight=0.0,
         recog_lm_second_weight=0.0,
         recog_lm_bwd_weight=0.0,
@@ -210,6 +216,12 @@ def make_decode_params(**kwargs):
     return args
 
 
+def make_eouts(elens=[40, 31, 17], device="cpu"):
+    eouts = [np.random.randn(elen, ENC_N_UNITS).astype(np.float32) for elen in elens]
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+    return eouts, torch.IntTensor(elens)
+
+
 def make_args_rnnlm(**kwargs):
     args = dict(
         lm_type='lstm',
@@ -249,6 +261,7 @@ def make_args_rnnlm(**kwargs):
         (False, '', {'recog_beam_width': 4, 'nbest': 4}),
         (False, '', {'recog_beam_width': 4, 'nbest': 4, 'softmax_smoothing': 2.0}),
         (False, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        (False, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.1, 'recog_ctc_window_margin': 10}),
         (False, '', {'recog_beam_width': 4, 'recog_softmax_smoothing': 0.8}),
         # pure CTC decoding
         (True, '', {'recog_beam_width': 1, 'recog_ctc_weight': 1.0}),
@@ -465,3 +478,731 @@ def test_streaming_decoding(params):
             end_hyps, hyps, _ = out
             assert isinstance(end_hyps, list)
             assert isinstance(hyps, list)
+
+
+@pytest.mark.parametrize(
+    "params,block_size",
+    [
+        ({'recog_beam_width': 1}, 8),
+        ({'recog_beam_width': 4}, 8),
+        ({'recog_beam_width': 4}, 13),
+        ({'recog_beam_width': 4, 'recog_lm_weight': 0.3}, 8),
+        ({'recog_beam_width': 4, 'recog_length_penalty': 0.1, 'recog_eos_threshold': 1.0}, 8),
+        ({'recog_beam_width': 4, 'recog_ctc_weight': 0.3}, 40),
+    ]
+)
+def test_beam_search_block_sync_batch(params, block_size):
+    """Block-synchronous decoding of streams joining and leaving the batch is equal to beam_search_block_sync()."""
+    args = make_args(attn_type='mocha', param_init=1.0, mocha_init_r=0)
+    params = make_decode_params(**params)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+    lm = None
+    if params['recog_lm_weight'] > 0:
+        module_lm = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module_lm.RNNLM(make_args_rnnlm())
+        lm.eval()
+
+    elens = [40, 31, 17, 26]
+    starts = [0, 1, 0, 2]  # blocks where streams join the batch
+    eouts = torch.randn(len(elens), max(elens), ENC_N_UNITS) * 3
+    ctc_log_probs = None
+    if params['recog_ctc_weight'] > 0:
+        ctc_log_probs = torch.log_softmax(torch.randn(len(elens), max(elens), VOCAB), dim=-1)
+    n_blocks = [math.ceil(elen / block_size) for elen in elens]
+
+    def summarize(hyps):
+        return [(hyp['hyp'], hyp['boundary']) for hyp in hyps], np.array([hyp['score'] for hyp in hyps])
+
+    with torch.no_grad():
+        outs_ref = {}
+        for b in range(len(elens)):
+            hyps = None
+            for i_block in range(n_blocks[b]):
+                t = i_block * block_size
+                end_hyps, hyps, _ = dec.beam_search_block_sync(
+                    eouts[b:b + 1, t:min(t + block_size, elens[b])], params, None, hyps, lm,
+                    ctc_log_probs[b:b + 1, t:min(t + block_size, elens[b])] if ctc_log_probs is not None else None)
+                outs_ref[b, i_block] = summarize(end_hyps + hyps)
+
+        streams = [None] * len(elens)
+        for i_block in range(max([s + n for s, n in zip(starts, n_blocks)])):
+            # streams in the middle of utterances
+            ids = [b for b in range(len(elens)) if starts[b] <= i_block < starts[b] + n_blocks[b]]
+            offsets = [(i_block - starts[b]) * block_size for b in ids]
+            eouts_block = pad_list([eouts[b, t:min(t + block_size, elens[b])] for b, t in zip(ids, offsets)], 0.)
+            elens_block = torch.IntTensor([min(block_size, elens[b] - t) for b, t in zip(ids, offsets)])
+            ctc_log_probs_block = None
+            if ctc_log_probs is not None:
+                ctc_log_probs_block = pad_list([ctc_log_probs[b, t:min(t + block_size, elens[b])]
+                                                for b, t in zip(ids, offsets)], 0.)
+            outs = dec.beam_search_block_sync_batch(eouts_block, elens_block, params,
+                                                    [streams[b] for b in ids], lm, ctc_log_probs_block)
+            for b, stream in zip(ids, outs):
+                streams[b] = stream
+                hyps, scores = summarize(stream['end_hyps'] + stream['hyps'])
+                hyps_ref, scores_ref = outs_ref[b, i_block - starts[b]]
+                assert hyps == hyps_ref
+                assert np.allclose(scores, scores_ref, atol=1e-4)
+
+    for b in range(len(elens)):
+        assert streams[b]['n_frames'] == elens[b]
+
+
+def test_beam_search_block_sync_batch_ctc():
+    """CTC log-probabilities of every block are registered to the CTC prefix scorer of each stream."""
+    args = make_args(attn_type='mocha', param_init=1.0, mocha_init_r=0)
+    params = make_decode_params(recog_beam_width=4, recog_ctc_weight=0.3)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+
+    elens = [40, 17]
+    block_size = 8
+    eouts = torch.randn(len(elens), max(elens), ENC_N_UNITS) * 3
+    ctc_log_probs = torch.log_softmax(torch.randn(len(elens), max(elens), VOCAB), dim=-1)
+
+    with torch.no_grad():
+        streams = [None] * len(elens)
+        for t in range(0, max(elens), block_size):
+            ids = [b for b in range(len(elens)) if t < elens[b]]
+            elens_block = torch.IntTensor([min(block_size, elens[b] - t) for b in ids])
+            outs = dec.beam_search_block_sync_batch(
+                eouts[ids, t:t + block_size], elens_block, params, [streams[b] for b in ids],
+                ctc_log_probs=ctc_log_probs[ids, t:t + block_size])
+            for b, stream in zip(ids, outs):
+                streams[b] = stream
+
+    for b in range(len(elens)):
+        assert streams[b]['ctc_prefix_scorer'].xlen == elens[b]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'attn_type': 'location'}),
+        ({'attn_type': 'add'}),
+        ({'attn_type': 'dot'}),
+        ({'attn_type': 'luong_general'}),
+        ({'attn_type': 'add', 'attn_n_heads': 4}),
+        ({'rnn_type': 'gru'}),
+        ({'n_projs': 8}),
+    ]
+)
+def test_export_step(args):
+    args = make_args(**args)
+    n_heads = args['attn_n_heads']
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+    module_export = importlib.import_module('neural_sp.models.export')
+    step = module_export.LASStepExport(dec)
+
+    def make_inputs(batch_size, emax):
+        eouts = torch.randn(batch_size, emax, ENC_N_UNITS)
+        elens = torch.IntTensor([emax] + [emax // 2] * (batch_size - 1))
+        hxs = torch.randn(args['n_layers'], batch_size, args['n_units'])
+        aw = torch.softmax(torch.randn(batch_size, n_heads, 1, emax), dim=-1)
+        return (torch.randint(0, VOCAB, (batch_size, 1)), eouts, elens,
+                torch.randn(batch_size, 1, ENC_N_UNITS), hxs, torch.randn_like(hxs), aw)
+
+    traced = module_export.trace(step, make_inputs(4, 40), [make_inputs(2, 23)])
+
+    # compare with the eager decoder at a new shape
+    y, eouts, elens, cv, hxs, cxs, aw = make_inputs(3, 31)
+    with torch.no_grad():
+        log_probs, cv_t, hxs_t, cxs_t, aw_t = traced(y, eouts, elens, cv, hxs, cxs, aw)
+        dstates = {'dstate': (hxs, cxs if args['rnn_type'] == 'lstm' else None)}
+        mask = make_pad_mask(elens).unsqueeze(1)
+        dstates, cv, aw, _, attn_v = dec.decode_step(eouts, dstates, cv, dec.embed(y), mask, aw, None,
+                                                     cache=False)
+        log_probs_ref = torch.log_softmax(dec.output(attn_v).squeeze(1), dim=-1)
+    assert log_probs.size() == (3, VOCAB)
+    assert torch.allclose(log_probs, log_probs_ref, atol=1e-5)
+    assert torch.allclose(cv_t, cv, atol=1e-5)
+    assert torch.allclose(aw_t, aw, atol=1e-5)
+    assert torch.allclose(hxs_t, dstates['dstate'][0], atol=1e-5)
+
+
+def make_args_transformerlm(**kwargs):
+    args = dict(
+        lm_type='transformer',
+        transformer_attn_type='scaled_dot',
+        transformer_n_heads=4,
+        n_layers=2,
+        transformer_d_model=16,
+        transformer_d_ff=64,
+        transformer_layer_norm_eps=1e-12,
+        transformer_ffn_activation='relu',
+        transformer_pe_type='add',
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        dropout_att=0.1,
+        dropout_layer=0.0,
+        lsm_prob=0.0,
+        transformer_param_init='xavier_uniform',
+        mem_len=0,
+        recog_mem_len=0,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+@pytest.mark.parametrize(
+    "backward, lm_type, params",
+    [
+        (False, '', {'recog_beam_width': 4}),
+        (False, '', {'recog_beam_width': 4, 'nbest': 4}),
+        (False, '', {'recog_beam_width': 4, 'exclude_eos': True}),
+        (False, '', {'recog_beam_width': 4, 'recog_softmax_smoothing': 0.8}),
+        (False, '', {'recog_beam_width': 4, 'recog_min_len_ratio': 0.5}),
+        (False, '', {'recog_beam_width': 4, 'recog_eos_threshold': 1.0}),
+        # length penalty
+        (False, '', {'recog_beam_width': 4, 'recog_length_penalty': 0.1}),
+        (False, '', {'recog_beam_width': 4, 'recog_length_penalty': 0.1, 'recog_gnmt_decoding': True}),
+        (False, '', {'recog_beam_width': 4, 'recog_length_norm': True}),
+        # shallow fusion
+        (False, 'rnn', {'recog_beam_width': 4, 'recog_lm_weight': 0.3}),
+        (False, 'transformer', {'recog_beam_width': 4, 'recog_lm_weight': 0.3}),
+        # rescoring
+        (False, '', {'recog_beam_width': 4, 'recog_lm_second_weight': 0.1, 'nbest': 2}),
+        # joint CTC/attention decoding
+        (False, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.3}),
+        (False, 'rnn', {'recog_beam_width': 4, 'recog_ctc_weight': 0.3, 'recog_lm_weight': 0.3}),
+        (False, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.3, 'recog_ctc_window_margin': 20}),
+        # backward
+        (True, '', {'recog_beam_width': 4, 'nbest': 2}),
+        (True, '', {'recog_beam_width': 4, 'exclude_eos': True}),
+        (True, 'rnn', {'recog_beam_width': 4, 'recog_lm_weight': 0.3}),
+        (True, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.3}),
+    ]
+)
+def test_beam_search_batch(backward, lm_type, params):
+    args = make_args(backward=backward)
+    params = make_decode_params(**params)
+    params['recog_max_len_ratio'] = 0.5
+
+    emax = 40
+    device = "cpu"
+
+    eouts, elens = make_eouts([emax, 31, 17], device)
+    batch_size = eouts.size(0)
+
+    lm, lm_second = None, None
+    if lm_type == 'rnn':
+        lm = importlib.import_module('neural_sp.models.lm.rnnlm').RNNLM(make_args_rnnlm())
+    elif lm_type == 'transformer':
+        lm = importlib.import_module('neural_sp.models.lm.transformerlm').TransformerLM(make_args_transformerlm())
+    if params['recog_lm_second_weight'] > 0:
+        lm_second = importlib.import_module('neural_sp.models.lm.rnnlm').RNNLM(make_args_rnnlm())
+
+    ctc_log_probs = None
+    if params['recog_ctc_weight'] > 0:
+        ctc_log_probs = torch.log_softmax(torch.randn(batch_size, emax, VOCAB, device=device), dim=-1)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+    with torch.no_grad():
+        nbest_hyps_ref, aws_ref, scores_ref = dec.beam_search(
+            eouts, elens, params, idx2token, lm, lm_second, None, ctc_log_probs,
+            nbest=params['nbest'], exclude_eos=params['exclude_eos'], cache_states=True)
+        nbest_hyps, aws, scores = dec.beam_search_batch(
+            eouts, elens, params, idx2token, lm, lm_second, None, ctc_log_probs,
+            nbest=params['nbest'], exclude_eos=params['exclude_eos'])
+
+    assert len(nbest_hyps) == batch_size
+    for b in range(batch_size):
+        assert len(nbest_hyps[b]) == params['nbest']
+        for n in range(params['nbest']):
+            assert math.isclose(scores[b][n], scores_ref[b][n], abs_tol=1e-4)
+            assert aws[b][n].shape == aws_ref[b][n].shape
+            # NOTE: hypotheses with tied scores can be swapped by floating-point errors
+            if nbest_hyps[b][n].tolist() == nbest_hyps_ref[b][n].tolist():
+                assert np.allclose(aws[b][n], aws_ref[b][n], atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "args, params",
+    [
+        ({}, {'recog_beam_width': 4}),
+        ({}, {'recog_beam_width': 4, 'nbest': 2, 'exclude_eos': True}),
+        ({}, {'recog_beam_width': 4, 'recog_coverage_penalty': 0.1}),
+        ({}, {'recog_beam_width': 4, 'recog_coverage_penalty': 0.1, 'recog_coverage_threshold': 0.05}),
+        ({}, {'recog_beam_width': 4, 'recog_coverage_penalty': 0.1, 'recog_gnmt_decoding': True,
+              'recog_length_penalty': 0.1}),
+        ({'attn_type': 'mocha'}, {'recog_beam_width': 4, 'recog_coverage_penalty': 0.1}),
+        ({'backward': True}, {'recog_beam_width': 4, 'recog_coverage_penalty': 0.1, 'exclude_eos': True}),
+    ]
+)
+def test_beam_search_store_aws(args, params):
+    args = make_args(**args)
+    params = make_decode_params(**params)
+
+    eouts, elens = make_eouts()
+    batch_size = eouts.size(0)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+    with torch.no_grad():
+        outs = [dec.beam_search(eouts, elens, params, idx2token=None,
+                                nbest=params['nbest'], exclude_eos=params['exclude_eos'], store_aws=store_aws)
+                for store_aws in [True, False]]
+    (nbest_hyps_ref, aws_ref, scores_ref), (nbest_hyps, aws, scores) = outs
+
+    # NOTE: the coverage penalty is accumulated over steps without the attention history
+    assert aws is None
+    for b in range(batch_size):
+        for n in range(params['nbest']):
+            assert nbest_hyps[b][n].tolist() == nbest_hyps_ref[b][n].tolist()
+            assert math.isclose(scores[b][n], scores_ref[b][n], abs_tol=1e-4)
+            assert aws_ref[b][n].shape[1] == len(nbest_hyps_ref[b][n])
+
+
+@pytest.mark.parametrize(
+    "backward, params",
+    [
+        (False, {'recog_beam_width': 4, 'nbest': 2}),
+        (False, {'recog_beam_width': 4, 'recog_ctc_weight': 0.3}),
+        (True, {'recog_beam_width': 4, 'exclude_eos': True}),
+    ]
+)
+def test_beam_search_batch_store_aws(backward, params):
+    args = make_args(backward=backward)
+    params = make_decode_params(**params)
+
+    eouts, elens = make_eouts()
+
+    ctc_log_probs = None
+    if params['recog_ctc_weight'] > 0:
+        ctc_log_probs = torch.log_softmax(torch.randn(eouts.size(0), eouts.size(1), VOCAB), dim=-1)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+    with torch.no_grad():
+        outs = [dec.beam_search_batch(eouts, elens, params, ctc_log_probs=ctc_log_probs,
+                                      nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+                                      store_aws=store_aws)
+                for store_aws in [True, False]]
+    (nbest_hyps_ref, aws_ref, scores_ref), (nbest_hyps, aws, scores) = outs
+
+    assert aws is None
+    for b in range(eouts.size(0)):
+        for n in range(params['nbest']):
+            assert nbest_hyps[b][n].tolist() == nbest_hyps_ref[b][n].tolist()
+            assert math.isclose(scores[b][n], scores_ref[b][n], abs_tol=1e-4)
+            assert aws_ref[b][n].shape[1] == len(nbest_hyps_ref[b][n])
+
+
+@pytest.mark.parametrize(
+    "args, params",
+    [
+        ({}, {'recog_beam_width': 4}),
+        ({}, {'recog_beam_width': 4, 'nbest': 2, 'recog_coverage_penalty': 0.1}),
+        ({'attn_type': 'mocha'}, {'recog_beam_width': 4}),
+        ({'backward': True}, {'recog_beam_width': 4, 'nbest': 2}),
+    ]
+)
+def test_beam_search_ensemble(args, params):
+    args = make_args(**args)
+    params = make_decode_params(**params)
+
+    eouts, elens = make_eouts()
+    batch_size = eouts.size(0)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+    # NOTE: a randomly initialized decoder outputs almost uniform distributions, and then
+    # hypotheses with tied scores are swapped by floating-point errors of the ensemble average
+    dec.output.weight.data.mul_(100)
+    with torch.no_grad():
+        nbest_hyps_ref, _, scores_ref = dec.beam_search(eouts, elens, params, idx2token=None,
+                                                        nbest=params['nbest'])
+        # NOTE: decoder steps run concurrently with distinct decoders and serially with a shared decoder
+        for ensmbl_decs in [[copy.deepcopy(dec) for _ in range(2)], [dec, dec]]:
+            nbest_hyps, _, scores = dec.beam_search(eouts, elens, params, idx2token=None,
+                                                    nbest=params['nbest'],
+                                                    ensmbl_eouts=[eouts] * 2, ensmbl_elens=[elens] * 2,
+                                                    ensmbl_decs=ensmbl_decs)
+
+            # ensemble of the same model is identical to the single model
+            for b in range(batch_size):
+                for n in range(params['nbest']):
+                    assert math.isclose(scores[b][n], scores_ref[b][n], abs_tol=1e-4)
+                    assert nbest_hyps[b][n].tolist() == nbest_hyps_ref[b][n].tolist()
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        ({'recog_beam_width': 4}),
+        ({'recog_beam_width': 4, 'recog_lm_weight': 0.3, 'recog_lm_bwd_weight': 0.3}),
+        ({'recog_beam_width': 4, 'recog_lm_weight': 0.3, 'recog_lm_bwd_weight': 0.3, 'recog_ctc_weight': 0.3}),
+    ]
+)
+def test_beam_search_fwd_bwd_concurrent(params):
+    """Forward and backward searches sharing LMs run concurrently as in Speech2Text.decode."""
+    params = make_decode_params(**params)
+
+    eouts, elens = make_eouts()
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec_fwd = module.RNNDecoder(**make_args(ctc_weight=0.5))
+    dec_bwd = module.RNNDecoder(**make_args(ctc_weight=0.5, backward=True))
+    dec_fwd.eval()
+    dec_bwd.eval()
+    lm, lm_bwd = None, None
+    if params['recog_lm_weight'] > 0:
+        module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module_rnnlm.RNNLM(make_args_rnnlm()).eval()
+        lm_bwd = module_rnnlm.RNNLM(make_args_rnnlm()).eval()
+
+    with torch.no_grad():
+        ctc_log_probs = dec_fwd.ctc_log_probs(eouts) if params['recog_ctc_weight'] > 0 else None
+        searches = [functools.partial(dec_fwd.beam_search, eouts, elens, params, None,
+                                      lm, None, lm_bwd, ctc_log_probs),
+                    functools.partial(dec_bwd.beam_search, eouts, elens, params, None,
+                                      lm_bwd, None, lm, ctc_log_probs)]
+        outs_ref = [search() for search in searches]
+        outs = parallel_apply(searches)
+    for (nbest_hyps_ref, _, scores_ref), (nbest_hyps, _, scores) in zip(outs_ref, outs):
+        for b in range(eouts.size(0)):
+            assert nbest_hyps[b][0].tolist() == nbest_hyps_ref[b][0].tolist()
+            assert math.isclose(scores[b][0], scores_ref[b][0], abs_tol=1e-4)
+
+
+@pytest.mark.parametrize("backward", [False, True])
+def test_beam_search_score_steps(backward):
+    params = make_decode_params(recog_beam_width=4, nbest=2)
+
+    eouts, elens = make_eouts()
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**make_args(backward=backward))
+    dec.eval()
+    with torch.no_grad():
+        nbest_hyps_ref, _, scores_ref = dec.beam_search(eouts, elens, params, nbest=2)
+        nbest_hyps, aws, scores = dec.beam_search(eouts, elens, params, nbest=2, store_score_steps=True)
+
+    for b in range(eouts.size(0)):
+        for n in range(2):
+            assert nbest_hyps[b][n].tolist() == nbest_hyps_ref[b][n].tolist()
+            assert scores[b][n].shape == (len(nbest_hyps[b][n]),)
+            assert aws[b][n].shape[1] == len(nbest_hyps[b][n])
+            # log probabilities are accumulated in the decoding order
+            score_total = scores[b][n][0] if backward else scores[b][n][-1]
+            assert math.isclose(score_total, scores_ref[b][n], abs_tol=1e-4)
+            assert np.all(np.diff(scores[b][n]) >= 0 if backward else np.diff(scores[b][n]) <= 0)
+
+
+def test_fwd_bwd_attention():
+    """The forward hypothesis is continued by the backward one at the same token attending to the same time."""
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.fwd_bwd_attention')
+    eos, max_time = 2, 10
+
+    def make_aws(times):
+        aws = np.zeros((1, len(times), max_time), dtype=np.float32)
+        aws[0, np.arange(len(times)), times] = 1
+        return aws
+
+    # the forward hypothesis is confident at the beginning, the backward one at the end
+    hyp_fwd, times_fwd = np.array([4, 5, 6, eos]), [1, 4, 7, 9]
+    scores_fwd = np.cumsum([-0.5, -0.5, -3., -0.1])
+    hyp_bwd, times_bwd = np.array([eos, 8, 5, 7]), [0, 1, 4, 7]
+    scores_bwd = np.cumsum([-0.1, -3., -0.5, -0.5][::-1])[::-1]
+
+    best_hyps = module.fwd_bwd_attention([[hyp_fwd]], [[make_aws(times_fwd)]], [[scores_fwd]],
+                                         [[hyp_bwd]], [[make_aws(times_bwd)]], [[scores_bwd]],
+                                         eos, False, 0., None, None)
+    assert best_hyps[0].tolist() == [4, 5, 7]
+
+    # no merging at different time
+    times_bwd = [0, 1, 2, 3]
+    best_hyps = module.fwd_bwd_attention([[hyp_fwd]], [[make_aws(times_fwd)]], [[scores_fwd]],
+                                         [[hyp_bwd]], [[make_aws(times_bwd)]], [[scores_bwd]],
+                                         eos, False, 0., None, None)
+    assert best_hyps[0].tolist() == [4, 5, 6]
+
+
+def make_speech2text(**kwargs):
+    module = importlib.import_module('neural_sp.bin.args_asr')
+    argv = ['--enc_type', 'blstm', '--enc_n_units', str(ENC_N_UNITS), '--enc_n_layers', '1',
+            '--dec_type', 'lstm', '--dec_n_units', '16', '--dec_n_layers', '1',
+            '--emb_dim', '8', '--attn_dim', '16', '--subsample', '1']
+    for k, v in kwargs.items():
+        argv += ['--' + k, str(v)]
+    parser = module.build_parser()
+    args, _ = parser.parse_known_args(argv)
+    parser = module.register_args_encoder(parser, args)
+    args, _ = parser.parse_known_args(argv)
+    parser = module.register_args_decoder(parser, args, args.dec_type)
+    args = parser.parse_args(argv)
+    # NOTE: these are set from datasets in the training stage
+    args.input_dim = 8
+    args.vocab = VOCAB
+    args.vocab_sub1 = -1
+    args.vocab_sub2 = -1
+    module = importlib.import_module('neural_sp.models.seq2seq.speech2text')
+    model = module.Speech2Text(args)
+    model.eval()
+    return model, vars(args)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        ({'recog_beam_width': 4}),
+        ({'recog_beam_width': 4, 'recog_ctc_weight': 0.3}),
+    ]
+)
+def test_decode_fwd_bwd_attention(params):
+    model, recog_params = make_speech2text(bwd_weight=0.5, ctc_weight=0.3)
+    recog_params.update(params)
+    recog_params['recog_fwd_bwd_attention'] = True
+
+    xs = [np.random.randn(xlen, 8).astype(np.float32) for xlen in [40, 31, 17]]
+    with torch.no_grad():
+        nbest_hyps, aws = model.decode(xs, recog_params, idx2token, exclude_eos=True)
+    assert aws is None
+    assert len(nbest_hyps) == len(xs)
+    for hyps in nbest_hyps:
+        assert len(hyps) == 1
+        assert 2 not in hyps[0].tolist()
+
+
+@pytest.mark.parametrize(
+    "args,params",
+    [
+        ({}, {'recog_coverage_penalty': 0.1, 'recog_coverage_threshold': 0.1}),
+        ({'attn_type': 'mocha', 'ctc_weight': 0.3}, {}),
+    ]
+)
+def test_decode_batch_fallback(args, params):
+    """Options unsupported by batched beam search fall back to per-utterance beam search."""
+    model, recog_params = make_speech2text(**args)
+    recog_params.update(recog_beam_width=2, **params)
+    assert not model.dec_fwd.batch_decodable(recog_params)
+
+    xs = [np.random.randn(xlen, 8).astype(np.float32) for xlen in [40, 31, 17]]
+    with torch.no_grad():
+        nbest_hyps_ref = [model.decode(xs[b:b + 1], recog_params, idx2token, exclude_eos=True)[0][0]
+                          for b in range(len(xs))]
+        recog_params['recog_batch_size'] = len(xs)
+        nbest_hyps = model.decode(xs, recog_params, idx2token, exclude_eos=True)[0]
+    for b in range(len(xs)):
+        assert np.array_equal(nbest_hyps[b][0], nbest_hyps_ref[b][0])
+
+
+@pytest.mark.parametrize("block_sync", [True, False])
+def test_decode_streaming_ctc_vad_cnn_cache(block_sync):
+    model, recog_params = make_speech2text(enc_type='conv_lstm', conv_channels='32_32',
+                                           conv_kernel_sizes='(3,3)_(3,3)', conv_strides='(1,1)_(1,1)',
+                                           conv_poolings='(2,2)_(2,2)', attn_type='mocha', ctc_weight=0.3)
+    # NOTE: every frame is regarded as blank to segment the stream frequently
+    recog_params.update(recog_beam_width=2, recog_block_sync=block_sync, recog_block_sync_size=20,
+                        recog_cnn_cache=True, recog_ctc_vad=True, recog_ctc_vad_blank_threshold=8,
+                        recog_ctc_vad_n_accum_frames=0, recog_ctc_vad_spike_threshold=1.1)
+
+    xs = [np.random.randn(150, 8).astype(np.float32)]
+    with torch.no_grad():
+        nbest_hyps, _ = model.decode_streaming(xs, recog_params, idx2token, exclude_eos=True)
+    assert len(nbest_hyps) == 1
+    assert 2 not in list(nbest_hyps[0][0])
+    assert not model.enc.conv.stateful
+
+
+def test_decode_streaming_reset_on_error():
+    model, recog_params = make_speech2text(enc_type='conv_lstm', conv_channels='32_32',
+                                           conv_kernel_sizes='(3,3)_(3,3)', conv_strides='(1,1)_(1,1)',
+                                           conv_poolings='(2,2)_(2,2)', ctc_weight=0.3)
+    recog_params.update(recog_beam_width=2, recog_block_sync=True, recog_block_sync_size=20,
+                        recog_cnn_cache=True)
+
+    def beam_search_block_sync(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    model.dec_fwd.beam_search_block_sync = beam_search_block_sync
+    xs = [np.random.randn(150, 8).astype(np.float32)]
+    with torch.no_grad(), pytest.raises(KeyboardInterrupt):
+        model.decode_streaming(xs, recog_params, idx2token, exclude_eos=True)
+    # the encoder is not left in the streaming mode
+    assert not model.enc.conv.stateful
+    for module in model.enc.conv.modules():
+        if hasattr(module, 'cache'):
+            assert all(v is None for v in module.cache.values())
+
+
+@pytest.mark.parametrize("ctc_vad", [False, True])
+def test_decode_streaming_batch(ctc_vad):
+    """Batched streaming decoding with block-synchronous MoChA is equal to decoding of each stream."""
+    model, recog_params = make_speech2text(enc_type='conv_lstm', conv_channels='4_4',
+                                           conv_kernel_sizes='(3,3)_(3,3)', conv_strides='(1,1)_(1,1)',
+                                           conv_poolings='(2,2)_(2,2)', attn_type='mocha', mocha_init_r=0,
+                                           param_init=1.0, ctc_weight=0.3)
+    # NOTE: every frame is regarded as blank to segment the stream frequently
+    recog_params.update(recog_beam_width=2, recog_block_sync=True, recog_block_sync_size=20,
+                        recog_cnn_cache=True, recog_ctc_vad=ctc_vad, recog_ctc_vad_blank_threshold=8,
+                        recog_ctc_vad_n_accum_frames=0, recog_ctc_vad_spike_threshold=1.1)
+
+    xs = [np.random.randn(xlen, 8).astype(np.float32) for xlen in [150, 97, 203]]
+    with torch.no_grad():
+        # multiple streams are dispatched to decode_streaming_batch()
+        best_hyps_id = model.decode_streaming(xs, recog_params, idx2token, exclude_eos=True)[0]
+        assert len(best_hyps_id) == len(xs)
+        for b in range(len(xs)):
+            best_hyps_id_ref = model.decode_streaming(xs[b:b + 1], recog_params, idx2token, exclude_eos=True)[0]
+            assert np.array_equal(np.array(best_hyps_id[b][0]), np.array(best_hyps_id_ref[0][0]))
+    assert not model.enc.conv.stateful
+
+
+def test_decode_streaming_batch_not_implemented():
+    model, recog_params = make_speech2text(ctc_weight=0.3)
+    recog_params.update(recog_block_sync=False)
+    xs = [np.random.randn(xlen, 8).astype(np.float32) for xlen in [40, 31]]
+    with torch.no_grad(), pytest.raises(NotImplementedError):
+        model.decode_streaming(xs, recog_params, idx2token, exclude_eos=True)
+
+
+LEX_WORDS = ['<unk>', '<eos>', '<pad>', 'ab', 'abc', "c'a", 'd', 'b', 'ba']
+UNITS = ['<blank>', '<unk>', '<eos>', '<pad>', ' ', "'", 'a', 'b', 'c', 'd']  # see test/decoders/dict.txt
+
+
+@pytest.mark.parametrize("dec_type", ['lstm', 'gru'])
+def test_export_model_onnx(tmp_path, dec_type):
+    ort = pytest.importorskip('onnxruntime')
+    model, _ = make_speech2text(dec_type=dec_type, ctc_weight=0.3)
+    module_export = importlib.import_module('neural_sp.models.export')
+    meta = module_export.export_model(model, str(tmp_path), onnx=True)
+    assert meta['ctc']
+
+    def run(name, inputs):
+        traced = torch.jit.load(str(tmp_path / meta['modules'][name]['torchscript']))
+        sess = ort.InferenceSession(str(tmp_path / meta['modules'][name]['onnx']),
+                                    providers=['CPUExecutionProvider'])
+        with torch.no_grad():
+            outs_ref = traced(*inputs)
+        outs = sess.run(None, {i.name: x.numpy() for i, x in zip(sess.get_inputs(), inputs)})
+        assert len(outs) == len(outs_ref)
+        for o_ref, o in zip(outs_ref, outs):
+            assert np.allclose(o_ref.numpy(), o, atol=1e-5)
+        return outs_ref
+
+    # ONNX graphs must match TorchScript modules at new shapes
+    eouts, elens = run('encoder', (torch.randn(4, 29, 8), torch.IntTensor([29, 23, 17, 5])))[:2]
+    hxs = torch.randn(1, 4, 16)
+    run('las_step', (torch.randint(0, VOCAB, (4, 1)), eouts, elens, torch.randn(4, 1, eouts.size(2)),
+                     hxs, torch.randn_like(hxs), torch.softmax(torch.randn(4, 1, 1, eouts.size(1)), dim=-1)))
+
+
+def make_lexicon(tmp_path, lm, wordpiece=False):
+    word_dict_path = str(tmp_path / 'word_dict.txt')
+    with open(word_dict_path, 'w') as f:
+        for i, w in enumerate(LEX_WORDS):
+            f.write('%s %d\n' % (w, i + 1))
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.lexicon')
+    if not wordpiece:
+        # words are spelled by characters
+        return module.LexiconPrefixTree.from_dicts('test/decoders/dict.txt', word_dict_path, lm=lm)
+
+    # NOTE: "'" is used as the word-initial unit instead of <space>
+    lexicon_path = str(tmp_path / 'lexicon.txt')
+    with open(lexicon_path, 'w') as f:
+        for w in LEX_WORDS[3:]:
+            f.write('%s %s\n' % (w, ' '.join(["'"] + list(w.replace("'", '')))))
+    asr_dict_path = str(tmp_path / 'dict.txt')
+    with open(asr_dict_path, 'w') as f:
+        for i, u in enumerate(UNITS[1:]):
+            if u != ' ':
+                f.write('%s %d\n' % (u, i + 1))
+    return module.LexiconPrefixTree.from_dicts(asr_dict_path, word_dict_path, lexicon_path, lm=lm)
+
+
+def spell(words, wordpiece=False):
+    if wordpiece:
+        return [UNITS.index(u) for w in words for u in ["'"] + list(w.replace("'", ''))]
+    return [UNITS.index(c) for c in ' '.join(words)]
+
+
+@pytest.mark.parametrize("wordpiece", [False, True])
+@pytest.mark.parametrize("words", [['ab'], ['abc', 'd', 'ab'], ["c'a", 'ba', 'b']])
+def test_lexicon_lookahead(tmp_path, wordpiece, words):
+    """Look-ahead scores of units sum up to the word-level LM score of the sentence."""
+    module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module_rnnlm.RNNLM(make_args_rnnlm(vocab=len(LEX_WORDS) + 1))
+    lm.eval()
+    lexicon = make_lexicon(tmp_path, lm, wordpiece)
+
+    with torch.no_grad():
+        state = lexicon.initial_state()
+        score = 0.
+        for idx in spell(words, wordpiece) + [2]:
+            scores, next_states = lexicon.score([state])
+            assert scores[0, idx] > float('-inf')
+            assert (scores[0] > float('-inf')).sum() < VOCAB  # invalid units are masked
+            score += scores[0, idx].item()
+            state = lexicon.next_state(state, idx, next_states[0])
+
+        ys = [LEX_WORDS.index(w) + 1 for w in words]
+        _, _, log_probs = lm.predict(torch.tensor([[2] + ys]))
+        score_ref = sum([log_probs[0, t, y].item() for t, y in enumerate(ys + [2])])
+    assert abs(score - score_ref) < 1e-4
+
+
+@pytest.mark.parametrize("lm_weight", [0.0, 0.5, 1.0])
+def test_beam_search_lexicon(tmp_path, lm_weight):
+    """Hypotheses of lexicon-constrained beam search consist of words in the lexicon."""
+    args = make_args()
+    params = make_decode_params(recog_beam_width=4, recog_lm_weight=lm_weight, recog_min_len_ratio=0.0)
+
+    lm = None
+    if lm_weight > 0:
+        module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module_rnnlm.RNNLM(make_args_rnnlm(vocab=len(LEX_WORDS) + 1))
+    lexicon = make_lexicon(tmp_path, lm)
+
+    eouts, elens = make_eouts()
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+    with torch.no_grad():
+        nbest_hyps, _, _ = dec.beam_search(eouts, elens, params, idx2token=None, nbest=4,
+                                           store_aws=False, lexicon=lexicon)
+    for hyps in nbest_hyps:
+        for hyp in hyps:
+            hyp = hyp.tolist()
+            assert 2 not in hyp[:-1]
+            words = ''.join([UNITS[idx] for idx in hyp if idx != 2]).split(' ')
+            if hyp[-1] == 2:
+                # NOTE: <eos> is allowed after <space>
+                words = [w for w in words if w != '']
+                assert all([w in LEX_WORDS[3:] for w in words])
+            else:
+                # reached the maximum length
+                assert all([w in LEX_WORDS[3:] for w in words[:-1]])
+
+
+def test_quantize_lexicon_lm(tmp_path):
+    """The word-level LM attached to the lexicon is quantized with the ASR model."""
+    module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module_rnnlm.RNNLM(make_args_rnnlm(vocab=len(LEX_WORDS) + 1))
+    model, _ = make_speech2text()
+    model.lexicon = make_lexicon(tmp_path, lm)
+
+    module_eval = importlib.import_module('neural_sp.bin.eval_utils')
+    module_eval.quantize_dynamic_model(model)
+    assert isinstance(model.dec_fwd.output, torch.nn.quantized.dynamic.Linear)
+    assert isinstance(model.lexicon.lm.output, torch.nn.quantized.dynamic.Linear)
+    with torch.no_grad():
+        _, _, scores_lm = model.lexicon.lm.predict(torch.LongTensor([[2]]), None)
+    assert scores_lm.size(-1) == len(LEX_WORDS) + 1
@@ -5,6 +5,8 @@
 
 import argparse
 import importlib
+import itertools
+import math
 import numpy as np
 import pytest
 import torch
@@ -86,6 +88,101 @@ def test_forward(args):
     assert isinstance(observation, dict)
 
 
+def transducer_nll_brute_force(log_probs, y):
+    """Sum over all alignments of a single utterance.
+
+    Args:
+        log_probs (FloatTensor): `[T, L+1, vocab]`
+        y (List): length `L`
+    Returns:
+        nll (FloatTensor): `[1]`
+
+    """
+    T, L = log_probs.size(0), len(y)
+    scores = []
+    # choose positions of labels among the first T-1+L transitions
+    for label_pos in itertools.combinations(range(T - 1 + L), L):
+        t, u, score = 0, 0, 0
+        for i in range(T - 1 + L):
+            if i in label_pos:
+                score = score + log_probs[t, u, y[u]]
+                u += 1
+            else:
+                score = score + log_probs[t, u, 0]
+                t += 1
+        scores.append(score + log_probs[T - 1, L, 0])
+    return -torch.logsumexp(torch.stack(scores), dim=0)
+
+
+@pytest.mark.parametrize(
+    "joint_chunk_size, joint_topk",
+    [
+        (1, 0),
+        (3, 0),
+        (100, 0),
+        (0, VOCAB),
+        (3, VOCAB),
+        (3, 2),
+    ]
+)
+def test_forward_transducer_chunkwise(joint_chunk_size, joint_topk):
+    """Memory-efficient Transducer loss is equal to the sum over all alignments on the full lattice."""
+    args = make_args(ctc_weight=0.0, dropout=0.0, dropout_emb=0.0, param_init=1.0)
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args, joint_chunk_size=joint_chunk_size, joint_topk=joint_topk)
+    dec.train()
+
+    elens = [5, 7, 3]
+    ylens = [2, 1, 3]
+    eouts = torch.randn(len(elens), max(elens), ENC_N_UNITS, requires_grad=True)
+    ys = [np.random.randint(4, VOCAB, ylen).tolist() for ylen in ylens]
+
+    loss = dec.forward_transducer(eouts, torch.IntTensor(elens), ys)
+    grad = torch.autograd.grad(loss, eouts)[0]
+
+    # reference
+    loss_ref = 0
+    for b, y in enumerate(ys):
+        ys_in = torch.LongTensor([[args['special_symbols']['eos']] + y])
+        dout, _ = dec.recurrency(dec.embed(ys_in), None)
+        log_probs = torch.log_softmax(dec.joint(eouts[b:b + 1, :elens[b]], dout), dim=-1)[0]
+        loss_ref += transducer_nll_brute_force(log_probs, y) / len(ys)
+    grad_ref = torch.autograd.grad(loss_ref, eouts)[0]
+
+    assert torch.allclose(loss, loss_ref, atol=1e-4)
+    if joint_topk == 0 or joint_topk >= VOCAB:
+        assert torch.allclose(grad, grad_ref, atol=1e-5)
+    else:
+        # gradients of the softmax normalizer are approximated
+        assert torch.isfinite(grad).all()
+
+
+@pytest.mark.parametrize("bias", [True, False])
+@pytest.mark.parametrize("vocab_block_size", [1, 3, 1024])
+def test_joint_topk_first_pass(bias, vocab_block_size):
+    """Normalizers and top-k entries accumulated over vocabulary blocks are equal to those of the full logits."""
+    args = make_args(ctc_weight=0.0, param_init=1.0)
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args, joint_topk=2)
+    if not bias:
+        dec.output.bias = None
+
+    enc_proj = torch.randn(2, 4, dec.output.in_features)
+    dec_proj = torch.randn(2, 3, dec.output.in_features)
+    ys = torch.LongTensor([[4, 5], [6, 6]])
+    lse, vocab_ids = dec._joint_topk_first_pass(enc_proj, dec_proj, ys, vocab_block_size)
+
+    logits = dec.output(torch.tanh(enc_proj.unsqueeze(2) + dec_proj.unsqueeze(1)))
+    assert torch.allclose(lse, torch.logsumexp(logits, dim=-1), atol=1e-5)
+    vocab_ids_ref = torch.cat([logits.topk(2, dim=-1)[1].reshape(-1), ys.reshape(-1), torch.LongTensor([dec.blank])])
+    assert torch.equal(vocab_ids, torch.unique(vocab_ids_ref))
+
+    # the second pass does not require the bias
+    lattice = dec._joint_lattice(enc_proj, dec_proj, ys, lse, vocab_ids)
+    assert lattice.size() == (2, 4, 3, 2)
+    assert torch.isfinite(lattice).all()
+
+
 def make_decode_params(**kwargs):
     args = dict(
         recog_batch_size=1,
@@ -97,6 +194,7 @@ def make_decode_params(**kwargs):
         recog_max_len_ratio=1.0,
         recog_lm_state_carry_over=False,
         recog_softmax_smoothing=1.0,
+        recog_max_symbols_per_frame=1,
         nbest=1,
     )
     args.update(kwargs)
@@ -209,3 +307,352 @@ def test_decoding(params):
             assert len(nbest_hyps[0]) == params['nbest']
             assert aws is None
             assert scores is None
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        ({'recog_beam_width': 1}),
+        ({'recog_beam_width': 4}),
+        ({'recog_beam_width': 4, 'nbest': 4}),
+        ({'recog_beam_width': 4, 'recog_softmax_smoothing': 0.8}),
+        ({'recog_beam_width': 4, 'recog_lm_weight': 0.3}),
+        ({'recog_beam_width': 4, 'recog_lm_second_weight': 0.3}),
+    ]
+)
+def test_beam_search_batch(params):
+    """Time-synchronous batch decoding with one label per frame is equal to beam_search()."""
+    args = make_args(param_init=1.0)
+    params = make_decode_params(**params)
+
+    lm, lm_second = None, None
+    module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+    if params['recog_lm_weight'] > 0:
+        lm = module_rnnlm.RNNLM(make_args_rnnlm())
+    if params['recog_lm_second_weight'] > 0:
+        lm_second = module_rnnlm.RNNLM(make_args_rnnlm())
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args)
+    dec.eval()
+
+    elens = [40, 31, 17]
+    eouts = torch.randn(len(elens), max(elens), ENC_N_UNITS)
+    with torch.no_grad():
+        nbest_hyps = dec.beam_search_batch(eouts, torch.IntTensor(elens), params,
+                                           lm=lm, lm_second=lm_second, nbest=params['nbest'])[0]
+        assert len(nbest_hyps) == len(elens)
+        for b in range(len(elens)):
+            nbest_hyps_b = dec.beam_search(eouts[b:b + 1, :elens[b]], torch.IntTensor(elens[b:b + 1]), params,
+                                           lm=lm, lm_second=lm_second, nbest=params['nbest'])[0]
+            assert len(nbest_hyps[b]) == params['nbest']
+            for hyp, hyp_ref in zip(nbest_hyps[b], nbest_hyps_b[0]):
+                assert np.array_equal(hyp, hyp_ref)
+
+
+@pytest.mark.parametrize("max_symbols", [2, 3])
+def test_beam_search_batch_multiple_symbols(max_symbols):
+    """Decoding multiple utterances at once gives the same results as one by one."""
+    args = make_args(param_init=1.0)
+    params = make_decode_params(recog_beam_width=4, nbest=4, recog_max_symbols_per_frame=max_symbols)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args)
+    dec.eval()
+
+    elens = [40, 31, 17]
+    eouts = torch.randn(len(elens), max(elens), ENC_N_UNITS)
+    with torch.no_grad():
+        nbest_hyps = dec.beam_search_batch(eouts, torch.IntTensor(elens), params, nbest=4)[0]
+        for b in range(len(elens)):
+            nbest_hyps_b = dec.beam_search_batch(eouts[b:b + 1, :elens[b]], torch.IntTensor(elens[b:b + 1]),
+                                                 params, nbest=4)[0][0]
+            assert len(nbest_hyps[b]) == len(nbest_hyps_b) == 4
+            for hyp, hyp_ref in zip(nbest_hyps[b], nbest_hyps_b):
+                assert np.array_equal(hyp, hyp_ref)
+
+
+@pytest.mark.parametrize(
+    "params,block_size",
+    [
+        ({'recog_beam_width': 1}, 8),
+        ({'recog_beam_width': 4}, 1),
+        ({'recog_beam_width': 4}, 8),
+        ({'recog_beam_width': 4}, 13),
+        ({'recog_beam_width': 4, 'recog_lm_weight': 0.3}, 8),
+    ]
+)
+def test_beam_search_block_sync(params, block_size):
+    """Chunk-synchronous decoding carrying the beam over blocks is equal to beam_search()."""
+    args = make_args(param_init=1.0)
+    params = make_decode_params(**params)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args)
+    dec.eval()
+    lm = None
+    if params['recog_lm_weight'] > 0:
+        module_lm = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module_lm.RNNLM(make_args_rnnlm())
+        lm.eval()
+
+    emax = 40
+    eouts = torch.randn(1, emax, ENC_N_UNITS)
+    with torch.no_grad():
+        hyp_ref = dec.beam_search(eouts, torch.IntTensor([emax]), params, lm=lm)[0][0][0]
+        hyps, end_hyps = None, []
+        for t in range(0, emax, block_size):
+            end_hyps, hyps, _ = dec.beam_search_block_sync(eouts[:, t:t + block_size], params, None,
+                                                           hyps, lm, end_hyps)
+        assert dec.n_frames == emax
+    best_hyp = max(end_hyps if len(end_hyps) > 0 else hyps,
+                   key=lambda x: x['score'] / max(len(x['hyp'][1:]), 1))
+    assert np.array_equal(np.array(best_hyp['hyp'][1:]), hyp_ref)
+
+
+@pytest.mark.parametrize(
+    "params,block_size",
+    [
+        ({'recog_beam_width': 1}, 8),
+        ({'recog_beam_width': 4}, 1),
+        ({'recog_beam_width': 4}, 8),
+        ({'recog_beam_width': 4}, 13),
+        ({'recog_beam_width': 4, 'recog_max_symbols_per_frame': 2}, 8),
+        ({'recog_beam_width': 4, 'recog_lm_weight': 0.3}, 8),
+    ]
+)
+def test_beam_search_block_sync_batch(params, block_size):
+    """Block-synchronous decoding of streams joining and leaving the batch is equal to beam_search_batch()."""
+    args = make_args(param_init=1.0)
+    params = make_decode_params(**params)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args)
+    dec.eval()
+    lm = None
+    if params['recog_lm_weight'] > 0:
+        module_lm = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module_lm.RNNLM(make_args_rnnlm())
+        lm.eval()
+
+    elens = [40, 31, 17, 26]
+    starts = [0, 1, 0, 2]  # blocks where streams join the batch
+    eouts = torch.randn(len(elens), max(elens), ENC_N_UNITS)
+    with torch.no_grad():
+        nbest_hyps_ref = dec.beam_search_batch(eouts, torch.IntTensor(elens), params, lm=lm)[0]
+
+        streams = [None] * len(elens)
+        n_blocks = [math.ceil(elen / block_size) for elen in elens]
+        for i_block in range(max([s + n for s, n in zip(starts, n_blocks)])):
+            # streams in the middle of utterances
+            ids = [b for b in range(len(elens)) if starts[b] <= i_block < starts[b] + n_blocks[b]]
+            offsets = [(i_block - starts[b]) * block_size for b in ids]
+            eouts_block = pad_list([eouts[b, t:min(t + block_size, elens[b])] for b, t in zip(ids, offsets)], 0.)
+            elens_block = torch.IntTensor([min(block_size, elens[b] - t) for b, t in zip(ids, offsets)])
+            outs = dec.beam_search_block_sync_batch(eouts_block, elens_block, params,
+                                                    [streams[b] for b in ids], lm)
+            for b, stream in zip(ids, outs):
+                streams[b] = stream
+
+    for b in range(len(elens)):
+        assert streams[b]['n_frames'] == elens[b]
+        best_hyp = max(streams[b]['end_hyps'] if len(streams[b]['end_hyps']) > 0 else streams[b]['hyps'],
+                       key=lambda x: x['score'] / max(len(x['hyp'][1:]), 1))
+        assert np.array_equal(np.array(best_hyp['hyp'][1:]), nbest_hyps_ref[b][0])
+
+
+@pytest.mark.parametrize("merge_prob", [True, False])
+def test_beam_search_block_sync_batch_merge_prob(merge_prob):
+    """Paths with the same prefix are merged in the same way as beam_search_block_sync()."""
+    args = make_args(param_init=1.0)
+    params = make_decode_params(recog_beam_width=4)
+    block_size = 8
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args)
+    dec.eval()
+
+    elens = [40, 31, 17]
+    eouts = torch.randn(len(elens), max(elens), ENC_N_UNITS)
+    with torch.no_grad():
+        streams = [None] * len(elens)
+        for t in range(0, max(elens), block_size):
+            ids = [b for b in range(len(elens)) if t < elens[b]]
+            eouts_block = pad_list([eouts[b, t:min(t + block_size, elens[b])] for b in ids], 0.)
+            elens_block = torch.IntTensor([min(block_size, elens[b] - t) for b in ids])
+            outs = dec.beam_search_block_sync_batch(eouts_block, elens_block, params,
+                                                    [streams[b] for b in ids], merge_prob=merge_prob)
+            for b, stream in zip(ids, outs):
+                streams[b] = stream
+
+        for b in range(len(elens)):
+            hyps, end_hyps = None, []
+            for t in range(0, elens[b], block_size):
+                end_hyps, hyps, _ = dec.beam_search_block_sync(eouts[b:b + 1, t:min(t + block_size, elens[b])],
+                                                               params, None, hyps, None, end_hyps,
+                                                               merge_prob=merge_prob)
+            # NOTE: compare all hypotheses since merging rarely changes the best one
+            hyps_ref = sorted(end_hyps + hyps, key=lambda x: x['score'], reverse=True)
+            hyps = sorted(streams[b]['end_hyps'] + streams[b]['hyps'], key=lambda x: x['score'], reverse=True)
+            assert [h['hyp'] for h in hyps] == [h['hyp'] for h in hyps_ref]
+            assert np.allclose([h['score'] for h in hyps], [h['score'] for h in hyps_ref], atol=1e-4)
+
+
+def make_speech2text(**kwargs):
+    module = importlib.import_module('neural_sp.bin.args_asr')
+    argv = ['--enc_type', 'conv_lstm', '--enc_n_units', str(ENC_N_UNITS), '--enc_n_layers', '2',
+            '--subsample', '1_1', '--conv_channels', '4_4', '--conv_kernel_sizes', '(3,3)_(3,3)',
+            '--conv_strides', '(1,1)_(1,1)', '--conv_poolings', '(2,2)_(2,2)',
+            '--dec_type', 'lstm_transducer', '--dec_n_units', '16', '--dec_n_layers', '1', '--emb_dim', '8']
+    for k, v in kwargs.items():
+        argv += ['--' + k, str(v)]
+    parser = module.build_parser()
+    args, _ = parser.parse_known_args(argv)
+    parser = module.register_args_encoder(parser, args)
+    args, _ = parser.parse_known_args(argv)
+    parser = module.register_args_decoder(parser, args, args.dec_type)
+    args = parser.parse_args(argv)
+    # NOTE: these are set from datasets in the training stage
+    args.input_dim = 8
+    args.vocab = VOCAB
+    args.vocab_sub1 = -1
+    args.vocab_sub2 = -1
+    module = importlib.import_module('neural_sp.models.seq2seq.speech2text')
+    model = module.Speech2Text(args)
+    model.eval()
+    return model, vars(args)
+
+
+@pytest.mark.parametrize("ctc_vad", [False, True])
+def test_decode_streaming_batch(ctc_vad):
+    """Each stream keeps its own encoder cache and frontend state in batched streaming decoding."""
+    model, recog_params = make_speech2text(ctc_weight=0.3)
+    # NOTE: every frame is regarded as blank to segment the stream frequently
+    recog_params.update(recog_beam_width=2, recog_block_sync_size=20, recog_cnn_cache=True,
+                        recog_ctc_vad=ctc_vad, recog_ctc_vad_blank_threshold=8,
+                        recog_ctc_vad_n_accum_frames=0, recog_ctc_vad_spike_threshold=1.1)
+
+    xs = [np.random.randn(xlen, 8).astype(np.float32) for xlen in [150, 97, 203]]
+    encode = model.encode
+
+    def decode(xs_decode):
+        # collect encoder outputs of each stream
+        eouts = [[] for _ in xs]
+
+        def encode_wrapper(xs_block, *args, **kwargs):
+            eout_dict = encode(xs_block, *args, **kwargs)
+            b = [xs_block[0].base is x for x in xs].index(True)
+            eouts[b].append(eout_dict['ys']['xs'][0, :eout_dict['ys']['xlens'][0]])
+            return eout_dict
+
+        model.encode = encode_wrapper
+        with torch.no_grad():
+            best_hyps_id = model.decode_streaming_batch(xs_decode, recog_params, idx2token, exclude_eos=True)[0]
+        del model.encode
+        return best_hyps_id, [torch.cat(eouts_b, dim=0) if len(eouts_b) > 0 else None for eouts_b in eouts]
+
+    best_hyps_id, eouts = decode(xs)
+    assert len(best_hyps_id) == len(xs)
+    with torch.no_grad():
+        # multiple streams are dispatched to decode_streaming_batch()
+        best_hyps_id_dispatch = model.decode_streaming(xs, recog_params, idx2token, exclude_eos=True)[0]
+    for b in range(len(xs)):
+        assert np.array_equal(np.array(best_hyps_id[b][0]), np.array(best_hyps_id_dispatch[b][0]))
+        # compare with decoding of a single stream
+        best_hyps_id_ref, eouts_ref = decode(xs[b:b + 1])
+        assert torch.allclose(eouts[b], eouts_ref[b])
+        assert np.array_equal(np.array(best_hyps_id[b][0]), np.array(best_hyps_id_ref[0][0]))
+
+
+@pytest.mark.parametrize("torch_112_plus", [False, True])
+def test_segment_max(monkeypatch, torch_112_plus):
+    """Path merging in batched beam search does not depend on Tensor.scatter_reduce."""
+    module = importlib.import_module('neural_sp.models.torch_utils')
+    monkeypatch.setattr(module, 'torch_112_plus', torch_112_plus and module.torch_112_plus)
+    values = torch.randn(50)
+    values[3] = float('-inf')
+    segment_ids = torch.randint(0, 7, (50,))
+    segment_ids[:7] = torch.arange(7)
+    out = module.segment_max(values, segment_ids, 7)
+    for i in range(7):
+        assert out[i].item() == values[segment_ids == i].max().item()
+    assert module.segment_max(values[:0], segment_ids[:0], 0).size() == (0,)
+
+
+@pytest.mark.parametrize(
+    "args,max_symbols",
+    [
+        ({'rnn_type': 'lstm_transducer'}, 1),
+        ({'rnn_type': 'gru_transducer'}, 1),
+        ({'rnn_type': 'lstm_transducer', 'n_projs': 8}, 1),
+        ({'rnn_type': 'lstm_transducer'}, 2),
+        ({'rnn_type': 'gru_transducer'}, 3),
+    ]
+)
+def test_greedy_batch(args, max_symbols):
+    """Batched greedy decoding gives the same results as frame-by-frame decoding of each utterance."""
+    args = make_args(param_init=1.0, **args)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args)
+    dec.eval()
+
+    elens = [40, 31, 0, 17]
+    eouts = torch.randn(len(elens), max(elens), ENC_N_UNITS)
+    with torch.no_grad():
+        hyps, _ = dec.greedy(eouts, torch.IntTensor(elens), max_len_ratio=1.0, idx2token=None,
+                             max_symbols_per_frame=max_symbols)
+        assert len(hyps) == len(elens)
+        for b in range(len(elens)):
+            hyp_ref = []
+            y = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(dec.eos)
+            dout, dstate = dec.recurrency(dec.embed(y), None)
+            for t in range(elens[b]):
+                for _ in range(max_symbols):
+                    y = dec.joint(eouts[b:b + 1, t:t + 1], dout).squeeze(2).argmax(-1)
+                    if y.item() == dec.blank:
+                        break
+                    hyp_ref += [y.item()]
+                    dout, dstate = dec.recurrency(dec.embed(y), dstate)
+            assert hyps[b] == hyp_ref
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'rnn_type': 'lstm_transducer'}),
+        ({'rnn_type': 'gru_transducer'}),
+        ({'rnn_type': 'lstm_transducer', 'n_projs': 8}),
+    ]
+)
+def test_export_step(args):
+    args = make_args(**args)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args)
+    dec.eval()
+    module_export = importlib.import_module('neural_sp.models.export')
+
+    n_layers, n_units = args['n_layers'], args['n_units']
+    hxs = torch.zeros(n_layers, 2, n_units)
+    prediction = module_export.trace(module_export.RNNTPredictionStepExport(dec),
+                                     (torch.randint(0, VOCAB, (2, 1)), hxs, hxs))
+    dout_dim = args['n_projs'] if args['n_projs'] > 0 else n_units
+    joint = module_export.trace(module_export.RNNTJointExport(dec),
+                                (torch.randn(2, 1, ENC_N_UNITS), torch.randn(2, 1, dout_dim)),
+                                [(torch.randn(3, 7, ENC_N_UNITS), torch.randn(3, 2, dout_dim))])
+
+    # greedy decoding with the traced modules must match the eager decoder
+    emax = 31
+    eouts = torch.randn(1, emax, ENC_N_UNITS)
+    with torch.no_grad():
+        hyps_ref, _ = dec.greedy(eouts, torch.IntTensor([emax]), max_len_ratio=1.0, idx2token=None)
+        hyp = []
+        hxs = torch.zeros(n_layers, 1, n_units)
+        dout, hxs, cxs = prediction(torch.zeros((1, 1), dtype=torch.int64).fill_(dec.eos), hxs, hxs)
+        for t in range(emax):
+            y = joint(eouts[:, t:t + 1], dout).squeeze(2).argmax(-1)
+            if y.item() != dec.blank:
+                hyp += [y.item()]
+                dout, hxs, cxs = prediction(y, hxs, cxs)
+    assert hyp == hyps_ref[0]
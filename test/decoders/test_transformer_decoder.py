@@ -4,9 +4,12 @@
 """Test for Transformer decoder."""
 
 import argparse
+import copy
 import importlib
+import math
 import numpy as np
 import pytest
+import random
 import torch
 
 from neural_sp.datasets.token_converter.character import Idx2char
@@ -141,11 +144,55 @@ def test_forward(args):
     assert isinstance(observation, dict)
 
 
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'n_layers': 2}),
+        ({'n_layers': 2, 'dropout_layer': 0.5}),
+        ({'n_layers': 2, 'ctc_weight': 0.5, 'ctc_lsm_prob': 0.0}),
+    ]
+)
+def test_forward_checkpoint(args):
+    args = make_args(**args)
+
+    batch_size = 4
+    emax = 40
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    ylens = [4, 5, 3, 7]
+    ys = [np.random.randint(0, VOCAB, ylen).astype(np.int32) for ylen in ylens]
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec.train()
+
+    losses, grads = [], []
+    for n_layers_checkpoint in [0, -1]:
+        dec.set_checkpointing(n_layers_checkpoint)
+        dec.zero_grad()
+        random.seed(1)
+        torch.manual_seed(1)
+        loss, _ = dec(eouts, elens, ys, task='all')
+        loss.backward()
+        losses.append(loss)
+        grads.append([p.grad for p in dec.parameters() if p.grad is not None])
+
+    assert torch.allclose(losses[0], losses[1])
+    assert len(grads[0]) == len(grads[1])
+    for g, g_ckpt in zip(grads[0], grads[1]):
+        assert torch.allclose(g, g_ckpt, atol=1e-5)
+
+
 def make_decode_params(**kwargs):
     args = dict(
         recog_batch_size=1,
         recog_beam_width=1,
         recog_ctc_weight=0.0,
+        recog_ctc_window_margin=0,
         recog_lm_weight=0.0,
         recog_lm_second_weight=0.0,
         recog_lm_bwd_weight=0.0,
@@ -208,6 +255,7 @@ def make_args_rnnlm(**kwargs):
         (False, {'recog_beam_width': 4, 'nbest': 4}),
         (False, {'recog_beam_width': 4, 'nbest': 4, 'softmax_smoothing': 2.0}),
         (False, {'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        (False, {'recog_beam_width': 4, 'recog_ctc_weight': 0.1, 'recog_ctc_window_margin': 10}),
         # length penalty
         (False, {'recog_length_penalty': 0.1}),
         (False, {'recog_length_norm': True}),
@@ -331,3 +379,288 @@ def test_decoding(backward, params):
             assert isinstance(scores, list)
             assert len(scores) == batch_size
             assert len(scores[0]) == params['nbest']
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'n_layers': 2}),
+        ({'n_layers': 3, 'ffn_bottleneck_dim': 16}),
+        ({'tie_embedding': True}),
+        ({'pe_type': 'none'}),
+    ]
+)
+def test_export_step(args):
+    args = make_args(**args)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec.eval()
+    module_export = importlib.import_module('neural_sp.models.export')
+    src_cache = module_export.trace(module_export.TransformerDecoderSrcCacheExport(dec),
+                                    (torch.randn(2, 40, ENC_N_UNITS),))
+    step = module_export.TransformerDecoderStepExport(dec)
+
+    n_layers = args['n_layers']
+    n_heads, d_k = args['n_heads'], args['d_model'] // args['n_heads']
+    with torch.no_grad():
+        src_keys, src_values = src_cache(torch.randn(2, 40, ENC_N_UNITS))
+    keys = torch.randn(n_layers, 2, 2, n_heads, d_k)
+    example_inputs = (torch.randint(0, VOCAB, (2, 1)), src_keys, src_values,
+                      torch.IntTensor([40, 20]), keys, torch.randn_like(keys))
+    check_keys = torch.zeros(n_layers, 2, 0, n_heads, d_k)
+    traced = module_export.trace(step, example_inputs,
+                                 [example_inputs[:4] + (check_keys, check_keys)])
+
+    # greedy decoding with the traced step must match the eager decoder
+    batch_size, emax = 3, 31
+    eouts = torch.randn(batch_size, emax, ENC_N_UNITS)
+    elens = torch.IntTensor([emax] * batch_size)
+    with torch.no_grad():
+        hyps_ref, _ = dec.greedy(eouts, elens, max_len_ratio=0.3, idx2token=None)
+        src_keys, src_values = src_cache(eouts)
+        ys = torch.zeros((batch_size, 1), dtype=torch.int64).fill_(dec.eos)
+        keys = torch.zeros(n_layers, batch_size, 0, n_heads, d_k)
+        values = torch.zeros_like(keys)
+        for i in range(math.ceil(emax * 0.3)):
+            log_probs, keys, values = traced(ys[:, -1:], src_keys, src_values, elens, keys, values)
+            assert keys.size() == (n_layers, batch_size, i + 1, n_heads, d_k)
+            ys = torch.cat([ys, log_probs.argmax(-1, keepdim=True)], dim=1)
+    for b in range(batch_size):
+        hyp = ys[b, 1:].tolist()
+        if dec.eos in hyp:
+            hyp = hyp[:hyp.index(dec.eos) + 1]
+        assert hyp == hyps_ref[b].tolist()
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'n_layers': 2}),
+        ({'pe_type': 'none'}),
+    ]
+)
+def test_export_step_onnx(args, tmp_path):
+    ort = pytest.importorskip('onnxruntime')
+    args = make_args(**args)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec.eval()
+    module_export = importlib.import_module('neural_sp.models.export')
+
+    n_layers = args['n_layers']
+    n_heads, d_k = args['n_heads'], args['d_model'] // args['n_heads']
+    src_cache = module_export.TransformerDecoderSrcCacheExport(dec)
+    eouts, check_eouts = torch.randn(2, 40, ENC_N_UNITS), torch.randn(3, 31, ENC_N_UNITS)
+    module_export.export_onnx(src_cache, (eouts,), [(check_eouts,)],
+                              (['eouts'], ['src_keys', 'src_values']), str(tmp_path / 'src_cache.onnx'))
+
+    def make_inputs(eouts, elens, ylen):
+        with torch.no_grad():
+            src_keys, src_values = src_cache(eouts)
+        keys = torch.randn(n_layers, eouts.size(0), ylen, n_heads, d_k)
+        return (torch.randint(0, VOCAB, (eouts.size(0), 1)), src_keys, src_values,
+                elens, keys, torch.randn_like(keys))
+
+    step = module_export.TransformerDecoderStepExport(dec)
+    input_names = ['y', 'src_keys', 'src_values', 'elens', 'keys', 'values']
+    module_export.export_onnx(step, make_inputs(eouts, torch.IntTensor([40, 20]), 2),
+                              [make_inputs(check_eouts, torch.IntTensor([31, 31, 20]), 0)],
+                              (input_names, ['log_probs', 'keys_out', 'values_out']),
+                              str(tmp_path / 'step.onnx'))
+    sess_src = ort.InferenceSession(str(tmp_path / 'src_cache.onnx'), providers=['CPUExecutionProvider'])
+    sess_step = ort.InferenceSession(str(tmp_path / 'step.onnx'), providers=['CPUExecutionProvider'])
+
+    # compare with the eager step at a new shape
+    inputs = make_inputs(torch.randn(4, 23, ENC_N_UNITS), torch.IntTensor([23, 20, 11, 5]), 3)
+    with torch.no_grad():
+        outs_ref = step(*inputs)
+    outs = sess_step.run(None, {k: x.numpy() for k, x in zip(input_names, inputs)})
+    for o_ref, o in zip(outs_ref, outs):
+        assert np.allclose(o_ref.numpy(), o, atol=1e-5)
+
+    # greedy decoding with ONNX Runtime must match the eager decoder
+    batch_size, emax = 3, 31
+    eouts = check_eouts
+    elens = torch.IntTensor([emax] * batch_size)
+    with torch.no_grad():
+        hyps_ref, _ = dec.greedy(eouts, elens, max_len_ratio=0.3, idx2token=None)
+    src_keys, src_values = sess_src.run(None, {'eouts': eouts.numpy()})
+    ys = np.full((batch_size, 1), dec.eos, dtype=np.int64)
+    keys = np.zeros((n_layers, batch_size, 0, n_heads, d_k), dtype=np.float32)
+    values = np.zeros_like(keys)
+    for i in range(math.ceil(emax * 0.3)):
+        log_probs, keys, values = sess_step.run(None, {
+            'y': ys[:, -1:], 'src_keys': src_keys, 'src_values': src_values,
+            'elens': elens.numpy(), 'keys': keys, 'values': values})
+        assert keys.shape == (n_layers, batch_size, i + 1, n_heads, d_k)
+        ys = np.concatenate([ys, log_probs.argmax(-1)[:, None]], axis=1)
+    for b in range(batch_size):
+        hyp = ys[b, 1:].tolist()
+        if dec.eos in hyp:
+            hyp = hyp[:hyp.index(dec.eos) + 1]
+        assert hyp == hyps_ref[b].tolist()
+
+
+@pytest.mark.parametrize(
+    "args, params",
+    [
+        ({}, {'recog_beam_width': 4}),
+        ({}, {'recog_beam_width': 4, 'nbest': 4}),
+        ({'n_layers': 3, 'pe_type': 'none'}, {'recog_beam_width': 4}),
+        ({'backward': True}, {'recog_beam_width': 4, 'nbest': 2}),
+        ({}, {'recog_beam_width': 4, 'recog_lm_weight': 0.3}),
+        ({'ctc_weight': 0.5}, {'recog_beam_width': 4, 'recog_ctc_weight': 0.3}),
+    ]
+)
+def test_beam_search_kv_cache(args, params):
+    args = make_args(**args)
+    params = make_decode_params(**params)
+    params['recog_max_len_ratio'] = 0.5
+
+    eouts = [np.random.randn(elen, ENC_N_UNITS).astype(np.float32) for elen in [40, 31, 17]]
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x).float() for x in eouts], 0.)
+    batch_size = eouts.size(0)
+    lm = None
+    if params['recog_lm_weight'] > 0:
+        lm = importlib.import_module('neural_sp.models.lm.rnnlm').RNNLM(make_args_rnnlm())
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec.eval()
+    with torch.no_grad():
+        ctc_log_probs = dec.ctc_log_probs(eouts) if params['recog_ctc_weight'] > 0 else None
+        outs = [dec.beam_search(eouts, elens, params, idx2token=None, lm=lm, ctc_log_probs=ctc_log_probs,
+                                nbest=params['nbest'], cache_states=cache_states)
+                for cache_states in [False, True]]
+    (nbest_hyps_ref, aws_ref, scores_ref), (nbest_hyps, aws, scores) = outs
+
+    for b in range(batch_size):
+        for n in range(params['nbest']):
+            assert math.isclose(scores[b][n], scores_ref[b][n], abs_tol=1e-4)
+            # NOTE: hypotheses with tied scores can be swapped by floating-point errors
+            if nbest_hyps[b][n].tolist() == nbest_hyps_ref[b][n].tolist():
+                assert np.allclose(aws[b][n], aws_ref[b][n], atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "args, params",
+    [
+        ({}, {'recog_beam_width': 4}),
+        ({'backward': True}, {'recog_beam_width': 4, 'nbest': 2}),
+    ]
+)
+def test_beam_search_ensemble(args, params):
+    args = make_args(**args)
+    params = make_decode_params(**params)
+    params['recog_max_len_ratio'] = 0.5
+
+    eouts = [np.random.randn(elen, ENC_N_UNITS).astype(np.float32) for elen in [40, 31, 17]]
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x).float() for x in eouts], 0.)
+    batch_size = eouts.size(0)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec.eval()
+    with torch.no_grad():
+        nbest_hyps_ref, _, scores_ref = dec.beam_search(eouts, elens, params, idx2token=None,
+                                                        nbest=params['nbest'])
+        # NOTE: decoder steps run concurrently with distinct decoders and serially with a shared decoder
+        for ensmbl_decs in [[copy.deepcopy(dec) for _ in range(2)], [dec, dec]]:
+            nbest_hyps, _, scores = dec.beam_search(eouts, elens, params, idx2token=None,
+                                                    nbest=params['nbest'],
+                                                    ensmbl_eouts=[eouts] * 2, ensmbl_elens=[elens] * 2,
+                                                    ensmbl_decs=ensmbl_decs)
+
+            # ensemble of the same model is identical to the single model
+            for b in range(batch_size):
+                for n in range(params['nbest']):
+                    assert math.isclose(scores[b][n], scores_ref[b][n], abs_tol=1e-4)
+                    assert nbest_hyps[b][n].tolist() == nbest_hyps_ref[b][n].tolist()
+
+
+@pytest.mark.parametrize(
+    "args, params, block_size",
+    [
+        # MMA
+        ({'attn_type': 'mocha', 'mma_init_r': 0, 'mma_n_heads_mono': 2}, {'recog_beam_width': 4}, 8),
+        ({'attn_type': 'mocha', 'mma_init_r': -4, 'mma_n_heads_mono': 2}, {'recog_beam_width': 4}, 8),
+        ({'attn_type': 'mocha', 'mma_init_r': 0, 'mma_n_heads_mono': 4}, {'recog_beam_width': 1}, 5),
+        # triggered attention
+        ({'ctc_weight': 0.3}, {'recog_beam_width': 4}, 40),
+        ({'ctc_weight': 0.3}, {'recog_beam_width': 4}, 8),
+    ]
+)
+def test_beam_search_block_sync(args, params, block_size):
+    args = make_args(**args)
+    params = make_decode_params(**params)
+    # NOTE: the minimum length is decided by encoder outputs received so far in streaming decoding
+    params['recog_min_len_ratio'] = 0.0
+
+    elen = 40
+    eouts = np2tensor(np.random.randn(1, elen, ENC_N_UNITS).astype(np.float32)).float()
+    elens = torch.IntTensor([elen])
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec.eval()
+    triggered = dec.attn_type != 'mocha'
+    with torch.no_grad():
+        ctc_log_probs = dec.ctc_log_probs(eouts) if triggered else None
+        best_hyp_ref = dec.beam_search(eouts, elens, params, idx2token=None, exclude_eos=True)[0][0][0]
+
+        hyps, end_hyps = None, []
+        for t in range(0, elen, block_size):
+            is_last_block = t + block_size >= elen
+            end_hyps, hyps, _ = dec.beam_search_block_sync(
+                eouts[:, t:t + block_size], params, idx2token=None, hyps=hyps,
+                ctc_log_probs=ctc_log_probs[:, t:t + block_size] if triggered else None,
+                end_hyps=end_hyps, is_last_block=is_last_block)
+            assert dec.n_frames == min(t + block_size, elen)
+            if triggered and not is_last_block:
+                # the number of output tokens never exceeds that of CTC spikes
+                for hyp in hyps + end_hyps:
+                    assert len(hyp['hyp'][1:]) <= dec.n_triggers
+    best_hyp = max(end_hyps if len(end_hyps) > 0 else hyps, key=lambda x: x['score'])
+    best_hyp = np.array(best_hyp['hyp'][1:])
+    if len(best_hyp) > 0 and best_hyp[-1] == dec.eos:
+        best_hyp = best_hyp[:-1]
+
+    # NOTE: triggered attention only attends to encoder outputs received so far
+    if not triggered or block_size >= elen:
+        assert best_hyp.tolist() == best_hyp_ref.tolist()
+
+
+def test_decode_batch_fallback():
+    """Utterances are decoded one by one with beam_search() if recog_batch_size > 1."""
+    module = importlib.import_module('neural_sp.bin.args_asr')
+    argv = ['--enc_type', 'blstm', '--enc_n_units', str(ENC_N_UNITS), '--enc_n_layers', '1',
+            '--dec_type', 'transformer', '--transformer_dec_d_model', '16', '--transformer_dec_d_ff', '16',
+            '--transformer_dec_n_heads', '2', '--dec_n_layers', '1', '--subsample', '1', '--ctc_weight', '0.3']
+    parser = module.build_parser()
+    args, _ = parser.parse_known_args(argv)
+    parser = module.register_args_encoder(parser, args)
+    args, _ = parser.parse_known_args(argv)
+    parser = module.register_args_decoder(parser, args, args.dec_type)
+    args = parser.parse_args(argv)
+    args.input_dim = 8
+    args.vocab = VOCAB
+    args.vocab_sub1 = -1
+    args.vocab_sub2 = -1
+    model = importlib.import_module('neural_sp.models.seq2seq.speech2text').Speech2Text(args)
+    model.eval()
+    recog_params = vars(args)
+    recog_params.update(recog_beam_width=2)
+    assert not model.dec_fwd.batch_decodable(recog_params)
+
+    xs = [np.random.randn(xlen, 8).astype(np.float32) for xlen in [40, 31, 17]]
+    with torch.no_grad():
+        nbest_hyps_ref = [model.decode(xs[b:b + 1], recog_params, idx2token, exclude_eos=True)[0][0]
+                          for b in range(len(xs))]
+        recog_params['recog_batch_size'] = len(xs)
+        nbest_hyps = model.decode(xs, recog_params, idx2token, exclude_eos=True)[0]
+    for b in range(len(xs)):
+        assert np.array_equal(nbest_hyps[b][0], nbest_hyps_ref[b][0])
@@ -161,3 +161,64 @@ def test_forward_1d(args):
         xs, xlens = enc(xs, xlens)
         assert xs.size(0) == batch_size
         assert xs.size(1) == xlens.max(), (xs.size(), xlens)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        # 2d
+        ({'channels': "32_32", 'kernel_sizes': "(3,3)_(3,3)",
+          'strides': "(1,1)_(1,1)", 'poolings': "(2,2)_(2,2)"}),
+        ({'channels': "32_32", 'kernel_sizes': "(3,3)_(3,3)",
+          'strides': "(1,1)_(1,1)", 'poolings': "(1,1)_(1,1)"}),
+        ({'channels': "32_32_32", 'kernel_sizes': "(3,3)_(3,3)_(3,3)",
+          'poolings': "(2,2)_(2,2)_(2,1)"}),
+        ({'batch_norm': True}),
+        ({'layer_norm': True}),
+        ({'residual': True, 'poolings': "(1,1)_(1,1)_(1,1)"}),
+        ({'bottleneck_dim': 8}),
+        # 1d
+        ({'channels': "32_32", 'kernel_sizes': "3_3",
+          'strides': "1_1", 'poolings': "2_2"}),
+        ({'channels': "32_32_32", 'kernel_sizes': "3_3_3",
+          'strides': "1_1_1", 'poolings': "2_2_1"}),
+        ({'channels': "80_80", 'kernel_sizes': "3_3",
+          'strides': "1_1", 'poolings': "1_1", 'residual': True}),
+    ]
+)
+def test_forward_stateful(args):
+    if '(' in args.get('kernel_sizes', '('):
+        args = make_args_2d(**args)
+    else:
+        args = make_args_1d(**args)
+
+    xmaxs = [37, 40, 45]
+    block_sizes = [1, 4, 8, 13]
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.conv')
+    enc = module.ConvEncoder(**args)
+    enc = enc.to(device)
+    enc.eval()
+
+    for xmax in xmaxs:
+        xs = np.random.randn(1, xmax, args['input_dim']).astype(np.float32)
+        xs = pad_list([np2tensor(x, device).float() for x in xs], 0.)
+        xlens = torch.IntTensor([xmax])
+        with torch.no_grad():
+            enc.stateful = False
+            eouts, elens = enc(xs, xlens)
+
+            for N_c in block_sizes:
+                enc.stateful = True
+                enc.reset_cache()
+                eouts_stream = []
+                for t in range(0, xmax, N_c):
+                    is_last_block = (t + N_c) >= xmax
+                    eout_block, elen_block = enc(xs[:, t:t + N_c], torch.IntTensor([xs[:, t:t + N_c].size(1)]),
+                                                 lookahead=not is_last_block)
+                    assert eout_block.size(1) == elen_block[0]
+                    eouts_stream.append(eout_block)
+                eouts_stream = torch.cat(eouts_stream, dim=1)
+                assert eouts_stream.size() == eouts.size(), (eouts_stream.size(), eouts.size())
+                assert torch.allclose(eouts, eouts_stream, atol=1e-5)
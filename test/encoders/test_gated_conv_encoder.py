@@ -0,0 +1,94 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for gated convolutional encoder."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+
+
+def make_args(**kwargs):
+    args = dict(
+        input_dim=80,
+        in_channel=1,
+        channels="32_32_32",
+        kernel_sizes="(3,1)_(3,1)_(3,1)",
+        dropout=0.1,
+        last_proj_dim=0,
+        param_init=0.1,
+    )
+    args.update(kwargs)
+    return args
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'channels': "32_32_32", 'kernel_sizes': "(3,1)_(3,1)_(3,1)"}),
+        ({'channels': "32_64", 'kernel_sizes': "(5,1)_(1,1)"}),
+        ({'last_proj_dim': 16}),
+    ]
+)
+def test_forward(args):
+    args = make_args(**args)
+
+    batch_size = 4
+    xmaxs = [40, 45]
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.gated_conv')
+    enc = module.GatedConvEncoder(**args)
+    enc = enc.to(device)
+
+    for xmax in xmaxs:
+        xs = np.random.randn(batch_size, xmax, args['input_dim']).astype(np.float32)
+        xlens = torch.IntTensor([len(x) - i for i, x in enumerate(xs)])
+        xs = pad_list([np2tensor(x, device).float() for x in xs], 0.)
+        enc_out_dict = enc(xs, xlens, task='all')
+
+        assert enc_out_dict['ys']['xs'].size(0) == batch_size
+        assert enc_out_dict['ys']['xs'].size(1) == enc_out_dict['ys']['xlens'].max()
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'channels': "32_32_32", 'kernel_sizes': "(3,1)_(3,1)_(3,1)"}),
+        ({'channels': "32_64", 'kernel_sizes': "(5,1)_(1,1)"}),
+    ]
+)
+def test_forward_streaming(args):
+    args = make_args(**args)
+
+    xmaxs = [37, 40]
+    block_sizes = [1, 4, 16]
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.gated_conv')
+    enc = module.GatedConvEncoder(**args)
+    enc = enc.to(device)
+    enc.eval()
+
+    for xmax in xmaxs:
+        xs = np.random.randn(1, xmax, args['input_dim']).astype(np.float32)
+        xlens = torch.IntTensor([xmax])
+        xs = pad_list([np2tensor(x, device).float() for x in xs], 0.)
+        with torch.no_grad():
+            eouts = enc(xs, xlens, task='all')['ys']['xs']
+
+            for N_c in block_sizes:
+                enc.reset_cache()
+                eouts_stream = []
+                for t in range(0, xmax, N_c):
+                    xs_block = xs[:, t:t + N_c]
+                    enc_out_dict = enc(xs_block, torch.IntTensor([xs_block.size(1)]), task='all',
+                                       streaming=True, lookahead=(t + N_c) < xmax)
+                    eouts_stream.append(enc_out_dict['ys']['xs'])
+                eouts_stream = torch.cat(eouts_stream, dim=1)
+                assert eouts_stream.size() == eouts.size()
+                assert torch.allclose(eouts, eouts_stream, atol=1e-5)
@@ -219,3 +219,33 @@ def test_forward(args):
             enc_out_dict_sub2 = enc(xs, xlens, task='ys_sub2')
             assert enc_out_dict_sub2['ys_sub2']['xs'].size(0) == batch_size
             assert enc_out_dict_sub2['ys_sub2']['xs'].size(1) == enc_out_dict_sub2['ys_sub2']['xlens'].max()
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'enc_type': 'blstm'}),
+        ({'enc_type': 'conv_blstm'}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_2_1", 'subsample_type': 'drop'}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_2_1", 'subsample_type': 'concat'}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_2_1", 'subsample_type': 'max_pool'}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_2_1", 'subsample_type': '1dconv'}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_2_1", 'subsample_type': 'add'}),
+    ]
+)
+def test_export(args):
+    args = make_args(**args)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.rnn')
+    enc = module.RNNEncoder(**args)
+    enc.eval()
+    module_export = importlib.import_module('neural_sp.models.export')
+
+    def make_inputs(batch_size, xmax):
+        xs = torch.randn(batch_size, xmax, args['input_dim'])
+        xlens = torch.IntTensor([xmax - i * enc.subsampling_factor for i in range(batch_size)])
+        return xs, xlens
+
+    # lengths must not be baked into the traced graph
+    module_export.trace(module_export.EncoderExport(enc), make_inputs(4, 40),
+                        [make_inputs(2, 45), make_inputs(3, 33)])
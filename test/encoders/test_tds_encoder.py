@@ -58,3 +58,46 @@ def test_forward(args):
 
         assert enc_out_dict['ys']['xs'].size(0) == batch_size
         assert enc_out_dict['ys']['xs'].size(1) == enc_out_dict['ys']['xlens'].max()
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'channels': "10_10_14_14_14_18_18_18_18_18",
+          'kernel_sizes': "(21,1)_(21,1)_(21,1)_(21,1)_(21,1)_(21,1)_(21,1)_(21,1)_(21,1)_(21,1)"}),
+        ({'channels': "4_4_8_8_12_12",
+          'kernel_sizes': "(5,1)_(5,1)_(5,1)_(5,1)_(5,1)_(5,1)"}),
+        ({'last_proj_dim': 64}),
+    ]
+)
+def test_forward_streaming(args):
+    args = make_args(**args)
+
+    xmaxs = [37, 40, 45]
+    block_sizes = [8, 16, 40]
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.tds')
+    enc = module.TDSEncoder(**args)
+    enc = enc.to(device)
+    enc.eval()
+
+    for xmax in xmaxs:
+        xs = np.random.randn(1, xmax, args['input_dim'] * args['in_channel']).astype(np.float32)
+        xlens = torch.IntTensor([xmax])
+        xs = pad_list([np2tensor(x, device).float() for x in xs], 0.)
+        with torch.no_grad():
+            eouts = enc(xs, xlens, task='all')['ys']['xs']
+
+            for N_c in block_sizes:
+                enc.reset_cache()
+                eouts_stream = []
+                for t in range(0, xmax, N_c):
+                    xs_block = xs[:, t:t + N_c]
+                    enc_out_dict = enc(xs_block, torch.IntTensor([xs_block.size(1)]), task='all',
+                                       streaming=True, lookahead=(t + N_c) < xmax)
+                    assert enc_out_dict['ys']['xs'].size(1) == enc_out_dict['ys']['xlens'][0]
+                    eouts_stream.append(enc_out_dict['ys']['xs'])
+                eouts_stream = torch.cat(eouts_stream, dim=1)
+                assert eouts_stream.size() == eouts.size(), (eouts_stream.size(), eouts.size())
+                assert torch.allclose(eouts, eouts_stream, atol=1e-5)
@@ -6,6 +6,7 @@
 import importlib
 import numpy as np
 import pytest
+import random
 import torch
 
 from neural_sp.models.torch_utils import np2tensor
@@ -176,3 +177,77 @@ def test_forward(args):
             if args['n_layers_sub2'] > 0:
                 assert enc_out_dict['ys_sub2']['xs'].size(0) == batch_size
                 assert enc_out_dict['ys_sub2']['xs'].size(1) == enc_out_dict['ys_sub2']['xlens'][0]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'n_layers': 3}),
+        ({'n_layers': 3, 'dropout_layer': 0.5}),
+        ({'n_layers': 3, 'n_layers_sub1': 2, 'task_specific_layer': True}),
+        ({'n_layers': 3, 'n_layers_sub1': 2, 'n_layers_sub2': 1}),
+    ]
+)
+def test_forward_checkpoint(args):
+    args = make_args(**args)
+
+    batch_size = 4
+    xmax = 40
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
+    enc = module.TransformerEncoder(**args)
+    enc = enc.to(device)
+    enc.train()
+
+    xs = np.random.randn(batch_size, xmax, args['input_dim']).astype(np.float32)
+    xlens = torch.IntTensor([len(x) - i * enc.subsampling_factor for i, x in enumerate(xs)])
+    xs = pad_list([np2tensor(x, device).float() for x in xs], 0.)
+
+    outs, grads = [], []
+    for n_layers_checkpoint in [0, -1]:
+        enc.set_checkpointing(n_layers_checkpoint)
+        enc.zero_grad()
+        random.seed(1)
+        torch.manual_seed(1)
+        enc_out_dict = enc(xs, xlens, task='all')
+        loss = enc_out_dict['ys']['xs'].sum()
+        for sub in ['sub1', 'sub2']:
+            if args['n_layers_' + sub] > 0:
+                loss += enc_out_dict['ys_' + sub]['xs'].sum()
+        loss.backward()
+        outs.append(enc_out_dict['ys']['xs'])
+        grads.append([p.grad for p in enc.parameters() if p.grad is not None])
+
+    assert torch.allclose(outs[0], outs[1], atol=1e-6)
+    assert len(grads[0]) == len(grads[1])
+    for g, g_ckpt in zip(grads[0], grads[1]):
+        assert torch.allclose(g, g_ckpt, atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'enc_type': 'transformer', 'pe_type': 'add'}),
+        ({'enc_type': 'conv_transformer', 'pe_type': 'relative'}),
+        ({'enc_type': 'conv_transformer', 'subsample': "1_2_1", 'subsample_type': 'concat'}),
+        ({'enc_type': 'conv_transformer', 'subsample': "1_2_1", 'subsample_type': 'add'}),
+        ({'enc_type': 'conv_transformer', 'subsample': "1_2_1", 'subsample_type': 'drop'}),
+    ]
+)
+def test_export(args):
+    args = make_args(**args)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
+    enc = module.TransformerEncoder(**args)
+    enc.eval()
+    module_export = importlib.import_module('neural_sp.models.export')
+
+    def make_inputs(batch_size, xmax):
+        xs = torch.randn(batch_size, xmax, args['input_dim'])
+        xlens = torch.IntTensor([xmax - i * enc.subsampling_factor for i in range(batch_size)])
+        return xs, xlens
+
+    # lengths must not be baked into the traced graph
+    module_export.trace(module_export.EncoderExport(enc), make_inputs(4, 40),
+                        [make_inputs(2, 45), make_inputs(3, 33)])
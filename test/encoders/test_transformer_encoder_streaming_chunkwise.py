@@ -303,3 +303,68 @@ def test_forward_streaming_chunkwise(args):
         assert torch.allclose(eout_all, eouts_cat, atol=atol)
         assert elens_cat.item() == eouts_cat.size(1)
         assert torch.equal(elens_all, elens_cat)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'enc_type': 'conv_uni_transformer', 'chunk_size_current': "8"}),
+        ({'enc_type': 'conv_uni_transformer', 'chunk_size_current': "16"}),
+        ({'enc_type': 'conv_uni_conformer', 'chunk_size_current': "8"}),
+        ({'enc_type': 'conv_uni_conformer_v2', 'chunk_size_current': "8"}),
+        ({'enc_type': 'conv_uni_transformer', 'chunk_size_current': "16",
+          'conv_channels': "32_32_32", 'conv_kernel_sizes': "(3,3)_(3,3)_(3,3)",
+          'conv_strides': "(1,1)_(1,1)_(1,1)", 'conv_poolings': "(2,2)_(2,2)_(2,2)"}),
+    ]
+)
+def test_forward_streaming_cnn_cache(args):
+    is_conformer = 'conformer' in args['enc_type']
+    if is_conformer:
+        args = make_args_conformer(**args)
+    else:
+        args = make_args_transformer(**args)
+
+    batch_size = 1
+    xmaxs = [t for t in range(164, 192, 3)]
+    device = "cpu"
+    atol = 1e-05
+
+    N_c = int(args['chunk_size_current'])
+    args['chunk_size_current'] = "0"
+    if is_conformer:
+        module = importlib.import_module('neural_sp.models.seq2seq.encoders.conformer')
+        enc = module.ConformerEncoder(**args)
+    else:
+        module = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
+        enc = module.TransformerEncoder(**args)
+    enc = enc.to(device)
+
+    enc.eval()
+    for xmax in xmaxs:
+        xs = np.random.randn(batch_size, xmax, args['input_dim']).astype(np.float32)
+        xlens = torch.IntTensor([len(x) for x in xs])
+
+        # all encoding
+        xs_pad = pad_list([np2tensor(x, device).float() for x in xs], 0.)
+        enc.reset_cache()
+        with torch.no_grad():
+            eout_all = enc(xs_pad, xlens, task='all')['ys']['xs']
+
+        # chunk by chunk encoding only with new frames
+        eouts_cat = []
+        enc.conv.stateful = True
+        enc.reset_cache()
+        for j in range(0, xmax, N_c):
+            xs_pad_chunk = xs_pad[:, j:j + N_c]
+            xlens_chunk = torch.IntTensor([xs_pad_chunk.size(1)])
+            with torch.no_grad():
+                eout_chunk = enc(xs_pad_chunk, xlens_chunk, task='all',
+                                 streaming=True,
+                                 lookback=j > 0,
+                                 lookahead=j + N_c < xmax)['ys']['xs']
+            eouts_cat.append(eout_chunk)
+        enc.conv.stateful = False
+
+        eouts_cat = torch.cat(eouts_cat, dim=1)
+        assert eout_all.size() == eouts_cat.size()
+        assert torch.allclose(eout_all, eouts_cat, atol=atol)
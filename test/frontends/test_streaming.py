@@ -6,6 +6,7 @@
 import importlib
 import numpy as np
 import pytest
+import torch
 
 
 def make_rnn_args(**kwargs):
@@ -93,6 +94,7 @@ def make_decode_params(**kwargs):
         recog_batch_size=1,
         recog_beam_width=1,
         recog_ctc_weight=0.0,
+        recog_ctc_window_margin=0,
         recog_lm_weight=0.0,
         recog_lm_second_weight=0.0,
         recog_lm_bwd_weight=0.0,
@@ -111,6 +113,7 @@ def make_decode_params(**kwargs):
         exclude_eos=False,
         recog_block_sync=True,
         recog_block_sync_size=20,
+        recog_cnn_cache=False,
         recog_ctc_vad=False,
         recog_ctc_vad_blank_threshold=40,
         recog_ctc_vad_spike_threshold=0.1,
@@ -140,9 +143,13 @@ def make_decode_params(**kwargs):
           'chunk_size_left': "16", 'chunk_size_current': "16", 'chunk_size_right': "16"}),
         ({'enc_type': 'conv_transformer', 'streaming_type': 'mask',
           'chunk_size_left': "16", 'chunk_size_current': "16"}),
+        # w/ CNN, cache CNN outputs
+        ({'enc_type': 'conv_lstm', 'cnn_cache': True}),
+        ({'enc_type': 'conv_uni_transformer', 'cnn_cache': True}),
     ]
 )
 def test_feature_extraction(args):
+    cnn_cache = args.pop('cnn_cache', False)
     if 'lstm' in args['enc_type']:
         args = make_rnn_args(**args)
         enc_module = importlib.import_module('neural_sp.models.seq2seq.encoders.rnn')
@@ -151,7 +158,7 @@ def test_feature_extraction(args):
         args = make_transformer_args(**args)
         enc_module = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
         enc = enc_module.TransformerEncoder(**args)
-    decode_args = make_decode_params()
+    decode_args = make_decode_params(recog_cnn_cache=cnn_cache)
     if args['enc_type'] in ['lstm', 'conv_lstm', 'uni_transformer', 'conv_uni_transformer']:
         args['chunk_size_current'] = 4
         # NOTE: do not set before model definition
@@ -165,6 +172,7 @@ def test_feature_extraction(args):
     for xmax in xmaxs:
         xs = np.arange(xmax)[:, None].astype(np.float32)
         streaming = streaming_module.Streaming(xs, decode_args, enc)
+        assert streaming.cnn_cache == cnn_cache
         N_l = streaming.N_l
         N_conv = streaming.conv_context
 
@@ -190,3 +198,78 @@ def test_feature_extraction(args):
         xs_cat = np.concatenate(xs_cat, axis=0)
         # assert len(xs) == len(xs_cat)
         assert np.array_equal(xs, xs_cat[:len(xs)])
+
+
+@pytest.mark.parametrize("block_size", [12, 20])
+def test_backoff_cnn_cache(block_size):
+    """Blocks after CTC-VAD boundaries start from the frame next to the boundary
+    even when encoder outputs are delayed by the cached CNN context."""
+    args = make_rnn_args(enc_type='conv_lstm', input_dim=8)
+    enc_module = importlib.import_module('neural_sp.models.seq2seq.encoders.rnn')
+    enc = enc_module.RNNEncoder(**args)
+    enc.eval()
+    decode_args = make_decode_params(recog_block_sync_size=block_size,
+                                     recog_cnn_cache=True,
+                                     recog_ctc_vad=True,
+                                     recog_ctc_vad_blank_threshold=8,
+                                     recog_ctc_vad_n_accum_frames=0)
+    factor = enc.subsampling_factor
+
+    xmax = 150
+    xs = np.random.randn(xmax, 8).astype(np.float32)
+
+    class Decoder(object):
+        n_frames = 0
+
+    streaming_module = importlib.import_module('neural_sp.models.seq2seq.frontends.streaming')
+    streaming = streaming_module.Streaming(xs, decode_args, enc)
+    assert streaming.cnn_cache and streaming.is_ctc_vad
+    enc.conv.stateful = True
+
+    segments = []  # (input offset, encoder outputs until the boundary)
+    is_reset = True
+    with torch.no_grad():
+        while True:
+            x_block, is_last_block, cnn_lookback, cnn_lookahead, xlen_block = streaming.extract_feature()
+            if is_reset:
+                enc.reset_cache()
+                segments.append((streaming.offset, []))
+            eout_block = enc(torch.from_numpy(x_block).unsqueeze(0), torch.IntTensor([xlen_block]), 'all',
+                             streaming=True, lookback=cnn_lookback, lookahead=cnn_lookahead)['ys']['xs']
+            streaming.update_eout_offset(eout_block.size(1), is_reset)
+            is_reset = False
+            if eout_block.size(1) == 0 and not is_last_block:
+                streaming.next_block()
+                continue
+
+            # a token is spiked at every 5 encoder outputs in each segment
+            n_eouts_seg = sum([eout.size(1) for eout in segments[-1][1]])
+            ctc_probs_block = torch.zeros(1, eout_block.size(1), 4)
+            ctc_probs_block[0, :, 0] = 1
+            for t in range(eout_block.size(1)):
+                if (n_eouts_seg + t) % 5 == 4:
+                    ctc_probs_block[0, t] = torch.tensor([0, 1., 0, 0])
+            is_reset = streaming.ctc_vad(ctc_probs_block)
+            if is_reset and streaming.bd_offset >= 0:
+                eout_block = eout_block[:, :streaming.bd_offset + 1]
+            segments[-1][1].append(eout_block)
+
+            if is_reset:
+                streaming.reset()
+            streaming.next_block()
+            if is_last_block:
+                break
+            streaming.backoff(x_block, Decoder())
+
+    assert len(segments) > 2
+    for (offset, eouts), (offset_next, _) in zip(segments[:-1], segments[1:]):
+        eouts = torch.cat(eouts, dim=1)
+        # the next segment starts from the frame next to the boundary
+        assert offset_next == offset + eouts.size(1) * factor
+        # encoder outputs in the segment correspond to input frames from the segment offset
+        enc.conv.stateful = False
+        enc.reset_cache()
+        with torch.no_grad():
+            x_seg = torch.from_numpy(xs[offset:]).unsqueeze(0)
+            eouts_ref = enc(x_seg, torch.IntTensor([x_seg.size(1)]), 'all')['ys']['xs']
+        assert torch.allclose(eouts, eouts_ref[:, :eouts.size(1)], atol=1e-5)
@@ -0,0 +1,158 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for n-gram LM."""
+
+import importlib
+import math
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+
+
+TOKENS = ['<unk>', '<eos>', '<pad>', 'a', 'b', 'c', 'd', 'e', 'f']
+VOCAB = len(TOKENS) + 1  # including <blank>
+EOS = 2
+
+ARPA = """
+\\data\\
+ngram 1=8
+ngram 2=7
+ngram 3=4
+
+\\1-grams:
+-1.0\t<unk>\t-0.2
+-99\t<s>\t-0.5
+-0.7\t</s>
+-0.6\ta\t-0.3
+-0.8\tb\t-0.25
+-0.9\tc\t-0.1
+-1.1\td
+-1.2\tx\t-0.1
+
+\\2-grams:
+-0.3\t<s> a\t-0.2
+-0.4\ta b\t-0.1
+-0.5\tb c
+-0.2\tc </s>
+-0.6\tb a\t-0.15
+-0.5\ta a
+-0.4\tx a
+
+\\3-grams:
+-0.1\t<s> a b
+-0.2\ta b c
+-0.3\tb a b
+-0.25\ta b </s>
+
+\\end\\
+"""
+
+
+def parse_arpa():
+    probs, bows = {}, {}
+    order = 0
+    for line in ARPA.strip().split('\n'):
+        if line.startswith('\\') and line.endswith('-grams:'):
+            order = int(line[1])
+        elif order > 0 and '\t' in line:
+            fields = line.split('\t')
+            words = tuple(fields[1].split(' '))
+            probs[words] = float(fields[0]) * math.log(10)
+            if len(fields) > 2:
+                bows[words] = float(fields[2]) * math.log(10)
+    return probs, bows
+
+
+def ref_log_prob(probs, bows, hist, w):
+    """Back-off probability computed recursively."""
+    hist = tuple(hist[-2:])
+    if hist + (w,) in probs:
+        return probs[hist + (w,)]
+    if len(hist) == 0:
+        return probs[('<unk>',)]
+    return bows.get(hist, 0) + ref_log_prob(probs, bows, hist[1:], w)
+
+
+@pytest.fixture
+def ngram_lm(tmp_path):
+    dict_path = str(tmp_path / 'dict.txt')
+    with open(dict_path, 'w') as f:
+        for i, token in enumerate(TOKENS):
+            f.write('%s %d\n' % (token, i + 1))
+    arpa_path = str(tmp_path / 'lm.arpa')
+    with open(arpa_path, 'w') as f:
+        f.write(ARPA)
+    module = importlib.import_module('neural_sp.models.lm.ngram')
+    return module.NgramLM.load(arpa_path, dict_path)
+
+
+@pytest.mark.parametrize(
+    "tokens",
+    [
+        ['a', 'b', 'c'],
+        ['a', 'b', 'a', 'b', 'c', '<eos>', 'a'],
+        ['d', 'e', 'a', 'a', 'b'],
+        ['f'],
+    ]
+)
+def test_predict(ngram_lm, tokens):
+    probs, bows = parse_arpa()
+    ys = torch.tensor([[EOS] + [TOKENS.index(t) + 1 for t in tokens]])
+    idx2arpa = ['<blank>'] + TOKENS
+    idx2arpa[EOS] = '</s>'
+
+    # step by step
+    state = None
+    hist = []
+    for t in range(ys.size(1)):
+        _, state, log_probs = ngram_lm.predict(ys[:, t:t + 1], state)
+        assert log_probs.size() == (1, 1, VOCAB)
+        w = idx2arpa[ys[0, t]]
+        hist = ['<s>'] if w == '</s>' else hist + [w]
+        for i in range(VOCAB):
+            assert abs(log_probs[0, 0, i].item() - ref_log_prob(probs, bows, hist, idx2arpa[i])) < 1e-4
+
+    # whole sequence at once
+    _, state_all, log_probs_all = ngram_lm.predict(ys)
+    assert torch.equal(state_all['hxs'], state['hxs'])
+    assert torch.allclose(log_probs_all[:, -1], log_probs[:, -1])
+
+
+def test_save_load(ngram_lm, tmp_path):
+    save_dir = str(tmp_path / 'lm_compiled')
+    ngram_lm.save(save_dir)
+    module = importlib.import_module('neural_sp.models.lm.ngram')
+    assert module.is_ngram_lm(save_dir)
+    lm = module.NgramLM.load(save_dir, mmap=True)
+    assert isinstance(lm.word, np.memmap)
+
+    ys = torch.tensor([[EOS, 4, 5, 6, 7, 2, 4], [EOS, 9, 8, 4, 5, 5, 3]])
+    _, state_ref, log_probs_ref = ngram_lm.predict(ys)
+    _, state, log_probs = lm.predict(ys)
+    assert torch.equal(state['hxs'], state_ref['hxs'])
+    assert torch.allclose(log_probs, log_probs_ref)
+
+
+@pytest.mark.parametrize("lm_weight", [0.3, 1.0])
+def test_ctc_shallow_fusion(ngram_lm, lm_weight):
+    """N-gram LM has the same state interface as RNNLM in batched beam search."""
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    ctc = module.CTC(eos=EOS, blank=0, enc_n_units=16, vocab=VOCAB, dropout=0.1, lsm_prob=0.0,
+                     fc_list='16_16', param_init=0.1, backward=False)
+    ctc.eval()
+    params = {'recog_beam_width': 4, 'recog_length_penalty': 0.0, 'recog_lm_weight': lm_weight,
+              'recog_lm_second_weight': 0.3, 'recog_lm_bwd_weight': 0.0, 'recog_ctc_prune_threshold': 0.0}
+
+    elens = [30, 21, 7]
+    eouts = pad_list([np2tensor(np.random.randn(elen, 16).astype(np.float32) * 4) for elen in elens], 0.)
+    elens = torch.IntTensor(elens)
+    with torch.no_grad():
+        nbest_hyps = ctc.beam_search(eouts, elens, params, idx2token=None, lm=ngram_lm, lm_second=ngram_lm)
+        for b in range(eouts.size(0)):
+            nbest_hyps_b = ctc.beam_search(eouts[b:b + 1, :elens[b]], elens[b:b + 1], params, idx2token=None,
+                                           lm=ngram_lm, lm_second=ngram_lm)[0]
+            assert nbest_hyps[b] == nbest_hyps_b
@@ -7,6 +7,8 @@ import argparse
 import importlib
 import numpy as np
 import pytest
+import time
+import torch
 
 
 VOCAB = 100  # large for adaptive softmax
@@ -72,3 +74,152 @@ def test_forward(args):
     # assert loss.size(0) == 1
     assert loss.item() >= 0
     assert isinstance(observation, dict)
+
+
+@pytest.mark.parametrize(
+    "args,bf16",
+    [
+        ({'lm_type': 'lstm'}, False),
+        ({'lm_type': 'lstm'}, True),
+        ({'lm_type': 'gru'}, False),
+        ({'n_projs': 16}, False),
+        ({'adaptive_softmax': True}, False),
+        ({'tie_embedding': True}, True),
+    ]
+)
+def test_forward_quantize(args, bf16):
+    args = make_args(**args)
+
+    ylens = [4, 5, 3, 7] * 20
+    ys = [np.random.randint(0, VOCAB, ylen).astype(np.int64) for ylen in ylens]
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(args)
+    lm = lm.to(device)
+    lm.eval()
+    with torch.no_grad():
+        loss, _, _ = lm(ys, state=None, n_caches=0)
+
+    module_eval = importlib.import_module('neural_sp.bin.eval_utils')
+    lm = module_eval.quantize_dynamic_model(lm)
+    with torch.no_grad(), module_eval.cpu_autocast(bf16):
+        loss_q, _, _ = lm(ys, state=None, n_caches=0)
+    assert abs(loss.item() - loss_q.item()) < 0.1
+
+
+def test_cpu_autocast(monkeypatch):
+    module_eval = importlib.import_module('neural_sp.bin.eval_utils')
+    with module_eval.cpu_autocast(False):
+        pass
+    monkeypatch.setattr(module_eval, 'torch_110_plus', False)
+    with module_eval.cpu_autocast(False):
+        pass
+    with pytest.raises(NotImplementedError):
+        module_eval.cpu_autocast(True)
+
+
+def test_parallel_apply_autocast():
+    module_utils = importlib.import_module('neural_sp.models.torch_utils')
+    if not module_utils.torch_110_plus:
+        pytest.skip('bfloat16 autocast on CPU requires PyTorch>=1.10.')
+    xs = torch.randn(4, 4)
+    with torch.autocast('cpu', dtype=torch.bfloat16):
+        outs = module_utils.parallel_apply([lambda: torch.mm(xs, xs)] * 3)
+    # autocast is applied in worker threads as well
+    assert [out.dtype for out in outs] == [torch.bfloat16] * 3
+    assert module_utils.tensor2np(outs[0]).dtype == np.float32
+
+
+def test_parallel_apply_num_threads():
+    module_utils = importlib.import_module('neural_sp.models.torch_utils')
+    n_threads_orig = torch.get_num_threads()
+    n_threads = 2
+    torch.set_num_threads(n_threads)
+
+    def fail():
+        raise ValueError
+
+    def slow():
+        time.sleep(0.1)
+        return torch.get_num_threads()
+
+    with pytest.raises(ValueError):
+        module_utils.parallel_apply([slow, fail])
+    # the number of threads is restored after all workers finish, even on errors
+    assert torch.get_num_threads() == n_threads
+    assert module_utils.parallel_apply([slow, slow])[0] == 1
+    assert torch.get_num_threads() == n_threads
+    torch.set_num_threads(n_threads_orig)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'lm_type': 'lstm'}),
+        ({'lm_type': 'gru'}),
+        ({'n_projs': 16}),
+        ({'residual': True, 'use_glu': True}),
+        ({'tie_embedding': True}),
+    ]
+)
+def test_export_step(args):
+    args = make_args(**args)
+
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(args)
+    lm.eval()
+    module_export = importlib.import_module('neural_sp.models.export')
+    step, example_inputs, _ = module_export.lm_step_module(lm)
+    traced = module_export.trace(step, example_inputs)
+
+    # step-by-step scores must match scores of the whole sequence
+    ys = torch.randint(0, VOCAB, (3, 6))
+    with torch.no_grad():
+        logits, _, _ = lm.decode(ys, None)
+        log_probs_ref = torch.log_softmax(logits, dim=-1)
+        state = lm.zero_state(3)
+        hxs = state['hxs']
+        cxs = state['cxs'] if state['cxs'] is not None else torch.zeros_like(hxs)
+        for i in range(ys.size(1)):
+            log_probs, hxs, cxs = traced(ys[:, i:i + 1], hxs, cxs)
+            assert torch.allclose(log_probs, log_probs_ref[:, i], atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "args,reverse,normalize",
+    [
+        ({'lm_type': 'lstm'}, False, False),
+        ({'lm_type': 'gru'}, False, False),
+        ({'n_projs': 16}, False, False),
+        ({}, True, False),
+        ({}, False, True),
+    ]
+)
+def test_lm_rescoring(args, reverse, normalize):
+    args = make_args(**args)
+
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(args)
+    lm.eval()
+    module_bs = importlib.import_module('neural_sp.models.seq2seq.decoders.beam_search')
+    helper = module_bs.BeamSearch(beam_width=4, eos=1, ctc_weight=0, device="cpu")
+
+    # including duplicates, prefixes of other hypotheses and a hypothesis without tokens
+    hyps_id = [[1, 5, 6, 7, 1], [1, 5, 6, 7, 1], [1, 5, 6], [1, 5, 6, 8], [1, 9, 2, 3, 4, 5, 1], [1]]
+    hyps = [{'hyp': ys, 'score': 0.} for ys in hyps_id]
+    with torch.no_grad():
+        helper.lm_rescoring(hyps, lm, 0.5, reverse=reverse, normalize=normalize, tag='second')
+
+        # score each hypothesis one by one
+        for ys, hyp in zip(hyps_id, hyps):
+            if reverse:
+                ys = ys[::-1]
+            score_lm = 0
+            if len(ys) > 1:
+                _, _, scores_lm = lm.predict(torch.tensor([ys[:-1]]), None)
+                score_lm = sum([scores_lm[0, t, ys[t + 1]].item() for t in range(len(ys) - 1)])
+                if normalize:
+                    score_lm /= len(ys) - 1
+            assert abs(hyp['score_lm_second'] - score_lm) < 1e-4
+            assert abs(hyp['score'] - score_lm * 0.5) < 1e-4
@@ -7,6 +7,7 @@ import argparse
 import importlib
 import numpy as np
 import pytest
+import torch
 
 
 VOCAB = 100  # large for adaptive softmax
@@ -79,3 +80,99 @@ def test_forward(args):
     # assert loss.size(0) == 1
     assert loss.item() >= 0
     assert isinstance(observation, dict)
+
+
+@pytest.mark.parametrize(
+    "args,bf16",
+    [
+        ({}, False),
+        ({}, True),
+        ({'tie_embedding': True}, False),
+    ]
+)
+def test_forward_quantize(args, bf16):
+    args = make_args(**args)
+
+    ylens = [4, 5, 3, 7] * 20
+    ys = [np.random.randint(0, VOCAB, ylen).astype(np.int64) for ylen in ylens]
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    lm = module.TransformerLM(args)
+    lm = lm.to(device)
+    lm.eval()
+    with torch.no_grad():
+        loss, _, _ = lm(ys, state=None, n_caches=0)
+
+    module_eval = importlib.import_module('neural_sp.bin.eval_utils')
+    lm = module_eval.quantize_dynamic_model(lm)
+    with torch.no_grad(), module_eval.cpu_autocast(bf16):
+        loss_q, _, _ = lm(ys, state=None, n_caches=0)
+    assert abs(loss.item() - loss_q.item()) < 0.1
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({}),
+        ({'n_layers': 3}),
+        ({'tie_embedding': True}),
+    ]
+)
+def test_export_step(args):
+    args = make_args(**args)
+
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    lm = module.TransformerLM(args)
+    lm.eval()
+    module_export = importlib.import_module('neural_sp.models.export')
+    step, example_inputs, _ = module_export.lm_step_module(lm)
+    traced = module_export.trace(step, example_inputs)
+
+    # step-by-step scores must match scores of the whole sequence
+    ys = torch.randint(0, VOCAB, (3, 6))
+    with torch.no_grad():
+        logits, _, _ = lm.decode(ys)
+        log_probs_ref = torch.log_softmax(logits, dim=-1)
+        cache = torch.zeros(args.n_layers, 3, 0, args.transformer_d_model)
+        for i in range(ys.size(1)):
+            log_probs, cache = traced(ys[:, :i + 1], cache)
+            assert torch.allclose(log_probs, log_probs_ref[:, i], atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "args,reverse,normalize",
+    [
+        ({}, False, False),
+        ({'n_layers': 3}, False, False),
+        ({}, True, False),
+        ({}, False, True),
+    ]
+)
+def test_lm_rescoring(args, reverse, normalize):
+    args = make_args(**args)
+
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    lm = module.TransformerLM(args)
+    lm.eval()
+    module_bs = importlib.import_module('neural_sp.models.seq2seq.decoders.beam_search')
+    helper = module_bs.BeamSearch(beam_width=4, eos=1, ctc_weight=0, device="cpu")
+
+    # including duplicates, prefixes of other hypotheses and a hypothesis without tokens
+    hyps_id = [[1, 5, 6, 7, 1], [1, 5, 6, 7, 1], [1, 5, 6], [1, 5, 6, 8], [1, 9, 2, 3, 4, 5, 1], [1]]
+    hyps = [{'hyp': ys, 'score': 0.} for ys in hyps_id]
+    with torch.no_grad():
+        helper.lm_rescoring(hyps, lm, 0.5, reverse=reverse, normalize=normalize, tag='second')
+
+        # score each hypothesis one by one
+        for ys, hyp in zip(hyps_id, hyps):
+            if reverse:
+                ys = ys[::-1]
+            score_lm = 0
+            if len(ys) > 1:
+                _, _, scores_lm = lm.predict(torch.tensor([ys[:-1]]), None)
+                score_lm = sum([scores_lm[0, t, ys[t + 1]].item() for t in range(len(ys) - 1)])
+                if normalize:
+                    score_lm /= len(ys) - 1
+            assert abs(hyp['score_lm_second'] - score_lm) < 1e-4
+            assert abs(hyp['score'] - score_lm * 0.5) < 1e-4
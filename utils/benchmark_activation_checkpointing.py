@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Benchmark memory and throughput of activation checkpointing in Transformer/Conformer encoders."""
+
+import argparse
+import time
+import torch
+
+from neural_sp.models.seq2seq.encoders.conformer import ConformerEncoder
+from neural_sp.models.seq2seq.encoders.transformer import TransformerEncoder
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--enc_type', type=str, default='conv_conformer',
+                    choices=['transformer', 'conv_transformer', 'conformer', 'conv_conformer'],
+                    help='type of encoder')
+parser.add_argument('--n_layers', type=int, default=12,
+                    help='number of encoder layers')
+parser.add_argument('--d_model', type=int, default=256,
+                    help='dimension of the MHA layer')
+parser.add_argument('--d_ff', type=int, default=2048,
+                    help='dimension of the FFN layer')
+parser.add_argument('--n_heads', type=int, default=4,
+                    help='number of heads in the MHA layer')
+parser.add_argument('--batch_size', type=int, default=16,
+                    help='number of utterances in a mini-batch')
+parser.add_argument('--xmax', type=int, default=1000,
+                    help='number of input frames per utterance')
+parser.add_argument('--input_dim', type=int, default=80,
+                    help='dimension of input features')
+parser.add_argument('--n_layers_checkpoint', type=str, default="0_6_-1",
+                    help='number of checkpointed layers to compare (-1 means all layers)')
+parser.add_argument('--n_steps', type=int, default=5,
+                    help='number of measured training steps')
+parser.add_argument('--n_gpus', type=int, default=0,
+                    help='number of GPUs (0 means CPU)')
+args = parser.parse_args()
+
+
+def build(device):
+    conf = dict(
+        input_dim=args.input_dim,
+        enc_type=args.enc_type,
+        n_heads=args.n_heads,
+        n_layers=args.n_layers,
+        n_layers_sub1=0,
+        n_layers_sub2=0,
+        d_model=args.d_model,
+        d_ff=args.d_ff,
+        ffn_bottleneck_dim=0,
+        ffn_activation='swish',
+        pe_type='relative' if 'conformer' in args.enc_type else 'none',
+        layer_norm_eps=1e-12,
+        last_proj_dim=0,
+        dropout_in=0.1,
+        dropout=0.1,
+        dropout_att=0.1,
+        dropout_layer=0.0,
+        subsample="_".join(['1'] * args.n_layers),
+        subsample_type='max_pool',
+        n_stacks=1,
+        n_splices=1,
+        conv_in_channel=1,
+        conv_channels="32_32",
+        conv_kernel_sizes="(3,3)_(3,3)",
+        conv_strides="(1,1)_(1,1)",
+        conv_poolings="(2,2)_(2,2)",
+        conv_batch_norm=False,
+        conv_layer_norm=False,
+        conv_bottleneck_dim=0,
+        conv_param_init=0.1,
+        task_specific_layer=False,
+        param_init='xavier_uniform',
+        clamp_len=-1,
+        lookahead="0",
+        chunk_size_left="0",
+        chunk_size_current="0",
+        chunk_size_right="0",
+        streaming_type='mask',
+    )
+    if 'conformer' in args.enc_type:
+        enc = ConformerEncoder(kernel_size=31, normalization='batch_norm', **conf)
+    else:
+        enc = TransformerEncoder(**conf)
+    return enc.to(device)
+
+
+def main():
+
+    device = torch.device('cuda' if args.n_gpus > 0 else 'cpu')
+    enc = build(device)
+    enc.train()
+
+    xs = torch.randn(args.batch_size, args.xmax, args.input_dim, device=device)
+    xlens = torch.IntTensor([args.xmax] * args.batch_size)
+
+    print('| #layers checkpointed | activation memory [MB] | utterances/sec |')
+    print('|---|---|---|')
+    for n_layers_checkpoint in list(map(int, args.n_layers_checkpoint.split('_'))):
+        enc.set_checkpointing(n_layers_checkpoint)
+
+        # count bytes of tensors saved for the backward pass
+        saved = [0]
+
+        def pack(x):
+            saved[0] += x.numel() * x.element_size()
+            return x
+
+        # warm up
+        enc(xs, xlens, task='all')['ys']['xs'].sum().backward()
+        enc.zero_grad()
+
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        start = time.time()
+        for _ in range(args.n_steps):
+            saved[0] = 0
+            with torch.autograd.graph.saved_tensors_hooks(pack, lambda x: x):
+                eouts = enc(xs, xlens, task='all')['ys']['xs']
+            eouts.sum().backward()
+            enc.zero_grad()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+            mem = torch.cuda.max_memory_allocated() / (1024 ** 2)
+        else:
+            mem = saved[0] / (1024 ** 2)
+        throughput = args.batch_size * args.n_steps / (time.time() - start)
+
+        n_layers = 'all' if n_layers_checkpoint < 0 else n_layers_checkpoint
+        print('| %s | %.1f | %.2f |' % (n_layers, mem, throughput))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Compare WER and RTF of joint CTC/attention decoding with windowed CTC prefix scoring on long-form utterances.
+
+Consecutive utterances in the evaluation set are concatenated to make long-form inputs.
+All other arguments are passed to neural_sp/bin/asr/eval.py, e.g.,
+    benchmark_ctc_window.py --margins 0_50_100 --n_concat 10 \
+        --recog_model exp/model.epoch-25 --recog_sets test.tsv --recog_ctc_weight 0.3 --recog_beam_width 10
+"""
+
+import argparse
+import logging
+import numpy as np
+import sys
+import time
+import torch
+
+from neural_sp.bin.args_asr import parse_args_eval
+from neural_sp.bin.train_utils import (
+    compute_subsampling_factor,
+    load_checkpoint
+)
+from neural_sp.datasets.asr import build_dataloader
+from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.models.seq2seq.speech2text import Speech2Text
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--margins', type=str, default="0_25_50_100",
+                    help='margins of CTC prefix scoring to compare (0 means all frames)')
+parser.add_argument('--n_concat', type=int, default=10,
+                    help='number of consecutive utterances concatenated into a long-form utterance')
+parser.add_argument('--max_n_utts', type=int, default=100,
+                    help='maximum number of long-form utterances to decode')
+bench_args, eval_argv = parser.parse_known_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def load_long_form_utterances(args):
+    dataloader = build_dataloader(args=args, tsv_path=args.recog_sets[0], batch_size=1, is_test=True)
+    dataloader.reset(1)
+    xs, refs = [], []
+    xs_long, refs_long = [], []
+    while True:
+        batch, is_new_epoch = dataloader.next(1)
+        ref = batch['text'][0]
+        if ref[0] == '<':
+            ref = ref.split('>')[1]
+        xs.append(batch['xs'][0])
+        refs.append(ref)
+        if len(xs) == bench_args.n_concat or is_new_epoch:
+            xs_long.append(np.concatenate(xs, axis=0))
+            refs_long.append(' '.join(refs))
+            xs, refs = [], []
+        if is_new_epoch or len(xs_long) == bench_args.max_n_utts:
+            break
+    return xs_long, refs_long, dataloader.idx2token[0]
+
+
+def main():
+
+    # NOTE: parse_args_eval() parses sys.argv again
+    sys.argv = sys.argv[:1] + eval_argv
+    args, recog_params, dir_name = parse_args_eval(eval_argv)
+    args = compute_subsampling_factor(args)
+    assert args.recog_ctc_weight > 0
+
+    xs_long, refs_long, idx2token = load_long_form_utterances(args)
+    n_frames = sum([len(x) for x in xs_long])
+    n_words = sum([len(ref.split(' ')) for ref in refs_long])
+
+    model = Speech2Text(args, dir_name)
+    load_checkpoint(args.recog_model[0], model)
+    if args.recog_n_gpus >= 1:
+        model.cudnn_setting(deterministic=True, benchmark=False)
+        model.cuda()
+    model.eval()
+
+    print('%d long-form utterances (%.1f sec on average)' % (len(xs_long), n_frames * 0.01 / len(xs_long)))
+    print('| margin | WER [%] | RTF |')
+    print('|---|---|---|')
+    for margin in list(map(int, bench_args.margins.split('_'))):
+        recog_params['recog_ctc_window_margin'] = margin
+        n_errs = 0
+        start = time.time()
+        with torch.no_grad():
+            for x, ref in zip(xs_long, refs_long):
+                best_hyp_id = model.decode([x], recog_params, None, exclude_eos=True)[0][0][0]
+                n_errs += compute_wer(ref=ref.split(' '), hyp=idx2token(best_hyp_id).split(' '))[0]
+        rtf = (time.time() - start) / (n_frames * 0.01)
+        print('| %s | %.2f | %.3f |' % (margin if margin > 0 else 'all', n_errs * 100 / n_words, rtf))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Compare WER and RTF of shallow fusion with RNNLM and n-gram LM.
+
+All other arguments are passed to neural_sp/bin/asr/eval.py, e.g.,
+    benchmark_ngram_fusion.py --ngram exp/lm/4gram.arpa --ngram_weight 0.3 \
+        --recog_model exp/model.epoch-25 --recog_sets test.tsv --recog_beam_width 10 \
+        --recog_lm exp/lm/model.epoch-10 --recog_lm_weight 0.3
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import torch
+
+from neural_sp.bin.args_asr import parse_args_eval
+from neural_sp.bin.train_utils import (
+    compute_subsampling_factor,
+    load_checkpoint,
+    load_config
+)
+from neural_sp.datasets.asr import build_dataloader
+from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.models.lm.build import build_lm
+from neural_sp.models.lm.ngram import NgramLM
+from neural_sp.models.seq2seq.speech2text import Speech2Text
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--ngram', type=str, required=True,
+                    help='ARPA file or directory compiled by utils/compile_arpa.py')
+parser.add_argument('--ngram_weight', type=float, default=0.3,
+                    help='weight of n-gram LM scores')
+parser.add_argument('--batch_size', type=int, default=1,
+                    help='number of utterances decoded at once')
+parser.add_argument('--max_n_utts', type=int, default=1000,
+                    help='maximum number of utterances to decode')
+bench_args, eval_argv = parser.parse_known_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def load_utterances(args):
+    dataloader = build_dataloader(args=args, tsv_path=args.recog_sets[0], batch_size=1, is_test=True)
+    dataloader.reset(1)
+    xs, refs = [], []
+    while True:
+        batch, is_new_epoch = dataloader.next(1)
+        ref = batch['text'][0]
+        if ref[0] == '<':
+            ref = ref.split('>')[1]
+        xs.append(batch['xs'][0])
+        refs.append(ref)
+        if is_new_epoch or len(xs) == bench_args.max_n_utts:
+            break
+    return xs, refs, dataloader.idx2token[0]
+
+
+def evaluate(model, xs, refs, idx2token, recog_params):
+    n_errs = 0
+    start = time.time()
+    with torch.no_grad():
+        for i in range(0, len(xs), bench_args.batch_size):
+            best_hyps_id = model.decode(xs[i:i + bench_args.batch_size], recog_params, None, exclude_eos=True)[0]
+            for ref, hyps_id in zip(refs[i:i + bench_args.batch_size], best_hyps_id):
+                n_errs += compute_wer(ref=ref.split(' '), hyp=idx2token(hyps_id[0]).split(' '))[0]
+    return n_errs, time.time() - start
+
+
+def main():
+
+    # NOTE: parse_args_eval() parses sys.argv again
+    sys.argv = sys.argv[:1] + eval_argv
+    args, recog_params, dir_name = parse_args_eval(eval_argv)
+    args = compute_subsampling_factor(args)
+    recog_params['recog_batch_size'] = bench_args.batch_size
+
+    xs, refs, idx2token = load_utterances(args)
+    n_frames = sum([len(x) for x in xs])
+    n_words = sum([len(ref.split(' ')) for ref in refs])
+
+    model = Speech2Text(args, dir_name)
+    load_checkpoint(args.recog_model[0], model)
+    if args.recog_n_gpus >= 1:
+        model.cudnn_setting(deterministic=True, benchmark=False)
+        model.cuda()
+    model.eval()
+
+    lms = {'none': (None, 0.)}
+    if args.recog_lm:
+        conf_lm = load_config(os.path.join(os.path.dirname(args.recog_lm), 'conf.yml'))
+        args_lm = argparse.Namespace(**conf_lm)
+        args_lm.recog_mem_len = args.recog_mem_len
+        rnnlm = build_lm(args_lm)
+        load_checkpoint(args.recog_lm, rnnlm)
+        if args.recog_n_gpus >= 1:
+            rnnlm.cuda()
+        lms['RNNLM'] = (rnnlm, args.recog_lm_weight)
+    start = time.time()
+    ngram = NgramLM.load(bench_args.ngram, os.path.join(dir_name, 'dict.txt'))
+    print('n-gram LM: %d-gram, %d nodes (loaded in %.1f sec)' % (ngram.order, ngram.n_nodes, time.time() - start))
+    lms['n-gram'] = (ngram, bench_args.ngram_weight)
+
+    print('%d utterances (%.1f sec on average)' % (len(xs), n_frames * 0.01 / len(xs)))
+    print('| LM | weight | WER [%] | RTF |')
+    print('|---|---|---|---|')
+    for name, (lm, lm_weight) in lms.items():
+        model.lm_fwd = lm
+        recog_params['recog_lm_weight'] = lm_weight
+        n_errs, elapsed = evaluate(model, xs, refs, idx2token, recog_params)
+        print('| %s | %.2f | %.2f | %.3f |' % (name, lm_weight, n_errs * 100 / n_words, elapsed / (n_frames * 0.01)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Compare WER and RTF of per-utterance and batched time-synchronous RNN-T beam search.
+
+All other arguments are passed to neural_sp/bin/asr/eval.py, e.g.,
+    benchmark_rnnt_beam_search.py --max_symbols 1_2_3 --batch_size 16 \
+        --recog_model exp/model.epoch-25 --recog_sets test.tsv --recog_beam_width 10
+"""
+
+import argparse
+import logging
+import sys
+import time
+import torch
+
+from neural_sp.bin.args_asr import parse_args_eval
+from neural_sp.bin.train_utils import (
+    compute_subsampling_factor,
+    load_checkpoint
+)
+from neural_sp.datasets.asr import build_dataloader
+from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.models.seq2seq.speech2text import Speech2Text
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--max_symbols', type=str, default="1_2_3",
+                    help='maximum numbers of labels emitted per frame in batched decoding to compare')
+parser.add_argument('--batch_size', type=int, default=16,
+                    help='number of utterances decoded at once in batched decoding')
+parser.add_argument('--max_n_utts', type=int, default=1000,
+                    help='maximum number of utterances to decode')
+bench_args, eval_argv = parser.parse_known_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def load_utterances(args):
+    dataloader = build_dataloader(args=args, tsv_path=args.recog_sets[0], batch_size=1, is_test=True)
+    dataloader.reset(1)
+    xs, refs = [], []
+    while True:
+        batch, is_new_epoch = dataloader.next(1)
+        ref = batch['text'][0]
+        if ref[0] == '<':
+            ref = ref.split('>')[1]
+        xs.append(batch['xs'][0])
+        refs.append(ref)
+        if is_new_epoch or len(xs) == bench_args.max_n_utts:
+            break
+    return xs, refs, dataloader.idx2token[0]
+
+
+def evaluate(model, xs, refs, idx2token, recog_params, batch_size):
+    n_errs = 0
+    start = time.time()
+    with torch.no_grad():
+        for i in range(0, len(xs), batch_size):
+            best_hyps_id = model.decode(xs[i:i + batch_size], recog_params, None, exclude_eos=True)[0]
+            for ref, hyps_id in zip(refs[i:i + batch_size], best_hyps_id):
+                n_errs += compute_wer(ref=ref.split(' '), hyp=idx2token(hyps_id[0]).split(' '))[0]
+    return n_errs, time.time() - start
+
+
+def main():
+
+    # NOTE: parse_args_eval() parses sys.argv again
+    sys.argv = sys.argv[:1] + eval_argv
+    args, recog_params, dir_name = parse_args_eval(eval_argv)
+    args = compute_subsampling_factor(args)
+
+    xs, refs, idx2token = load_utterances(args)
+    n_frames = sum([len(x) for x in xs])
+    n_words = sum([len(ref.split(' ')) for ref in refs])
+
+    model = Speech2Text(args, dir_name)
+    load_checkpoint(args.recog_model[0], model)
+    assert 'transducer' in model.dec_type
+    if args.recog_n_gpus >= 1:
+        model.cudnn_setting(deterministic=True, benchmark=False)
+        model.cuda()
+    model.eval()
+
+    print('%d utterances (%.1f sec on average)' % (len(xs), n_frames * 0.01 / len(xs)))
+    print('| search | batch size | max symbols/frame | WER [%] | RTF |')
+    print('|---|---|---|---|---|')
+    recog_params['recog_batch_size'] = 1
+    n_errs, elapsed = evaluate(model, xs, refs, idx2token, recog_params, 1)
+    print('| label-synchronous | 1 | - | %.2f | %.3f |' % (n_errs * 100 / n_words, elapsed / (n_frames * 0.01)))
+    # NOTE: recog_batch_size > 1 dispatches to beam_search_batch
+    recog_params['recog_batch_size'] = max(2, bench_args.batch_size)
+    for max_symbols in list(map(int, bench_args.max_symbols.split('_'))):
+        recog_params['recog_max_symbols_per_frame'] = max_symbols
+        n_errs, elapsed = evaluate(model, xs, refs, idx2token, recog_params, bench_args.batch_size)
+        wer = n_errs * 100 / n_words
+        rtf = elapsed / (n_frames * 0.01)
+        print('| time-synchronous | %d | %d | %.2f | %.3f |' % (bench_args.batch_size, max_symbols, wer, rtf))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Compare WER of offline and chunk-synchronous streaming RNN-T decoding, and report per-chunk latency.
+
+All other arguments are passed to neural_sp/bin/asr/eval.py, e.g.,
+    benchmark_rnnt_streaming.py --recog_model exp/model.epoch-25 --recog_sets test.tsv \
+        --recog_beam_width 4 --recog_block_sync_size 40
+"""
+
+import argparse
+import logging
+import numpy as np
+import sys
+import time
+import torch
+
+from neural_sp.bin.args_asr import parse_args_eval
+from neural_sp.bin.train_utils import (
+    compute_subsampling_factor,
+    load_checkpoint
+)
+from neural_sp.datasets.asr import build_dataloader
+from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.models.seq2seq.speech2text import Speech2Text
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--max_n_utts', type=int, default=1000,
+                    help='maximum number of utterances to decode')
+bench_args, eval_argv = parser.parse_known_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def load_utterances(args):
+    dataloader = build_dataloader(args=args, tsv_path=args.recog_sets[0], batch_size=1, is_test=True)
+    dataloader.reset(1)
+    xs, refs = [], []
+    while True:
+        batch, is_new_epoch = dataloader.next(1)
+        ref = batch['text'][0]
+        if ref[0] == '<':
+            ref = ref.split('>')[1]
+        xs.append(batch['xs'][0])
+        refs.append(ref)
+        if is_new_epoch or len(xs) == bench_args.max_n_utts:
+            break
+    return xs, refs, dataloader.idx2token[0]
+
+
+def main():
+
+    # NOTE: parse_args_eval() parses sys.argv again
+    sys.argv = sys.argv[:1] + eval_argv
+    args, recog_params, dir_name = parse_args_eval(eval_argv)
+    args = compute_subsampling_factor(args)
+
+    xs, refs, idx2token = load_utterances(args)
+    n_frames = sum([len(x) for x in xs])
+    n_words = sum([len(ref.split(' ')) for ref in refs])
+
+    model = Speech2Text(args, dir_name)
+    load_checkpoint(args.recog_model[0], model)
+    assert 'transducer' in model.dec_type
+    if args.recog_n_gpus >= 1:
+        model.cudnn_setting(deterministic=True, benchmark=False)
+        model.cuda()
+    model.eval()
+
+    print('%d utterances (%.1f sec on average)' % (len(xs), n_frames * 0.01 / len(xs)))
+    print('| mode | WER [%] | RTF | latency/chunk (avg / 90%) [ms] |')
+    print('|---|---|---|---|')
+    for mode in ['offline', 'streaming']:
+        n_errs = 0
+        latencies = []
+        start = time.time()
+        with torch.no_grad():
+            for x, ref in zip(xs, refs):
+                if mode == 'offline':
+                    best_hyp_id = model.decode([x], recog_params, None, exclude_eos=True)[0][0][0]
+                else:
+                    best_hyp_id = model.decode_streaming([x], recog_params, None, exclude_eos=True)[0][0][0]
+                    latencies += model.chunk_latencies
+                n_errs += compute_wer(ref=ref.split(' '), hyp=idx2token(best_hyp_id).split(' '))[0]
+        rtf = (time.time() - start) / (n_frames * 0.01)
+        latency = '-'
+        if len(latencies) > 0:
+            latency = '%.1f / %.1f' % (np.mean(latencies) * 1000, np.percentile(latencies, 90) * 1000)
+        print('| %s | %.2f | %.3f | %s |' % (mode, n_errs * 100 / n_words, rtf, latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Compile an ARPA file into a memory-mappable n-gram LM for shallow fusion."""
+
+import argparse
+import logging
+
+from neural_sp.models.lm.ngram import NgramLM
+
+parser = argparse.ArgumentParser()
+parser.add_argument('arpa', type=str,
+                    help='ARPA file')
+parser.add_argument('dict', type=str,
+                    help='dictionary file of the ASR model')
+parser.add_argument('out_dir', type=str,
+                    help='directory to save trie arrays')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    lm = NgramLM.from_arpa(args.arpa, args.dict)
+    lm.save(args.out_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Summarize accuracy versus RTF of evaluation runs with different inference precisions."""
+
+import argparse
+import codecs
+import os
+import re
+
+parser = argparse.ArgumentParser()
+parser.add_argument('recog_dirs', type=str, nargs='+',
+                    help='directories containing decode.log of neural_sp/bin/asr/eval.py')
+args = parser.parse_args()
+
+METRICS = [('WER / CER', re.compile(r'WER / CER \(avg\.\): ([\d.]+) / ([\d.]+) %')),
+           ('PER', re.compile(r'PER \(avg\.\): ([\d.]+) %')),
+           ('BLEU', re.compile(r'BLEU \(avg\.\): ([\d.]+)')),
+           ('Accuracy', re.compile(r'Accuracy \(avg\.\): ([\d.]+)')),
+           ('PPL', re.compile(r'PPL \(avg\.\): ([\d.]+)'))]
+RTF = re.compile(r'RTF \(avg\.\): ([\d.]+) \((\S+)\)')
+
+
+def parse(log_path):
+    precision, rtf, metric, score = '-', '-', '-', '-'
+    with codecs.open(log_path, 'r', encoding="utf-8") as f:
+        for line in f:
+            m = RTF.search(line)
+            if m is not None:
+                rtf, precision = m.group(1), m.group(2)
+                continue
+            for name, pattern in METRICS:
+                m = pattern.search(line)
+                if m is not None:
+                    metric, score = name, ' / '.join(m.groups())
+                    break
+    return precision, metric, score, rtf
+
+
+def main():
+
+    print('| recog_dir | precision | metric | score | RTF |')
+    print('|---|---|---|---|---|')
+    for recog_dir in args.recog_dirs:
+        log_path = os.path.join(recog_dir, 'decode.log')
+        if not os.path.isfile(log_path):
+            continue
+        precision, metric, score, rtf = parse(log_path)
+        print('| %s | %s | %s | %s | %s |' % (recog_dir, precision, metric, score, rtf))
+
+
+if __name__ == '__main__':
+    main()